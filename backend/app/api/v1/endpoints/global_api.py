@@ -415,42 +415,7 @@ async def process_global_document_with_progress(
         finally:
             logger.info(f"🔧 LlamaIndex add_document 结束，added_count={added_count}")
 
-        # 持久化也加入超时与心跳
-        logger.info("💾 开始持久化索引到存储目录")
-        persist_task = _asyncio.create_task(_asyncio.to_thread(retriever.index.storage_context.persist, persist_dir=str(retriever.storage_dir)))
-        persist_wait = 0
-        try:
-            while True:
-                try:
-                    await _asyncio.wait_for(persist_task, timeout=30)
-                    break
-                except _asyncio.TimeoutError:
-                    persist_wait += 30
-                    task_queue.update_task_progress(
-                        task_id,
-                        TaskStage.INDEXING,
-                        90,
-                        f"持久化索引中... 已等待 {persist_wait}s"
-                    )
-                    logger.info(f"⏳ persist 心跳: 等待 {persist_wait}s")
-                    if persist_wait >= 600:
-                        raise _asyncio.TimeoutError()
-        except _asyncio.TimeoutError:
-            logger.error("⏰ 持久化索引超时(600s)")
-            # 尝试从索引中删除已添加的数据
-            try:
-                if retriever:
-                    retriever.delete_by_document_id(doc_id)
-                    logger.info(f"已尝试从索引中删除持久化超时的文档: {doc_id}")
-            except Exception as cleanup_err:
-                logger.warning(f"清理索引数据失败: {cleanup_err}")
-            # 清理失败的上传
-            await cleanup_failed_upload(doc_id, file_path)
-            await update_document_status(doc_id, 'failed', 
-                                        processing_completed=datetime.now().isoformat(),
-                                        error_message="索引持久化超时(600秒)，请重新上传")
-            task_queue.fail_task(task_id, "索引持久化超时(600秒)，文件上传失败，请重新上传")
-            return
+        # 持久化由检索器的调度器合并执行（插入已写入分段存储/写前日志）
         success = bool(added_count)
         
         if success:
@@ -585,24 +550,7 @@ async def process_global_document_step_by_step(file_path: str, document_data: Di
                 return
             finally:
                 logger.info("🔧[step] LlamaIndex add_document 结束")
-            # 持久化
-            logger.info("💾[step] 开始持久化索引到存储目录")
-            persist_task = _asyncio.create_task(_asyncio.to_thread(retriever.index.storage_context.persist, persist_dir=str(retriever.storage_dir)))
-            waited_persist = 0
-            try:
-                while True:
-                    try:
-                        await _asyncio.wait_for(persist_task, timeout=30)
-                        break
-                    except _asyncio.TimeoutError:
-                        waited_persist += 30
-                        logger.info(f"⏳[step] persist 心跳: 等待 {waited_persist}s")
-                        if waited_persist >= 600:
-                            raise _asyncio.TimeoutError()
-            except _asyncio.TimeoutError:
-                logger.error("⏰[step] 持久化索引超时(600s)")
-                await update_document_status(doc_id, 'failed', processing_completed=datetime.now().isoformat())
-                return
+            # 持久化由检索器的调度器合并执行（插入已写入分段存储/写前日志）
 
             if added_count:
                 logger.info(f"✅ 文档解析和入库成功: {document_data['original_filename']}，新节点: {added_count}")
@@ -748,11 +696,25 @@ async def list_global_documents():
     try:
         # 从 LlamaIndex 向量库加载（新格式）
         vector_documents = []
+        # 仅当检索器已在本进程加载时使用（不为列表接口触发模型加载）
+        from app.services.llamaindex_retriever import get_loaded_retriever
+        global_retriever = get_loaded_retriever("global")
         try:
             llamaindex_storage_dir = Path("llamaindex_storage/global")
             docstore_file = llamaindex_storage_dir / "docstore.json"
             
-            if docstore_file.exists():
+            segment_dir = llamaindex_storage_dir / "segments"
+            
+            if global_retriever is not None:
+                # 检索器已加载：直接使用元数据倒排索引聚合，不再解析整个 docstore.json
+                vector_documents = global_retriever.list_documents()
+                logger.info(f"✅ 从元数据索引加载了 {len(vector_documents)} 个文档")
+            elif (segment_dir / "nodes.sqlite").exists():
+                # 分段存储：在 SQLite 中按文件名聚合
+                from app.services.segment_vector_store import summarize_documents
+                vector_documents = summarize_documents(segment_dir) or []
+                logger.info(f"✅ 从分段存储加载了 {len(vector_documents)} 个文档")
+            elif docstore_file.exists():
                 import json
                 with open(docstore_file, 'r', encoding='utf-8') as f:
                     docstore_data = json.load(f)
@@ -1296,12 +1258,6 @@ async def delete_global_document(doc_id: str):
         # 2) 找出 original_filename 以同步业务 JSON 与物理文件删除
         original_filename = None
         file_path = None
-        try:
-            ds = getattr(retriever.index.storage_context, 'docstore', None)
-            nodes_map = getattr(ds, 'docs', None) or getattr(ds, '_docstore', None) or getattr(ds, '_dict', None) or {}
-            # 若按 doc_id 未命中，需要从旧的存储读取元数据（回退逻辑：直接扫描存储文件较重，这里保持轻量行为）
-        except Exception:
-            nodes_map = {}
         
         # 2) 如果索引中未找到，尝试按文件名删除（可能 document_id 设置不正确）
         if deleted == 0:
@@ -34,22 +34,14 @@ def get_production_workflow():
     global _production_workflow
     if _production_workflow is None:
         from app.services.langchain_rag_service import get_rag_service
-        from langchain_openai import ChatOpenAI
+        from app.services.llm_registry import get_llm
         
         rag_service = get_rag_service()
         llm = rag_service.llm
         
         if llm is None:
-            # 初始化 LLM（第三方兼容）
-            import os
-            api_key = os.getenv('THIRD_PARTY_API_KEY') or os.getenv('OPENAI_API_KEY')
-            api_base = os.getenv('THIRD_PARTY_API_BASE') or os.getenv('OPENAI_BASE_URL', 'https://api.openai.com/v1')
-            llm = ChatOpenAI(
-                model="gpt-3.5-turbo",
-                temperature=0.1,
-                openai_api_key=api_key,
-                openai_api_base=api_base
-            )
+            # 使用共享 LLM 客户端（第三方兼容）
+            llm = get_llm(model="gpt-3.5-turbo", temperature=0.1)
         
         from app.workflows.production_workflow import ProductionWorkflow
         _production_workflow = ProductionWorkflow(llm, rag_service)
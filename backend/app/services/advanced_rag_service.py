@@ -23,8 +23,6 @@ from langchain_community.document_loaders import (
 )
 from langchain_community.vectorstores import FAISS
 from langchain_openai import OpenAIEmbeddings, ChatOpenAI
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from sentence_transformers import SentenceTransformer
 from langchain.prompts import PromptTemplate
 from langchain.schema import Document
 from langchain.chains.combine_documents import create_stuff_documents_chain
@@ -33,6 +31,7 @@ from langchain.chains import create_retrieval_chain
 # 导入混合检索器和智能分块器
 from .hybrid_retriever import HybridRetriever
 from .smart_chunker import SmartChunker
+from .embedding_registry import get_embedding_registry, resolve_model_path
 
 logger = logging.getLogger(__name__)
 
@@ -86,22 +85,16 @@ class AdvancedRAGService:
             os.environ['HF_HUB_OFFLINE'] = '1'
             os.environ['HF_DATASETS_OFFLINE'] = '1'
             
-            # 使用BGE模型
-            model_name = 'BAAI/bge-large-zh-v1.5'
+            # 使用BGE模型（与其他服务解析规则一致，确保命中同一份共享模型）
+            model_name = resolve_model_path()
             
             try:
                 logger.info(f"正在加载BGE模型: {model_name}")
                 
-                embeddings = HuggingFaceEmbeddings(
-                    model_name=model_name,
-                    model_kwargs={'device': 'cuda' if os.getenv('CUDA_VISIBLE_DEVICES') else 'cpu'},
-                    encode_kwargs={'normalize_embeddings': True}
-                )
-                
-                # 测试嵌入
-                test_embedding = embeddings.embed_query('测试')
-                logger.info(f"✅ BGE模型加载成功: {model_name}, 维度: {len(test_embedding)}")
-                return embeddings
+                # 从注册表借用共享模型
+                engine = get_embedding_registry().get_engine(model_name)
+                logger.info(f"✅ BGE模型加载成功: {model_name}, 维度: {engine.dimension}")
+                return engine.as_langchain(normalize=True)
                 
             except Exception as e:
                 logger.error(f"BGE模型加载失败: {str(e)}")
@@ -264,15 +257,17 @@ class AdvancedRAGService:
                     self.embeddings,
                     allow_dangerous_deserialization=True
                 )
-                vector_store.add_documents(chunked_documents)
+                added_ids = vector_store.add_documents(chunked_documents)
             else:
                 vector_store = FAISS.from_documents(chunked_documents, self.embeddings)
+                added_ids = list(vector_store.docstore._dict)
             
             # 保存向量存储
             vector_store.save_local(str(vector_store_path))
             
-            # 更新混合检索器
-            hybrid_retriever._build_bm25_index()
+            # 更新混合检索器：切换到新保存的向量存储，BM25 只索引新增文档
+            hybrid_retriever.vector_store = vector_store
+            hybrid_retriever._index_bm25_documents(added_ids)
             
             logger.info(f"文档添加成功: {file_path}, 工作区: {workspace_id}")
             return True
@@ -446,8 +441,9 @@ class AdvancedRAGService:
                         del vector_store.docstore._dict[doc_id]
                         vector_store.save_local(str(vector_store_path))
                         
-                        # 重建BM25索引
-                        hybrid_retriever._build_bm25_index()
+                        # 更新混合检索器：切换到新保存的向量存储，BM25 只移除被删除的文档
+                        hybrid_retriever.vector_store = vector_store
+                        hybrid_retriever._remove_bm25_documents([doc_id])
                         
                         logger.info(f"文档删除成功: {doc_id}")
                         return True
@@ -0,0 +1,243 @@
+"""
+近似最近邻（ANN）索引 - 为分段向量存储提供 FAISS 检索加速
+按节点数自适应选择索引类型：小工作区使用精确的 Flat 内积，超过阈值后使用 IVF 或 HNSW；
+索引在后台线程中训练与重建，构建完成后原子替换，并抽样评估相对暴力检索的召回率
+"""
+
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, FrozenSet, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+try:
+    import faiss  # type: ignore
+except ImportError:
+    faiss = None
+
+
+def is_available() -> bool:
+    """faiss 是否可用"""
+    return faiss is not None
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """按行 L2 归一化（内积即余弦相似度）"""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class AnnSnapshot:
+    """一次构建的结果：FAISS 索引 + 行号到节点ID的映射 + 构建时覆盖的向量段"""
+
+    def __init__(self, index: Any, node_ids: List[str], covered_segments: FrozenSet[int], kind: str):
+        self.index = index
+        self.node_ids = node_ids
+        self.covered_segments = covered_segments
+        self.kind = kind
+
+    def __len__(self) -> int:
+        return len(self.node_ids)
+
+    def search(self, query: np.ndarray, k: int) -> List[Tuple[str, float]]:
+        """检索归一化查询向量的 top-k，返回 [(node_id, 余弦相似度)]"""
+        k = min(k, len(self.node_ids))
+        if k <= 0:
+            return []
+        scores, rows = self.index.search(query.reshape(1, -1), k)
+        return [
+            (self.node_ids[row], float(score))
+            for row, score in zip(rows[0], scores[0])
+            if row >= 0
+        ]
+
+
+class FaissAnnIndex:
+    """
+    按规模自适应的 FAISS 索引
+
+    - 节点数 <= flat_max_nodes：IndexFlatIP（精确检索）
+    - 超过阈值：IVF（IndexIVFFlat）或 HNSW（IndexHNSWFlat），由 index_type 指定
+
+    重建通过 snapshot_fn 获取 (归一化向量, 节点ID, 覆盖的段) 快照，在后台线程中完成，
+    检索始终使用上一个已完成的快照，不会被构建阻塞
+    """
+
+    def __init__(
+        self,
+        flat_max_nodes: int = 20000,
+        index_type: str = "hnsw",
+        ivf_nlist: int = 1024,
+        ivf_nprobe: int = 16,
+        hnsw_m: int = 32,
+        hnsw_ef_construction: int = 200,
+        hnsw_ef_search: int = 128,
+        oversample: int = 2,
+        recall_eval_queries: int = 64,
+        recall_eval_k: int = 10
+    ):
+        if faiss is None:
+            raise ImportError("faiss 未安装，无法启用 ANN 索引（pip install faiss-cpu）")
+        self.flat_max_nodes = int(flat_max_nodes)
+        self.index_type = str(index_type).lower()
+        if self.index_type not in {"ivf", "hnsw"}:
+            raise ValueError(f"不支持的 ANN 索引类型: {index_type}（可选 ivf / hnsw）")
+        self.ivf_nlist = int(ivf_nlist)
+        self.ivf_nprobe = int(ivf_nprobe)
+        self.hnsw_m = int(hnsw_m)
+        self.hnsw_ef_construction = int(hnsw_ef_construction)
+        self.hnsw_ef_search = int(hnsw_ef_search)
+        self.oversample = max(1, int(oversample))
+        self.recall_eval_queries = int(recall_eval_queries)
+        self.recall_eval_k = int(recall_eval_k)
+
+        self._snapshot: Optional[AnnSnapshot] = None
+        self._lock = threading.Lock()
+        self._building = False
+        self._rebuild_pending = False
+
+        # 统计
+        self.total_builds = 0
+        self.last_build_time: Optional[float] = None
+        self.last_recall: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    @property
+    def snapshot(self) -> Optional[AnnSnapshot]:
+        return self._snapshot
+
+    def reset(self):
+        """丢弃当前快照（存储清空或合并后，旧快照覆盖的段已不存在），检索回退到暴力计算直至重建完成"""
+        self._snapshot = None
+
+    def build(self, vectors: np.ndarray, node_ids: List[str], covered_segments: FrozenSet[int]) -> AnnSnapshot:
+        """同步构建索引（vectors 需已归一化）"""
+        count, dimension = vectors.shape
+        if count <= self.flat_max_nodes:
+            kind = "flat"
+            index = faiss.IndexFlatIP(dimension)
+        elif self.index_type == "ivf":
+            # nlist 过大时每个簇的训练样本不足，按 4*sqrt(n) 收紧
+            nlist = max(1, min(self.ivf_nlist, int(4 * np.sqrt(count))))
+            kind = f"ivf{nlist}"
+            quantizer = faiss.IndexFlatIP(dimension)
+            index = faiss.IndexIVFFlat(quantizer, dimension, nlist, faiss.METRIC_INNER_PRODUCT)
+            train_size = min(count, nlist * 256)
+            train_rows = np.random.default_rng(0).choice(count, size=train_size, replace=False)
+            index.train(vectors[np.sort(train_rows)])
+            index.nprobe = min(self.ivf_nprobe, nlist)
+        else:
+            kind = f"hnsw{self.hnsw_m}"
+            index = faiss.IndexHNSWFlat(dimension, self.hnsw_m, faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efConstruction = self.hnsw_ef_construction
+            index.hnsw.efSearch = self.hnsw_ef_search
+        index.add(vectors)
+        return AnnSnapshot(index, list(node_ids), frozenset(covered_segments), kind)
+
+    def evaluate_recall(self, snapshot: AnnSnapshot, vectors: np.ndarray) -> Optional[float]:
+        """抽样已有向量作为查询，计算 ANN 相对暴力检索的 recall@k"""
+        count = vectors.shape[0]
+        k = min(self.recall_eval_k, count)
+        if snapshot.kind == "flat" or k == 0 or self.recall_eval_queries <= 0:
+            return 1.0 if k else None
+        sample = np.random.default_rng(1).choice(count, size=min(self.recall_eval_queries, count), replace=False)
+        queries = vectors[sample]
+        # 逐条计算精确 top-k，避免 (查询数 x 节点数) 的大矩阵
+        exact = [np.argpartition(-(vectors @ q), k - 1)[:k] for q in queries]
+        _, approx = snapshot.index.search(queries, k)
+        hits = sum(len(set(e.tolist()) & set(a.tolist())) for e, a in zip(exact, approx))
+        return hits / float(k * len(sample))
+
+    def rebuild(self, snapshot_fn: Callable[[], Tuple[np.ndarray, List[str], FrozenSet[int]]]):
+        """同步重建并替换当前快照"""
+        start = time.time()
+        vectors, node_ids, covered_segments = snapshot_fn()
+        if len(node_ids) == 0:
+            self._snapshot = None
+            return
+        snapshot = self.build(vectors, node_ids, covered_segments)
+        recall = self.evaluate_recall(snapshot, vectors)
+        self._snapshot = snapshot
+        self.total_builds += 1
+        self.last_build_time = time.time() - start
+        self.last_recall = recall
+        self.last_error = None
+        recall_text = f"{recall:.3f}" if recall is not None else "-"
+        logger.info(
+            f"ANN 索引构建完成: 类型={snapshot.kind}, 节点={len(snapshot)}, "
+            f"recall@{self.recall_eval_k}={recall_text}, 耗时 {self.last_build_time:.2f} 秒"
+        )
+
+    def schedule_rebuild(self, snapshot_fn: Callable[[], Tuple[np.ndarray, List[str], FrozenSet[int]]]):
+        """在后台线程中重建；构建期间再次请求时，完成后再重建一次"""
+        with self._lock:
+            if self._building:
+                self._rebuild_pending = True
+                return
+            self._building = True
+
+        def _run():
+            while True:
+                try:
+                    self.rebuild(snapshot_fn)
+                except Exception as e:
+                    self.last_error = str(e)
+                    logger.error(f"ANN 索引构建失败，继续使用暴力检索: {e}", exc_info=True)
+                with self._lock:
+                    if not self._rebuild_pending:
+                        self._building = False
+                        return
+                    self._rebuild_pending = False
+
+        threading.Thread(target=_run, name="ann-index-build", daemon=True).start()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """索引统计"""
+        snapshot = self._snapshot
+        return {
+            "backend": "faiss",
+            "kind": snapshot.kind if snapshot else None,
+            "nodes": len(snapshot) if snapshot else 0,
+            "building": self._building,
+            "flat_max_nodes": self.flat_max_nodes,
+            "index_type": self.index_type,
+            "total_builds": self.total_builds,
+            "last_build_time": self.last_build_time,
+            "recall": self.last_recall,
+            "last_error": self.last_error
+        }
+
+
+def create_ann_index(config: Dict[str, Any]) -> Optional[FaissAnnIndex]:
+    """
+    按 llamaindex.storage.ann 配置创建 ANN 索引
+
+    Returns:
+        未启用或 faiss 不可用时返回 None（分段存储回退到暴力检索）
+    """
+    if not config or not config.get('enabled', False):
+        return None
+    backend = config.get('backend', 'faiss')
+    if backend != 'faiss':
+        logger.warning(f"未知的 ANN 后端: {backend}，使用暴力检索")
+        return None
+    if faiss is None:
+        logger.warning("faiss 未安装，ANN 索引未启用，使用暴力检索")
+        return None
+    return FaissAnnIndex(
+        flat_max_nodes=config.get('flat_max_nodes', 20000),
+        index_type=config.get('index_type', 'hnsw'),
+        ivf_nlist=config.get('ivf_nlist', 1024),
+        ivf_nprobe=config.get('ivf_nprobe', 16),
+        hnsw_m=config.get('hnsw_m', 32),
+        hnsw_ef_construction=config.get('hnsw_ef_construction', 200),
+        hnsw_ef_search=config.get('hnsw_ef_search', 128),
+        oversample=config.get('oversample', 2),
+        recall_eval_queries=config.get('recall_eval_queries', 64),
+        recall_eval_k=config.get('recall_eval_k', 10)
+    )
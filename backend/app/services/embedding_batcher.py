@@ -0,0 +1,165 @@
+"""
+嵌入微批处理器 - 合并并发查询编码
+在很短的等待窗口内收集待编码文本，凑成一个批次后一次性送入模型，
+调用方拿到 Future，适用于 LangGraph 并发检索等扇出场景
+"""
+
+import asyncio
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingBatcher:
+    """动态微批处理：按最大批量 / 最大等待时间合并编码请求"""
+
+    def __init__(
+        self,
+        encode_fn: Callable[[List[str]], Any],
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5.0,
+        name: str = "embedding"
+    ):
+        """
+        Args:
+            encode_fn: 批量编码函数，输入文本列表，返回与之等长的向量序列
+            max_batch_size: 单批最大文本数
+            max_wait_ms: 第一个请求到达后最多等待多久再发车（毫秒）
+            name: 工作线程名称后缀
+        """
+        self.encode_fn = encode_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+
+        self._queue: "queue.Queue[Optional[Tuple[str, Future]]]" = queue.Queue()
+        self._running = True
+
+        # 统计
+        self._stats_lock = threading.Lock()
+        self.total_requests = 0
+        self.total_batches = 0
+        self.total_batched = 0
+        self.total_encoded = 0
+        self.max_observed_batch = 0
+        self.total_encode_time = 0.0
+
+        self._worker = threading.Thread(
+            target=self._worker_loop,
+            name=f"embedding-batcher-{name}",
+            daemon=True
+        )
+        self._worker.start()
+        logger.info(f"嵌入微批处理器启动: max_batch_size={self.max_batch_size}, max_wait_ms={max_wait_ms}")
+
+    def submit(self, text: str) -> Future:
+        """提交单条文本，返回 Future（结果为 List[float]）"""
+        future: Future = Future()
+        if not self._running:
+            future.set_exception(RuntimeError("嵌入微批处理器已关闭"))
+            return future
+        self._queue.put((text, future))
+        with self._stats_lock:
+            self.total_requests += 1
+        return future
+
+    def submit_many(self, texts: List[str]) -> List[Future]:
+        """批量提交文本"""
+        return [self.submit(text) for text in texts]
+
+    def encode(self, text: str, timeout: Optional[float] = None) -> List[float]:
+        """同步编码（阻塞直到所在批次完成）"""
+        return self.submit(text).result(timeout=timeout)
+
+    async def aencode(self, text: str) -> List[float]:
+        """异步编码，不阻塞事件循环"""
+        return await asyncio.wrap_future(self.submit(text))
+
+    def _collect_batch(self, first: Tuple[str, Future]) -> List[Tuple[str, Future]]:
+        """从第一个请求开始，在等待窗口内尽量凑满一个批次"""
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # 关闭信号：放回队列，让主循环退出
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _worker_loop(self):
+        """工作线程：取批次 -> 去重 -> 编码 -> 回填 Future"""
+        while True:
+            first = self._queue.get()
+            if first is None:
+                break
+
+            batch = self._collect_batch(first)
+
+            # 跳过已被调用方取消的请求
+            live = [(text, fut) for text, fut in batch if fut.set_running_or_notify_cancel()]
+            if not live:
+                continue
+
+            # 同一批次内相同文本只编码一次
+            unique_texts: List[str] = []
+            positions: Dict[str, int] = {}
+            for text, _ in live:
+                if text not in positions:
+                    positions[text] = len(unique_texts)
+                    unique_texts.append(text)
+
+            encode_start = time.time()
+            try:
+                vectors = self.encode_fn(unique_texts)
+            except Exception as e:
+                logger.error(f"微批编码失败（批量={len(unique_texts)}）: {e}")
+                for _, fut in live:
+                    fut.set_exception(e)
+                continue
+            elapsed = time.time() - encode_start
+
+            for text, fut in live:
+                vector = vectors[positions[text]]
+                fut.set_result(vector.tolist() if hasattr(vector, 'tolist') else list(vector))
+
+            with self._stats_lock:
+                self.total_batches += 1
+                self.total_batched += len(live)
+                self.total_encoded += len(unique_texts)
+                self.max_observed_batch = max(self.max_observed_batch, len(live))
+                self.total_encode_time += elapsed
+
+    def shutdown(self, wait: bool = True):
+        """关闭处理器（队列中剩余请求仍会处理完）"""
+        if not self._running:
+            return
+        self._running = False
+        self._queue.put(None)
+        if wait:
+            self._worker.join(timeout=5)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """批处理统计"""
+        with self._stats_lock:
+            batches = self.total_batches
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000,
+                "queue_depth": self._queue.qsize(),
+                "total_requests": self.total_requests,
+                "total_batches": batches,
+                "total_encoded": self.total_encoded,
+                "avg_batch_size": round(self.total_batched / batches, 2) if batches else 0.0,
+                "max_observed_batch": self.max_observed_batch,
+                "avg_encode_ms": round(self.total_encode_time / batches * 1000, 2) if batches else 0.0
+            }
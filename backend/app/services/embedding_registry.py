@@ -0,0 +1,372 @@
+"""
+嵌入模型注册表 - 进程级共享 BGE 模型
+按 (模型路径, 设备) 缓存模型，所有检索器和服务共用同一份权重；是否归一化按调用指定
+"""
+
+import os
+import logging
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .embedding_batcher import EmbeddingBatcher
+from .embedding_store import EmbeddingStore, make_model_id
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BGE_MODEL_NAME = 'BAAI/bge-large-zh-v1.5'
+
+# LlamaIndex / LangChain 适配层均为可选依赖，缺失时对应适配器不可用
+try:
+    from llama_index.core.base.embeddings.base import BaseEmbedding as _LIBaseEmbedding
+    from llama_index.core.bridge.pydantic import PrivateAttr
+except ImportError:
+    _LIBaseEmbedding = None
+
+try:
+    from langchain_core.embeddings import Embeddings as _LCEmbeddings
+except ImportError:
+    _LCEmbeddings = object
+
+
+def resolve_model_path(model_name: Optional[str] = None) -> str:
+    """解析模型路径：显式参数 > LOCAL_BGE_MODEL_DIR > BGE_MODEL_NAME"""
+    if model_name:
+        return str(model_name)
+    local_model_dir = os.getenv('LOCAL_BGE_MODEL_DIR', '')
+    if local_model_dir and Path(local_model_dir).exists():
+        return str(local_model_dir)
+    return os.getenv('BGE_MODEL_NAME', DEFAULT_BGE_MODEL_NAME)
+
+
+def resolve_device(device: Optional[str] = None) -> str:
+    """解析运行设备（与各服务原有规则一致：设置了 CUDA_VISIBLE_DEVICES 即使用 GPU）"""
+    if device:
+        return device
+    return 'cuda' if os.getenv('CUDA_VISIBLE_DEVICES') else 'cpu'
+
+
+def _default_batch_size() -> int:
+    """从 rag_config.yaml 读取 embedding.batch_size"""
+    try:
+        from app.utils.config_loader import get_rag_config
+        return int(get_rag_config().get('llamaindex.embedding.batch_size', 32))
+    except Exception:
+        return 32
+
+
+def _embedding_store_config() -> Dict[str, Any]:
+    """从 rag_config.yaml 读取 embedding.store"""
+    try:
+        from app.utils.config_loader import get_rag_config
+        return get_rag_config().get('llamaindex.embedding.store', {}) or {}
+    except Exception:
+        return {}
+
+
+def _micro_batching_config() -> Dict[str, Any]:
+    """从 rag_config.yaml 读取 embedding.micro_batching"""
+    try:
+        from app.utils.config_loader import get_rag_config
+        return get_rag_config().get('llamaindex.embedding.micro_batching', {}) or {}
+    except Exception:
+        return {}
+
+
+class EmbeddingEngine:
+    """
+    单个已加载的嵌入模型（SentenceTransformer）及其框架适配器
+
+    归一化与否只影响输出向量，不影响权重：同一份模型按 normalize 分别提供
+    嵌入存储、查询微批处理器与适配器，两种向量互不混用
+    """
+
+    def __init__(self, model_path: str, device: str = 'cpu', batch_size: int = 32):
+        self.model_path = model_path
+        self.device = device
+        self.batch_size = batch_size
+
+        # 本地目录加载时强制离线，避免连接 HuggingFace
+        if Path(model_path).exists():
+            os.environ['HF_HUB_OFFLINE'] = '1'
+            os.environ['HF_DATASETS_OFFLINE'] = '1'
+            os.environ['TRANSFORMERS_OFFLINE'] = '1'
+
+        from sentence_transformers import SentenceTransformer
+
+        load_start = time.time()
+        self.model = SentenceTransformer(model_path, device=device)
+        self.load_time = time.time() - load_start
+        self.loaded_at = time.time()
+        self.dimension = self.model.get_sentence_embedding_dimension()
+
+        # 使用统计
+        self._stats_lock = threading.Lock()
+        self.encode_calls = 0
+        self.encoded_texts = 0
+
+        # 以下均按 normalize 分开
+        self._llamaindex_adapters: Dict[bool, Any] = {}
+        self._langchain_adapters: Dict[bool, Any] = {}
+
+        # 查询微批处理器（首次异步查询编码时创建）
+        self._batchers: Dict[bool, EmbeddingBatcher] = {}
+        self._batcher_lock = threading.Lock()
+
+        # 文档块向量持久化存储（首次编码文档时打开；打开失败记为 None）
+        self._stores: Dict[bool, Optional[EmbeddingStore]] = {}
+        self._store_lock = threading.Lock()
+
+        logger.info(
+            f"✅ 嵌入模型加载完成: {model_path} (device={device}, "
+            f"dim={self.dimension}, 耗时 {self.load_time:.2f} 秒)"
+        )
+
+    def encode(self, texts: List[str], batch_size: Optional[int] = None, normalize: bool = True) -> np.ndarray:
+        """批量编码文本，返回 float32 矩阵 (len(texts), dim)"""
+        if not texts:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+        vectors = self.model.encode(
+            list(texts),
+            batch_size=batch_size or self.batch_size,
+            normalize_embeddings=normalize,
+            convert_to_numpy=True,
+            show_progress_bar=False
+        )
+        with self._stats_lock:
+            self.encode_calls += 1
+            self.encoded_texts += len(texts)
+        return np.asarray(vectors, dtype=np.float32)
+
+    def encode_query(self, text: str, normalize: bool = True) -> List[float]:
+        """编码单条查询"""
+        return self.encode([text], normalize=normalize)[0].tolist()
+
+    def get_store(self, normalize: bool = True) -> Optional[EmbeddingStore]:
+        """获取本模型（按归一化方式区分）的持久化嵌入存储；配置关闭或打开失败时返回 None"""
+        normalize = bool(normalize)
+        if normalize in self._stores:
+            return self._stores[normalize]
+        with self._store_lock:
+            if normalize not in self._stores:
+                store = None
+                config = _embedding_store_config()
+                if config.get('enabled', True):
+                    try:
+                        store = EmbeddingStore(
+                            root_dir=config.get('path', 'llamaindex_storage/_embedding_store'),
+                            model_id=make_model_id(self.model_path, normalize),
+                            dimension=self.dimension,
+                            model_path=self.model_path
+                        )
+                    except Exception as e:
+                        logger.error(f"嵌入存储打开失败，文档将直接编码: {e}")
+                self._stores[normalize] = store
+        return self._stores[normalize]
+
+    def encode_documents(self, texts: List[str], normalize: bool = True) -> np.ndarray:
+        """编码文档块：先查持久化存储，仅对新内容调用模型"""
+        store = self.get_store(normalize)
+        if store is None:
+            return self.encode(texts, normalize=normalize)
+        return store.encode_with_store(list(texts), lambda batch: self.encode(batch, normalize=normalize))
+
+    def get_batcher(self, normalize: bool = True) -> Optional[EmbeddingBatcher]:
+        """获取查询微批处理器；配置关闭时返回 None"""
+        normalize = bool(normalize)
+        batcher = self._batchers.get(normalize)
+        if batcher is not None:
+            return batcher
+        config = _micro_batching_config()
+        if not config.get('enabled', True):
+            return None
+        with self._batcher_lock:
+            if normalize not in self._batchers:
+                self._batchers[normalize] = EmbeddingBatcher(
+                    encode_fn=lambda texts: self.encode(texts, batch_size=len(texts), normalize=normalize),
+                    max_batch_size=config.get('max_batch_size', self.batch_size),
+                    max_wait_ms=config.get('max_wait_ms', 5.0),
+                    name=Path(self.model_path).name
+                )
+            return self._batchers[normalize]
+
+    async def aencode_query(self, text: str, normalize: bool = True) -> List[float]:
+        """异步编码单条查询：并发请求经微批处理器合并成一个批次"""
+        batcher = self.get_batcher(normalize)
+        if batcher is None:
+            return self.encode_query(text, normalize=normalize)
+        return await batcher.aencode(text)
+
+    def as_llamaindex(self, normalize: bool = True):
+        """返回共享本模型的 LlamaIndex 嵌入适配器"""
+        if _LIBaseEmbedding is None:
+            raise ImportError("LlamaIndex 未安装，无法创建嵌入适配器")
+        normalize = bool(normalize)
+        if normalize not in self._llamaindex_adapters:
+            self._llamaindex_adapters[normalize] = SharedLlamaIndexEmbedding(self, normalize=normalize)
+        return self._llamaindex_adapters[normalize]
+
+    def as_langchain(self, normalize: bool = True):
+        """返回共享本模型的 LangChain 嵌入适配器"""
+        normalize = bool(normalize)
+        if normalize not in self._langchain_adapters:
+            self._langchain_adapters[normalize] = SharedLangChainEmbeddings(self, normalize=normalize)
+        return self._langchain_adapters[normalize]
+
+    def memory_bytes(self) -> int:
+        """估算模型常驻内存（参数 + buffer）"""
+        try:
+            total = sum(p.numel() * p.element_size() for p in self.model.parameters())
+            total += sum(b.numel() * b.element_size() for b in self.model.buffers())
+            return int(total)
+        except Exception:
+            return 0
+
+    def get_info(self) -> Dict[str, Any]:
+        """模型信息"""
+        return {
+            "model_path": self.model_path,
+            "device": self.device,
+            "dimension": self.dimension,
+            "batch_size": self.batch_size,
+            "memory_mb": round(self.memory_bytes() / (1024 * 1024), 2),
+            "load_time": round(self.load_time, 2),
+            "loaded_at": self.loaded_at,
+            "encode_calls": self.encode_calls,
+            "encoded_texts": self.encoded_texts,
+            "micro_batching": {
+                f"normalize={key}": batcher.get_stats() for key, batcher in self._batchers.items()
+            } or None,
+            "store": {
+                f"normalize={key}": store.get_stats() for key, store in self._stores.items() if store
+            } or None
+        }
+
+
+if _LIBaseEmbedding is not None:
+    class SharedLlamaIndexEmbedding(_LIBaseEmbedding):
+        """LlamaIndex 嵌入适配器，委托给共享的 EmbeddingEngine"""
+
+        _engine: Any = PrivateAttr()
+        _normalize: bool = PrivateAttr(default=True)
+
+        def __init__(self, engine: EmbeddingEngine, normalize: bool = True, **kwargs: Any):
+            super().__init__(
+                model_name=engine.model_path,
+                embed_batch_size=engine.batch_size,
+                **kwargs
+            )
+            self._engine = engine
+            self._normalize = normalize
+
+        @classmethod
+        def class_name(cls) -> str:
+            return "SharedLlamaIndexEmbedding"
+
+        def _get_query_embedding(self, query: str) -> List[float]:
+            return self._engine.encode_query(query, normalize=self._normalize)
+
+        async def _aget_query_embedding(self, query: str) -> List[float]:
+            return await self._engine.aencode_query(query, normalize=self._normalize)
+
+        def _get_text_embedding(self, text: str) -> List[float]:
+            return self._engine.encode_documents([text], normalize=self._normalize)[0].tolist()
+
+        def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+            return self._engine.encode_documents(texts, normalize=self._normalize).tolist()
+else:
+    SharedLlamaIndexEmbedding = None
+
+
+class SharedLangChainEmbeddings(_LCEmbeddings):
+    """LangChain 嵌入适配器，委托给共享的 EmbeddingEngine"""
+
+    def __init__(self, engine: EmbeddingEngine, normalize: bool = True):
+        self.engine = engine
+        self.normalize = normalize
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.engine.encode_documents(texts, normalize=self.normalize).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.engine.encode_query(text, normalize=self.normalize)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await self.engine.aencode_query(text, normalize=self.normalize)
+
+
+class EmbeddingModelRegistry:
+    """进程级嵌入模型注册表"""
+
+    def __init__(self):
+        self._engines: Dict[Tuple[str, str], EmbeddingEngine] = {}
+        self._lock = threading.Lock()
+
+    def get_engine(self, model_path: Optional[str] = None, device: Optional[str] = None) -> EmbeddingEngine:
+        """获取（必要时加载）共享模型"""
+        key = (resolve_model_path(model_path), resolve_device(device))
+
+        # 快速路径：已加载
+        engine = self._engines.get(key)
+        if engine is not None:
+            return engine
+
+        with self._lock:
+            # 双重检查，防止并发重复加载
+            if key not in self._engines:
+                logger.info(f"加载共享嵌入模型: {key[0]} (device={key[1]})")
+                self._engines[key] = EmbeddingEngine(
+                    model_path=key[0],
+                    device=key[1],
+                    batch_size=_default_batch_size()
+                )
+            return self._engines[key]
+
+    def get_llamaindex_embedding(self, model_path: Optional[str] = None, device: Optional[str] = None, normalize: bool = True):
+        """获取 LlamaIndex 嵌入适配器"""
+        return self.get_engine(model_path, device).as_llamaindex(normalize)
+
+    def get_langchain_embeddings(self, model_path: Optional[str] = None, device: Optional[str] = None, normalize: bool = True):
+        """获取 LangChain 嵌入适配器"""
+        return self.get_engine(model_path, device).as_langchain(normalize)
+
+    def get_sentence_transformer(self, model_path: Optional[str] = None, device: Optional[str] = None):
+        """获取底层 SentenceTransformer（供直接调用 encode 的旧服务使用，归一化由调用方决定）"""
+        return self.get_engine(model_path, device).model
+
+    def is_loaded(self, model_path: Optional[str] = None, device: Optional[str] = None) -> bool:
+        """模型是否已常驻"""
+        return (resolve_model_path(model_path), resolve_device(device)) in self._engines
+
+    def get_stats(self) -> Dict[str, Any]:
+        """常驻模型及内存报告"""
+        engines = list(self._engines.values())
+        models = [engine.get_info() for engine in engines]
+        return {
+            "resident_models": len(models),
+            "total_memory_mb": round(sum(m["memory_mb"] for m in models), 2),
+            "models": models
+        }
+
+
+# 全局注册表实例
+_registry_instance: Optional[EmbeddingModelRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_embedding_registry() -> EmbeddingModelRegistry:
+    """获取全局嵌入模型注册表"""
+    global _registry_instance
+    if _registry_instance is None:
+        with _registry_lock:
+            if _registry_instance is None:
+                _registry_instance = EmbeddingModelRegistry()
+    return _registry_instance
+
+
+def get_embedding_engine(model_path: Optional[str] = None, device: Optional[str] = None) -> EmbeddingEngine:
+    """获取共享嵌入模型（便捷函数）"""
+    return get_embedding_registry().get_engine(model_path, device)
@@ -0,0 +1,216 @@
+"""
+持久化内容寻址嵌入存储
+以 (模型ID, sha256(文本)) 为键缓存文档块向量，向量保存在追加写入的 float32 文件中并通过 mmap 读取，
+导入、重建索引、重复上传时先查此存储，只对未见过的文本调用模型
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_HEX_KEY = re.compile(rb'[0-9a-f]{64}')
+
+
+def text_digest(text: str) -> str:
+    """文本内容哈希（sha256 十六进制）"""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def make_model_id(model_path: str, normalize: bool = True) -> str:
+    """由模型路径与归一化设置生成稳定的目录名"""
+    base = re.sub(r'[^A-Za-z0-9._-]+', '_', Path(str(model_path).rstrip('/')).name) or 'model'
+    suffix = hashlib.sha1(f"{model_path}|{normalize}".encode('utf-8')).hexdigest()[:8]
+    return f"{base}-{suffix}"
+
+
+class EmbeddingStore:
+    """
+    单个模型的嵌入存储
+
+    目录结构:
+        meta.json    模型信息与向量维度
+        vectors.f32  追加写入的 float32 行矩阵（mmap 读取）
+        keys.txt     与向量行一一对应的文本哈希，每行一个
+
+    写入顺序为先向量后键，崩溃后只保留完整的定长键记录，并以键与向量中较短者为准，保证键不会指向不完整的向量；
+    进程内写入失败时两个文件都截断回已提交的行数，下一次追加前也会先截断，行号始终与键对齐
+    """
+
+    def __init__(self, root_dir: str, model_id: str, dimension: int, model_path: str = ""):
+        self.dir = Path(root_dir) / model_id
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.model_id = model_id
+        self.dimension = int(dimension)
+        self.row_bytes = self.dimension * 4
+
+        self.meta_path = self.dir / "meta.json"
+        self.vectors_path = self.dir / "vectors.f32"
+        self.keys_path = self.dir / "keys.txt"
+        # 键为定长 sha256 十六进制串加换行
+        self.key_bytes = 64 + 1
+
+        self._lock = threading.RLock()
+        self._index: Dict[str, int] = {}
+        self._matrix: Optional[np.memmap] = None
+
+        # 统计
+        self.hits = 0
+        self.misses = 0
+
+        self._load(model_path)
+
+    def _load(self, model_path: str):
+        """加载键索引，并修复崩溃导致的键/向量行数不一致"""
+        if self.meta_path.exists():
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            if int(meta.get("dimension", self.dimension)) != self.dimension:
+                raise ValueError(
+                    f"嵌入存储维度不匹配: {self.dir} 记录 {meta.get('dimension')}，当前模型 {self.dimension}"
+                )
+        else:
+            with open(self.meta_path, 'w', encoding='utf-8') as f:
+                json.dump({"model_id": self.model_id, "model_path": model_path, "dimension": self.dimension}, f, ensure_ascii=False)
+
+        keys = self._read_keys()
+        vector_rows = self.vectors_path.stat().st_size // self.row_bytes if self.vectors_path.exists() else 0
+        rows = min(len(keys), vector_rows)
+        keys = keys[:rows]
+
+        # 键文件按定长记录截断，去掉残缺键行与多出的键，后续追加才会从记录边界开始
+        for path, size in ((self.keys_path, rows * self.key_bytes), (self.vectors_path, rows * self.row_bytes)):
+            if path.exists() and path.stat().st_size != size:
+                logger.warning(f"嵌入存储文件与已提交行数不一致，截断: {path.name} -> {rows} 行")
+                with open(path, 'r+b') as f:
+                    f.truncate(size)
+
+        self._index = {key: row for row, key in enumerate(keys)}
+        logger.info(f"嵌入存储已加载: {self.dir}，条目={len(self._index)}")
+
+    def _read_keys(self) -> List[str]:
+        """读取键文件中连续的完整记录（64 位十六进制 + 换行），遇到残缺或损坏的记录即停止"""
+        if not self.keys_path.exists():
+            return []
+        with open(self.keys_path, 'rb') as f:
+            data = f.read()
+        keys: List[str] = []
+        for offset in range(0, len(data) - self.key_bytes + 1, self.key_bytes):
+            record = data[offset:offset + self.key_bytes]
+            if record[-1:] != b"\n" or not _HEX_KEY.fullmatch(record[:-1]):
+                break
+            keys.append(record[:-1].decode('ascii'))
+        return keys
+
+    def _truncate_to_index(self):
+        """把向量与键文件截断到已提交的行数（去掉失败写入留下的尾部）"""
+        rows = len(self._index)
+        for path, size in ((self.vectors_path, rows * self.row_bytes), (self.keys_path, rows * self.key_bytes)):
+            if path.exists() and path.stat().st_size != size:
+                logger.warning(f"嵌入存储文件存在未提交的尾部，截断: {path.name} -> {rows} 行")
+                with open(path, 'r+b') as f:
+                    f.truncate(size)
+
+    def _get_matrix(self) -> Optional[np.memmap]:
+        """按当前行数映射向量文件（写入后重新映射）"""
+        rows = len(self._index)
+        if rows == 0:
+            return None
+        if self._matrix is None or self._matrix.shape[0] != rows:
+            self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(rows, self.dimension))
+        return self._matrix
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def get_many(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """查询向量，未命中位置返回 None"""
+        with self._lock:
+            matrix = self._get_matrix()
+            results: List[Optional[np.ndarray]] = []
+            for text in texts:
+                row = self._index.get(text_digest(text))
+                results.append(np.array(matrix[row]) if row is not None and matrix is not None else None)
+            return results
+
+    def put_many(self, texts: List[str], vectors: Any):
+        """追加写入新向量（已存在的键跳过）"""
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dimension)
+        with self._lock:
+            new_keys: List[str] = []
+            seen = set()
+            new_rows: List[np.ndarray] = []
+            for text, vector in zip(texts, vectors):
+                key = text_digest(text)
+                if key in self._index or key in seen:
+                    continue
+                seen.add(key)
+                new_keys.append(key)
+                new_rows.append(vector)
+            if not new_keys:
+                return
+
+            # 追加前先去掉之前失败写入的尾部，新行的行号才与 len(self._index) 一致
+            self._truncate_to_index()
+            start = len(self._index)
+            try:
+                # 先写向量并落盘，再写键
+                with open(self.vectors_path, 'ab') as f:
+                    f.write(np.ascontiguousarray(np.stack(new_rows), dtype=np.float32).tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+                with open(self.keys_path, 'a', encoding='utf-8') as f:
+                    f.write("".join(k + "\n" for k in new_keys))
+                    f.flush()
+                    os.fsync(f.fileno())
+            except Exception:
+                self._truncate_to_index()
+                raise
+
+            for offset, key in enumerate(new_keys):
+                self._index[key] = start + offset
+            self._matrix = None
+
+    def encode_with_store(self, texts: List[str], encode_fn: Callable[[List[str]], Any]) -> np.ndarray:
+        """先查存储，只对未命中文本调用 encode_fn，结果写回存储"""
+        if not texts:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+
+        cached = self.get_many(texts)
+        missing_positions = [i for i, vector in enumerate(cached) if vector is None]
+
+        # 同一次调用内的重复文本只编码一次
+        missing_texts = list(dict.fromkeys(texts[i] for i in missing_positions))
+        with self._lock:
+            self.hits += len(texts) - len(missing_positions)
+            self.misses += len(missing_texts)
+
+        if missing_texts:
+            encoded = np.asarray(encode_fn(missing_texts), dtype=np.float32).reshape(-1, self.dimension)
+            self.put_many(missing_texts, encoded)
+            by_text = dict(zip(missing_texts, encoded))
+            for i in missing_positions:
+                cached[i] = by_text[texts[i]]
+
+        return np.stack(cached).astype(np.float32, copy=False)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """存储统计"""
+        total = self.hits + self.misses
+        return {
+            "path": str(self.dir),
+            "entries": len(self._index),
+            "dimension": self.dimension,
+            "size_mb": round(len(self._index) * self.row_bytes / (1024 * 1024), 2),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0
+        }
@@ -0,0 +1,121 @@
+"""
+检索 / 入库专用线程池
+CPU 密集的检索（相似度计算、BM25、节点读取）与入库（解析、分块、编码、写索引）不在事件循环上执行，
+分别提交到并发数可配置的两个线程池：入库线程少于检索线程，大批量入库不会占满检索的执行资源，
+也不会阻塞状态 WebSocket 等其它接口；两个池均统计排队深度、运行数与等待耗时
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def _executors_config() -> Dict[str, Any]:
+    """从 rag_config.yaml 读取 llamaindex.executors"""
+    try:
+        from app.utils.config_loader import get_rag_config
+        return get_rag_config().get('llamaindex.executors', {}) or {}
+    except Exception:
+        return {}
+
+
+class BoundedExecutor:
+    """并发数固定的线程池，附带排队与耗时统计"""
+
+    def __init__(self, name: str, max_workers: int):
+        self.name = name
+        self.max_workers = max(1, int(max_workers))
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=f"{name}-worker")
+        self._lock = threading.Lock()
+
+        # 统计
+        self.queued = 0
+        self.running = 0
+        self.max_queue_depth = 0
+        self.completed = 0
+        self.failed = 0
+        self.total_wait_time = 0.0
+        self.total_run_time = 0.0
+
+    async def run(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """在线程池中执行 fn(*args, **kwargs) 并等待结果"""
+        submitted = time.perf_counter()
+        with self._lock:
+            self.queued += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.queued)
+
+        def _call():
+            started = time.perf_counter()
+            with self._lock:
+                self.queued -= 1
+                self.running += 1
+                self.total_wait_time += started - submitted
+            try:
+                return fn(*args, **kwargs)
+            except Exception:
+                with self._lock:
+                    self.failed += 1
+                raise
+            finally:
+                with self._lock:
+                    self.running -= 1
+                    self.completed += 1
+                    self.total_run_time += time.perf_counter() - started
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._pool, _call)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """排队深度、运行数与平均等待/执行耗时"""
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "queued": self.queued,
+                "running": self.running,
+                "max_queue_depth": self.max_queue_depth,
+                "completed": self.completed,
+                "failed": self.failed,
+                "avg_wait_ms": round(self.total_wait_time * 1000 / self.completed, 2) if self.completed else 0.0,
+                "avg_run_ms": round(self.total_run_time * 1000 / self.completed, 2) if self.completed else 0.0
+            }
+
+    def shutdown(self, wait: bool = True):
+        self._pool.shutdown(wait=wait)
+
+
+_query_executor: Optional[BoundedExecutor] = None
+_ingest_executor: Optional[BoundedExecutor] = None
+_executors_lock = threading.Lock()
+
+
+def get_query_executor() -> BoundedExecutor:
+    """检索线程池（单例，llamaindex.executors.query_workers）"""
+    global _query_executor
+    if _query_executor is None:
+        with _executors_lock:
+            if _query_executor is None:
+                _query_executor = BoundedExecutor("retrieval", _executors_config().get('query_workers', 4))
+    return _query_executor
+
+
+def get_ingest_executor() -> BoundedExecutor:
+    """入库线程池（单例，llamaindex.executors.ingest_workers）"""
+    global _ingest_executor
+    if _ingest_executor is None:
+        with _executors_lock:
+            if _ingest_executor is None:
+                _ingest_executor = BoundedExecutor("ingest", _executors_config().get('ingest_workers', 2))
+    return _ingest_executor
+
+
+def get_executor_stats() -> Dict[str, Any]:
+    """两个线程池的统计"""
+    return {
+        "query": get_query_executor().get_stats(),
+        "ingest": get_ingest_executor().get_stats()
+    }
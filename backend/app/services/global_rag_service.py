@@ -10,7 +10,7 @@ from typing import List, Dict, Any, Optional
 from pathlib import Path
 
 from langchain_community.vectorstores import FAISS
-from langchain_community.embeddings import HuggingFaceEmbeddings
+from .embedding_registry import get_embedding_registry
 from langchain.schema import Document
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 
@@ -62,19 +62,13 @@ class GlobalRAGService:
             local_model_path = "/root/.cache/sentence_transformers/BAAI_bge-large-zh-v1.5"
             if os.path.exists(local_model_path):
                 logger.info(f"从本地路径加载BGE模型: {local_model_path}")
-                embeddings = HuggingFaceEmbeddings(
-                    model_name=local_model_path,
-                    model_kwargs={'device': 'cpu'},
-                    encode_kwargs={'normalize_embeddings': True}
+                embeddings = get_embedding_registry().get_langchain_embeddings(
+                    local_model_path, normalize=True
                 )
             else:
-                # 在线下载
-                logger.info("从HuggingFace下载BGE模型")
-                embeddings = HuggingFaceEmbeddings(
-                    model_name="BAAI/bge-large-zh-v1.5",
-                    model_kwargs={'device': 'cpu'},
-                    encode_kwargs={'normalize_embeddings': True}
-                )
+                # 未找到缓存目录时按统一规则解析（LOCAL_BGE_MODEL_DIR 或在线模型），与其他服务共享同一份模型
+                logger.info("按统一规则加载BGE模型")
+                embeddings = get_embedding_registry().get_langchain_embeddings(normalize=True)
             
             logger.info("✅ BGE嵌入模型初始化成功")
             return embeddings
@@ -10,21 +10,22 @@ from typing import List, Dict, Any, Optional, Tuple
 from pathlib import Path
 import pickle
 import json
-from collections import defaultdict
 
-# BM25检索
-from rank_bm25 import BM25Okapi
+# BM25检索（增量倒排索引）
+from .lexical_index import LexicalIndex
 
 # 向量检索
 from langchain_community.vectorstores import FAISS
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from sentence_transformers import SentenceTransformer
+from .embedding_registry import get_embedding_registry
 
 # 重排序
-from .reranker_service import RerankerService
+from .reranker_service import get_reranker_service
 
 logger = logging.getLogger(__name__)
 
+_EMPTY_IDS = np.empty(0, dtype=object)
+_EMPTY_SCORES = np.empty(0, dtype=np.float32)
+
 
 class HybridRetriever:
     """混合检索器 - BM25 + 向量检索 + RRF融合"""
@@ -34,33 +35,28 @@ class HybridRetriever:
         self.vector_db_path = Path(vector_db_path)
         
         # 初始化组件
-        self.bm25_index = None
+        self.bm25_index: Optional[LexicalIndex] = None
         self.vector_store = None
-        self.reranker_service = RerankerService()
-        self.documents = []
-        self.document_ids = []
+        self.reranker_service = get_reranker_service()  # 进程内共享，模型只加载一次
         
         # 配置参数
         self.bm25_weight = 0.3  # BM25权重
         self.vector_weight = 0.7  # 向量检索权重
         self.rrf_k = 60  # RRF参数
+        self.rerank_candidates = 20  # 送入重排序的融合候选数
         
         self._initialize_components()
     
     def _initialize_components(self):
         """初始化检索组件"""
         try:
-            # 初始化BGE嵌入模型（强制本地优先）
+            # 初始化BGE嵌入模型（强制本地优先，借用进程级共享模型）
             local_model_dir = os.getenv('LOCAL_BGE_MODEL_DIR', '')
             model_name = local_model_dir if local_model_dir else os.getenv('BGE_MODEL_NAME', 'BAAI/bge-large-zh-v1.5')
             if local_model_dir:
                 os.environ['HF_HUB_OFFLINE'] = '1'
                 os.environ['HF_DATASETS_OFFLINE'] = '1'
-            self.embeddings = HuggingFaceEmbeddings(
-                model_name=model_name,
-                model_kwargs={'device': 'cuda' if os.getenv('CUDA_VISIBLE_DEVICES') else 'cpu'},
-                encode_kwargs={'normalize_embeddings': True}
-            )
+            self.embeddings = get_embedding_registry().get_langchain_embeddings(model_name, normalize=True)
             
             # 重排序服务已在初始化时创建
             if self.reranker_service.is_available():
@@ -99,145 +95,137 @@ class HybridRetriever:
             self.vector_store = None
     
     def _build_bm25_index(self):
-        """构建BM25索引"""
+        """由向量存储的 docstore 全量构建BM25索引（仅在加载向量存储时调用，之后按变更的文档ID增量维护）"""
         try:
             if not self.vector_store:
                 logger.warning("向量存储为空，无法构建BM25索引")
                 return
             
-            # 从向量存储中提取文档
-            if hasattr(self.vector_store, 'docstore') and hasattr(self.vector_store.docstore, '_dict'):
-                docstore = self.vector_store.docstore
-                self.documents = []
-                self.document_ids = []
-                
-                for doc_id, doc in docstore._dict.items():
-                    # 分词处理（简单的中文分词）
-                    content = doc.page_content
-                    # 使用简单的字符级分词，适合中文
-                    tokens = list(content)
-                    self.documents.append(tokens)
-                    self.document_ids.append(doc_id)
-                
-                if self.documents:
-                    self.bm25_index = BM25Okapi(self.documents)
-                    logger.info(f"BM25索引构建成功: {len(self.documents)} 个文档")
-                else:
-                    logger.warning("没有文档可用于构建BM25索引")
+            if not (hasattr(self.vector_store, 'docstore') and hasattr(self.vector_store.docstore, '_dict')):
+                return
+            self.bm25_index = LexicalIndex.build(
+                (doc_id, doc.page_content) for doc_id, doc in self.vector_store.docstore._dict.items()
+            )
+            logger.info(f"BM25索引构建完成: {len(self.bm25_index)} 个文档")
             
         except Exception as e:
             logger.error(f"BM25索引构建失败: {e}")
             self.bm25_index = None
     
-    def _bm25_search(self, query: str, top_k: int = 20) -> List[Dict[str, Any]]:
-        """BM25检索"""
+    def _index_bm25_documents(self, doc_ids: List[str]):
+        """把新写入向量存储的文档加入BM25索引（开销与新增文档数成正比）"""
+        if self.bm25_index is None:
+            self._build_bm25_index()
+            return
+        docstore = self.vector_store.docstore._dict
+        added = 0
+        for doc_id in doc_ids:
+            doc = docstore.get(doc_id)
+            if doc is not None:
+                self.bm25_index.add(doc_id, doc.page_content)
+                added += 1
+        logger.info(f"BM25索引已更新: 新增 {added}，共 {len(self.bm25_index)} 个文档")
+    
+    def _remove_bm25_documents(self, doc_ids: List[str]):
+        """从BM25索引移除已删除的文档（打墓碑）"""
+        if self.bm25_index is None:
+            return
+        removed = self.bm25_index.remove(doc_ids)
+        logger.info(f"BM25索引已更新: 删除 {removed}，共 {len(self.bm25_index)} 个文档")
+    
+    def _bm25_search_ids(self, query: str, top_k: int = 20) -> Tuple[np.ndarray, np.ndarray]:
+        """BM25检索：返回 (docstore ID 数组, 分数数组)，不读取文档内容"""
         if not self.bm25_index:
-            return []
+            return _EMPTY_IDS, _EMPTY_SCORES
         
         try:
-            # 查询分词
-            query_tokens = list(query)
-            
-            # BM25检索
-            scores = self.bm25_index.get_scores(query_tokens)
-            
-            # 获取Top-K结果
-            top_indices = np.argsort(scores)[::-1][:top_k]
-            
-            results = []
-            for idx in top_indices:
-                if scores[idx] > 0:  # 只返回有分数的结果
-                    doc_id = self.document_ids[idx]
-                    doc = self.vector_store.docstore._dict[doc_id]
-                    
-                    results.append({
-                        'doc_id': doc_id,
-                        'content': doc.page_content,
-                        'metadata': doc.metadata,
-                        'bm25_score': float(scores[idx]),
-                        'rank': len(results) + 1
-                    })
-            
-            logger.info(f"BM25检索完成: {len(results)} 个结果")
-            return results
+            hits = self.bm25_index.search(query, top_k)
+            ids = np.array([doc_id for doc_id, _ in hits], dtype=object)
+            scores = np.array([score for _, score in hits], dtype=np.float32)
+            logger.info(f"BM25检索完成: {len(ids)} 个结果")
+            return ids, scores
             
         except Exception as e:
             logger.error(f"BM25检索失败: {e}")
-            return []
+            return _EMPTY_IDS, _EMPTY_SCORES
     
-    def _vector_search(self, query: str, top_k: int = 20) -> List[Dict[str, Any]]:
-        """向量检索"""
+    def _vector_search_ids(self, query: str, top_k: int = 20) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        向量检索：直接查询 FAISS 索引，按 index_to_docstore_id 映射得到 docstore ID，
+        返回 (ID 数组, 相似度数组)，不读取文档内容
+        """
         if not self.vector_store:
-            return []
+            return _EMPTY_IDS, _EMPTY_SCORES
         
         try:
-            # 执行相似性搜索
-            docs_with_scores = self.vector_store.similarity_search_with_score(query, k=top_k)
-            
-            results = []
-            for i, (doc, score) in enumerate(docs_with_scores):
-                # 获取文档ID
-                doc_id = None
-                if hasattr(self.vector_store, 'docstore') and hasattr(self.vector_store.docstore, '_dict'):
-                    for idx, stored_doc in self.vector_store.docstore._dict.items():
-                        if stored_doc.page_content == doc.page_content:
-                            doc_id = idx
-                            break
-                
-                results.append({
-                    'doc_id': doc_id or f"vector_{i}",
-                    'content': doc.page_content,
-                    'metadata': doc.metadata,
-                    'vector_score': float(1 - score),  # 转换为相似度
-                    'rank': i + 1
-                })
+            vector = np.asarray([self.embeddings.embed_query(query)], dtype=np.float32)
+            if getattr(self.vector_store, '_normalize_L2', False):
+                vector /= np.linalg.norm(vector, axis=1, keepdims=True) + 1e-12
+            distances, rows = self.vector_store.index.search(vector, top_k)
+            valid = rows[0] >= 0
+            mapping = self.vector_store.index_to_docstore_id
+            ids = np.array([mapping[int(row)] for row in rows[0][valid]], dtype=object)
+            distances = distances[0][valid].astype(np.float32)
+            
+            strategy = getattr(self.vector_store, 'distance_strategy', None)
+            if getattr(strategy, 'value', strategy) == 'MAX_INNER_PRODUCT':
+                scores = distances
+            else:
+                scores = 1 - distances  # L2 距离转换为相似度
             
-            logger.info(f"向量检索完成: {len(results)} 个结果")
-            return results
+            logger.info(f"向量检索完成: {len(ids)} 个结果")
+            return ids, scores
             
         except Exception as e:
             logger.error(f"向量检索失败: {e}")
-            return []
+            return _EMPTY_IDS, _EMPTY_SCORES
     
-    def _rrf_fusion(self, bm25_results: List[Dict], vector_results: List[Dict]) -> List[Dict[str, Any]]:
-        """RRF (Reciprocal Rank Fusion) 融合"""
-        try:
-            # 创建文档ID到分数的映射
-            doc_scores = defaultdict(float)
-            doc_info = {}
-            
-            # BM25结果处理
-            for i, result in enumerate(bm25_results):
-                doc_id = result['doc_id']
-                rrf_score = 1.0 / (self.rrf_k + i + 1)  # RRF公式
-                doc_scores[doc_id] += self.bm25_weight * rrf_score
-                doc_info[doc_id] = result
-            
-            # 向量检索结果处理
-            for i, result in enumerate(vector_results):
-                doc_id = result['doc_id']
-                rrf_score = 1.0 / (self.rrf_k + i + 1)
-                doc_scores[doc_id] += self.vector_weight * rrf_score
-                if doc_id not in doc_info:
-                    doc_info[doc_id] = result
-            
-            # 按融合分数排序
-            sorted_docs = sorted(doc_scores.items(), key=lambda x: x[1], reverse=True)
-            
-            # 构建最终结果
-            fused_results = []
-            for doc_id, fused_score in sorted_docs:
-                result = doc_info[doc_id].copy()
-                result['fused_score'] = fused_score
-                result['rank'] = len(fused_results) + 1
-                fused_results.append(result)
-            
-            logger.info(f"RRF融合完成: {len(fused_results)} 个结果")
-            return fused_results
-            
-        except Exception as e:
-            logger.error(f"RRF融合失败: {e}")
-            return []
+    def _vector_search(self, query: str, top_k: int = 20) -> List[Dict[str, Any]]:
+        """向量检索（返回含内容的结果字典）"""
+        ids, scores = self._vector_search_ids(query, top_k)
+        return self._materialize(ids, {'vector_score': dict(zip(ids, scores))})
+    
+    def _rrf_fusion_ids(self, bm25_ids: np.ndarray, vector_ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """RRF (Reciprocal Rank Fusion) 融合：在 ID 数组上计算，返回按融合分数降序的 (ID, 分数)"""
+        ids = np.concatenate([bm25_ids, vector_ids])
+        if ids.size == 0:
+            return _EMPTY_IDS, _EMPTY_SCORES
+        weights = np.concatenate([
+            self.bm25_weight / (self.rrf_k + np.arange(1, len(bm25_ids) + 1)),  # RRF公式
+            self.vector_weight / (self.rrf_k + np.arange(1, len(vector_ids) + 1))
+        ])
+        unique_ids, inverse = np.unique(ids, return_inverse=True)
+        fused = np.bincount(inverse, weights=weights)
+        order = np.argsort(-fused, kind='stable')
+        logger.info(f"RRF融合完成: {len(unique_ids)} 个结果")
+        return unique_ids[order], fused[order]
+    
+    def _materialize(
+        self,
+        ids: np.ndarray,
+        source_scores: Dict[str, Dict[str, float]],
+        fused_scores: Optional[np.ndarray] = None
+    ) -> List[Dict[str, Any]]:
+        """只为给定的 ID 读取 docstore 内容，构建结果字典"""
+        docstore = self.vector_store.docstore._dict if self.vector_store else {}
+        results = []
+        for i, doc_id in enumerate(ids):
+            doc = docstore.get(doc_id)
+            if doc is None:
+                continue
+            result = {
+                'doc_id': doc_id,
+                'content': doc.page_content,
+                'metadata': doc.metadata,
+                'rank': len(results) + 1
+            }
+            for key, scores in source_scores.items():
+                if doc_id in scores:
+                    result[key] = float(scores[doc_id])
+            if fused_scores is not None:
+                result['fused_score'] = float(fused_scores[i])
+            results.append(result)
+        return results
     
     def _rerank_results(self, query: str, results: List[Dict[str, Any]], top_k: int = 5) -> List[Dict[str, Any]]:
         """重排序结果"""
@@ -270,20 +258,30 @@ class HybridRetriever:
         try:
             logger.info(f"开始混合检索: '{query}', top_k={top_k}")
             
-            # 1. BM25检索
-            bm25_results = self._bm25_search(query, top_k=20)
-            
-            # 2. 向量检索
-            vector_results = self._vector_search(query, top_k=20)
-            
-            # 3. RRF融合
-            fused_results = self._rrf_fusion(bm25_results, vector_results)
-            
-            # 4. 重排序（可选）
-            if use_rerank and self.reranker_service.is_available():
-                final_results = self._rerank_results(query, fused_results, top_k)
+            # 1. BM25检索（ID + 分数）
+            bm25_ids, bm25_scores = self._bm25_search_ids(query, top_k=20)
+            
+            # 2. 向量检索（ID + 分数）
+            vector_ids, vector_scores = self._vector_search_ids(query, top_k=20)
+            
+            # 3. RRF融合（在 ID 上计算）
+            fused_ids, fused_scores = self._rrf_fusion_ids(bm25_ids, vector_ids)
+            
+            # 4. 只为最终候选读取内容，重排序（可选）
+            use_rerank = use_rerank and self.reranker_service.is_available()
+            pool = max(top_k, self.rerank_candidates) if use_rerank else top_k
+            candidates = self._materialize(
+                fused_ids[:pool],
+                {
+                    'bm25_score': dict(zip(bm25_ids, bm25_scores)),
+                    'vector_score': dict(zip(vector_ids, vector_scores))
+                },
+                fused_scores[:pool]
+            )
+            if use_rerank:
+                final_results = self._rerank_results(query, candidates, top_k)
             else:
-                final_results = fused_results[:top_k]
+                final_results = candidates[:top_k]
             
             # 5. 添加检索元信息
             for i, result in enumerate(final_results):
@@ -319,10 +317,8 @@ class HybridRetriever:
                     )
                     langchain_docs.append(doc)
                 
-                self.vector_store.add_documents(langchain_docs)
-            
-            # 重建BM25索引
-            self._build_bm25_index()
+                # 增量更新BM25索引（只处理新增文档）
+                self._index_bm25_documents(self.vector_store.add_documents(langchain_docs))
             
             logger.info(f"文档添加成功: {len(documents)} 个文档")
             
@@ -337,7 +333,7 @@ class HybridRetriever:
             'bm25_available': self.bm25_index is not None,
             'vector_available': self.vector_store is not None,
             'reranker_available': self.reranker_service.is_available(),
-            'document_count': len(self.documents),
+            'document_count': len(self.bm25_index) if self.bm25_index else 0,
             'bm25_weight': self.bm25_weight,
             'vector_weight': self.vector_weight,
             'rrf_k': self.rrf_k,
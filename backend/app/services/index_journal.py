@@ -0,0 +1,137 @@
+"""
+二级索引增量持久化
+快照（JSON）+ 追加日志（JSON Lines）：每次落盘只把上次落盘后的变更追加到日志，
+日志条目数超过语料规模的一定比例时才重写快照并清空日志，单文件上传的落盘开销与变更量成正比。
+快照与日志都带代号，重写快照后残留的旧日志不会被重放
+"""
+
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 日志条目数超过 max(_COMPACT_MIN_RECORDS, 存活条目数 * _COMPACT_RATIO) 时重写快照
+_COMPACT_RATIO = 0.5
+_COMPACT_MIN_RECORDS = 1000
+
+
+def journal_path(path: Path) -> Path:
+    """快照对应的日志路径"""
+    return path.with_suffix(path.suffix + '.log')
+
+
+class IndexJournal:
+    """
+    单个索引的落盘状态：上次落盘后的变更、日志条目数与快照代号
+
+    不自带锁，由所属索引在自身锁内调用
+    """
+
+    def __init__(self):
+        self.pending: List[Dict[str, Any]] = []
+        self.records = 0
+        self.generation = 0
+        # 新建（或全量重建）的索引尚无快照，下次落盘写快照，期间不记录变更
+        self.snapshot_needed = True
+
+    def record(self, entry: Dict[str, Any]):
+        """登记一条变更（需要写快照时不必记录）"""
+        if not self.snapshot_needed:
+            self.pending.append(entry)
+
+    def save(self, path: Path, snapshot: Callable[[], Dict[str, Any]], live_count: int) -> bool:
+        """
+        落盘：没有变更时直接返回 False；日志过长、快照缺失或需要全量快照时重写快照，否则只追加日志
+
+        Args:
+            snapshot: 返回快照内容（不含代号）
+            live_count: 索引当前条目数，决定日志多长时重写快照
+        """
+        path = Path(path)
+        if not self.snapshot_needed and not self.pending and path.exists():
+            return False
+        path.parent.mkdir(parents=True, exist_ok=True)
+        log_path = journal_path(path)
+        threshold = max(_COMPACT_MIN_RECORDS, int(live_count * _COMPACT_RATIO))
+        if self.snapshot_needed or not path.exists() or self.records + len(self.pending) > threshold:
+            generation = self.generation + 1
+            payload = snapshot()
+            payload["generation"] = generation
+            tmp_path = path.with_suffix(path.suffix + '.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(payload, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+            log_path.unlink(missing_ok=True)
+            self.generation = generation
+            self.records = 0
+            self.snapshot_needed = False
+        else:
+            lines = []
+            if not log_path.exists():
+                lines.append(json.dumps({"generation": self.generation}))
+            lines.extend(json.dumps(entry, ensure_ascii=False) for entry in self.pending)
+            try:
+                with open(log_path, 'a', encoding='utf-8') as f:
+                    f.write("".join(line + "\n" for line in lines))
+                    f.flush()
+                    os.fsync(f.fileno())
+            except Exception:
+                # 日志尾部可能已写入半行，之后不能再追加
+                self.snapshot_needed = True
+                self.pending = []
+                raise
+            self.records += len(self.pending)
+        self.pending = []
+        return True
+
+    @classmethod
+    def read(cls, path: Path) -> Optional[Tuple[Dict[str, Any], List[Dict[str, Any]], "IndexJournal"]]:
+        """
+        读取快照与同代号的日志
+
+        Returns:
+            (快照, 按顺序待重放的变更, 已加载的落盘状态)；快照不存在或损坏时返回 None
+        """
+        path = Path(path)
+        if not path.exists():
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                payload = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"索引快照损坏，将重建: {path}, {e}")
+            return None
+
+        journal = cls()
+        journal.generation = int(payload.get("generation", 0))
+        journal.snapshot_needed = False
+        entries: List[Dict[str, Any]] = []
+        log_path = journal_path(path)
+        if log_path.exists():
+            with open(log_path, 'r', encoding='utf-8') as f:
+                lines = f.read().split("\n")
+            try:
+                header = json.loads(lines[0])
+            except ValueError:
+                header = {}
+            if header.get("generation") == journal.generation:
+                # 以换行结尾的行才是完整条目；崩溃时最后一行可能写了一半，之后的追加会接在残行上，
+                # 因此遇到残行即停止，并在下次落盘时改写快照
+                for line in lines[1:-1]:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        journal.snapshot_needed = True
+                        break
+                if lines[-1]:
+                    journal.snapshot_needed = True
+                if journal.snapshot_needed:
+                    logger.warning(f"索引日志存在残缺行，下次落盘重写快照: {log_path}")
+            else:
+                # 快照已重写但旧日志未删除
+                journal.snapshot_needed = True
+            journal.records = len(entries)
+        return payload, entries, journal
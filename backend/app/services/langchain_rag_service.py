@@ -26,17 +26,14 @@ from langchain_community.document_loaders import (
     UnstructuredPowerPointLoader
 )
 from langchain_community.vectorstores import FAISS
-from langchain_openai import OpenAIEmbeddings, ChatOpenAI
-try:
-    from langchain_community.embeddings import HuggingFaceEmbeddings
-except ImportError:
-    # 新版本路径
-    from langchain_huggingface import HuggingFaceEmbeddings
-
-from sentence_transformers import SentenceTransformer
+from langchain_openai import OpenAIEmbeddings
 
 # 导入缓存管理器
 from .smart_cache_manager import get_cache_manager
+# 进程级共享嵌入模型
+from .embedding_registry import get_embedding_registry
+# 进程级共享 LLM 客户端
+from .llm_registry import get_llm
 
 logger = logging.getLogger(__name__)
 
@@ -81,16 +78,10 @@ class LangChainRAGService:
                 os.environ['OPENAI_API_KEY'] = api_key
                 os.environ['OPENAI_BASE_URL'] = api_base
                 
-                # 从环境变量读取模型名称
-                model_name = os.getenv('LLM_MODEL', 'gpt-4o-2024-08-06')
-                self.llm = ChatOpenAI(
-                    model=model_name,
-                    temperature=0.1,
-                    openai_api_key=api_key,
-                    openai_api_base=api_base,
-                    request_timeout=120,  # 增加到120秒超时，适应大模型调用时间
-                    max_retries=1  # 减少重试次数
-                )
+                # 使用进程级共享客户端（模型名称读取 LLM_MODEL，超时与重试见 llm.http_pool）
+                self.llm = get_llm(temperature=0.1, base_url=api_base)
+                if self.llm is None:
+                    raise ValueError("共享 LLM 客户端不可用")
                 logger.info("LLM初始化成功")
             except Exception as e:
                 logger.warning(f"LLM初始化失败: {str(e)}")
@@ -135,20 +126,14 @@ class LangChainRAGService:
                 model_name = os.getenv('BGE_MODEL_NAME', 'BAAI/bge-large-zh-v1.5')
             
             try:
-                logger.info(f"正在加载BGE模型: {model_name}")
+                logger.info(f"正在获取共享BGE模型: {model_name}")
                 
-                # 直接使用SentenceTransformer加载BGE模型
-                model = SentenceTransformer(model_name)
-                
-                # 使用HuggingFaceEmbeddings包装BGE模型
-                embeddings = HuggingFaceEmbeddings(
-                    model_name=model_name,
-                    model_kwargs={'device': 'cuda' if os.getenv('CUDA_VISIBLE_DEVICES') else 'cpu'},
-                    encode_kwargs={'normalize_embeddings': True}  # BGE模型建议归一化
-                )
+                # 从注册表借用共享模型（BGE模型建议归一化），不再重复加载权重
+                engine = get_embedding_registry().get_engine(model_name)
+                embeddings = engine.as_langchain(normalize=True)
                 
-                logger.info(f"✅ 成功加载BGE模型: {model_name}")
-                logger.info(f"   维度: {len(embeddings.embed_query('测试'))}")
+                logger.info(f"✅ 成功获取BGE模型: {model_name}")
+                logger.info(f"   维度: {engine.dimension}")
                 return embeddings
                 
             except Exception as e:
@@ -0,0 +1,298 @@
+"""
+节点词法索引（BM25）
+增量维护的倒排表：每个词对应 (文档槽位, 词频) 两个紧凑数组，新增文档只追加涉及的倒排表，
+删除只打墓碑标记并在墓碑过多时整理；检索时只读取查询词的倒排表，
+在命中文档上向量化计算 BM25 分数，再用 argpartition 取 top-k
+"""
+
+import logging
+import re
+import threading
+from array import array
+from collections import Counter
+from pathlib import Path
+from typing import Collection, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from app.services.index_journal import IndexJournal
+
+logger = logging.getLogger(__name__)
+
+try:
+    import jieba  # type: ignore
+    jieba.setLogLevel(logging.WARNING)
+except ImportError:
+    jieba = None
+
+_FORMAT_VERSION = 2
+
+# 英文/数字串（产品编码、型号等）整体作为一个词；连续汉字单独成段再细分
+_TOKEN_PATTERN = re.compile(r"[a-z0-9][a-z0-9_\-\.]*[a-z0-9]|[a-z0-9]|[一-鿿]+")
+_CJK_PATTERN = re.compile(r"[一-鿿]")
+
+# 墓碑槽位占比超过此值（且数量足够多）时整理倒排表
+_COMPACT_DEAD_RATIO = 0.5
+_COMPACT_MIN_DEAD = 1000
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    中文友好的分词：
+    - 英文/数字串整体保留（小写）
+    - 连续汉字切为重叠二元组（单字段保留单字）；安装了 jieba 时再补充长度大于 2 的词（二字词已由二元组覆盖）
+    """
+    if not text:
+        return []
+    tokens: List[str] = []
+    for piece in _TOKEN_PATTERN.findall(text.lower()):
+        if not _CJK_PATTERN.match(piece):
+            tokens.append(piece)
+            continue
+        if len(piece) == 1:
+            tokens.append(piece)
+            continue
+        tokens.extend(piece[i:i + 2] for i in range(len(piece) - 1))
+        if jieba is not None:
+            tokens.extend(word for word in jieba.cut(piece) if len(word) > 2)
+    return tokens
+
+
+class _Postings:
+    """单个词的倒排表：文档槽位与词频的紧凑数组（只追加）"""
+
+    __slots__ = ("slots", "tfs", "df")
+
+    def __init__(self):
+        self.slots = array('i')
+        self.tfs = array('f')
+        self.df = 0  # 存活文档数（不含墓碑）
+
+
+class LexicalIndex:
+    """BM25 倒排索引，增删节点的开销与节点自身的词数成正比"""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        self._journal = IndexJournal()
+        self._reset()
+
+    def _reset(self):
+        self._slot_of: Dict[str, int] = {}
+        self._slot_ids: List[Optional[str]] = []
+        # 槽位 -> {词: 词频}，删除时据此更新文档频率；墓碑槽位为 None
+        self._slot_terms: List[Optional[Dict[str, int]]] = []
+        self._lengths = array('f')
+        self._postings: Dict[str, _Postings] = {}
+        self._total_length = 0.0
+        self._dead = 0
+        self._posting_count = 0
+
+    def __len__(self) -> int:
+        return len(self._slot_of)
+
+    def __contains__(self, node_id: str) -> bool:
+        return node_id in self._slot_of
+
+    def node_ids(self) -> List[str]:
+        with self._lock:
+            return list(self._slot_of.keys())
+
+    def add(self, node_id: str, text: str):
+        """登记节点文本（重复登记时以新文本为准）"""
+        terms = dict(Counter(tokenize(text)))
+        with self._lock:
+            self._add_terms(node_id, terms)
+            self._journal.record({"op": "add", "id": node_id, "terms": terms})
+
+    def _add_terms(self, node_id: str, terms: Dict[str, int]):
+        with self._lock:
+            if node_id in self._slot_of:
+                self._remove_one(node_id)
+            slot = len(self._slot_ids)
+            length = float(sum(terms.values()))
+            self._slot_of[node_id] = slot
+            self._slot_ids.append(node_id)
+            self._slot_terms.append(terms)
+            self._lengths.append(length)
+            self._total_length += length
+            for term, tf in terms.items():
+                postings = self._postings.get(term)
+                if postings is None:
+                    postings = self._postings[term] = _Postings()
+                postings.slots.append(slot)
+                postings.tfs.append(tf)
+                postings.df += 1
+            self._posting_count += len(terms)
+
+    def remove(self, node_ids: Iterable[str]) -> int:
+        """移除节点（打墓碑），返回实际移除数量"""
+        removed: List[str] = []
+        with self._lock:
+            for node_id in node_ids:
+                if node_id in self._slot_of:
+                    self._remove_one(node_id)
+                    removed.append(node_id)
+            if removed:
+                self._journal.record({"op": "remove", "ids": removed})
+            if self._dead >= _COMPACT_MIN_DEAD and self._dead > _COMPACT_DEAD_RATIO * len(self._slot_ids):
+                self._compact()
+        return len(removed)
+
+    def _remove_one(self, node_id: str):
+        slot = self._slot_of.pop(node_id)
+        terms = self._slot_terms[slot]
+        self._slot_terms[slot] = None
+        self._slot_ids[slot] = None
+        self._total_length -= self._lengths[slot]
+        self._dead += 1
+        for term in terms:
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.df -= 1
+
+    def _compact(self):
+        """丢弃墓碑槽位，按存活文档重建倒排表"""
+        live = [(node_id, self._slot_terms[slot]) for node_id, slot in self._slot_of.items()]
+        dead = self._dead
+        self._reset()
+        for node_id, terms in live:
+            self._add_terms(node_id, terms)
+        logger.info(f"词法索引整理完成: 清理墓碑={dead}, 存活节点={len(live)}")
+
+    def search(
+        self,
+        query: str,
+        top_k: int = 10,
+        allowed: Optional[Collection[str]] = None
+    ) -> List[Tuple[str, float]]:
+        """
+        BM25 检索：只对查询词倒排表中的文档打分
+
+        Args:
+            allowed: 只在这些节点中检索（元数据预过滤）；None 表示不限制
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms or top_k <= 0:
+            return []
+        with self._lock:
+            total = len(self._slot_of)
+            if total == 0:
+                return []
+            avg_length = self._total_length / total or 1.0
+            # 零拷贝视图：只按命中槽位取文档长度；离开锁前释放，避免阻止数组追加
+            lengths = np.frombuffer(self._lengths, dtype=np.float32) if len(self._lengths) else np.zeros(0, np.float32)
+            slot_parts, weight_parts = [], []
+            for term in terms:
+                postings = self._postings.get(term)
+                if postings is None or postings.df <= 0:
+                    continue
+                idf = np.log((total - postings.df + 0.5) / (postings.df + 0.5) + 1.0)
+                slots = np.array(postings.slots, dtype=np.int64)
+                tfs = np.array(postings.tfs, dtype=np.float32)
+                norm = self.k1 * (1 - self.b + self.b * lengths[slots] / avg_length)
+                slot_parts.append(slots)
+                weight_parts.append(idf * tfs * (self.k1 + 1) / (tfs + norm))
+            del lengths
+            slot_ids = self._slot_ids
+            if not slot_parts:
+                return []
+            # 按命中槽位稀疏累加（规模为倒排表总长度，而非语料规模）
+            candidates, inverse = np.unique(np.concatenate(slot_parts), return_inverse=True)
+            scores = np.bincount(inverse, weights=np.concatenate(weight_parts))
+            if allowed is not None:
+                allowed_slots = np.fromiter(
+                    (self._slot_of[node_id] for node_id in allowed if node_id in self._slot_of), dtype=np.int64
+                )
+                alive = np.isin(candidates, allowed_slots)
+            else:
+                alive = np.fromiter((slot_ids[slot] is not None for slot in candidates), dtype=bool, count=len(candidates))
+            candidates, scores = candidates[alive], scores[alive]
+            if candidates.size == 0:
+                return []
+            if candidates.size > top_k:
+                keep = np.argpartition(-scores, top_k - 1)[:top_k]
+                candidates, scores = candidates[keep], scores[keep]
+            order = np.argsort(-scores, kind='stable')
+            return [(slot_ids[candidates[i]], float(scores[i])) for i in order]
+
+    def get_stats(self) -> Dict[str, float]:
+        """索引统计"""
+        with self._lock:
+            return {
+                "nodes": len(self._slot_of),
+                "terms": len(self._postings),
+                "dead_slots": self._dead,
+                "postings": sum(len(p.slots) for p in self._postings.values())
+            }
+
+    def estimate_memory_bytes(self) -> int:
+        """估算常驻内存：倒排条目（槽位 + 词频各 4 字节）、每个槽位的词频字典与每个词的倒排表对象"""
+        with self._lock:
+            return self._posting_count * 8 + len(self._slot_ids) * 240 + len(self._postings) * 200
+
+    @classmethod
+    def build(cls, items: Iterable[Tuple[str, str]]) -> "LexicalIndex":
+        """由 (node_id, 文本) 序列全量构建"""
+        index = cls()
+        for node_id, text in items:
+            index.add(str(node_id), text)
+        return index
+
+    def save(self, path: Path) -> bool:
+        """
+        落盘（见 index_journal）：只把上次落盘后的增删追加到日志，日志过长时才重写快照
+
+        Returns:
+            没有变更时返回 False
+        """
+        with self._lock:
+            return self._journal.save(path, self._snapshot, len(self._slot_of))
+
+    def _snapshot(self) -> Dict:
+        docs = {node_id: self._slot_terms[slot] for node_id, slot in self._slot_of.items()}
+        return {"version": _FORMAT_VERSION, "jieba": jieba is not None, "docs": docs}
+
+    @classmethod
+    def load(cls, path: Path) -> Optional["LexicalIndex"]:
+        """读取快照并重放日志；文件不存在、格式不符或分词方式变化时返回 None"""
+        loaded = IndexJournal.read(path)
+        if loaded is None:
+            return None
+        payload, entries, journal = loaded
+        if payload.get("version") != _FORMAT_VERSION or payload.get("jieba") != (jieba is not None):
+            return None
+
+        index = cls()
+        for node_id, terms in payload.get("docs", {}).items():
+            index._add_terms(node_id, terms)
+        for entry in entries:
+            if entry.get("op") == "add":
+                index._add_terms(entry["id"], entry["terms"])
+            elif entry.get("op") == "remove":
+                index.remove(entry["ids"])
+        index._journal = journal
+        return index
+
+
+def rrf_fuse(
+    ranked_lists: List[Tuple[List[str], float]],
+    rrf_k: int = 60
+) -> List[Tuple[str, float]]:
+    """
+    RRF（Reciprocal Rank Fusion）融合多路排序结果
+
+    Args:
+        ranked_lists: [(按相关度降序的节点ID列表, 权重)]
+        rrf_k: RRF 平滑参数
+
+    Returns:
+        按融合分数降序的 [(node_id, 融合分数)]
+    """
+    fused: Dict[str, float] = {}
+    for node_ids, weight in ranked_lists:
+        for rank, node_id in enumerate(node_ids):
+            fused[node_id] = fused.get(node_id, 0.0) + weight / (rrf_k + rank + 1)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
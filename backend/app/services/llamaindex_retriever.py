@@ -5,56 +5,384 @@ LlamaIndex 高级检索引擎
 
 from typing import List, Dict, Optional, Any
 from pathlib import Path
+import asyncio
+import json
 import logging
 import os
 import threading
 import time
+from contextlib import ExitStack, contextmanager
+
+import numpy as np
 
 logger = logging.getLogger(__name__)
 
 try:
     # 使用最小依赖集合，避免触发 LLM 模块
     from llama_index.core.indices.vector_store import VectorStoreIndex
+    from llama_index.core.indices.vector_store.retrievers import VectorIndexRetriever
     from llama_index.core.storage.storage_context import StorageContext
     from llama_index.core.indices.loading import load_index_from_storage
-    from llama_index.core.node_parser import SemanticSplitterNodeParser
-    from llama_index.embeddings.huggingface import HuggingFaceEmbedding
     from llama_index.core import SimpleDirectoryReader
     from llama_index.core import Document as LI_Document  # type: ignore
+    from llama_index.core.schema import QueryBundle, MetadataMode
+    from llama_index.core.ingestion import run_transformations
+    from llama_index.core.storage.docstore.utils import doc_to_json, json_to_doc
 except ImportError as e:
     # 0.10.x 备用导入路径（进一步最小化）
     logger.error(f"LlamaIndex 导入失败: {e}，尝试备用路径")
     try:
         from llama_index import VectorStoreIndex, StorageContext, load_index_from_storage, SimpleDirectoryReader
-        from llama_index.node_parser import SemanticSplitterNodeParser
-        from llama_index.embeddings import HuggingFaceEmbedding
+        from llama_index.indices.vector_store.retrievers import VectorIndexRetriever
+        from llama_index.schema import QueryBundle, MetadataMode
+        from llama_index.ingestion import run_transformations
+        from llama_index.storage.docstore.utils import doc_to_json, json_to_doc
     except ImportError:
         raise ImportError("无法导入 LlamaIndex 模块，请检查安装")
 
-# 全局缓存：避免重复加载模型和索引
-_retriever_cache = {}
-_cache_lock = threading.Lock()  # 线程锁，确保并发安全
+from app.services.ann_index import create_ann_index
+from app.services.embedding_registry import get_embedding_registry
+from app.services.executors import get_ingest_executor, get_query_executor
+from app.services.query_sharing import embed_query_with, retrieve_with
+from app.services.lexical_index import LexicalIndex, rrf_fuse
+from app.services.metadata_index import MetadataIndex, validate_filters
+from app.services.persist_scheduler import PersistScheduler
+from app.services.retriever_cache import RetrieverLRUCache
+from app.services.segment_vector_store import SegmentVectorStore
+from app.services.stacked_vector_index import StackedVectorIndex
+
+# 每次上传都会变化、与内容无关的元数据字段：不参与向量计算，
+# 使同一文件重新上传时文本块内容一致，可命中持久化嵌入存储
+_VOLATILE_EMBED_METADATA_KEYS = [
+    'document_id', 'task_id', 'upload_time', 'file_size', 'file_path',
+    'source', 'zip_file', 'enable_ocr', 'extract_tables', 'extract_images'
+]
+
+# JSON 存储下每个节点（文本 + 元数据 + 关系）在 docstore 中的平均常驻字节估算
+_JSON_NODE_BYTES = 2048
+
+# 旧版 JSON 持久化文件（迁移到分段存储后移入 legacy_json/）
+_LEGACY_JSON_FILES = [
+    'docstore.json', 'index_store.json', 'default__vector_store.json',
+    'graph_store.json', 'image__vector_store.json', 'index_wal.log', 'deletions.log'
+]
+
+
+def _storage_config() -> Dict[str, Any]:
+    """从 rag_config.yaml 读取 llamaindex.storage"""
+    try:
+        from app.utils.config_loader import get_rag_config
+        return get_rag_config().get('llamaindex.storage', {}) or {}
+    except Exception:
+        return {}
+
+
+def _retrieval_config() -> Dict[str, Any]:
+    """从 rag_config.yaml 读取 llamaindex.retrieval"""
+    try:
+        from app.utils.config_loader import get_rag_config
+        return get_rag_config().get('llamaindex.retrieval', {}) or {}
+    except Exception:
+        return {}
+
+
+def flush_all_retrievers():
+    """落盘所有已加载检索器的待提交变更（进程退出前调用）"""
+    # 先停止后台淘汰，等进行中的淘汰落盘完成
+    _retriever_cache.close()
+    for workspace_id, retriever in list(_retriever_cache.items()):
+        try:
+            retriever.shutdown()
+        except Exception as e:
+            logger.error(f"检索器落盘失败: workspace={workspace_id}, error={e}")
+
+def _retriever_cache_config() -> Dict[str, Any]:
+    """从 rag_config.yaml 读取 llamaindex.retriever_cache"""
+    try:
+        from app.utils.config_loader import get_rag_config
+        return get_rag_config().get('llamaindex.retriever_cache', {}) or {}
+    except Exception:
+        return {}
+
+def _evict_workspace_caches(workspace_id: str):
+    """工作区检索器被淘汰时，一并释放引用它的堆叠向量矩阵"""
+    if _stacked_index is not None:
+        _stacked_index.evict_workspace(workspace_id)
+
+def _stacked_index_bytes() -> int:
+    """跨工作区堆叠矩阵的内存（计入检索器缓存预算）"""
+    return _stacked_index.memory_bytes() if _stacked_index is not None else 0
+
+def _create_retriever_cache() -> RetrieverLRUCache:
+    config = _retriever_cache_config()
+    return RetrieverLRUCache(
+        lambda workspace_id: LlamaIndexRetriever(workspace_id),
+        max_memory_bytes=int(float(config.get('max_memory_mb', 4096)) * 1024 * 1024),
+        max_entries=config.get('max_workspaces', 256),
+        min_idle_s=config.get('min_idle_s', 120),
+        pinned=config.get('pinned', ["global"]),
+        check_every=config.get('check_every', 64),
+        on_evict=_evict_workspace_caches,
+        shared_memory=_stacked_index_bytes
+    )
+
+# 全局缓存：按内存预算淘汰空闲工作区的 LRU（嵌入模型由 embedding_registry 共享，不随工作区淘汰）
+_retriever_cache = _create_retriever_cache()
 
 def get_retriever(workspace_id: str = "global") -> "LlamaIndexRetriever":
     """
-    获取或创建检索器（单例模式，线程安全）
+    获取或创建检索器（LRU 缓存，线程安全；被淘汰的工作区在下次使用时重新加载）
     重要：请使用此函数获取检索器实例，而不是直接实例化 LlamaIndexRetriever
     """
-    # 第一次快速检查（无锁，用于已经缓存的情况）
-    if workspace_id in _retriever_cache:
-        logger.debug(f"使用缓存的检索器: {workspace_id}")
-        return _retriever_cache[workspace_id]
+    return _retriever_cache.get_or_load(workspace_id)
+
+def lease_retriever(workspace_id: str = "global", retriever: Optional["LlamaIndexRetriever"] = None):
+    """
+    租用检索器（上下文管理器）：租约有效期间缓存不会淘汰并关闭该检索器，
+    供跨多次 await 使用检索器的长流程（复杂检索、DeepResearch）包住整个运行过程
+
+    Args:
+        retriever: 已持有的实例；为 None 时经 get_retriever 获取
+    """
+    return _retriever_cache.lease(workspace_id, get_retriever(workspace_id) if retriever is None else retriever)
+
+def get_loaded_retriever(workspace_id: str = "global") -> Optional["LlamaIndexRetriever"]:
+    """返回已加载的检索器；未加载（或已被淘汰）时返回 None，不触发模型与索引加载"""
+    return _retriever_cache.get(workspace_id)
+
+def get_retriever_cache_stats() -> Dict[str, Any]:
+    """检索器缓存统计：命中/未命中/淘汰次数与各工作区常驻内存估算"""
+    return _retriever_cache.get_stats()
+
+async def retrieve_from_workspaces(
+    query: str,
+    workspace_ids: List[str],
+    top_k: int = 5,
+    use_hybrid: bool = True,
+    use_compression: bool = True
+) -> Dict[str, List[Dict]]:
+    """
+    多索引检索：查询只编码一次，然后在多个工作区索引上并行检索
+    
+    Args:
+        query: 查询文本
+        workspace_ids: 工作区ID列表（可包含 "global"）
+        top_k: 每个工作区返回结果数量
+    
+    Returns:
+        Dict[str, List[Dict]]: {workspace_id: 检索结果}
+    """
+    # 保序去重
+    workspace_ids = list(dict.fromkeys(workspace_ids))
+    if not workspace_ids:
+        return {}
+    
+    with ExitStack() as leases:
+        retrievers = [leases.enter_context(lease_retriever(ws_id)) for ws_id in workspace_ids]
+        # 共享同一嵌入模型的检索器（见 embedding_registry）直接复用查询向量
+        query_embedding = await embed_query_with(retrievers[0], query)
+        results = await asyncio.gather(*[
+            retrieve_with(
+                retriever,
+                query,
+                query_embedding,
+                source=retrievers[0],
+                top_k=top_k,
+                use_hybrid=use_hybrid,
+                use_compression=use_compression
+            )
+            for retriever in retrievers
+        ], return_exceptions=True)
     
-    # 需要创建时，使用锁确保线程安全
-    with _cache_lock:
-        # 双重检查，防止在获取锁的期间其他线程已经创建了实例
-        if workspace_id not in _retriever_cache:
-            logger.info(f"创建新的检索器实例: {workspace_id}（这可能需要几秒钟加载模型和索引）")
-            _retriever_cache[workspace_id] = LlamaIndexRetriever(workspace_id)
-            logger.info(f"✅ 检索器实例创建完成: {workspace_id}")
+    merged: Dict[str, List[Dict]] = {}
+    for ws_id, result in zip(workspace_ids, results):
+        if isinstance(result, Exception):
+            logger.error(f"多索引检索失败: workspace={ws_id}, error={result}")
+            merged[ws_id] = []
         else:
-            logger.debug(f"检索器已被其他线程创建，使用缓存: {workspace_id}")
-        return _retriever_cache[workspace_id]
+            merged[ws_id] = result
+    return merged
+
+_stacked_index: Optional[StackedVectorIndex] = None
+_stacked_index_lock = threading.Lock()
+
+def get_stacked_index() -> StackedVectorIndex:
+    """获取跨工作区堆叠向量索引（单例，配置见 llamaindex.retrieval.fanout）"""
+    global _stacked_index
+    if _stacked_index is None:
+        with _stacked_index_lock:
+            if _stacked_index is None:
+                config = _retrieval_config().get('fanout', {}) or {}
+                _stacked_index = StackedVectorIndex(
+                    max_entries=config.get('cache_entries', 4),
+                    oversample=config.get('oversample', 2),
+                    max_nodes=config.get('max_stack_total_nodes', 200000)
+                )
+    return _stacked_index
+
+async def search_workspaces(
+    query: str,
+    workspace_ids: List[str],
+    top_k: int = 5,
+    use_hybrid: bool = True,
+    query_embedding: Optional[List[float]] = None
+) -> List[Dict]:
+    """
+    跨工作区检索并全局排序：分段存储的工作区向量堆叠为一个矩阵，一次矩阵乘法完成向量检索；
+    超过堆叠上限或使用 JSON 存储的工作区单独检索后并入同一排序
+    
+    Args:
+        query: 查询文本
+        workspace_ids: 工作区ID列表（可包含 "global"）
+        top_k: 返回结果总数（跨工作区）
+        use_hybrid: 是否融合各工作区的 BM25 结果（RRF）
+        query_embedding: 预先计算好的查询向量
+    
+    Returns:
+        List[Dict]: 与 LlamaIndexRetriever.retrieve 相同的格式，另含 workspace_id
+    """
+    workspace_ids = list(dict.fromkeys(workspace_ids))
+    if not workspace_ids:
+        return []
+    with ExitStack() as leases:
+        retrievers = {ws_id: leases.enter_context(lease_retriever(ws_id)) for ws_id in workspace_ids}
+        return await _search_leased_workspaces(query, retrievers, top_k, use_hybrid, query_embedding)
+
+async def _search_leased_workspaces(
+    query: str,
+    retrievers: Dict[str, "LlamaIndexRetriever"],
+    top_k: int,
+    use_hybrid: bool,
+    query_embedding: Optional[List[float]]
+) -> List[Dict]:
+    """search_workspaces 的主体（调用方已租用全部检索器）"""
+    workspace_ids = list(retrievers)
+    if query_embedding is None:
+        query_embedding = await retrievers[workspace_ids[0]].embed_query(query)
+    
+    config = _retrieval_config()
+    max_workspace_nodes = int((config.get('fanout', {}) or {}).get('max_workspace_nodes', 200000))
+    candidates = top_k * max(1, int(config.get('candidate_multiplier', 2))) if use_hybrid else top_k
+    
+    stackable, separate = [], []
+    for ws_id, retriever in retrievers.items():
+        store = retriever.segment_store()
+        if store is not None and len(store) <= max_workspace_nodes:
+            stackable.append((ws_id, store))
+        elif retriever.node_count() > 0:
+            separate.append(ws_id)
+    # 单个堆叠矩阵的总行数有上限，放不下的工作区单独检索
+    stacked, overflow = get_stacked_index().partition(stackable)
+    separate.extend(overflow)
+    
+    # 1. 向量检索：堆叠矩阵一次乘法 + 其余工作区各自检索（大工作区走各自的 ANN）
+    vector_hits: List[tuple] = []
+    try:
+        vector_hits = await get_query_executor().run(get_stacked_index().search, stacked, query_embedding, candidates)
+    except Exception as e:
+        logger.error(f"跨工作区堆叠检索失败，改为逐个工作区检索: {e}")
+        separate.extend(ws_id for ws_id, _ in stacked)
+    separate_results = await asyncio.gather(*[
+        retrievers[ws_id].retrieve(query, top_k=candidates, use_hybrid=False, query_embedding=query_embedding)
+        for ws_id in separate
+    ])
+    formatted: Dict[tuple, Dict] = {}
+    for ws_id, results in zip(separate, separate_results):
+        for result in results:
+            key = (ws_id, result["node_id"])
+            formatted[key] = result
+            vector_hits.append((ws_id, result["node_id"], result["score"]))
+    vector_hits.sort(key=lambda hit: hit[2], reverse=True)
+    vector_scores = {(ws_id, node_id): score for ws_id, node_id, score in vector_hits}
+    
+    lexical_keys = set()
+    if not use_hybrid:
+        fused = [(key, None) for key in list(vector_scores)[:top_k]]
+    else:
+        # 2. 各工作区 BM25（分数不可跨语料比较，每个工作区作为一路参与 RRF）
+        lexical_hits = await asyncio.gather(*[
+            get_query_executor().run(lambda r=retriever: r.get_lexical_index().search(query, candidates))
+            for retriever in retrievers.values()
+        ])
+        ranked_lists = [(list(vector_scores), float(config.get('vector_weight', 1.0)))]
+        for ws_id, hits in zip(retrievers, lexical_hits):
+            keys = [(ws_id, node_id) for node_id, _ in hits]
+            lexical_keys.update(keys)
+            ranked_lists.append((keys, float(config.get('bm25_weight', 1.0))))
+        fused = rrf_fuse(ranked_lists, rrf_k=int(config.get('rrf_k', 60)))[:top_k]
+    
+    # 3. 只为最终 top_k 按工作区批量读取节点
+    pending: Dict[str, List[str]] = {}
+    for key, _ in fused:
+        if key not in formatted:
+            pending.setdefault(key[0], []).append(key[1])
+    def _load_pending():
+        for ws_id, node_ids in pending.items():
+            scores = {node_id: vector_scores[(ws_id, node_id)] for node_id in node_ids if (ws_id, node_id) in vector_scores}
+            for node_id, result in retrievers[ws_id].load_results(node_ids, query_embedding, scores).items():
+                formatted[(ws_id, node_id)] = result
+    if pending:
+        await get_query_executor().run(_load_pending)
+    
+    results = []
+    for key, fused_score in fused:
+        result = formatted.get(key)
+        if result is None:
+            continue
+        result = dict(result, workspace_id=key[0])
+        if use_hybrid:
+            result["fused_score"] = fused_score
+            result["retrieval_sources"] = [
+                source for source, hit in (("vector", key in vector_scores), ("bm25", key in lexical_keys)) if hit
+            ]
+        results.append(result)
+    return results
+
+class _ReadWriteLock:
+    """读写锁：检索并发读取，删除独占写入（写者优先，避免删除被持续的检索饿死）"""
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+        self.last_released = time.time()
+
+    @property
+    def busy(self) -> bool:
+        """是否有进行中或等待中的读写"""
+        return bool(self._readers or self._writer or self._waiting_writers)
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writer or self._waiting_writers:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                self.last_released = time.time()
+                if self._readers == 0:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self.last_released = time.time()
+                self._cond.notify_all()
 
 class LlamaIndexRetriever:
     """LlamaIndex 高级检索引擎 - 为 LangGraph 提供检索服务"""
@@ -64,6 +392,29 @@ class LlamaIndexRetriever:
         logger.info(f"LlamaIndexRetriever init 开始: workspace_id={workspace_id}")
         self.workspace_id = workspace_id
         self.storage_dir = Path(f"llamaindex_storage/{workspace_id}")
+        # 写前日志（JSON 存储）：记录自上次全量持久化以来插入与删除的节点
+        self.wal_path = self.storage_dir / "index_wal.log"
+        self._rw_lock = _ReadWriteLock()
+        self._persist_lock = threading.Lock()
+        # 合并持久化：写入只标记脏数据，由调度器按时间/数量阈值或批处理结束时统一落盘
+        scheduler_config = _storage_config().get('persist_scheduler', {}) or {}
+        self._persist_scheduler = PersistScheduler(
+            self.persist,
+            max_delay_s=float(scheduler_config.get('max_delay_s', 5.0)),
+            max_pending_changes=int(scheduler_config.get('max_pending_changes', 5000)),
+            name=workspace_id
+        )
+        # 元数据倒排索引（document_id / original_filename 等 -> 节点ID），首次使用时加载或重建
+        self.metadata_index_path = self.storage_dir / "metadata_index.json"
+        self._metadata_index: Optional[MetadataIndex] = None
+        self._metadata_index_lock = threading.Lock()
+        # BM25 词法索引（与向量索引同步增删），混合检索时与向量结果做 RRF 融合
+        self.lexical_index_path = self.storage_dir / "lexical_index.json"
+        self._lexical_index: Optional[LexicalIndex] = None
+        self._lexical_index_lock = threading.Lock()
+        # 排队或执行中的入库任务数（解析与编码不持有读写锁，缓存淘汰需另行判断）
+        self._ingest_inflight = 0
+        self._ingest_inflight_lock = threading.Lock()
         
         # 嵌入模型（强制本地加载，避免连接HuggingFace）
         model_load_start = time.time()
@@ -74,29 +425,13 @@ class LlamaIndexRetriever:
                 f"LOCAL_BGE_MODEL_DIR 未设置或目录不存在: {local_model_dir}\n"
                 f"请设置环境变量 LOCAL_BGE_MODEL_DIR 指向本地BGE模型目录，或确保该目录存在。"
             )
-        # 强制离线模式
-        os.environ['HF_HUB_OFFLINE'] = '1'
-        os.environ['HF_DATASETS_OFFLINE'] = '1'
-        logger.info(f"开始加载BGE嵌入模型（这可能需要几秒到几十秒）...")
-        self.embed_model = HuggingFaceEmbedding(
-            model_name=local_model_dir,
-            cache_folder=local_model_dir  # 使用模型目录作为缓存
-        )
+        # 使用进程级共享模型：所有工作区共用一份权重，仅首次调用需要加载
+        registry = get_embedding_registry()
+        if not registry.is_loaded(local_model_dir):
+            logger.info(f"开始加载BGE嵌入模型（这可能需要几秒到几十秒）...")
+        self.embed_model = registry.get_llamaindex_embedding(local_model_dir)
         model_load_time = time.time() - model_load_start
-        logger.info(f"✅ BGE模型加载完成（耗时 {model_load_time:.2f} 秒）: {local_model_dir}")
-        
-        # 语义分块器
-        parser_start = time.time()
-        self.node_parser = SemanticSplitterNodeParser(
-            buffer_size=1,
-            breakpoint_percentile_threshold=95,
-            embed_model=self.embed_model
-        )
-        parser_time = time.time() - parser_start
-        logger.debug(f"语义分块器初始化完成（耗时 {parser_time:.2f} 秒）")
-        
-        # # 后处理器栈
-        # self._init_postprocessors()
+        logger.info(f"✅ BGE模型就绪（耗时 {model_load_time:.2f} 秒）: {local_model_dir}")
         
         # 索引
         index_load_start = time.time()
@@ -107,35 +442,77 @@ class LlamaIndexRetriever:
         total_time = time.time() - init_start_time
         logger.info(f"✅ LlamaIndexRetriever 初始化完成（总耗时 {total_time:.2f} 秒）：模型={model_load_time:.2f}s, 索引={index_load_time:.2f}s")
     
-    def _init_postprocessors(self):
-        """初始化后处理器栈"""
-        # 重排序
-        self.reranker = SentenceTransformerRerank(
-            model="BAAI/bge-reranker-v2-m3",
-            top_n=10
-        )
-        
-        # 相似度过滤
-        self.similarity_filter = SimilarityPostprocessor(
-            similarity_cutoff=0.7
-        )
-        
-        # 句子级压缩（LlamaIndex 原生）- 如果可用则启用
-        if SentenceEmbeddingOptimizer is not None:
-            self.sentence_optimizer = SentenceEmbeddingOptimizer(
-                embed_model=self.embed_model,
-                percentile_cutoff=0.5,
-                threshold_cutoff=0.7
-            )
-        else:
-            logger.warning("SentenceEmbeddingOptimizer 不可用，跳过句子级压缩")
-            self.sentence_optimizer = None
-        
-        # 长上下文重排序
-        self.context_reorder = LongContextReorder()
-    
     def _load_or_create_index(self):
-        """加载或创建索引"""
+        """加载或创建索引（按 llamaindex.storage.format 选择分段存储或 JSON 存储）"""
+        if _storage_config().get('format', 'segment') == 'segment':
+            return self._load_or_create_segment_index()
+        return self._load_or_create_json_index()
+
+    def _load_or_create_segment_index(self):
+        """打开分段存储；首次启动时把旧版 JSON 索引迁移过来"""
+        try:
+            self.storage_dir.mkdir(parents=True, exist_ok=True)
+            segment_dir = self.storage_dir / "segments"
+            if not SegmentVectorStore.exists(segment_dir) and (self.storage_dir / "docstore.json").exists():
+                self._migrate_json_storage(segment_dir)
+            store = SegmentVectorStore(str(segment_dir))
+            ann_config = _storage_config().get('ann', {}) or {}
+            ann = create_ann_index(ann_config)
+            if ann is not None:
+                # 后台构建，完成前仍走暴力检索
+                store.attach_ann_index(ann, rebuild_ratio=float(ann_config.get('rebuild_ratio', 0.1)))
+            logger.info(f"✅ 分段索引加载完成: workspace={self.workspace_id}, 节点数={len(store)}")
+            return VectorStoreIndex.from_vector_store(store, embed_model=self.embed_model)
+        except Exception as e:
+            logger.error(f"加载分段索引失败: {e}，使用后备方案", exc_info=True)
+            logger.info(f"后备方案：创建空索引: {self.workspace_id}")
+            return VectorStoreIndex([], embed_model=self.embed_model)
+
+    def _migrate_json_storage(self, segment_dir: Path):
+        """
+        将 JSON 持久化的索引（含未合并的删除日志）写入分段存储，
+        先写到临时目录再整体改名，完成后旧文件移入 legacy_json/ 备查
+        """
+        import shutil
+
+        migrate_start = time.time()
+        # 直接加载（不走空索引后备），加载失败时保留旧文件并由调用方处理
+        legacy_index = load_index_from_storage(
+            StorageContext.from_defaults(persist_dir=str(self.storage_dir)),
+            embed_model=self.embed_model
+        )
+        self._replay_wal(legacy_index)
+        embedding_dict = legacy_index.vector_store.data.embedding_dict
+        docstore = legacy_index.docstore
+        node_ids = [node_id for node_id in legacy_index.index_struct.nodes_dict if node_id in embedding_dict]
+        logger.info(f"开始迁移 JSON 索引到分段存储: workspace={self.workspace_id}, 节点数={len(node_ids)}")
+
+        tmp_dir = segment_dir.with_name(segment_dir.name + ".tmp")
+        if tmp_dir.exists():
+            shutil.rmtree(tmp_dir)
+        store = SegmentVectorStore(str(tmp_dir))
+        for start in range(0, len(node_ids), 2048):
+            batch = []
+            for node_id in node_ids[start:start + 2048]:
+                node = docstore.get_document(node_id, raise_error=False)
+                if node is None:
+                    continue
+                node.embedding = embedding_dict[node_id]
+                batch.append(node)
+            store.add(batch)
+        store.close()
+        os.replace(tmp_dir, segment_dir)
+
+        legacy_dir = self.storage_dir / "legacy_json"
+        legacy_dir.mkdir(exist_ok=True)
+        for name in _LEGACY_JSON_FILES:
+            path = self.storage_dir / name
+            if path.exists():
+                os.replace(path, legacy_dir / name)
+        logger.info(f"✅ 索引迁移完成（耗时 {time.time() - migrate_start:.2f} 秒），旧文件已移至 {legacy_dir}")
+
+    def _load_or_create_json_index(self):
+        """加载或创建 JSON 持久化的索引"""
         try:
             if self.storage_dir.exists():
                 # 检查是否有必要的索引文件
@@ -155,13 +532,9 @@ class LlamaIndexRetriever:
                         storage_context,
                         embed_model=self.embed_model
                     )
+                    self._replay_wal(index)
                     
-                    # 统计节点数量
-                    try:
-                        node_count = len(index.storage_context.docstore.docs) if hasattr(index.storage_context, 'docstore') else 0
-                        logger.info(f"✅ 索引加载完成: workspace={self.workspace_id}, 节点数={node_count}")
-                    except Exception:
-                        logger.info(f"✅ 索引加载完成: {self.workspace_id}")
+                    logger.info(f"✅ 索引加载完成: workspace={self.workspace_id}, 节点数={len(index.index_struct.nodes_dict)}")
                     return index
                 else:
                     logger.warning(f"⚠️ 索引文件不完整，重新创建: {self.workspace_id}")
@@ -179,12 +552,18 @@ class LlamaIndexRetriever:
             logger.info(f"后备方案：创建空索引: {self.workspace_id}")
             return VectorStoreIndex([], embed_model=self.embed_model)
     
+    async def embed_query(self, query: str) -> List[float]:
+        """编码查询向量（可传给多个检索器的 retrieve 复用，避免重复编码）"""
+        return await self.embed_model.aget_query_embedding(query)
+    
     async def retrieve(
         self,
         query: str,
         top_k: int = 5,
         use_hybrid: bool = True,
-        use_compression: bool = True
+        use_compression: bool = True,
+        query_embedding: Optional[List[float]] = None,
+        filters: Optional[Dict[str, Any]] = None
     ) -> List[Dict]:
         """
         高级检索 - 返回 LangGraph 可用的格式
@@ -192,56 +571,184 @@ class LlamaIndexRetriever:
         Args:
             query: 查询文本
             top_k: 返回结果数量
-            use_hybrid: 是否使用混合检索
+            use_hybrid: 是否使用混合检索（向量 + BM25，按 RRF 融合排序）
             use_compression: 是否使用压缩
+            query_embedding: 预先计算好的查询向量（提供时跳过编码）
+            filters: 元数据过滤条件，检索前经元数据索引求出候选节点（见 MetadataIndex.match），
+                支持 document_id / original_filename / file_type / sheet（值或值列表）
+                与 upload_time: {"from": ..., "to": ...}
         
         Returns:
-            List[Dict]: 包含 content, metadata, score, node_id
+            List[Dict]: 包含 content, metadata, score（向量余弦相似度）, node_id；
+            混合检索时另含 fused_score 与 retrieval_sources
+        
+        Raises:
+            ValueError: 过滤条件不合法
         """
+        if filters:
+            validate_filters(filters)
         try:
             # 如果索引为空，返回空结果
-            if self.index is None or len(self.index.storage_context.docstore.docs) == 0:
+            if self.index is None or self.node_count() == 0:
                 logger.info(f"索引为空，返回空结果: {self.workspace_id}")
                 return []
             
-            # 1. 检索（使用内置简化检索器，避免触发 LLM 相关模块）
-            retriever = self.index.as_retriever(similarity_top_k=top_k * (4 if use_hybrid else 2))
-            try:
-                nodes = await retriever.aretrieve(query)
-            except Exception as e:
-                # 容错：若底层引用坏节点，尽量返回空而不是报错
-                logger.error(f"底层检索异常（可能包含坏节点），已忽略: {e}")
-                nodes = []
-            
-            # 4. 转换格式
-            results = []
-            for node in nodes[:top_k]:
-                # 确保 score 是原生的 Python float，而非 numpy 类型
-                score = node.score if hasattr(node, 'score') else 0.0
-                if hasattr(score, 'item'):  # numpy type
-                    score = float(score.item())
-                else:
-                    score = float(score)
-                
-                try:
-                    results.append({
-                        "content": node.get_content(),
-                        "metadata": getattr(node, 'metadata', {}),
-                        "score": score,
-                        "node_id": getattr(node, 'node_id', '')
-                    })
-                except Exception as node_err:
-                    # 忽略无法反序列化/缺失的节点
-                    logger.warning(f"忽略坏节点: {node_err}")
-            
-            return results
+            # 查询编码经共享微批处理器完成，其余 CPU 密集的检索步骤在检索线程池中执行，不占用事件循环
+            if query_embedding is None:
+                query_embedding = await self.embed_query(query)
+            return await get_query_executor().run(
+                self._retrieve_sync, query, top_k, use_hybrid, query_embedding, filters
+            )
             
         except Exception as e:
             logger.error(f"检索失败: {e}")
             return []
     
+    def _retrieve_sync(
+        self,
+        query: str,
+        top_k: int,
+        use_hybrid: bool,
+        query_embedding: List[float],
+        filters: Optional[Dict[str, Any]]
+    ) -> List[Dict]:
+        """retrieve 的同步部分：元数据预过滤、向量检索、BM25、RRF 融合与结果组装"""
+        # 元数据预过滤：先求候选节点集合，向量与 BM25 只在集合内计算
+        allowed = None
+        if filters:
+            allowed = self.get_metadata_index().match(filters)
+            if not allowed:
+                logger.info(f"元数据过滤无匹配节点: workspace={self.workspace_id}, filters={filters}")
+                return []
+        
+        config = _retrieval_config()
+        candidates = top_k * max(1, int(config.get('candidate_multiplier', 2))) if use_hybrid else top_k
+        
+        # 1. 向量检索（使用内置简化检索器，避免触发 LLM 相关模块）
+        if allowed is not None:
+            retriever = VectorIndexRetriever(self.index, similarity_top_k=candidates, node_ids=list(allowed))
+        else:
+            retriever = self.index.as_retriever(similarity_top_k=candidates)
+        try:
+            with self._rw_lock.read():
+                nodes = retriever.retrieve(QueryBundle(query_str=query, embedding=query_embedding))
+        except Exception as e:
+            # 容错：若底层引用坏节点，尽量返回空而不是报错
+            logger.error(f"底层检索异常（可能包含坏节点），已忽略: {e}")
+            nodes = []
+        
+        if not use_hybrid:
+            results = [self._format_result(node.node, node.score) for node in nodes[:top_k]]
+            return [result for result in results if result is not None]
+        
+        # 2. BM25 检索（首次使用时加载或构建词法索引）
+        lexical_hits = self.get_lexical_index().search(query, candidates, allowed=allowed)
+        
+        # 3. RRF 融合，只为融合后的 top_k 读取节点内容
+        fused = rrf_fuse([
+            ([node.node.node_id for node in nodes], float(config.get('vector_weight', 1.0))),
+            ([node_id for node_id, _ in lexical_hits], float(config.get('bm25_weight', 1.0)))
+        ], rrf_k=int(config.get('rrf_k', 60)))[:top_k]
+        
+        vector_hits = {node.node.node_id: node for node in nodes}
+        lexical_ids = {node_id for node_id, _ in lexical_hits}
+        lexical_only = [node_id for node_id, _ in fused if node_id not in vector_hits]
+        lexical_nodes = {node.node_id: node for node in self._get_nodes(lexical_only)}
+        similarities = self._vector_similarities(lexical_only, query_embedding)
+        
+        results = []
+        for node_id, fused_score in fused:
+            if node_id in vector_hits:
+                node, score = vector_hits[node_id].node, vector_hits[node_id].score
+            elif node_id in lexical_nodes:
+                node, score = lexical_nodes[node_id], similarities.get(node_id, 0.0)
+            else:
+                continue
+            result = self._format_result(node, score)
+            if result is None:
+                continue
+            result["fused_score"] = fused_score
+            result["retrieval_sources"] = [
+                source for source, hit in (("vector", node_id in vector_hits), ("bm25", node_id in lexical_ids)) if hit
+            ]
+            results.append(result)
+        return results
+    
+    @staticmethod
+    def _format_result(node: Any, score: Any) -> Optional[Dict[str, Any]]:
+        """转换为 LangGraph 使用的结果格式（坏节点返回 None）"""
+        # 确保 score 是原生的 Python float，而非 numpy 类型
+        if score is None:
+            score = 0.0
+        score = float(score.item()) if hasattr(score, 'item') else float(score)
+        try:
+            return {
+                "content": node.get_content(),
+                "metadata": getattr(node, 'metadata', {}),
+                "score": score,
+                "node_id": getattr(node, 'node_id', '')
+            }
+        except Exception as node_err:
+            # 忽略无法反序列化/缺失的节点
+            logger.warning(f"忽略坏节点: {node_err}")
+            return None
+    
+    def _vector_similarities(self, node_ids: List[str], query_embedding: List[float]) -> Dict[str, float]:
+        """计算指定节点与查询向量的余弦相似度（用于只被 BM25 召回的节点）"""
+        if not node_ids:
+            return {}
+        store = self.segment_store()
+        if store is not None:
+            vectors = store.get_vectors(node_ids)
+        else:
+            embedding_dict = getattr(getattr(self.index.vector_store, 'data', None), 'embedding_dict', {}) or {}
+            vectors = {node_id: embedding_dict[node_id] for node_id in node_ids if node_id in embedding_dict}
+        q = np.asarray(query_embedding, dtype=np.float32)
+        q_norm = float(np.linalg.norm(q)) or 1.0
+        similarities = {}
+        for node_id, vector in vectors.items():
+            vector = np.asarray(vector, dtype=np.float32)
+            similarities[node_id] = float(vector @ q / ((float(np.linalg.norm(vector)) or 1.0) * q_norm))
+        return similarities
+    
+    def load_results(
+        self,
+        node_ids: List[str],
+        query_embedding: List[float],
+        scores: Optional[Dict[str, float]] = None
+    ) -> Dict[str, Dict[str, Any]]:
+        """
+        按ID读取节点并组装为 retrieve 的结果格式（供跨工作区检索在融合后读取最终结果）
+
+        Args:
+            scores: 已知的向量相似度；缺失的节点按 query_embedding 计算余弦相似度
+
+        Returns:
+            {node_id: 结果}，不存在或无法解析的节点跳过
+        """
+        scores = scores or {}
+        with self._rw_lock.read():
+            similarities = self._vector_similarities([node_id for node_id in node_ids if node_id not in scores], query_embedding)
+            nodes = self._get_nodes(node_ids)
+        results = {}
+        for node in nodes:
+            result = self._format_result(node, scores.get(node.node_id, similarities.get(node.node_id, 0.0)))
+            if result is not None:
+                results[node.node_id] = result
+        return results
+
     async def add_document(self, file_path: str, metadata: Dict = None) -> int:
-        """添加文档（按文件类型解析 -> Document 列表 -> 插入与持久化）"""
+        """添加文档（按文件类型解析 -> Document 列表 -> 插入与持久化），在入库线程池中执行"""
+        with self._ingest_inflight_lock:
+            self._ingest_inflight += 1
+        try:
+            return await get_ingest_executor().run(self._add_document_sync, file_path, metadata)
+        finally:
+            with self._ingest_inflight_lock:
+                self._ingest_inflight -= 1
+
+    def _add_document_sync(self, file_path: str, metadata: Dict = None) -> int:
+        """add_document 的同步实现（解析、分块、编码与写索引均为 CPU 密集）"""
         import traceback
         file_path_str = str(file_path)
         try:
@@ -289,7 +796,7 @@ class LlamaIndexRetriever:
             logger.info(f"[LlamaIndex] 开始插入文档到索引: blocks={len(docs)}, file={file_path_str}")
             logger.info(f"[LlamaIndex] base_meta keys: {list(base_meta.keys())}, document_id={base_meta.get('document_id')}")
             
-            inserted = 0
+            li_documents: List[Any] = []
             for idx, doc in enumerate(docs):
                 # 兼容外部 Document 对象或纯文本
                 if isinstance(doc, LI_Document):
@@ -303,10 +810,14 @@ class LlamaIndexRetriever:
                         logger.warning(f"Document metadata 中缺少 document_id，补充中...")
                         doc.metadata['document_id'] = base_meta.get('document_id')
                     
+                    doc.excluded_embed_metadata_keys = list(
+                        dict.fromkeys(list(doc.excluded_embed_metadata_keys or []) + _VOLATILE_EMBED_METADATA_KEYS)
+                    )
+                    
                     if idx < 3:  # 前3个文档记录日志
                         logger.debug(f"插入 Document #{idx}: metadata keys={list(doc.metadata.keys())[:10]}, document_id={doc.metadata.get('document_id')}")
                     
-                    self.index.insert(doc)
+                    li_documents.append(doc)
                 else:
                     # 构造 LI Document 对象
                     try:
@@ -321,25 +832,17 @@ class LlamaIndexRetriever:
                     if idx < 3:  # 前3个文档记录日志
                         logger.debug(f"插入 Document #{idx} (constructed): metadata keys={list(final_meta.keys())[:10]}, document_id={final_meta.get('document_id')}")
                     
-                    self.index.insert(_Doc(text=text, metadata=final_meta))
-                inserted += 1
-                if inserted % 20 == 0:
-                    logger.info(f"[LlamaIndex] 已插入 {inserted}/{len(docs)} 块…")
-
-            # 持久化前做节点计数校验
-            node_count = 0
-            try:
-                if hasattr(self.index, '_docstore') and self.index._docstore:
-                    node_count = len(self.index._docstore.docs)
-            except Exception:
-                node_count = 0
-
-            if inserted > 0 and node_count > 0:
-                logger.info(f"[LlamaIndex] 开始持久化索引: inserted={inserted}, nodes={node_count}, dir={self.storage_dir}")
-                self.index.storage_context.persist(persist_dir=str(self.storage_dir))
-                logger.info("[LlamaIndex] 索引持久化完成")
-            else:
-                logger.warning(f"未检测到有效节点（inserted={inserted}, nodes={node_count}），跳过持久化")
+                    li_documents.append(_Doc(
+                        text=text,
+                        metadata=final_meta,
+                        excluded_embed_metadata_keys=list(_VOLATILE_EMBED_METADATA_KEYS)
+                    ))
+
+            inserted = self._insert_documents(li_documents)
+            node_count = self.node_count()
+
+            if inserted == 0 or node_count == 0:
+                logger.warning(f"未检测到有效节点（inserted={inserted}, nodes={node_count}）")
 
             logger.info(f"[LlamaIndex] 文档插入完成: added_blocks={inserted}, current_nodes={node_count}")
             return max(inserted, node_count)
@@ -349,134 +852,454 @@ class LlamaIndexRetriever:
             logger.error(traceback.format_exc())
             return 0
 
-    def _rebuild_index_from_nodes(self, kept_nodes: List[Any]) -> int:
-        """使用保留的节点重建索引（用于删除后保持一致性）。"""
+    def _insert_documents(self, documents: List[Any]) -> int:
+        """
+        批量插入：先对全部文档分块，再按 embedding.batch_size 分批编码所有节点，
+        最后在写锁内一次性写入索引（编码期间不阻塞检索）
+
+        Returns:
+            插入的节点数
+        """
+        if not documents:
+            return 0
+
+        split_start = time.time()
+        nodes = run_transformations(documents, self.index._transformations)
+        logger.info(f"[LlamaIndex] 分块完成: documents={len(documents)}, nodes={len(nodes)}, 耗时 {time.time() - split_start:.2f} 秒")
+        if not nodes:
+            return 0
+
+        embed_start = time.time()
+        batch_size = max(1, int(getattr(self.embed_model, 'embed_batch_size', 32) or 32))
+        pending = [node for node in nodes if node.embedding is None]
+        for start in range(0, len(pending), batch_size):
+            batch = pending[start:start + batch_size]
+            texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in batch]
+            for node, embedding in zip(batch, self.embed_model.get_text_embedding_batch(texts)):
+                node.embedding = embedding
+            done = min(start + batch_size, len(pending))
+            if done == len(pending) or (start // batch_size + 1) % 20 == 0:
+                logger.info(f"[LlamaIndex] 已编码 {done}/{len(pending)} 个节点…")
+        logger.info(f"[LlamaIndex] 节点编码完成: nodes={len(pending)}, 耗时 {time.time() - embed_start:.2f} 秒")
+
+        with self._rw_lock.write():
+            if self.segment_store() is None:
+                self._append_wal({"op": "insert", "nodes": [self._node_to_wal(node) for node in nodes]})
+            self.index.insert_nodes(nodes)
+            if self.segment_store() is None:
+                for document in documents:
+                    self.index.docstore.set_document_hash(document.get_doc_id(), document.hash)
+            if self._metadata_index is not None:
+                for node in nodes:
+                    self._metadata_index.add(node.node_id, node.metadata)
+            if self._lexical_index is not None:
+                for node in nodes:
+                    self._lexical_index.add(node.node_id, node.get_content())
+        # 插入已由分段存储/写前日志保证持久，全量落盘交给调度器合并执行
+        self._persist_scheduler.mark_dirty(len(nodes))
+        return len(nodes)
+
+    def persist(self):
+        """
+        持久化索引
+        - 分段存储：数据写入时已提交，此处只按需合并向量段并保存元数据索引
+        - JSON 存储：全量持久化，完成后清空写前日志（变更已包含在快照中）
+
+        一般无需直接调用：写入后由调度器合并落盘，需要立即落盘时使用 flush()
+        """
+        store = self.segment_store()
+        if store is not None:
+            compaction = _storage_config().get('compaction', {}) or {}
+            with self._persist_lock:
+                with self._rw_lock.read():
+                    store.compact(
+                        max_segments=int(compaction.get('max_segments', 16)),
+                        max_dead_ratio=float(compaction.get('max_dead_ratio', 0.3))
+                    )
+                self._save_secondary_indexes()
+            return
+
+        with self._persist_lock:
+            with self._rw_lock.read():
+                storage_context = self.index.storage_context
+                # 增量删除不会逐次回写 index_struct，全量持久化前同步一次
+                storage_context.index_store.add_index_struct(self.index.index_struct)
+                storage_context.persist(persist_dir=str(self.storage_dir))
+                self._save_secondary_indexes()
+                self._truncate_wal()
+
+    def _save_secondary_indexes(self):
+        """保存已加载的元数据索引与词法索引（只追加上次落盘后的变更，未变更时不写文件）"""
+        if self._metadata_index is not None:
+            self._metadata_index.save(self.metadata_index_path)
+        if self._lexical_index is not None:
+            self._lexical_index.save(self.lexical_index_path)
+
+    def flush(self) -> bool:
+        """立即落盘待提交的变更（没有变更时直接返回 False）"""
+        return self._persist_scheduler.flush()
+
+    def persist_batch(self):
+        """
+        批处理上下文：期间只累积变更，退出时统一落盘一次
+
+        用法:
+            with retriever.persist_batch():
+                for path in files:
+                    await retriever.add_document(path)
+        """
+        return self._persist_scheduler.batch()
+
+    def get_persist_stats(self) -> Dict[str, Any]:
+        """持久化调度统计"""
+        return self._persist_scheduler.get_stats()
+
+    def shutdown(self):
+        """停止持久化调度、落盘剩余变更并关闭分段存储的 SQLite 连接（之后实例不可再使用）"""
+        self._persist_scheduler.shutdown(flush=True)
+        store = self.segment_store()
+        if store is not None:
+            with self._rw_lock.write():
+                store.close()
+
+    def warm_up(self, query: str = "预热查询"):
+        """加载二级索引并执行一次向量检索（计算段范数、触发 ANN 构建），供启动预热使用"""
+        self.get_metadata_index()
+        self.get_lexical_index()
+        if self.index is None or self.node_count() == 0:
+            return
+        query_embedding = self.embed_model.get_query_embedding(query)
+        with self._rw_lock.read():
+            self.index.as_retriever(similarity_top_k=1).retrieve(QueryBundle(query_str=query, embedding=query_embedding))
+
+    def is_idle(self, min_idle_s: float) -> bool:
+        """
+        可被缓存淘汰：没有进行中的检索/写入与入库任务，不在批处理（persist_batch）中，
+        没有待落盘的变更，且最近一次读写已超过 min_idle_s 秒
+        """
+        scheduler = self._persist_scheduler
+        return (
+            not self._rw_lock.busy
+            and self._ingest_inflight == 0
+            and not scheduler.in_batch
+            and not scheduler.dirty
+            and time.time() - self._rw_lock.last_released >= min_idle_s
+        )
+
+    def estimate_memory_bytes(self) -> int:
+        """
+        估算本工作区常驻内存（向量索引 + ANN + BM25 + 元数据索引）；
+        分段存储的 mmap 向量页由操作系统按需换入换出，不计入
+        """
+        total = 0
+        store = self.segment_store()
+        if store is not None:
+            total += store.estimate_memory_bytes()
+        elif self.index is not None:
+            embedding_dict = getattr(getattr(self.index, 'vector_store', None), 'data', None)
+            embedding_dict = getattr(embedding_dict, 'embedding_dict', {}) or {}
+            dimension = len(next(iter(embedding_dict.values()))) if embedding_dict else 0
+            # JSON 存储：向量为 Python float 列表（每个约 32 字节），节点常驻于 docstore
+            total += len(embedding_dict) * (dimension * 32 + _JSON_NODE_BYTES)
+        if self._lexical_index is not None:
+            total += self._lexical_index.estimate_memory_bytes()
+        if self._metadata_index is not None:
+            total += self._metadata_index.estimate_memory_bytes()
+        return total
+
+    def segment_store(self) -> Optional[SegmentVectorStore]:
+        """当前索引使用分段存储时返回该存储"""
+        vector_store = getattr(self.index, 'vector_store', None)
+        return vector_store if isinstance(vector_store, SegmentVectorStore) else None
+
+    def node_count(self) -> int:
+        """当前索引节点数（读取 index_struct / 分段存储位置表，不展开 docstore）"""
         try:
-            # 将节点转为 Document 再构建索引，避免直接操作底层存储导致不一致
-            try:
-                from llama_index.core import Document as _Doc
-            except Exception:
-                from llama_index import Document as _Doc
-
-            documents: List[_Doc] = []
-            for node in kept_nodes:
-                try:
-                    text = node.get_content() if hasattr(node, 'get_content') else getattr(node, 'text', '')
-                    metadata = getattr(node, 'metadata', {}) or {}
-                    documents.append(_Doc(text=text or '', metadata=metadata))
-                except Exception as e:
-                    logger.warning(f"重建时跳过异常节点: {e}")
-
-            # 创建新索引
-            from llama_index.core.indices.vector_store import VectorStoreIndex as _VSI
-            new_index = _VSI(documents, embed_model=self.embed_model)
-            self.index = new_index
-            self.index.storage_context.persist(persist_dir=str(self.storage_dir))
-            try:
-                if hasattr(self.index, '_docstore') and self.index._docstore:
-                    return len(self.index._docstore.docs)
-            except Exception:
-                pass
-            return len(documents)
-        except Exception as e:
-            logger.error(f"重建索引失败: {e}")
+            store = self.segment_store()
+            if store is not None:
+                return len(store)
+            return len(self.index.index_struct.nodes_dict)
+        except Exception:
+            return 0
+
+    def _has_node(self, node_id: str) -> bool:
+        store = self.segment_store()
+        if store is not None:
+            return node_id in store
+        return node_id in self.index.index_struct.nodes_dict
+
+    def _get_node(self, node_id: str) -> Optional[Any]:
+        """按ID读取单个节点"""
+        store = self.segment_store()
+        if store is not None:
+            nodes = store.get_nodes([node_id])
+            return nodes[0] if nodes else None
+        return self.index.docstore.get_document(node_id, raise_error=False)
+
+    def _get_nodes(self, node_ids: List[str]) -> List[Any]:
+        """按ID批量读取节点（不存在的ID跳过）"""
+        if not node_ids:
+            return []
+        store = self.segment_store()
+        if store is not None:
+            return store.get_nodes(node_ids)
+        docstore = self.index.docstore
+        return [node for node in (docstore.get_document(node_id, raise_error=False) for node_id in node_ids) if node is not None]
+
+    @staticmethod
+    def _node_metadata(node: Any) -> Dict[str, Any]:
+        """读取节点 metadata（兼容被包装的节点）"""
+        meta = getattr(node, 'metadata', None)
+        if not isinstance(meta, dict) and hasattr(node, 'node'):
+            meta = getattr(node.node, 'metadata', None)
+        return meta if isinstance(meta, dict) else {}
+
+    @staticmethod
+    def _remove_nodes_from_index(index: Any, node_ids: List[str]) -> List[str]:
+        """
+        从向量存储、index_struct 与 docstore 中移除指定节点，只触及这些节点（O(删除数)）
+
+        Returns:
+            实际存在并被移除的节点ID
+        """
+        vector_store = index.vector_store
+        if isinstance(vector_store, SegmentVectorStore):
+            return vector_store.remove_nodes(node_ids)
+        data = getattr(vector_store, 'data', None)
+        embedding_dict = getattr(data, 'embedding_dict', None)
+        nodes_dict = index.index_struct.nodes_dict
+        docstore = index.docstore
+
+        removed: List[str] = []
+        for node_id in node_ids:
+            hit = False
+            if embedding_dict is not None:
+                # SimpleVectorStore：直接按键删除，避免 delete_nodes 遍历全部向量
+                hit = embedding_dict.pop(node_id, None) is not None
+                data.text_id_to_ref_doc_id.pop(node_id, None)
+                data.metadata_dict.pop(node_id, None)
+            if node_id in nodes_dict:
+                index.index_struct.delete(node_id)
+                hit = True
+            if docstore.document_exists(node_id):
+                docstore.delete_document(node_id, raise_error=False)
+                hit = True
+            if hit:
+                removed.append(node_id)
+
+        if embedding_dict is None and removed:
+            vector_store.delete_nodes(removed)
+        return removed
+
+    def _delete_nodes(self, node_ids: List[str]) -> int:
+        """
+        增量删除节点：先追加写前日志，再在写锁内修改内存索引
+
+        检索在读锁内执行，删除提交前看到的是删除前的完整索引，提交后看到的是删除后的索引
+        """
+        node_ids = list(dict.fromkeys(str(node_id) for node_id in node_ids))
+        if not node_ids:
             return 0
+        with self._rw_lock.write():
+            # 分段存储的删除即时提交到 SQLite，无需写前日志
+            if self.segment_store() is None:
+                self._append_wal({"op": "delete", "node_ids": node_ids})
+            removed = self._remove_nodes_from_index(self.index, node_ids)
+            if self._metadata_index is not None:
+                self._metadata_index.remove(removed)
+            if self._lexical_index is not None:
+                self._lexical_index.remove(removed)
+        if removed:
+            self._persist_scheduler.mark_dirty(len(removed))
+        logger.info(f"增量删除节点: workspace={self.workspace_id}, 请求={len(node_ids)}, 删除={len(removed)}")
+        return len(removed)
+
+    def _append_wal(self, record: Dict[str, Any]):
+        """追加一条写前日志记录并落盘（加载索引时重放）"""
+        self.storage_dir.mkdir(parents=True, exist_ok=True)
+        line = json.dumps({"ts": time.time(), **record}, ensure_ascii=False)
+        with open(self.wal_path, 'a', encoding='utf-8') as f:
+            f.write(line + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _truncate_wal(self):
+        """全量持久化后清空写前日志"""
+        for path in (self.wal_path, self.storage_dir / "deletions.log"):
+            if path.exists():
+                path.unlink()
+
+    @staticmethod
+    def _node_to_wal(node: Any) -> Dict[str, Any]:
+        """序列化节点（含向量），重放时无需重新编码"""
+        return {"node": doc_to_json(node), "embedding": node.embedding}
+
+    def _replay_wal(self, index: Any) -> int:
+        """
+        将写前日志按顺序重放到刚加载的索引上（幂等：重复插入覆盖同ID节点，已删除的节点自动跳过）
+
+        兼容旧版删除日志 deletions.log（每行只有 node_ids）
+        """
+        replayed = 0
+        for path in (self.storage_dir / "deletions.log", self.wal_path):
+            if not path.exists():
+                continue
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                        if record.get("op", "delete") == "insert":
+                            nodes = []
+                            for item in record.get("nodes", []):
+                                node = json_to_doc(item["node"])
+                                node.embedding = item.get("embedding")
+                                nodes.append(node)
+                            index.insert_nodes(nodes)
+                            replayed += len(nodes)
+                        else:
+                            replayed += len(self._remove_nodes_from_index(index, record.get("node_ids", [])))
+                    except (ValueError, KeyError, AttributeError):
+                        # 崩溃时最后一行可能写了一半
+                        logger.warning(f"跳过损坏的写前日志行: {path}")
+                        continue
+        if replayed:
+            logger.info(f"重放写前日志: workspace={self.workspace_id}, 节点变更={replayed}")
+        return replayed
+
+    def get_metadata_index(self) -> MetadataIndex:
+        """
+        获取元数据倒排索引：优先读取持久化文件并与当前索引核对，
+        文件缺失或与索引不一致时从 docstore 全量重建（仅发生一次）
+        """
+        if self._metadata_index is not None:
+            return self._metadata_index
+        with self._metadata_index_lock:
+            if self._metadata_index is None:
+                with self._rw_lock.read():
+                    self._metadata_index = self._load_or_build_metadata_index()
+        return self._metadata_index
+
+    def _load_or_build_metadata_index(self) -> MetadataIndex:
+        node_count = self.node_count()
+        metadata_index = MetadataIndex.load(self.metadata_index_path)
+        if metadata_index is not None:
+            # 删除日志中尚未全量持久化的删除
+            metadata_index.remove([nid for nid in metadata_index.node_ids() if not self._has_node(nid)])
+            if len(metadata_index) == node_count:
+                logger.info(f"元数据索引已加载: workspace={self.workspace_id}, 节点数={len(metadata_index)}")
+                return metadata_index
+            logger.warning(f"元数据索引与向量索引不一致（{len(metadata_index)} vs {node_count}），重建")
+
+        build_start = time.time()
+        store = self.segment_store()
+        if store is not None:
+            # 分段存储直接读取 SQLite 中的元数据列，不反序列化节点
+            metadata_index = MetadataIndex.build(store.iter_metadata())
+        else:
+            metadata_index = MetadataIndex.build(
+                (node_id, self._node_metadata(node)) for node_id, node in self._iter_docstore_items()
+            )
+        logger.info(
+            f"元数据索引重建完成: workspace={self.workspace_id}, 节点数={len(metadata_index)}, "
+            f"耗时 {time.time() - build_start:.2f} 秒"
+        )
+        try:
+            metadata_index.save(self.metadata_index_path)
+        except Exception as e:
+            logger.warning(f"元数据索引保存失败: {e}")
+        return metadata_index
+
+    def get_lexical_index(self) -> LexicalIndex:
+        """获取 BM25 词法索引：优先读取持久化文件并与当前索引核对，不一致时全量重建（仅发生一次）"""
+        if self._lexical_index is not None:
+            return self._lexical_index
+        with self._lexical_index_lock:
+            if self._lexical_index is None:
+                with self._rw_lock.read():
+                    self._lexical_index = self._load_or_build_lexical_index()
+        return self._lexical_index
+
+    def _load_or_build_lexical_index(self) -> LexicalIndex:
+        node_count = self.node_count()
+        lexical_index = LexicalIndex.load(self.lexical_index_path)
+        if lexical_index is not None:
+            lexical_index.remove([nid for nid in lexical_index.node_ids() if not self._has_node(nid)])
+            if len(lexical_index) == node_count:
+                logger.info(f"词法索引已加载: workspace={self.workspace_id}, 节点数={len(lexical_index)}")
+                return lexical_index
+            logger.warning(f"词法索引与向量索引不一致（{len(lexical_index)} vs {node_count}），重建")
+
+        build_start = time.time()
+        lexical_index = LexicalIndex.build(
+            (node_id, node.get_content()) for node_id, node in self._iter_docstore_items()
+        )
+        logger.info(
+            f"词法索引重建完成: workspace={self.workspace_id}, 节点数={len(lexical_index)}, "
+            f"耗时 {time.time() - build_start:.2f} 秒"
+        )
+        try:
+            lexical_index.save(self.lexical_index_path)
+        except Exception as e:
+            logger.warning(f"词法索引保存失败: {e}")
+        return lexical_index
+
+    def get_node_ids_by_field(self, field: str, value: str) -> List[str]:
+        """按 document_id / original_filename / task_id / file_type 查找节点ID"""
+        return self.get_metadata_index().lookup(field, value)
+
+    def list_documents(self) -> List[Dict[str, Any]]:
+        """按原始文件名聚合的文档列表（每个文件只读取一个节点的 metadata）"""
+        documents: List[Dict[str, Any]] = []
+        for filename, node_ids in self.get_metadata_index().groups('original_filename').items():
+            first_id = min(node_ids)
+            node = self._get_node(first_id)
+            meta = self._node_metadata(node) if node is not None else {}
+            documents.append({
+                "id": first_id,
+                "filename": filename,
+                "original_filename": filename,
+                "file_size": meta.get('file_size', 0),
+                "file_type": meta.get('file_type', meta.get('mime_type', '')),
+                "status": "completed",
+                "created_at": meta.get('upload_time', meta.get('creation_date', '')),
+                "chunk_count": len(node_ids)
+            })
+        return documents
 
     def delete_by_original_filename(self, original_filename: str) -> Dict[str, Any]:
-        """根据 original_filename 删除对应所有节点，并持久化重建索引。"""
+        """根据 original_filename 删除对应所有节点（增量删除，仅持久化删除记录）。"""
         try:
-            ds = getattr(self.index.storage_context, 'docstore', None)
-            if ds is None:
-                return {"deleted": 0, "kept": 0}
-            # LlamaIndex docstore 可能为 dict-like: .docs or ._dict
-            nodes_map = getattr(ds, 'docs', None) or getattr(ds, '_docstore', None) or getattr(ds, '_dict', None) or {}
-            if hasattr(nodes_map, 'items'):
-                items = list(nodes_map.items())
-            else:
-                # 兼容结构
-                items = []
-            kept_nodes: List[Any] = []
-            deleted = 0
-            for _, node in items:
-                meta = getattr(node, 'metadata', {}) or {}
-                fname = meta.get('original_filename') or meta.get('file_name') or ''
-                if fname == original_filename:
-                    deleted += 1
-                else:
-                    kept_nodes.append(node)
-            kept = len(kept_nodes)
-            self._rebuild_index_from_nodes(kept_nodes)
-            return {"deleted": deleted, "kept": kept}
+            node_ids = self.get_node_ids_by_field('original_filename', original_filename)
+            deleted = self._delete_nodes(node_ids)
+            return {"deleted": deleted, "kept": self.node_count()}
         except Exception as e:
             logger.error(f"按文件名删除失败: {e}")
             return {"deleted": 0, "kept": 0, "error": str(e)}
 
-    def inspect_all_nodes_metadata(self) -> List[Dict[str, Any]]:
-        """调试函数：检查索引中所有节点的metadata"""
+    def inspect_all_nodes_metadata(self, document_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """调试函数：检查索引中节点的metadata（指定 document_id 时只检查该文档的节点）"""
         nodes_info = []
         try:
-            ds = getattr(self.index.storage_context, 'docstore', None)
-            if ds is None:
-                logger.warning("docstore 不存在")
-                return nodes_info
-            
-            # 尝试多种方式访问节点映射
-            nodes_map = None
-            for attr_name in ['docs', '_docstore', '_dict']:
-                nodes_map = getattr(ds, attr_name, None)
-                if nodes_map is not None:
-                    break
-            
-            if nodes_map is None or not hasattr(nodes_map, 'items'):
-                logger.warning(f"无法访问节点映射，docstore 类型: {type(ds)}")
-                return nodes_info
-            
-            items = list(nodes_map.items())
+            if document_id:
+                items = [
+                    (node_id, self._get_node(node_id))
+                    for node_id in self.get_node_ids_by_field('document_id', document_id)
+                ]
+            else:
+                items = self._iter_docstore_items()
             logger.info(f"检查 {len(items)} 个节点的metadata")
             
             for node_id, node in items:
-                # 尝试多种方式访问 metadata
-                meta = {}
-                node_type = type(node).__name__
-                
-                # 方法1: 直接访问 node.metadata
-                if hasattr(node, 'metadata'):
-                    meta_raw = getattr(node, 'metadata', None)
-                    if isinstance(meta_raw, dict):
-                        meta = meta_raw
-                    elif meta_raw is not None:
-                        try:
-                            meta = dict(meta_raw) if hasattr(meta_raw, '__iter__') else {}
-                        except:
-                            meta = {}
-                
-                # 方法2: 通过 node.node.metadata 访问
-                elif hasattr(node, 'node') and hasattr(node.node, 'metadata'):
-                    meta_raw = getattr(node.node, 'metadata', None)
-                    if isinstance(meta_raw, dict):
-                        meta = meta_raw
-                
-                # 方法3: 尝试通过反射获取
-                if not meta:
-                    try:
-                        if hasattr(node, '__dict__'):
-                            node_dict = node.__dict__
-                            if 'metadata' in node_dict:
-                                meta = node_dict['metadata'] if isinstance(node_dict['metadata'], dict) else {}
-                    except:
-                        pass
-                
-                # 记录节点信息
-                node_info = {
+                meta = self._node_metadata(node)
+                nodes_info.append({
                     'node_id': str(node_id)[:100],
-                    'node_type': node_type,
+                    'node_type': type(node).__name__,
                     'has_metadata': bool(meta),
-                    'metadata': dict(meta) if isinstance(meta, dict) else {},
-                    'document_id': meta.get('document_id') if isinstance(meta, dict) else None,
-                    'original_filename': meta.get('original_filename') if isinstance(meta, dict) else None,
-                    'metadata_keys': list(meta.keys()) if isinstance(meta, dict) else []
-                }
-                nodes_info.append(node_info)
+                    'metadata': dict(meta),
+                    'document_id': meta.get('document_id'),
+                    'original_filename': meta.get('original_filename'),
+                    'metadata_keys': list(meta.keys())
+                })
             
             return nodes_info
         except Exception as e:
@@ -485,6 +1308,9 @@ class LlamaIndexRetriever:
 
     def _iter_docstore_items(self) -> List[Any]:
         """内部工具：以(items)形式返回docstore节点列表。"""
+        store = self.segment_store()
+        if store is not None:
+            return list(store.iter_nodes())
         ds = getattr(self.index.storage_context, 'docstore', None)
         if ds is None:
             return []
@@ -507,148 +1333,29 @@ class LlamaIndexRetriever:
         - 若它匹配某个node_id，则从该节点metadata中取document_id并返回；
         - 否则返回None。
         """
-        items = self._iter_docstore_items()
-        if not items:
-            return None
-        candidate_doc_id: Optional[str] = None
-        # 第一遍：如果传入的是document_id，看看是否存在任何节点引用它
-        for _, node in items:
-            meta = getattr(node, 'metadata', {}) or {}
-            if isinstance(meta, dict):
-                doc_id = meta.get('document_id') or meta.get('doc_id') or meta.get('docId')
-                if doc_id and doc_id == id_or_node_id:
-                    return id_or_node_id
-        # 第二遍：如果传入的是node_id，尝试用node_id命中
-        for node_id, node in items:
-            if str(node_id) == id_or_node_id:
-                meta = getattr(node, 'metadata', {}) or {}
-                if isinstance(meta, dict):
-                    doc_id = meta.get('document_id') or meta.get('doc_id') or meta.get('docId')
-                    if doc_id:
-                        candidate_doc_id = doc_id
-                        break
-        return candidate_doc_id
+        metadata_index = self.get_metadata_index()
+        if metadata_index.count('document_id', id_or_node_id):
+            return id_or_node_id
+        return metadata_index.get_value(id_or_node_id, 'document_id')
 
     def get_node_ids_by_document_id(self, document_id: str) -> List[str]:
         """返回与给定document_id关联的所有node_id列表。"""
-        node_ids: List[str] = []
-        for node_id, node in self._iter_docstore_items():
-            meta = getattr(node, 'metadata', {}) or {}
-            if isinstance(meta, dict):
-                doc_id = meta.get('document_id') or meta.get('doc_id') or meta.get('docId')
-                if doc_id == document_id:
-                    node_ids.append(str(node_id))
-        return node_ids
+        return self.get_node_ids_by_field('document_id', document_id)
 
     def delete_by_document_id(self, document_id: str) -> Dict[str, Any]:
-        """根据 metadata.document_id 删除对应所有节点，并持久化重建索引。"""
+        """根据 metadata.document_id 删除对应所有节点（增量删除，仅持久化删除记录）。"""
         try:
             # 先解析：允许传入的是 node_id 或 document_id
             resolved_doc_id = self.resolve_document_id(document_id)
             if not resolved_doc_id:
                 logger.warning(f"无法解析为有效document_id: {document_id}")
-                return {"deleted": 0, "kept": 0}
+                return {"deleted": 0, "kept": self.node_count()}
 
-            ds = getattr(self.index.storage_context, 'docstore', None)
-            if ds is None:
-                logger.warning(f"docstore 不存在，无法删除 document_id={resolved_doc_id}")
-                return {"deleted": 0, "kept": 0}
-            
-            # 尝试多种方式访问节点映射
-            nodes_map = None
-            for attr_name in ['docs', '_docstore', '_dict']:
-                nodes_map = getattr(ds, attr_name, None)
-                if nodes_map is not None:
-                    break
-            
-            if nodes_map is None:
-                logger.warning(f"无法访问节点映射，docstore 类型: {type(ds)}")
-                return {"deleted": 0, "kept": 0}
-            
-            if not hasattr(nodes_map, 'items'):
-                logger.warning(f"节点映射不支持 items()，类型: {type(nodes_map)}")
-                return {"deleted": 0, "kept": 0}
-            
-            items = list(nodes_map.items())
-            logger.info(f"开始检查 {len(items)} 个节点，查找 document_id={resolved_doc_id}")
-            
-            kept_nodes: List[Any] = []
-            deleted = 0
-            found_nodes_info = []  # 用于调试
-            
-            for node_id, node in items:
-                # 尝试多种方式访问 metadata
-                meta = {}
-                node_type = type(node).__name__
-                
-                # 方法1: 直接访问 node.metadata
-                if hasattr(node, 'metadata'):
-                    meta_raw = getattr(node, 'metadata', None)
-                    if isinstance(meta_raw, dict):
-                        meta = meta_raw
-                    elif meta_raw is not None:
-                        try:
-                            meta = dict(meta_raw) if hasattr(meta_raw, '__iter__') else {}
-                        except:
-                            meta = {}
-                
-                # 方法2: 通过 node.node.metadata 访问（节点可能被包装）
-                if not meta and hasattr(node, 'node'):
-                    if hasattr(node.node, 'metadata'):
-                        meta_raw = getattr(node.node, 'metadata', None)
-                        if isinstance(meta_raw, dict):
-                            meta = meta_raw
-                
-                # 方法3: 尝试通过反射获取
-                if not meta and hasattr(node, '__dict__'):
-                    try:
-                        node_dict = node.__dict__
-                        if 'metadata' in node_dict:
-                            meta_raw = node_dict['metadata']
-                            if isinstance(meta_raw, dict):
-                                meta = meta_raw
-                    except:
-                        pass
-                
-                # 确保 meta 是字典
-                if not isinstance(meta, dict):
-                    meta = {}
-                
-                # 获取 document_id（尝试多种字段名）
-                doc_id = None
-                if isinstance(meta, dict):
-                    doc_id = meta.get('document_id') or meta.get('doc_id') or meta.get('docId')
-                
-                # 调试日志：记录前10个节点的信息
-                if len(found_nodes_info) < 10:
-                    found_nodes_info.append({
-                        'node_id': str(node_id)[:50],
-                        'node_type': node_type,
-                        'doc_id': doc_id,
-                        'has_meta': bool(meta),
-                        'meta_keys': list(meta.keys())[:10] if isinstance(meta, dict) else [],
-                        'original_filename': meta.get('original_filename') if isinstance(meta, dict) else None
-                    })
-                
-                if doc_id == resolved_doc_id:
-                    deleted += 1
-                    logger.debug(f"找到匹配节点: node_id={node_id}, document_id={doc_id}, type={node_type}")
-                else:
-                    kept_nodes.append(node)
-            
-            if deleted == 0 and found_nodes_info:
-                logger.warning(f"未找到 document_id={resolved_doc_id}")
-                logger.info(f"索引中前10个节点的信息: {found_nodes_info}")
-            
-            kept = len(kept_nodes)
-            logger.info(f"删除结果: deleted={deleted}, kept={kept}, 总数={len(items)}")
-            
-            if deleted > 0:
-                self._rebuild_index_from_nodes(kept_nodes)
-                logger.info(f"已重建索引，保留 {kept} 个节点")
-            
-            return {"deleted": deleted, "kept": kept, "all_nodes_info": found_nodes_info[:20], "resolved_document_id": resolved_doc_id}
+            node_ids = self.get_node_ids_by_document_id(resolved_doc_id)
+            deleted = self._delete_nodes(node_ids)
+            kept = self.node_count()
+            logger.info(f"删除结果: document_id={resolved_doc_id}, deleted={deleted}, kept={kept}")
+            return {"deleted": deleted, "kept": kept, "resolved_document_id": resolved_doc_id}
         except Exception as e:
             logger.error(f"按 document_id 删除失败: {e}", exc_info=True)
             return {"deleted": 0, "kept": 0, "error": str(e)}
-
@@ -0,0 +1,211 @@
+"""
+LLM 客户端注册表 - 进程级共享 ChatOpenAI 与 HTTP 连接池
+按 (模型, API Base, 温度, 超时, 重试次数) 缓存客户端，所有客户端共用同一对长连接 httpx 客户端（同步 / 异步），
+请求处理中获取 LLM 不再加载嵌入模型、也不再为每次请求建立新的 TLS 连接
+"""
+
+import os
+import logging
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LLM_MODEL = 'gpt-4o-2024-08-06'
+DEFAULT_API_BASE = 'https://api.openai.com/v1'
+
+# langchain_openai / httpx 为可选依赖，缺失时 get_llm 返回 None（与原先 LLM 初始化失败时的行为一致）
+try:
+    from langchain_openai import ChatOpenAI
+except ImportError:
+    ChatOpenAI = None
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+
+def _http_pool_config() -> Dict[str, Any]:
+    """从 rag_config.yaml 读取 llm.http_pool"""
+    try:
+        from app.utils.config_loader import get_rag_config
+        return get_rag_config().get('llm.http_pool', {}) or {}
+    except Exception:
+        return {}
+
+
+def resolve_api_key() -> Optional[str]:
+    """API Key：THIRD_PARTY_API_KEY > OPENAI_API_KEY"""
+    return os.getenv('THIRD_PARTY_API_KEY') or os.getenv('OPENAI_API_KEY')
+
+
+def resolve_api_base(base_url: Optional[str] = None) -> str:
+    """API Base：显式参数 > THIRD_PARTY_API_BASE > OPENAI_BASE_URL"""
+    if base_url:
+        return base_url
+    return os.getenv('THIRD_PARTY_API_BASE') or os.getenv('OPENAI_BASE_URL', DEFAULT_API_BASE)
+
+
+def resolve_model(model: Optional[str] = None) -> str:
+    """模型名称：显式参数 > LLM_MODEL"""
+    return model or os.getenv('LLM_MODEL', DEFAULT_LLM_MODEL)
+
+
+class LLMClientRegistry:
+    """进程级 LLM 客户端注册表"""
+
+    def __init__(self):
+        self._clients: Dict[Tuple[str, str, float, float, int], Any] = {}
+        self._lock = threading.Lock()
+        self._http_client = None
+        self._http_async_client = None
+
+        config = _http_pool_config()
+        self.max_connections = int(config.get('max_connections', 100))
+        self.max_keepalive_connections = int(config.get('max_keepalive_connections', 20))
+        self.keepalive_expiry = float(config.get('keepalive_expiry_s', 60))
+        self.request_timeout = float(config.get('request_timeout_s', 120))
+        self.max_retries = int(config.get('max_retries', 1))
+
+        # 统计
+        self.hits = 0
+        self.created = 0
+
+    def _ensure_http_clients(self):
+        """创建共享的长连接 httpx 客户端（调用方持有 self._lock）"""
+        if httpx is None or self._http_client is not None:
+            return
+        limits = httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry
+        )
+        timeout = httpx.Timeout(self.request_timeout)
+        self._http_client = httpx.Client(limits=limits, timeout=timeout)
+        self._http_async_client = httpx.AsyncClient(limits=limits, timeout=timeout)
+        logger.info(
+            f"创建共享 LLM HTTP 连接池: max_connections={self.max_connections}, "
+            f"keepalive={self.max_keepalive_connections}, expiry={self.keepalive_expiry}s"
+        )
+
+    def get_llm(
+        self,
+        model: Optional[str] = None,
+        temperature: float = 0.1,
+        base_url: Optional[str] = None,
+        request_timeout: Optional[float] = None,
+        max_retries: Optional[int] = None
+    ):
+        """
+        获取（必要时创建）共享 LLM 客户端
+
+        Args:
+            request_timeout: 单次请求超时（秒），默认 llm.http_pool.request_timeout_s
+            max_retries: 失败重试次数，默认 llm.http_pool.max_retries
+
+        Returns:
+            ChatOpenAI 实例；未配置 API Key 或缺少 langchain_openai 时返回 None
+        """
+        key = (
+            resolve_model(model),
+            resolve_api_base(base_url),
+            round(float(temperature), 3),
+            float(self.request_timeout if request_timeout is None else request_timeout),
+            int(self.max_retries if max_retries is None else max_retries)
+        )
+
+        # 快速路径：已创建
+        llm = self._clients.get(key)
+        if llm is not None:
+            self.hits += 1
+            return llm
+
+        api_key = resolve_api_key()
+        if ChatOpenAI is None or not api_key:
+            logger.warning("LLM 不可用：缺少 langchain_openai 或未配置 THIRD_PARTY_API_KEY / OPENAI_API_KEY")
+            return None
+
+        with self._lock:
+            # 双重检查，防止并发重复创建
+            if key not in self._clients:
+                self._ensure_http_clients()
+                logger.info(
+                    f"创建共享 LLM 客户端: model={key[0]}, base={key[1]}, temperature={key[2]}, "
+                    f"timeout={key[3]}s, max_retries={key[4]}"
+                )
+                # 连接池的超时只是默认值，每次请求按客户端的 request_timeout 覆盖
+                self._clients[key] = ChatOpenAI(
+                    model=key[0],
+                    temperature=key[2],
+                    openai_api_key=api_key,
+                    openai_api_base=key[1],
+                    request_timeout=key[3],
+                    max_retries=key[4],
+                    http_client=self._http_client,
+                    http_async_client=self._http_async_client
+                )
+                self.created += 1
+            return self._clients[key]
+
+    def close(self):
+        """关闭共享连接池（进程退出时调用）"""
+        with self._lock:
+            self._clients.clear()
+            if self._http_client is not None:
+                self._http_client.close()
+                self._http_client = None
+            self._http_async_client = None
+
+    async def aclose(self):
+        """关闭同步与异步连接池"""
+        async_client = self._http_async_client
+        self.close()
+        if async_client is not None:
+            await async_client.aclose()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """已创建的客户端与连接池配置"""
+        return {
+            "clients": [
+                {
+                    "model": model, "api_base": base, "temperature": temperature,
+                    "request_timeout_s": timeout, "max_retries": retries
+                }
+                for model, base, temperature, timeout, retries in list(self._clients)
+            ],
+            "created": self.created,
+            "hits": self.hits,
+            "http_pool": {
+                "active": self._http_client is not None,
+                "max_connections": self.max_connections,
+                "max_keepalive_connections": self.max_keepalive_connections,
+                "keepalive_expiry_s": self.keepalive_expiry
+            }
+        }
+
+
+# 全局注册表实例
+_registry_instance: Optional[LLMClientRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_llm_registry() -> LLMClientRegistry:
+    """获取全局 LLM 客户端注册表"""
+    global _registry_instance
+    if _registry_instance is None:
+        with _registry_lock:
+            if _registry_instance is None:
+                _registry_instance = LLMClientRegistry()
+    return _registry_instance
+
+
+def get_llm(
+    model: Optional[str] = None,
+    temperature: float = 0.1,
+    base_url: Optional[str] = None,
+    request_timeout: Optional[float] = None,
+    max_retries: Optional[int] = None
+):
+    """获取共享 LLM 客户端（便捷函数）"""
+    return get_llm_registry().get_llm(model, temperature, base_url, request_timeout, max_retries)
@@ -0,0 +1,238 @@
+"""
+本地意图分类器 - LangGraph 意图节点的快速路径
+先用高精度关键词规则识别问候与文档生成，再用查询向量对各意图示例句质心做最近质心分类；
+质心只用于在需要检索的意图（简单问答 / 复杂推理）之间做判定，跳过检索的意图只由关键词规则给出，
+只有两者都不确定时才调用 LLM。查询向量与检索共用（同一请求只编码一次）
+"""
+
+import asyncio
+import logging
+import re
+import threading
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 各意图的示例句（可在 rag_config.yaml 的 langgraph.rag_workflow.local_intent.prototypes 中覆盖）
+DEFAULT_PROTOTYPES: Dict[str, List[str]] = {
+    "greeting": [
+        "你好", "您好", "谢谢", "再见", "早上好", "在吗", "辛苦了", "你是谁", "你能做什么", "好的，明白了"
+    ],
+    "simple_qa": [
+        "这个项目是什么", "入驻条件有哪些", "申请流程是怎样的", "报销标准是多少",
+        "合同的截止日期是哪天", "这份文件主要讲了什么", "负责人是谁", "补贴金额是多少"
+    ],
+    "complex_reasoning": [
+        "比较这两个方案的区别", "分析这两份合同条款的差异", "为什么今年的预算比去年高",
+        "这项政策对企业有什么影响", "综合几个文件说明项目的整体风险", "A 和 B 哪个更适合我们"
+    ],
+    "document_generation": [
+        "帮我写一份报告", "生成一个 Excel 表格", "根据这些文件整理一份总结文档",
+        "制作一个 PPT", "把刚才的讨论整理成会议纪要"
+    ]
+}
+
+_GREETINGS = {
+    "你好", "您好", "你好呀", "hi", "hello", "hey", "嗨", "哈喽", "在吗", "在么",
+    "谢谢", "谢谢你", "多谢", "感谢", "thanks", "thankyou", "辛苦了",
+    "再见", "拜拜", "bye", "早上好", "上午好", "中午好", "下午好", "晚上好", "晚安",
+    "好的", "好", "ok", "收到", "明白了", "知道了"
+}
+# 生成请求须是祈使句：动词位于句首，前面只允许礼貌用语（请/帮我/给我...）、
+# "根据/基于..." 依据短语或 "把..." 宾语前置，动词后不能紧跟 的/了/过，
+# 避免 "上次生成的报告里..."、"生成的报告有问题" 之类的陈述或提问被误判
+_GENERATION_PATTERN = re.compile(
+    r"^(?:请|麻烦你?)?"
+    r"(?:(?:根据|基于|按照|参考|结合)[^，,。；;]{1,20}?[，,]?)?"
+    r"(?:请|帮我|给我|帮忙|替我|请帮我|麻烦帮我)?"
+    r"(?:把[^，,。；;]{1,20}?)?"
+    r"(?:生成|撰写|制作|起草|导出|(?:写|做|整理|输出)(?:一份|一个|一篇|个|份|篇|成))(?![的了过])"
+    r".{0,12}?"
+    r"(?:报告|文档|方案|总结|纪要|word|excel|ppt|表格|幻灯片|演示文稿|简报)",
+    re.IGNORECASE
+)
+# 疑问句（询问已有文档或操作方法）不按生成请求处理
+_QUESTION_PATTERN = re.compile(r"什么|哪些|哪个|哪里|吗|怎么|怎样|如何|为什么|是否|能否|[？?]")
+_COMPARISON_MARKERS = ("比较", "对比", "区别", "差异", "异同", "优缺点", "哪个更", "哪一个更", " vs ", "相比")
+_PUNCTUATION = re.compile(r"[\s，。！？、,.!?~～…]+")
+# 最近质心可以直接给出的意图：都需要检索，误判只影响复杂度，不会让真实问题跳过检索。
+# 问候 / 文档生成的质心仍参与比较，最近的是它们时交给 LLM 判定
+_CENTROID_INTENTS = ("simple_qa", "complex_reasoning")
+
+
+def _local_intent_config() -> Dict[str, Any]:
+    """从 rag_config.yaml 读取 langgraph.rag_workflow.local_intent"""
+    try:
+        from app.utils.config_loader import get_rag_config
+        return get_rag_config().get('langgraph.rag_workflow.local_intent', {}) or {}
+    except Exception:
+        return {}
+
+
+def _normalize(text: str) -> str:
+    return _PUNCTUATION.sub("", text or "").lower()
+
+
+def _result(intent: str, source: str, confidence: float, question: str) -> Dict[str, Any]:
+    """组装与 LLM 意图节点相同字段的结果"""
+    needs_retrieval = intent not in ("greeting", "document_generation")
+    multi_hop = intent == "complex_reasoning" and any(marker in question.lower() for marker in _COMPARISON_MARKERS)
+    return {
+        "intent": intent,
+        "needs_retrieval": needs_retrieval,
+        "complexity": "high" if intent == "complex_reasoning" else "low",
+        "requires_multi_hop": multi_hop,
+        "confidence": round(float(confidence), 4),
+        "source": source
+    }
+
+
+class LocalIntentClassifier:
+    """关键词规则 + 最近质心的本地意图分类器"""
+
+    def __init__(
+        self,
+        prototypes: Optional[Dict[str, Sequence[str]]] = None,
+        min_similarity: float = 0.55,
+        min_margin: float = 0.05
+    ):
+        self.prototypes = {intent: list(texts) for intent, texts in (prototypes or DEFAULT_PROTOTYPES).items() if texts}
+        self.min_similarity = float(min_similarity)
+        self.min_margin = float(min_margin)
+        self._centroids: Optional[np.ndarray] = None
+        self._centroid_intents: List[str] = []
+        self._lock = threading.Lock()
+
+        # 统计
+        self.total = 0
+        self.keyword_hits = 0
+        self.centroid_hits = 0
+        self.fallbacks = 0
+
+    # ---- 关键词规则 ----
+
+    @staticmethod
+    def classify_keywords(question: str) -> Optional[Dict[str, Any]]:
+        """高精度规则：整句为问候语，或"动词 + 文档类型"的祈使句生成请求；其余返回 None"""
+        normalized = _normalize(question)
+        if not normalized:
+            return None
+        if normalized in _GREETINGS:
+            return _result("greeting", "keyword", 0.98, question)
+        stripped = question.strip()
+        if _GENERATION_PATTERN.search(stripped) and not _QUESTION_PATTERN.search(stripped):
+            return _result("document_generation", "keyword", 0.9, question)
+        return None
+
+    # ---- 最近质心 ----
+
+    async def _ensure_centroids(self, embed: Callable[[str], Awaitable[Optional[List[float]]]], dimension: int) -> bool:
+        """首次使用时编码示例句并计算各意图的归一化质心（与查询使用同一编码函数）"""
+        if self._centroids is not None and self._centroids.shape[1] == dimension:
+            return True
+        intents = list(self.prototypes)
+        texts = [text for intent in intents for text in self.prototypes[intent]]
+        vectors = await asyncio.gather(*[embed(text) for text in texts])
+        if any(vector is None for vector in vectors):
+            return False
+        matrix = np.asarray(vectors, dtype=np.float32)
+        if matrix.ndim != 2 or matrix.shape[1] != dimension:
+            return False
+        matrix /= np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-12
+
+        centroids, offset = [], 0
+        for intent in intents:
+            count = len(self.prototypes[intent])
+            centroid = matrix[offset:offset + count].mean(axis=0)
+            centroids.append(centroid / (np.linalg.norm(centroid) + 1e-12))
+            offset += count
+        with self._lock:
+            self._centroids = np.stack(centroids)
+            self._centroid_intents = intents
+        logger.info(f"本地意图质心已计算: {len(intents)} 类, {len(texts)} 条示例")
+        return True
+
+    def classify_embedding(self, question: str, query_embedding: Sequence[float]) -> Optional[Dict[str, Any]]:
+        """最近质心：最高相似度不低于 min_similarity、领先第二名 min_margin 且属于检索类意图时接受"""
+        if self._centroids is None or len(self._centroid_intents) < 2:
+            return None
+        q = np.asarray(query_embedding, dtype=np.float32)
+        scores = self._centroids @ (q / (float(np.linalg.norm(q)) or 1.0))
+        order = np.argsort(-scores)
+        best, second = float(scores[order[0]]), float(scores[order[1]])
+        intent = self._centroid_intents[int(order[0])]
+        if intent not in _CENTROID_INTENTS or best < self.min_similarity or best - second < self.min_margin:
+            return None
+        return _result(intent, "centroid", best, question)
+
+    # ---- 对外接口 ----
+
+    async def classify(
+        self,
+        question: str,
+        embed: Optional[Callable[[str], Awaitable[Optional[List[float]]]]] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        本地判定意图
+
+        Args:
+            question: 用户问题
+            embed: 查询编码函数（与检索共用）；为 None 时只使用关键词规则
+
+        Returns:
+            {"intent", "needs_retrieval", "complexity", "requires_multi_hop", "confidence", "source"}；
+            不确定时返回 None，由调用方回退到 LLM
+        """
+        result = self.classify_keywords(question)
+        if result is None and embed is not None:
+            try:
+                query_embedding = await embed(question)
+                if query_embedding is not None and await self._ensure_centroids(embed, len(query_embedding)):
+                    result = self.classify_embedding(question, query_embedding)
+            except Exception as e:
+                logger.warning(f"本地意图质心分类失败，回退 LLM: {e}")
+                result = None
+
+        with self._lock:
+            self.total += 1
+            if result is None:
+                self.fallbacks += 1
+            elif result["source"] == "keyword":
+                self.keyword_hits += 1
+            else:
+                self.centroid_hits += 1
+        return result
+
+    def get_stats(self) -> Dict[str, Any]:
+        """命中率统计（命中 = 未调用 LLM）"""
+        with self._lock:
+            hits = self.keyword_hits + self.centroid_hits
+            return {
+                "total": self.total,
+                "keyword_hits": self.keyword_hits,
+                "centroid_hits": self.centroid_hits,
+                "llm_fallbacks": self.fallbacks,
+                "hit_rate": round(hits / self.total, 4) if self.total else 0.0,
+                "centroids_ready": self._centroids is not None
+            }
+
+
+_classifier_instance: Optional[LocalIntentClassifier] = None
+_classifier_lock = threading.Lock()
+
+
+def get_local_intent_classifier() -> LocalIntentClassifier:
+    """获取全局本地意图分类器（单例）"""
+    global _classifier_instance
+    if _classifier_instance is None:
+        with _classifier_lock:
+            if _classifier_instance is None:
+                config = _local_intent_config()
+                _classifier_instance = LocalIntentClassifier(
+                    prototypes=config.get('prototypes') or None,
+                    min_similarity=config.get('min_similarity', 0.55),
+                    min_margin=config.get('min_margin', 0.05)
+                )
+    return _classifier_instance
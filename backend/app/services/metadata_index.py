@@ -0,0 +1,277 @@
+"""
+节点元数据二级索引
+维护 document_id / original_filename / task_id / file_type / sheet -> 节点ID 的倒排表，
+以及按上传时间排序的节点列表；文档管理接口按这些字段查找节点、检索按元数据预过滤时
+无需遍历整个 docstore
+"""
+
+import bisect
+import logging
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from app.services.index_journal import IndexJournal
+
+logger = logging.getLogger(__name__)
+
+# 索引字段 -> 依次尝试的 metadata 键（兼容历史数据中的别名）
+INDEXED_FIELDS: Dict[str, Tuple[str, ...]] = {
+    'document_id': ('document_id', 'doc_id', 'docId'),
+    'original_filename': ('original_filename', 'file_name'),
+    'task_id': ('task_id',),
+    'file_type': ('file_type',),
+    'sheet': ('sheet', 'sheet_name'),
+}
+
+# 上传时间（范围过滤）依次尝试的 metadata 键
+UPLOAD_TIME_KEYS: Tuple[str, ...] = ('upload_time', 'creation_date', 'created_at')
+
+_FORMAT_VERSION = 2
+
+
+def parse_timestamp(value: Any) -> Optional[float]:
+    """把 ISO 时间字符串 / datetime / 秒级时间戳转换为时间戳，无法解析时返回 None"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, datetime):
+        return value.timestamp()
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        pass
+    try:
+        return datetime.fromisoformat(str(value).replace('Z', '+00:00')).timestamp()
+    except ValueError:
+        return None
+
+
+def extract_indexed_values(metadata: Optional[Dict[str, Any]]) -> Dict[str, str]:
+    """从节点 metadata 中提取需要索引的字段值"""
+    values: Dict[str, str] = {}
+    if not isinstance(metadata, dict):
+        return values
+    for field, keys in INDEXED_FIELDS.items():
+        for key in keys:
+            value = metadata.get(key)
+            if value:
+                values[field] = str(value)
+                break
+    return values
+
+
+def extract_upload_time(metadata: Optional[Dict[str, Any]]) -> Optional[float]:
+    """从节点 metadata 中提取上传时间戳"""
+    if not isinstance(metadata, dict):
+        return None
+    for key in UPLOAD_TIME_KEYS:
+        timestamp = parse_timestamp(metadata.get(key))
+        if timestamp is not None:
+            return timestamp
+    return None
+
+
+def validate_filters(filters: Dict[str, Any]):
+    """校验检索过滤条件（字段与上传时间范围格式），不合法时抛出 ValueError"""
+    for field, value in filters.items():
+        if field == 'upload_time':
+            if value is None:
+                continue
+            if isinstance(value, dict):
+                bounds = [value.get("from"), value.get("to")]
+            elif isinstance(value, (list, tuple)) and len(value) == 2:
+                bounds = list(value)
+            else:
+                raise ValueError("upload_time 过滤条件应为 {\"from\": ..., \"to\": ...}")
+            for bound in bounds:
+                if bound not in (None, '') and parse_timestamp(bound) is None:
+                    raise ValueError(f"无法解析的时间: {bound}")
+        elif field not in INDEXED_FIELDS:
+            raise ValueError(f"不支持的过滤字段: {field}（可选 {', '.join(list(INDEXED_FIELDS) + ['upload_time'])}）")
+
+
+class MetadataIndex:
+    """倒排索引：字段值 -> 节点ID集合，增删节点时同步维护"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        # node_id -> {字段: 值}，删除时据此定位倒排表条目
+        self._nodes: Dict[str, Dict[str, str]] = {}
+        self._postings: Dict[str, Dict[str, Set[str]]] = {field: {} for field in INDEXED_FIELDS}
+        # node_id -> 上传时间戳；按时间排序的视图在首次范围查询时构建，写入后失效
+        self._upload_times: Dict[str, float] = {}
+        self._time_order: Optional[Tuple[List[float], List[str]]] = None
+        self._journal = IndexJournal()
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    def __contains__(self, node_id: str) -> bool:
+        return node_id in self._nodes
+
+    def add(self, node_id: str, metadata: Optional[Dict[str, Any]]):
+        """登记节点（重复登记时以新 metadata 为准）"""
+        values = extract_indexed_values(metadata)
+        timestamp = extract_upload_time(metadata)
+        with self._lock:
+            self._put(node_id, values, timestamp)
+            self._journal.record({"op": "add", "id": node_id, "values": values, "upload_time": timestamp})
+
+    def _put(self, node_id: str, values: Dict[str, str], timestamp: Optional[float]):
+        if node_id in self._nodes:
+            self._remove_one(node_id)
+        values = {field: value for field, value in values.items() if field in self._postings}
+        self._nodes[node_id] = values
+        for field, value in values.items():
+            self._postings[field].setdefault(value, set()).add(node_id)
+        if timestamp is not None:
+            self._upload_times[node_id] = float(timestamp)
+            self._time_order = None
+
+    def remove(self, node_ids: Iterable[str]) -> int:
+        """移除节点，返回实际移除数量"""
+        removed: List[str] = []
+        with self._lock:
+            for node_id in node_ids:
+                if node_id in self._nodes:
+                    self._remove_one(node_id)
+                    removed.append(node_id)
+            if removed:
+                self._journal.record({"op": "remove", "ids": removed})
+        return len(removed)
+
+    def _remove_one(self, node_id: str):
+        values = self._nodes.pop(node_id)
+        for field, value in values.items():
+            postings = self._postings[field].get(value)
+            if postings is None:
+                continue
+            postings.discard(node_id)
+            if not postings:
+                del self._postings[field][value]
+        if self._upload_times.pop(node_id, None) is not None:
+            self._time_order = None
+
+    def lookup(self, field: str, value: str) -> List[str]:
+        """按字段值查找节点ID"""
+        with self._lock:
+            return list(self._postings[field].get(str(value), ()))
+
+    def count(self, field: str, value: str) -> int:
+        """某字段值对应的节点数"""
+        with self._lock:
+            return len(self._postings[field].get(str(value), ()))
+
+    def lookup_time_range(self, start: Optional[float] = None, end: Optional[float] = None) -> Set[str]:
+        """上传时间在 [start, end] 内的节点ID（二分查找按时间排序的视图）"""
+        with self._lock:
+            if self._time_order is None:
+                ordered = sorted(self._upload_times.items(), key=lambda item: item[1])
+                self._time_order = ([t for _, t in ordered], [node_id for node_id, _ in ordered])
+            times, node_ids = self._time_order
+            lo = bisect.bisect_left(times, start) if start is not None else 0
+            hi = bisect.bisect_right(times, end) if end is not None else len(times)
+            return set(node_ids[lo:hi])
+
+    def match(self, filters: Dict[str, Any]) -> Set[str]:
+        """
+        求满足全部过滤条件的节点ID集合（检索前预过滤）
+
+        Args:
+            filters: {字段: 值 或 值列表（任一匹配）}，字段为 INDEXED_FIELDS 之一；
+                另支持 upload_time: {"from": 起始, "to": 截止}（ISO 字符串或时间戳，可只给一端）
+
+        Raises:
+            ValueError: 不支持的过滤字段
+        """
+        candidates: List[Set[str]] = []
+        with self._lock:
+            for field, value in filters.items():
+                if value is None:
+                    continue
+                if field == 'upload_time':
+                    bounds = value if isinstance(value, dict) else {"from": value[0], "to": value[1]}
+                    candidates.append(self.lookup_time_range(
+                        parse_timestamp(bounds.get("from")), parse_timestamp(bounds.get("to"))
+                    ))
+                elif field in INDEXED_FIELDS:
+                    values = value if isinstance(value, (list, tuple, set)) else [value]
+                    matched: Set[str] = set()
+                    for item in values:
+                        matched |= self._postings[field].get(str(item), set())
+                    candidates.append(matched)
+                else:
+                    raise ValueError(f"不支持的过滤字段: {field}")
+        if not candidates:
+            return set(self.node_ids())
+        # 从最小的集合开始求交集
+        candidates.sort(key=len)
+        result = set(candidates[0])
+        for other in candidates[1:]:
+            result &= other
+        return result
+
+    def get_value(self, node_id: str, field: str) -> Optional[str]:
+        """读取节点的某个索引字段值"""
+        with self._lock:
+            return self._nodes.get(node_id, {}).get(field)
+
+    def groups(self, field: str) -> Dict[str, List[str]]:
+        """按字段值分组的节点ID（用于文档列表等聚合视图）"""
+        with self._lock:
+            return {value: list(node_ids) for value, node_ids in self._postings[field].items()}
+
+    def node_ids(self) -> List[str]:
+        with self._lock:
+            return list(self._nodes.keys())
+
+    def estimate_memory_bytes(self) -> int:
+        """估算常驻内存（每个节点的字段字典与倒排集合条目）"""
+        with self._lock:
+            return len(self._nodes) * (200 + 120 * len(INDEXED_FIELDS)) + len(self._upload_times) * 100
+
+    @classmethod
+    def build(cls, items: Iterable[Tuple[str, Any]]) -> "MetadataIndex":
+        """由 (node_id, metadata) 序列全量构建"""
+        index = cls()
+        for node_id, metadata in items:
+            index.add(str(node_id), metadata)
+        return index
+
+    def save(self, path: Path) -> bool:
+        """
+        落盘（见 index_journal）：只把上次落盘后的增删追加到日志，日志过长时才重写快照
+
+        Returns:
+            没有变更时返回 False
+        """
+        with self._lock:
+            return self._journal.save(path, self._snapshot, len(self._nodes))
+
+    def _snapshot(self) -> Dict[str, Any]:
+        return {"version": _FORMAT_VERSION, "nodes": self._nodes, "upload_times": self._upload_times}
+
+    @classmethod
+    def load(cls, path: Path) -> Optional["MetadataIndex"]:
+        """读取快照并重放日志；文件不存在或格式不符时返回 None"""
+        loaded = IndexJournal.read(path)
+        if loaded is None:
+            return None
+        payload, entries, journal = loaded
+        if payload.get("version") != _FORMAT_VERSION:
+            return None
+
+        index = cls()
+        upload_times = payload.get("upload_times", {})
+        for node_id, values in payload.get("nodes", {}).items():
+            index._put(node_id, values, upload_times.get(node_id))
+        for entry in entries:
+            if entry.get("op") == "add":
+                index._put(entry["id"], entry["values"], entry.get("upload_time"))
+            elif entry.get("op") == "remove":
+                index.remove(entry["ids"])
+        index._journal = journal
+        return index
@@ -0,0 +1,182 @@
+"""
+索引持久化调度器 - 合并提交（group commit）
+写入只标记脏数据，后台线程在达到时间或数量阈值、或批处理结束时统一持久化一次，
+避免批量导入时每个文件都全量重写索引；崩溃安全由调用方的写前日志保证
+"""
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class PersistScheduler:
+    """按 (最大延迟, 最大待提交变更数) 合并持久化请求"""
+
+    def __init__(
+        self,
+        flush_fn: Callable[[], Any],
+        max_delay_s: float = 5.0,
+        max_pending_changes: int = 5000,
+        name: str = "index"
+    ):
+        """
+        Args:
+            flush_fn: 实际执行持久化的函数
+            max_delay_s: 第一次标记脏数据后最多等待多久落盘（秒）
+            max_pending_changes: 待提交变更（节点）数达到此值时立即落盘
+            name: 工作线程名称后缀
+        """
+        self.flush_fn = flush_fn
+        self.max_delay_s = max(0.0, float(max_delay_s))
+        self.max_pending_changes = max(1, int(max_pending_changes))
+        self.name = name
+
+        self._cond = threading.Condition(threading.Lock())
+        self._flush_lock = threading.Lock()
+        self._pending_changes = 0
+        self._dirty_since: Optional[float] = None
+        self._batch_depth = 0
+        self._flush_requested = False
+        self._running = True
+
+        # 统计
+        self.total_marks = 0
+        self.total_flushes = 0
+        self.total_flush_time = 0.0
+        self.last_flush_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+        self._worker = threading.Thread(
+            target=self._worker_loop,
+            name=f"persist-scheduler-{name}",
+            daemon=True
+        )
+        self._worker.start()
+
+    @property
+    def dirty(self) -> bool:
+        return self._dirty_since is not None
+
+    @property
+    def in_batch(self) -> bool:
+        return self._batch_depth > 0
+
+    def mark_dirty(self, changes: int = 1):
+        """登记一次变更（不立即落盘）"""
+        with self._cond:
+            if self._dirty_since is None:
+                self._dirty_since = time.monotonic()
+            self._pending_changes += max(0, int(changes))
+            self.total_marks += 1
+            self._cond.notify_all()
+
+    def request_flush(self):
+        """请求后台线程尽快落盘（不等待完成）"""
+        with self._cond:
+            self._flush_requested = True
+            self._cond.notify_all()
+
+    def flush(self) -> bool:
+        """
+        同步落盘（有脏数据时）
+
+        Returns:
+            是否执行了持久化
+        """
+        with self._flush_lock:
+            with self._cond:
+                if self._dirty_since is None:
+                    self._flush_requested = False
+                    return False
+                changes = self._pending_changes
+                self._dirty_since = None
+                self._pending_changes = 0
+                self._flush_requested = False
+
+            start = time.time()
+            try:
+                self.flush_fn()
+            except Exception as e:
+                # 落盘失败：恢复脏标记，等待下次重试
+                self.last_error = str(e)
+                logger.error(f"索引持久化失败（{self.name}），稍后重试: {e}")
+                with self._cond:
+                    if self._dirty_since is None:
+                        self._dirty_since = time.monotonic()
+                    self._pending_changes += changes
+                return False
+
+            elapsed = time.time() - start
+            self.total_flushes += 1
+            self.total_flush_time += elapsed
+            self.last_flush_at = time.time()
+            self.last_error = None
+            logger.info(f"索引已持久化（{self.name}）: 合并变更={changes}, 耗时 {elapsed:.2f} 秒")
+            return True
+
+    @contextmanager
+    def batch(self):
+        """批处理期间暂停按时间落盘，结束时（最外层）请求一次落盘"""
+        with self._cond:
+            self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            with self._cond:
+                self._batch_depth -= 1
+                if self._batch_depth == 0 and self._dirty_since is not None:
+                    self._flush_requested = True
+                self._cond.notify_all()
+
+    def _due(self) -> bool:
+        """是否应当落盘（需持有 _cond）"""
+        if self._dirty_since is None:
+            return False
+        if self._flush_requested or self._pending_changes >= self.max_pending_changes:
+            return True
+        if self._batch_depth > 0:
+            return False
+        return time.monotonic() - self._dirty_since >= self.max_delay_s
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                while self._running and not self._due():
+                    timeout = None
+                    if self._dirty_since is not None and self._batch_depth == 0:
+                        timeout = max(0.0, self._dirty_since + self.max_delay_s - time.monotonic())
+                    self._cond.wait(timeout=timeout)
+                if not self._running:
+                    return
+            if not self.flush() and self.last_error:
+                # 落盘失败后退避，避免持续重试
+                time.sleep(max(1.0, self.max_delay_s))
+
+    def shutdown(self, flush: bool = True):
+        """停止后台线程，默认先落盘剩余变更"""
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        self._worker.join(timeout=5)
+        if flush:
+            self.flush()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """调度统计"""
+        with self._cond:
+            return {
+                "dirty": self._dirty_since is not None,
+                "pending_changes": self._pending_changes,
+                "in_batch": self._batch_depth > 0,
+                "max_delay_s": self.max_delay_s,
+                "max_pending_changes": self.max_pending_changes,
+                "total_marks": self.total_marks,
+                "total_flushes": self.total_flushes,
+                "avg_flush_ms": round(self.total_flush_time / self.total_flushes * 1000, 2) if self.total_flushes else 0.0,
+                "last_flush_at": self.last_flush_at,
+                "last_error": self.last_error
+            }
@@ -0,0 +1,187 @@
+"""
+查询向量共享
+多个检索器使用同一个共享嵌入模型时，查询只编码一次再分发给各检索器；
+模型不同、或检索器不支持预编码向量时，由检索器自行编码
+"""
+
+import asyncio
+import inspect
+import logging
+from contextlib import ExitStack, contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_accepts_cache: Dict[tuple, bool] = {}
+
+
+def _accepts(retriever: Any, name: str) -> bool:
+    """检索器的 retrieve 是否接受关键字参数 name（按类型缓存）"""
+    key = (type(retriever), name)
+    if key not in _accepts_cache:
+        try:
+            params = inspect.signature(retriever.retrieve).parameters
+            _accepts_cache[key] = name in params or any(p.kind == p.VAR_KEYWORD for p in params.values())
+        except (TypeError, ValueError, AttributeError):
+            _accepts_cache[key] = False
+    return _accepts_cache[key]
+
+
+def shares_embedding(source: Any, target: Any) -> bool:
+    """target 能否直接使用 source 编码的查询向量（同一共享嵌入模型实例，见 embedding_registry）"""
+    if source is target:
+        return True
+    model = getattr(source, 'embed_model', None)
+    return model is not None and model is getattr(target, 'embed_model', None)
+
+
+async def embed_query_with(retriever: Any, query: str) -> Optional[list]:
+    """用检索器的模型编码查询；检索器不支持或编码失败时返回 None"""
+    embed = getattr(retriever, 'embed_query', None)
+    if embed is None:
+        return None
+    try:
+        return await embed(query)
+    except Exception as e:
+        logger.warning(f"查询预编码失败，回退为各检索器独立编码: {e}")
+        return None
+
+
+def retrieve_with(retriever: Any, query: str, query_embedding=None, source: Any = None, filters=None, **kwargs):
+    """
+    调用 retriever.retrieve
+
+    Args:
+        query_embedding: source 检索器编码的查询向量；仅在 retriever 与 source 共享模型且支持该参数时传入
+        filters: 元数据过滤条件；检索器不支持时抛出 ValueError，避免静默扩大检索范围
+    """
+    if query_embedding is not None and _accepts(retriever, 'query_embedding') \
+            and (source is None or shares_embedding(source, retriever)):
+        kwargs["query_embedding"] = query_embedding
+    if filters:
+        if not _accepts(retriever, 'filters'):
+            raise ValueError(f"检索器不支持元数据过滤: {type(retriever).__name__}")
+        kwargs["filters"] = filters
+    return retriever.retrieve(query, **kwargs)
+
+
+def stacked_workspace_ids(*retrievers: Any) -> Optional[List[str]]:
+    """
+    检索器都是进程缓存中的 LlamaIndex 检索器时返回其工作区ID（可交给 search_workspaces 一次堆叠检索），
+    否则（测试替身、旧检索器、未经 get_retriever 创建的实例）返回 None
+    """
+    workspace_ids = []
+    for retriever in retrievers:
+        workspace_id = getattr(retriever, 'workspace_id', None)
+        if workspace_id is None or not callable(getattr(retriever, 'segment_store', None)):
+            return None
+        workspace_ids.append(workspace_id)
+    from app.services.llamaindex_retriever import get_loaded_retriever
+    if any(get_loaded_retriever(ws_id) is not retriever for ws_id, retriever in zip(workspace_ids, retrievers)):
+        return None
+    return workspace_ids
+
+
+class SharedQueryRetrievalMixin:
+    """工作流复用的检索辅助：同一请求内每个查询只编码一次（用工作区检索器的模型），并按模型是否共享分发"""
+
+    workspace_retriever: Any
+    global_retriever: Any
+
+    @contextmanager
+    def _leased_retrievers(self):
+        """运行期间租用缓存中的工作区与全局检索器，长流程进行中不会被检索器缓存淘汰关闭"""
+        with ExitStack() as leases:
+            for retriever in (self.workspace_retriever, self.global_retriever):
+                workspace_id = getattr(retriever, 'workspace_id', None)
+                if workspace_id is not None and callable(getattr(retriever, 'segment_store', None)):
+                    from app.services.llamaindex_retriever import lease_retriever
+                    leases.enter_context(lease_retriever(workspace_id, retriever))
+            yield
+
+    async def _embed_query(self, query: str):
+        """预先编码查询（同一工作流实例内按查询缓存；检索器不支持时返回 None）"""
+        cache = self.__dict__.setdefault('_query_embeddings', {})
+        if query in cache:
+            return cache[query]
+        embedding = await embed_query_with(self.workspace_retriever, query)
+        if embedding is not None:
+            cache[query] = embedding
+        return embedding
+
+    def _retrieve(self, retriever, query: str, query_embedding=None, filters=None, **kwargs):
+        """调用检索器；预编码向量只传给与工作区检索器共享模型的检索器"""
+        return retrieve_with(retriever, query, query_embedding, source=self.workspace_retriever, filters=filters, **kwargs)
+
+    async def _search_stacked(self, query: str, query_embedding, top_k: int, use_hybrid: bool) -> Optional[List[Dict]]:
+        """
+        工作区与全局都是缓存中的 LlamaIndex 检索器时，经 search_workspaces 一次堆叠检索（结果带 workspace_id）；
+        不满足条件或堆叠检索失败时返回 None，由调用方分别检索
+        """
+        workspace_ids = stacked_workspace_ids(self.workspace_retriever, self.global_retriever)
+        if not workspace_ids or len(set(workspace_ids)) != len(workspace_ids):
+            return None
+        from app.services.llamaindex_retriever import search_workspaces
+        try:
+            return await search_workspaces(
+                query, workspace_ids, top_k=top_k, use_hybrid=use_hybrid, query_embedding=query_embedding
+            )
+        except Exception as e:
+            logger.warning(f"跨工作区堆叠检索失败，改为分别检索: {e}")
+            return None
+
+    async def _retrieve_split(
+        self, query: str, query_embedding=None, filters=None, top_k: int = 5, use_hybrid: bool = True
+    ) -> Tuple[List[Dict], List[Dict]]:
+        """
+        在工作区与全局上检索，分别返回两边的候选 (工作区候选, 全局候选)，每边至多 top_k 个：
+        无过滤条件时走一次堆叠检索（取全局排名前 2*top_k 再按 workspace_id 拆分），否则并行分别检索
+        """
+        if not filters:
+            stacked = await self._search_stacked(query, query_embedding, top_k * 2, use_hybrid)
+            if stacked is not None:
+                workspace_id = self.workspace_retriever.workspace_id
+                workspace_docs = [doc for doc in stacked if doc.get('workspace_id') == workspace_id]
+                global_docs = [doc for doc in stacked if doc.get('workspace_id') != workspace_id]
+                return workspace_docs[:top_k], global_docs[:top_k]
+        return await self._retrieve_each(query, query_embedding, filters, top_k, use_hybrid)
+
+    async def _retrieve_each(
+        self, query: str, query_embedding=None, filters=None, top_k: int = 5, use_hybrid: bool = True
+    ) -> Tuple[List[Dict], List[Dict]]:
+        """并行分别检索工作区与全局，失败的一边返回空列表"""
+        workspace_docs, global_docs = await asyncio.gather(
+            self._retrieve(self.workspace_retriever, query, query_embedding, filters, top_k=top_k, use_hybrid=use_hybrid),
+            self._retrieve(self.global_retriever, query, query_embedding, filters, top_k=top_k, use_hybrid=use_hybrid),
+            return_exceptions=True
+        )
+        for result in (workspace_docs, global_docs):
+            if isinstance(result, Exception):
+                logger.error(f"检索失败: {result}")
+        return (
+            workspace_docs if not isinstance(workspace_docs, Exception) else [],
+            global_docs if not isinstance(global_docs, Exception) else []
+        )
+
+    async def _retrieve_across(
+        self, query: str, query_embedding=None, filters=None, top_k: int = 5, use_hybrid: bool = True
+    ) -> List[Dict]:
+        """
+        在工作区与全局上检索并合并为一个按相关度排序的列表：
+        无过滤条件且两者都是缓存中的 LlamaIndex 检索器时，走 search_workspaces 的一次堆叠检索；
+        否则分别检索后合并去重：结果都带 RRF 融合分数（混合检索）时按融合分数排序，与堆叠检索一致，
+        否则按向量分数排序
+        """
+        if not filters:
+            stacked = await self._search_stacked(query, query_embedding, top_k, use_hybrid)
+            if stacked is not None:
+                return stacked
+
+        merged: Dict[Any, Dict] = {}
+        for result in await self._retrieve_each(query, query_embedding, filters, top_k, use_hybrid):
+            for doc in result:
+                merged.setdefault(doc.get('node_id', id(doc)), doc)
+        # 混合检索的向量分数不代表排序：只命中 BM25 的结果余弦很低，按 score 排序会把它们压到纯向量结果之后
+        docs = list(merged.values())
+        key = 'fused_score' if docs and all('fused_score' in doc for doc in docs) else 'score'
+        return sorted(docs, key=lambda doc: doc.get(key) or 0, reverse=True)[:top_k]
@@ -1,28 +1,147 @@
 """
 重排序服务 - BGE-reranker-v2-m3
 提供高质量的重排序功能，提升检索结果的相关性
+
+进程内共享一个模型实例（get_reranker_service）：并发请求的 (查询, 文档) 对在很短的等待窗口内
+合并为一次推理，按长度分桶减少 padding，超长文本按 max_length 截断，
+分数按 (查询哈希, 节点ID) 缓存，同一查询重复重排序时不再推理
 """
 
 import os
+import hashlib
 import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
 import numpy as np
 from typing import List, Dict, Any, Optional, Tuple
 import torch
 
+from app.utils.config_loader import get_reranking_config
+
 logger = logging.getLogger(__name__)
 
 
+def _hash_text(text: str) -> str:
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class _RerankBatcher:
+    """合并并发重排序请求：每个请求是一组 (查询, 文档) 对，凑批后一次推理"""
+
+    def __init__(self, score_fn, max_batch_pairs: int = 256, max_wait_ms: float = 5.0):
+        self.score_fn = score_fn
+        self.max_batch_pairs = max(1, int(max_batch_pairs))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._queue: "queue.Queue[Optional[Tuple[List[Tuple[str, str]], Future]]]" = queue.Queue()
+
+        # 统计
+        self.total_requests = 0
+        self.total_batches = 0
+        self.total_pairs = 0
+        self.max_observed_pairs = 0
+
+        self._worker = threading.Thread(target=self._worker_loop, name="rerank-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, pairs: List[Tuple[str, str]]) -> Future:
+        """提交一组 (查询, 文档) 对，Future 结果为等长的分数列表"""
+        future: Future = Future()
+        self._queue.put((pairs, future))
+        self.total_requests += 1
+        return future
+
+    def _collect_batch(self, first) -> List[Tuple[List[Tuple[str, str]], Future]]:
+        batch = [first]
+        pair_count = len(first[0])
+        deadline = time.monotonic() + self.max_wait
+        while pair_count < self.max_batch_pairs:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)
+                break
+            batch.append(item)
+            pair_count += len(item[0])
+        return batch
+
+    def _worker_loop(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                break
+            batch = [item for item in self._collect_batch(first) if item[1].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            # 合并所有请求的文档对（相同的对只推理一次）
+            unique_pairs: List[Tuple[str, str]] = []
+            positions: Dict[Tuple[str, str], int] = {}
+            for pairs, _ in batch:
+                for pair in pairs:
+                    if pair not in positions:
+                        positions[pair] = len(unique_pairs)
+                        unique_pairs.append(pair)
+
+            try:
+                scores = self.score_fn(unique_pairs)
+            except Exception as e:
+                logger.error(f"批量重排序推理失败（文档对={len(unique_pairs)}）: {e}")
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            for pairs, future in batch:
+                future.set_result([scores[positions[pair]] for pair in pairs])
+            self.total_batches += 1
+            self.total_pairs += len(unique_pairs)
+            self.max_observed_pairs = max(self.max_observed_pairs, len(unique_pairs))
+
+    def shutdown(self):
+        self._queue.put(None)
+        self._worker.join(timeout=5)
+
+
 class RerankerService:
-    """重排序服务"""
-    
-    def __init__(self):
+    """重排序服务（请通过 get_reranker_service() 获取共享实例）"""
+
+    def __init__(
+        self,
+        model_name: Optional[str] = None,
+        batch_size: Optional[int] = None,
+        max_length: Optional[int] = None,
+        cache_size: Optional[int] = None,
+        max_wait_ms: Optional[float] = None
+    ):
+        config = get_reranking_config()
         self.reranker = None
-        self.model_name = "BAAI/bge-reranker-v2-m3"
+        self.model_name = model_name or config.get('model', "BAAI/bge-reranker-v2-m3")
+        self.batch_size = int(batch_size or config.get('batch_size', 32))
+        self.max_length = int(max_length or config.get('max_length', 512))
+        self.cache_size = int(cache_size if cache_size is not None else config.get('cache_size', 20000))
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
         self.use_fp16 = torch.cuda.is_available()
-        
+
+        # 分数缓存：(查询哈希, 节点ID/内容哈希) -> 分数
+        self._cache: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # 单个文档对的平均推理耗时（毫秒，指数滑动平均），用于按时间预算估算可重排序的候选数
+        self.ms_per_pair: Optional[float] = None
+
         self._initialize_reranker()
-    
+        self._batcher = _RerankBatcher(
+            self._score_pairs,
+            max_batch_pairs=int(config.get('max_batch_pairs', 256)),
+            max_wait_ms=float(max_wait_ms if max_wait_ms is not None else config.get('max_wait_ms', 5))
+        )
+
     def _initialize_reranker(self):
         """初始化重排序模型"""
         try:
@@ -30,158 +149,346 @@ class RerankerService:
             os.environ['TRANSFORMERS_OFFLINE'] = '1'
             os.environ['HF_HUB_OFFLINE'] = '1'
             os.environ['HF_DATASETS_OFFLINE'] = '1'
-            
+
             logger.info(f"正在加载重排序模型: {self.model_name}")
-            
+
             # 尝试使用FlagEmbedding
             try:
                 from FlagEmbedding import FlagReranker
                 self.reranker = FlagReranker(
-                    self.model_name, 
+                    self.model_name,
                     use_fp16=self.use_fp16,
                     device=self.device
                 )
                 logger.info(f"✅ FlagReranker加载成功: {self.model_name}")
-                
+
             except ImportError:
                 logger.warning("FlagEmbedding不可用，尝试使用sentence-transformers")
                 # 回退到sentence-transformers
                 from sentence_transformers import CrossEncoder
                 self.reranker = CrossEncoder(
                     'cross-encoder/ms-marco-MiniLM-L-12-v2',
-                    device=self.device
+                    device=self.device,
+                    max_length=self.max_length
                 )
                 logger.info("✅ CrossEncoder加载成功")
-                
+
             except Exception as e:
                 logger.error(f"重排序模型加载失败: {e}")
                 self.reranker = None
-                
+
         except Exception as e:
             logger.error(f"重排序服务初始化失败: {e}")
             self.reranker = None
-    
+
+    def _score_pairs(self, pairs: List[Tuple[str, str]]) -> List[float]:
+        """
+        推理一组 (查询, 文档) 对：按长度排序后切成 batch_size 的桶，
+        同一桶内长度相近，padding 最少；结果按原顺序返回
+        """
+        # 按 token 上限的约 2 倍字符数预截断，减少分词开销（模型内部仍按 max_length 截断）
+        max_chars = self.max_length * 2
+        pairs = [[query[:max_chars], text[:max_chars]] for query, text in pairs]
+        order = sorted(range(len(pairs)), key=lambda i: len(pairs[i][0]) + len(pairs[i][1]))
+        scores: List[float] = [0.0] * len(pairs)
+        infer_start = time.perf_counter()
+        for start in range(0, len(order), self.batch_size):
+            bucket = order[start:start + self.batch_size]
+            bucket_pairs = [pairs[i] for i in bucket]
+            if hasattr(self.reranker, 'compute_score'):
+                # FlagReranker
+                bucket_scores = self.reranker.compute_score(
+                    bucket_pairs, batch_size=len(bucket_pairs), max_length=self.max_length
+                )
+            else:
+                # CrossEncoder
+                bucket_scores = self.reranker.predict(bucket_pairs, batch_size=len(bucket_pairs))
+            if isinstance(bucket_scores, np.ndarray):
+                bucket_scores = bucket_scores.tolist()
+            elif not isinstance(bucket_scores, list):
+                bucket_scores = [bucket_scores]  # 单个文档对时返回标量
+            for i, score in zip(bucket, bucket_scores):
+                scores[i] = float(score)
+        if pairs:
+            per_pair = (time.perf_counter() - infer_start) * 1000 / len(pairs)
+            self.ms_per_pair = per_pair if self.ms_per_pair is None else 0.8 * self.ms_per_pair + 0.2 * per_pair
+        return scores
+
+    def score_many(
+        self,
+        requests: List[Tuple[str, List[Tuple[Optional[str], str]]]],
+        timeout: Optional[float] = None
+    ) -> List[List[float]]:
+        """
+        为多个查询的候选打分，未命中缓存的文档对合并为一次推理
+
+        Args:
+            requests: [(查询, [(节点ID或None, 文档内容)])]，无节点ID时按内容哈希缓存
+            timeout: 等待推理的最长秒数，超时抛出 concurrent.futures.TimeoutError
+                （推理仍在后台完成并写入缓存）
+
+        Returns:
+            与 requests 对应的分数列表
+        """
+        results: List[List[Optional[float]]] = []
+        missing: List[Tuple[int, int, Tuple[str, str], Tuple[str, str]]] = []
+        with self._cache_lock:
+            for qi, (query, items) in enumerate(requests):
+                query_hash = _hash_text(query)
+                row: List[Optional[float]] = []
+                for di, (node_id, text) in enumerate(items):
+                    key = (query_hash, node_id or _hash_text(text))
+                    score = self._cache.get(key)
+                    if score is None:
+                        missing.append((qi, di, key, (query, text)))
+                    else:
+                        self._cache.move_to_end(key)
+                    row.append(score)
+                results.append(row)
+            self.cache_hits += sum(len(row) for row in results) - len(missing)
+            self.cache_misses += len(missing)
+
+        if missing:
+            future = self._batcher.submit([pair for _, _, _, pair in missing])
+            keys = [key for _, _, key, _ in missing]
+            future.add_done_callback(lambda f: self._fill_cache(keys, f))
+            scores = future.result(timeout=timeout)
+            for (qi, di, _, _), score in zip(missing, scores):
+                results[qi][di] = score
+        return results  # type: ignore[return-value]
+
+    def _fill_cache(self, keys: List[Tuple[str, str]], future: Future):
+        """推理完成后写入缓存（超时放弃等待的请求也会写入，供下次命中）"""
+        if self.cache_size <= 0 or future.cancelled() or future.exception() is not None:
+            return
+        with self._cache_lock:
+            for key, score in zip(keys, future.result()):
+                self._cache[key] = score
+                self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _is_cached(self, query_hash: str, node_id: Optional[str], text: str) -> bool:
+        with self._cache_lock:
+            return (query_hash, node_id or _hash_text(text)) in self._cache
+
+    def score(self, query: str, items: List[Tuple[Optional[str], str]], timeout: Optional[float] = None) -> List[float]:
+        """为单个查询的候选打分（见 score_many）"""
+        return self.score_many([(query, items)], timeout=timeout)[0]
+
+    @staticmethod
+    def _document_items(documents: List[Dict[str, Any]]) -> List[Tuple[Optional[str], str]]:
+        return [
+            (doc.get('node_id') or doc.get('doc_id'), doc.get('content', ''))
+            for doc in documents
+        ]
+
+    @staticmethod
+    def _apply_scores(documents: List[Dict[str, Any]], scores: List[float], top_k: int) -> List[Dict[str, Any]]:
+        for i, doc in enumerate(documents):
+            doc['rerank_score'] = float(scores[i])
+            doc['original_rank'] = i + 1
+        return sorted(documents, key=lambda x: x['rerank_score'], reverse=True)[:top_k]
+
     def rerank(self, query: str, documents: List[Dict[str, Any]], top_k: int = 5) -> List[Dict[str, Any]]:
         """
         重排序文档
-        
+
         Args:
             query: 查询文本
             documents: 待排序的文档列表
             top_k: 返回的文档数量
-            
+
         Returns:
             重排序后的文档列表
         """
         if not self.reranker or not documents:
             logger.warning("重排序模型不可用或文档为空，返回原始排序")
             return documents[:top_k]
-        
+
         try:
-            # 准备重排序数据
-            pairs = []
-            for doc in documents:
-                content = doc.get('content', '')
-                pairs.append([query, content])
-            
-            # 执行重排序
-            if hasattr(self.reranker, 'compute_score'):
-                # FlagReranker
-                scores = self.reranker.compute_score(pairs)
-                if isinstance(scores, np.ndarray):
-                    scores = scores.tolist()
-            else:
-                # CrossEncoder
-                scores = self.reranker.predict(pairs)
-                if isinstance(scores, np.ndarray):
-                    scores = scores.tolist()
-            
-            # 更新文档分数
-            for i, doc in enumerate(documents):
-                doc['rerank_score'] = float(scores[i])
-                doc['original_rank'] = i + 1
-            
-            # 按重排序分数排序
-            reranked_docs = sorted(documents, key=lambda x: x['rerank_score'], reverse=True)
-            
+            scores = self.score(query, self._document_items(documents))
+            reranked_docs = self._apply_scores(documents, scores, top_k)
             logger.info(f"重排序完成: {len(documents)} -> {len(reranked_docs)} 个文档")
-            return reranked_docs[:top_k]
-            
+            return reranked_docs
+
         except Exception as e:
             logger.error(f"重排序失败: {e}")
             return documents[:top_k]
-    
+
+    def rerank_with_budget(
+        self,
+        query: str,
+        documents: List[Dict[str, Any]],
+        top_k: int = 5,
+        budget_ms: float = 150.0
+    ) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """
+        在时间预算内重排序：按历史单对耗时估算预算内能推理的候选数，
+        从原排序（向量/融合顺序）的前部开始重排序，其余候选保持原顺序排在其后；
+        推理超出预算时放弃等待，整体回退为原顺序
+
+        Returns:
+            (排序后的 top_k 文档, 统计信息 {applied, candidates, reranked, time_ms, budget_ms, timed_out})
+        """
+        start = time.perf_counter()
+        info: Dict[str, Any] = {
+            "applied": False,
+            "candidates": len(documents),
+            "reranked": 0,
+            "budget_ms": budget_ms,
+            "timed_out": False
+        }
+
+        def _finish(docs: List[Dict[str, Any]]):
+            info["time_ms"] = round((time.perf_counter() - start) * 1000, 2)
+            return docs[:top_k], info
+
+        if not self.reranker or not documents or budget_ms <= 0:
+            return _finish(documents)
+
+        # 已缓存的候选不耗推理时间；首次调用没有耗时统计时只重排序 top_k 个
+        items = self._document_items(documents)
+        query_hash = _hash_text(query)
+        affordable = int(budget_ms * 0.8 / self.ms_per_pair) if self.ms_per_pair else top_k
+        count = 0
+        for node_id, text in items:
+            if not self._is_cached(query_hash, node_id, text):
+                if affordable <= 0:
+                    break
+                affordable -= 1
+            count += 1
+        if count == 0:
+            return _finish(documents)
+
+        remaining_s = max(0.0, budget_ms / 1000 - (time.perf_counter() - start))
+        try:
+            scores = self.score(query, items[:count], timeout=remaining_s)
+        except FutureTimeoutError:
+            info["timed_out"] = True
+            logger.info(f"重排序超出预算 {budget_ms}ms，回退为原顺序（候选={count}）")
+            return _finish(documents)
+        except Exception as e:
+            logger.error(f"预算内重排序失败，回退为原顺序: {e}")
+            return _finish(documents)
+
+        reranked = self._apply_scores(documents[:count], scores, count)
+        info["applied"] = True
+        info["reranked"] = count
+        return _finish(reranked + documents[count:])
+
     def batch_rerank(self, queries: List[str], documents_list: List[List[Dict[str, Any]]], top_k: int = 5) -> List[List[Dict[str, Any]]]:
         """
-        批量重排序
-        
+        批量重排序（所有查询的文档对合并为一次推理）
+
         Args:
             queries: 查询列表
             documents_list: 每个查询对应的文档列表
             top_k: 每个查询返回的文档数量
-            
+
         Returns:
             重排序后的文档列表
         """
         if not self.reranker:
             logger.warning("重排序模型不可用，返回原始排序")
             return [docs[:top_k] for docs in documents_list]
-        
+
         try:
-            results = []
-            for query, documents in zip(queries, documents_list):
-                reranked = self.rerank(query, documents, top_k)
-                results.append(reranked)
-            
+            all_scores = self.score_many([
+                (query, self._document_items(documents))
+                for query, documents in zip(queries, documents_list)
+            ])
+            results = [
+                self._apply_scores(documents, scores, top_k)
+                for documents, scores in zip(documents_list, all_scores)
+            ]
             logger.info(f"批量重排序完成: {len(queries)} 个查询")
             return results
-            
+
         except Exception as e:
             logger.error(f"批量重排序失败: {e}")
             return [docs[:top_k] for docs in documents_list]
-    
+
     def get_rerank_score(self, query: str, document: str) -> float:
         """
         获取单个文档的重排序分数
-        
+
         Args:
             query: 查询文本
             document: 文档内容
-            
+
         Returns:
             重排序分数
         """
         if not self.reranker:
             return 0.0
-        
+
         try:
-            if hasattr(self.reranker, 'compute_score'):
-                # FlagReranker
-                score = self.reranker.compute_score([[query, document]])
-                if isinstance(score, np.ndarray):
-                    score = score[0]
-                return float(score)
-            else:
-                # CrossEncoder
-                score = self.reranker.predict([[query, document]])
-                if isinstance(score, np.ndarray):
-                    score = score[0]
-                return float(score)
-                
+            return self.score(query, [(None, document)])[0]
         except Exception as e:
             logger.error(f"获取重排序分数失败: {e}")
             return 0.0
-    
+
     def is_available(self) -> bool:
         """检查重排序服务是否可用"""
         return self.reranker is not None
-    
+
     def get_model_info(self) -> Dict[str, Any]:
         """获取模型信息"""
+        lookups = self.cache_hits + self.cache_misses
         return {
             "model_name": self.model_name,
             "device": self.device,
             "use_fp16": self.use_fp16,
             "available": self.is_available(),
-            "model_type": "FlagReranker" if hasattr(self.reranker, 'compute_score') else "CrossEncoder" if self.reranker else "None"
+            "model_type": "FlagReranker" if hasattr(self.reranker, 'compute_score') else "CrossEncoder" if self.reranker else "None",
+            "batch_size": self.batch_size,
+            "max_length": self.max_length,
+            "cache_entries": len(self._cache),
+            "cache_hit_rate": round(self.cache_hits / lookups, 4) if lookups else 0.0,
+            "batches": self._batcher.total_batches,
+            "batched_requests": self._batcher.total_requests,
+            "max_observed_pairs": self._batcher.max_observed_pairs,
+            "ms_per_pair": round(self.ms_per_pair, 3) if self.ms_per_pair else None
         }
+
+
+# 全局共享实例
+_service_instance: Optional[RerankerService] = None
+_service_lock = threading.Lock()
+_service_loading = False
+
+
+def get_reranker_service() -> RerankerService:
+    """获取进程内共享的重排序服务（模型只加载一次）"""
+    global _service_instance
+    if _service_instance is None:
+        with _service_lock:
+            if _service_instance is None:
+                _service_instance = RerankerService()
+    return _service_instance
+
+
+def get_reranker_service_if_ready() -> Optional[RerankerService]:
+    """
+    已加载时返回共享实例；否则在后台线程开始加载并返回 None，
+    供延迟敏感的对话路径使用（首次请求不等待模型加载）
+    """
+    global _service_loading
+    if _service_instance is not None:
+        return _service_instance
+    with _service_lock:
+        if _service_instance is None and not _service_loading:
+            _service_loading = True
+            threading.Thread(target=_load_service_in_background, name="reranker-loader", daemon=True).start()
+    return None
+
+
+def _load_service_in_background():
+    global _service_loading
+    try:
+        get_reranker_service()
+    except Exception as e:
+        logger.error(f"重排序服务后台加载失败: {e}")
+    finally:
+        _service_loading = False
@@ -0,0 +1,318 @@
+"""
+检索器缓存 - 按内存预算淘汰空闲工作区的 LRU
+工作区检索器首次使用时加载索引，内存估算超出预算（或工作区数超出上限）时，
+按最近最少使用顺序淘汰空闲、未固定且未被租用的工作区；淘汰前落盘待提交变更，下次使用时重新加载。
+长时间运行的工作流通过 lease() 租用检索器，租约释放前不会被淘汰关闭。
+预算检查、落盘与关闭在后台线程执行，不阻塞调用方（事件循环）。
+嵌入模型由 embedding_registry 进程级共享，不随工作区淘汰
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class _Entry:
+    __slots__ = ("value", "last_used", "resident_bytes", "leases")
+
+    def __init__(self, value: Any):
+        self.value = value
+        self.last_used = time.time()
+        self.resident_bytes = 0
+        self.leases = 0  # 进行中的租约数，大于 0 时不淘汰
+
+
+class RetrieverLRUCache:
+    """
+    内存预算 LRU（兼容原 dict 缓存的读取接口：get / items / in / len）
+
+    缓存值需提供:
+        estimate_memory_bytes() -> int   常驻内存估算
+        is_idle(min_idle_s) -> bool      没有进行中的读写且空闲超过 min_idle_s
+        shutdown()                       落盘并停止后台任务
+
+    shared_memory 返回引用已缓存工作区的共享结构（如跨工作区堆叠矩阵）的内存，一并计入预算；
+    这些结构随工作区淘汰（on_evict）释放
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[str], Any],
+        max_memory_bytes: int = 4 * 1024 ** 3,
+        max_entries: int = 256,
+        min_idle_s: float = 120.0,
+        pinned: Iterable[str] = ("global",),
+        check_every: int = 64,
+        on_evict: Optional[Callable[[str], None]] = None,
+        shared_memory: Optional[Callable[[], int]] = None,
+        background: bool = True
+    ):
+        self.factory = factory
+        self.max_memory_bytes = int(max_memory_bytes)
+        self.max_entries = max(1, int(max_entries))
+        self.min_idle_s = float(min_idle_s)
+        self.pinned = set(pinned)
+        self.check_every = max(1, int(check_every))
+        self.on_evict = on_evict
+        self.shared_memory = shared_memory
+        self.background = background
+
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()  # 保护 LRU 顺序与统计
+        self._load_lock = threading.Lock()  # 加载新工作区（加载耗时较长，与命中路径分开）
+        self._closing: Dict[str, threading.Event] = {}
+
+        # 后台预算检查：get_or_load 只登记请求，由工作线程执行 enforce_budget
+        self._budget_cond = threading.Condition(threading.Lock())
+        self._budget_requested = False
+        self._budget_protect: Optional[str] = None
+        self._budget_requested_at = 0.0
+        self._budget_worker: Optional[threading.Thread] = None
+        self._running = True
+
+        # 统计
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # ---- dict 兼容接口 ----
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """读取已加载的值（不触发加载、不计入命中统计）"""
+        entry = self._entries.get(key)
+        return entry.value if entry is not None else default
+
+    def items(self) -> List[Tuple[str, Any]]:
+        with self._lock:
+            return [(key, entry.value) for key, entry in self._entries.items()]
+
+    # ---- 获取 / 加载 ----
+
+    def get_or_load(self, key: str) -> Any:
+        """命中时更新 LRU 顺序；未命中时加载，并按预算淘汰空闲工作区"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.last_used = time.time()
+                self._entries.move_to_end(key)
+                self.hits += 1
+                check = self.hits % self.check_every == 0
+        if entry is not None:
+            if check:
+                self.request_budget_check()
+            return entry.value
+
+        with self._load_lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                # 同一工作区正在淘汰落盘时，等落盘完成再加载，避免两个实例同时写入
+                closing = self._closing.get(key)
+                if closing is not None:
+                    closing.wait()
+                logger.info(f"加载工作区检索器: {key}")
+                entry = _Entry(self.factory(key))
+                entry.resident_bytes = self._measure(key, entry.value)
+                with self._lock:
+                    self._entries[key] = entry
+                    self.misses += 1
+            else:
+                with self._lock:
+                    entry.last_used = time.time()
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+        self.request_budget_check(protect=key)
+        return entry.value
+
+    @contextmanager
+    def lease(self, key: str, value: Any = None) -> Iterator[Any]:
+        """
+        租用检索器：租约有效期间该工作区不会被淘汰（shutdown），释放后按正常 LRU 规则处理
+
+        Args:
+            value: 调用方已持有的实例；为 None 时获取（必要时加载）。该实例已被淘汰时不再租用，原样返回
+        """
+        entry = None
+        while True:
+            current = self.get_or_load(key) if value is None else value
+            with self._lock:
+                candidate = self._entries.get(key)
+                if candidate is not None and candidate.value is current:
+                    candidate.leases += 1
+                    entry = candidate
+                    break
+            if value is not None:
+                break
+            # 获取与登记之间被淘汰，重新加载
+        try:
+            yield current
+        finally:
+            if entry is not None:
+                with self._lock:
+                    entry.leases -= 1
+                    entry.last_used = time.time()
+
+    # ---- 后台预算检查 ----
+
+    def request_budget_check(self, protect: Optional[str] = None):
+        """请求后台线程执行一次预算检查（不等待）；protect 为本次刚使用、不应被淘汰的工作区"""
+        if not self.background:
+            self.enforce_budget(protect=() if protect is None else (protect,))
+            return
+        with self._budget_cond:
+            if not self._running:
+                return
+            self._budget_requested = True
+            self._budget_requested_at = time.time()
+            if protect is not None:
+                # 合并的多次请求只保护最近加载的工作区，较早加载的由 min_idle_s 保护
+                self._budget_protect = protect
+            if self._budget_worker is None:
+                self._budget_worker = threading.Thread(
+                    target=self._budget_loop, name="retriever-cache-evictor", daemon=True
+                )
+                self._budget_worker.start()
+            self._budget_cond.notify_all()
+
+    def _budget_loop(self):
+        while True:
+            with self._budget_cond:
+                while self._running and not self._budget_requested:
+                    self._budget_cond.wait()
+                if not self._running:
+                    return
+                protect = self._budget_protect
+                self._budget_requested = False
+                self._budget_protect = None
+                requested_at = self._budget_requested_at
+            try:
+                # 请求之后才使用（加载）的工作区留给下一次检查，避免按过期的请求淘汰刚加载的实例
+                self.enforce_budget(protect=() if protect is None else (protect,), used_before=requested_at)
+            except Exception as e:
+                logger.error(f"检索器缓存预算检查失败: {e}")
+
+    def close(self):
+        """停止后台预算检查线程（进程退出前调用；已加载的检索器由调用方落盘）"""
+        with self._budget_cond:
+            self._running = False
+            worker = self._budget_worker
+            self._budget_cond.notify_all()
+        if worker is not None:
+            worker.join(timeout=30)
+
+    # ---- 淘汰 ----
+
+    @staticmethod
+    def _measure(key: str, value: Any) -> int:
+        try:
+            return int(value.estimate_memory_bytes())
+        except Exception as e:
+            logger.warning(f"估算工作区内存失败: {key}, {e}")
+            return 0
+
+    def _shared_bytes(self) -> int:
+        if self.shared_memory is None:
+            return 0
+        try:
+            return int(self.shared_memory())
+        except Exception as e:
+            logger.warning(f"估算共享结构内存失败: {e}")
+            return 0
+
+    def enforce_budget(self, protect: Iterable[str] = (), used_before: Optional[float] = None) -> List[str]:
+        """
+        重新估算各工作区内存，超出预算时按 LRU 顺序淘汰空闲工作区，返回被淘汰的工作区
+        （同步执行，含被淘汰工作区的落盘；正常路径由后台线程调用）
+        """
+        protect = {protect} if isinstance(protect, str) else set(protect)
+        for key, value in self.items():
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.resident_bytes = self._measure(key, value)
+        # 共享结构在淘汰引用它的工作区后才释放，这里按淘汰前的占用计（偏保守）
+        shared = self._shared_bytes()
+
+        evicted: List[Tuple[str, Any]] = []
+        now = time.time()
+        with self._lock:
+            total = shared + sum(entry.resident_bytes for entry in self._entries.values())
+            count = len(self._entries)
+            for key in list(self._entries.keys()):
+                if total <= self.max_memory_bytes and count <= self.max_entries:
+                    break
+                entry = self._entries[key]
+                if key in protect or key in self.pinned or entry.leases > 0 or now - entry.last_used < self.min_idle_s \
+                        or (used_before is not None and entry.last_used >= used_before) \
+                        or not self._is_idle(entry.value):
+                    continue
+                del self._entries[key]
+                self._closing[key] = threading.Event()
+                total -= entry.resident_bytes
+                count -= 1
+                self.evictions += 1
+                evicted.append((key, entry.value))
+            over_budget = total > self.max_memory_bytes or count > self.max_entries
+
+        if over_budget and not evicted:
+            logger.warning(
+                f"检索器缓存超出预算但没有可淘汰的空闲工作区: "
+                f"{total / 1024 ** 2:.0f}MB / {self.max_memory_bytes / 1024 ** 2:.0f}MB, 工作区={count}"
+            )
+        for key, value in evicted:
+            self._close(key, value)
+        return [key for key, _ in evicted]
+
+    def _is_idle(self, value: Any) -> bool:
+        try:
+            return bool(value.is_idle(self.min_idle_s))
+        except Exception:
+            return False
+
+    def _close(self, key: str, value: Any):
+        try:
+            value.shutdown()
+            if self.on_evict is not None:
+                self.on_evict(key)
+            logger.info(f"已淘汰空闲工作区检索器: {key}")
+        except Exception as e:
+            logger.error(f"淘汰工作区检索器时落盘失败: {key}, {e}")
+        finally:
+            self._closing.pop(key).set()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """命中/未命中/淘汰计数与各工作区常驻内存估算（最近一次预算检查时的值，不触发检查）"""
+        shared = self._shared_bytes()
+        now = time.time()
+        with self._lock:
+            workspaces = {
+                key: {
+                    "resident_bytes": entry.resident_bytes,
+                    "idle_s": round(now - entry.last_used, 1),
+                    "leases": entry.leases,
+                    "pinned": key in self.pinned
+                }
+                for key, entry in self._entries.items()
+            }
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(workspaces),
+                "resident_bytes": sum(item["resident_bytes"] for item in workspaces.values()),
+                "shared_bytes": shared,
+                "max_memory_bytes": self.max_memory_bytes,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "workspaces": workspaces
+            }
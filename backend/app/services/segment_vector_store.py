@@ -0,0 +1,703 @@
+"""
+分段向量存储 - LlamaIndex 索引的二进制持久化格式
+向量按段追加写入 float32 文件并通过 mmap 读取，节点与元数据保存在 SQLite 中，
+每次写入只追加新段、只提交增量行，加载时不再解析数百 MB 的 JSON
+"""
+
+import itertools
+import json
+import logging
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows：无 flock，不做跨进程的孤立段清理
+    fcntl = None
+
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import BaseNode
+from llama_index.core.storage.docstore.utils import doc_to_json, json_to_doc
+from llama_index.core.vector_stores.types import (
+    BasePydanticVectorStore,
+    MetadataFilters,
+    VectorStoreQuery,
+    VectorStoreQueryMode,
+    VectorStoreQueryResult,
+)
+from llama_index.core.vector_stores.simple import _build_metadata_filter_fn
+
+from app.services.ann_index import normalize_rows
+
+logger = logging.getLogger(__name__)
+
+NODES_DB_NAME = "nodes.sqlite"
+LOCK_FILE_NAME = "store.lock"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS segments (id INTEGER PRIMARY KEY, rows INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS nodes (
+    node_id TEXT PRIMARY KEY,
+    segment INTEGER NOT NULL,
+    row INTEGER NOT NULL,
+    ref_doc_id TEXT,
+    metadata TEXT,
+    node TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_nodes_ref_doc ON nodes(ref_doc_id);
+"""
+
+# 过滤检索时每次从 SQLite 读取元数据的候选数
+_FILTER_SCAN_CHUNK = 256
+
+# 每个节点在位置表/ID 列表中的常驻字节估算（字符串 ID + 字典条目）
+_NODE_OVERHEAD_BYTES = 160
+
+# 进程内存储实例编号（目录被删除重建后，新实例的段ID会从 1 重新开始）
+_instance_ids = itertools.count(1)
+
+
+class _Segment:
+    """一个向量段：mmap 向量矩阵 + 行号到节点ID的映射 + 存活标记"""
+
+    def __init__(self, seg_id: int, path: Path, rows: int, dimension: int):
+        self.id = seg_id
+        self.path = path
+        self.rows = rows
+        self.vectors = np.memmap(path, dtype=np.float32, mode='r', shape=(rows, dimension)) if rows else None
+        self.node_ids: List[Optional[str]] = [None] * rows
+        self.alive = np.zeros(rows, dtype=bool)
+        self._norms: Optional[np.ndarray] = None
+
+    @property
+    def norms(self) -> np.ndarray:
+        """向量范数（首次检索时计算并缓存）"""
+        if self._norms is None:
+            norms = np.linalg.norm(self.vectors, axis=1)
+            norms[norms == 0] = 1.0
+            self._norms = norms
+        return self._norms
+
+
+class SegmentVectorStore(BasePydanticVectorStore):
+    """
+    追加写入的分段向量存储（stores_text=True，节点不再进入 docstore.json）
+
+    目录结构:
+        nodes.sqlite      节点 JSON、元数据、(段, 行) 位置，写入即提交
+        seg-000001.f32    第 1 段向量（行优先 float32），写入后只读
+        store.lock        打开期间持有共享 flock；只有独占成功（无其他打开者）时才清理孤立段文件
+
+    SQLite 连接在线程间共享，所有语句都在 self._lock 内执行
+    """
+
+    stores_text: bool = True
+    persist_dir: str
+
+    _conn: Any = PrivateAttr()
+    _lock: Any = PrivateAttr()
+    _lock_file: Any = PrivateAttr(default=None)
+    _dimension: Optional[int] = PrivateAttr(default=None)
+    _segments: Dict[int, _Segment] = PrivateAttr(default_factory=dict)
+    _locations: Dict[str, Tuple[int, int]] = PrivateAttr(default_factory=dict)
+    _next_segment_id: int = PrivateAttr(default=1)
+    _instance_id: int = PrivateAttr(default=0)
+    _ann: Any = PrivateAttr(default=None)
+    _ann_rebuild_ratio: float = PrivateAttr(default=0.1)
+
+    def __init__(self, persist_dir: str, **kwargs: Any):
+        super().__init__(persist_dir=str(persist_dir), **kwargs)
+        Path(self.persist_dir).mkdir(parents=True, exist_ok=True)
+        self._lock = threading.RLock()
+        self._lock_file = self._acquire_file_lock()
+        self._conn = sqlite3.connect(
+            str(Path(self.persist_dir) / NODES_DB_NAME),
+            check_same_thread=False
+        )
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+        self._segments = {}
+        self._locations = {}
+        self._instance_id = next(_instance_ids)
+        self._load()
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "SegmentVectorStore"
+
+    @staticmethod
+    def exists(persist_dir: Any) -> bool:
+        """目录下是否已有分段存储"""
+        return (Path(persist_dir) / NODES_DB_NAME).exists()
+
+    @property
+    def client(self) -> Any:
+        return self._conn
+
+    def _acquire_file_lock(self):
+        """持有目录的共享 flock 直到 close()，让其他打开者知道存储正在使用"""
+        if fcntl is None:
+            return None
+        lock_file = open(Path(self.persist_dir) / LOCK_FILE_NAME, 'a+')
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_SH)
+        return lock_file
+
+    def _fetchall(self, sql: str, params: Any = ()) -> List[Tuple]:
+        """在锁内执行只读语句（共享连接不能被多个线程同时使用）"""
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def close(self):
+        """关闭 SQLite 连接并释放目录锁（之后不可再使用）"""
+        with self._lock:
+            self._conn.close()
+            if self._lock_file is not None:
+                self._lock_file.close()
+                self._lock_file = None
+
+    def _segment_path(self, seg_id: int) -> Path:
+        return Path(self.persist_dir) / f"seg-{seg_id:06d}.f32"
+
+    def _load(self):
+        """加载段目录与节点位置（只读取 ID 与行号，不解析节点 JSON）"""
+        rows = self._fetchall("SELECT value FROM meta WHERE key='dimension'")
+        self._dimension = int(rows[0][0]) if rows else None
+
+        registered = set()
+        for seg_id, rows in self._fetchall("SELECT id, rows FROM segments ORDER BY id"):
+            path = self._segment_path(seg_id)
+            expected = rows * (self._dimension or 0) * 4
+            if not path.exists() or path.stat().st_size < expected:
+                logger.error(f"向量段缺失或不完整，丢弃该段节点: {path}")
+                with self._lock, self._conn:
+                    self._conn.execute("DELETE FROM nodes WHERE segment=?", (seg_id,))
+                    self._conn.execute("DELETE FROM segments WHERE id=?", (seg_id,))
+                continue
+            self._segments[seg_id] = _Segment(seg_id, path, rows, self._dimension or 0)
+            registered.add(path.name)
+
+        rows = self._fetchall("SELECT value FROM meta WHERE key='next_segment_id'")
+        self._next_segment_id = max(int(rows[0][0]) if rows else 1, max(self._segments.keys(), default=0) + 1)
+
+        for node_id, seg_id, row in self._fetchall("SELECT node_id, segment, row FROM nodes"):
+            segment = self._segments.get(seg_id)
+            if segment is None or row >= segment.rows:
+                continue
+            segment.node_ids[row] = node_id
+            segment.alive[row] = True
+            self._locations[node_id] = (seg_id, row)
+
+        self._remove_orphan_segments(registered)
+        logger.info(f"分段向量存储已加载: {self.persist_dir}，段={len(self._segments)}，节点={len(self._locations)}")
+
+    def _remove_orphan_segments(self, registered: set):
+        """
+        清理写入向量后、提交 SQLite 前崩溃留下的孤立段文件。
+        其他打开者（本进程或其他进程）可能正处于"段文件已写、尚未登记"的中间状态，
+        因此只有拿到目录独占锁时才清理，否则跳过留待下次加载
+        """
+        orphans = [path for path in Path(self.persist_dir).glob("seg-*.f32") if path.name not in registered]
+        if not orphans:
+            return
+        if self._lock_file is None:
+            logger.info(f"无法获取目录独占锁，跳过孤立向量段清理: {len(orphans)} 个")
+            return
+        try:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            logger.info(f"存储正被其他实例使用，跳过孤立向量段清理: {len(orphans)} 个")
+            return
+        try:
+            # 获得独占锁前其他实例可能已登记新段，按当前 SQLite 重新判断
+            registered = {self._segment_path(seg_id).name for (seg_id,) in self._fetchall("SELECT id FROM segments")}
+            for path in orphans:
+                if path.name not in registered:
+                    logger.warning(f"清理未提交的向量段: {path}")
+                    path.unlink(missing_ok=True)
+        finally:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_SH)
+
+    # ---- 写入 ----
+
+    def _allocate_segment_id(self) -> int:
+        """
+        分配新段ID（需持有 self._lock）。ID 单调递增且先于段文件落盘提交，清空并合并后也不会复用，
+        ANN 快照与跨工作区堆叠按段ID判断覆盖范围，复用ID会让新写入的向量被当作已建索引而漏检
+        """
+        seg_id = self._next_segment_id
+        self._next_segment_id = seg_id + 1
+        with self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('next_segment_id', ?)", (str(self._next_segment_id),)
+            )
+        return seg_id
+
+    def add(self, nodes: List[BaseNode], **add_kwargs: Any) -> List[str]:
+        """追加一个新段：先写向量并落盘，再在一个事务内登记段与节点"""
+        if not nodes:
+            return []
+        vectors = np.asarray([node.get_embedding() for node in nodes], dtype=np.float32)
+        if vectors.ndim != 2:
+            raise ValueError("节点向量维度不一致，无法写入分段存储")
+
+        with self._lock:
+            if self._dimension is None:
+                self._dimension = int(vectors.shape[1])
+                with self._conn:
+                    self._conn.execute("INSERT OR REPLACE INTO meta VALUES ('dimension', ?)", (str(self._dimension),))
+            elif vectors.shape[1] != self._dimension:
+                raise ValueError(f"向量维度不匹配: 存储为 {self._dimension}，写入为 {vectors.shape[1]}")
+
+            seg_id = self._allocate_segment_id()
+            path = self._segment_path(seg_id)
+            with open(path, 'wb') as f:
+                f.write(np.ascontiguousarray(vectors).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+
+            rows = []
+            for row, node in enumerate(nodes):
+                stored = node.copy()
+                stored.embedding = None
+                rows.append((
+                    node.node_id, seg_id, row, node.ref_doc_id,
+                    json.dumps(node.metadata or {}, ensure_ascii=False, default=str),
+                    json.dumps(doc_to_json(stored), ensure_ascii=False)
+                ))
+            with self._conn:
+                self._conn.execute("INSERT INTO segments VALUES (?, ?)", (seg_id, len(nodes)))
+                self._conn.executemany("INSERT OR REPLACE INTO nodes VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+            segment = _Segment(seg_id, path, len(nodes), self._dimension)
+            for row, node in enumerate(nodes):
+                # 同一节点重复写入时，旧位置作废
+                self._mark_dead(node.node_id)
+                segment.node_ids[row] = node.node_id
+                segment.alive[row] = True
+                self._locations[node.node_id] = (seg_id, row)
+            self._segments[seg_id] = segment
+        self._maybe_rebuild_ann()
+        return [node.node_id for node in nodes]
+
+    def _mark_dead(self, node_id: str) -> bool:
+        location = self._locations.pop(node_id, None)
+        if location is None:
+            return False
+        segment = self._segments.get(location[0])
+        if segment is not None:
+            segment.alive[location[1]] = False
+        return True
+
+    def remove_nodes(self, node_ids: List[str]) -> List[str]:
+        """删除节点并立即提交，返回实际删除的节点ID（O(删除数)）"""
+        with self._lock:
+            removed = [node_id for node_id in node_ids if node_id in self._locations]
+            if not removed:
+                return []
+            with self._conn:
+                self._conn.executemany("DELETE FROM nodes WHERE node_id=?", [(node_id,) for node_id in removed])
+            for node_id in removed:
+                self._mark_dead(node_id)
+        self._maybe_rebuild_ann()
+        return removed
+
+    def delete_nodes(
+        self,
+        node_ids: Optional[List[str]] = None,
+        filters: Optional[MetadataFilters] = None,
+        **delete_kwargs: Any,
+    ) -> None:
+        """删除节点；同时给出 node_ids 与 filters 时只删除两者都满足的节点"""
+        if filters is not None:
+            node_ids = self._match_filters(node_ids, filters)
+        self.remove_nodes(list(node_ids or []))
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        node_ids = [r[0] for r in self._fetchall("SELECT node_id FROM nodes WHERE ref_doc_id=?", (ref_doc_id,))]
+        self.remove_nodes(node_ids)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.remove_nodes(list(self._locations.keys()))
+            self.compact(force=True)
+
+    def persist(self, persist_path: str = "", fs: Any = None) -> None:
+        """写入时已逐次提交，无需额外持久化"""
+
+    # ---- 读取 ----
+
+    def __len__(self) -> int:
+        return len(self._locations)
+
+    def __bool__(self) -> bool:
+        # StorageContext.from_defaults 用 `if vector_store:` 判断是否传入存储，空存储也必须为真
+        return True
+
+    def __contains__(self, node_id: str) -> bool:
+        return node_id in self._locations
+
+    def get_nodes(
+        self,
+        node_ids: Optional[List[str]] = None,
+        filters: Optional[MetadataFilters] = None,
+    ) -> List[BaseNode]:
+        """
+        按ID读取节点（保持传入顺序，不存在的ID跳过）；
+        给出 filters 时只返回元数据满足条件的节点，node_ids 为 None 则在全部节点中筛选
+        """
+        if filters is not None:
+            node_ids = self._match_filters(node_ids, filters)
+        node_ids = list(node_ids or [])
+        found: Dict[str, BaseNode] = {}
+        for start in range(0, len(node_ids), 500):
+            chunk = node_ids[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            for node_id, node_json in self._fetchall(
+                f"SELECT node_id, node FROM nodes WHERE node_id IN ({placeholders})", chunk
+            ):
+                found[node_id] = json_to_doc(json.loads(node_json))
+        return [found[node_id] for node_id in node_ids if node_id in found]
+
+    def get_metadata(self, node_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """按ID读取节点元数据"""
+        result: Dict[str, Dict[str, Any]] = {}
+        for start in range(0, len(node_ids), 500):
+            chunk = node_ids[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            for node_id, metadata in self._fetchall(
+                f"SELECT node_id, metadata FROM nodes WHERE node_id IN ({placeholders})", chunk
+            ):
+                result[node_id] = json.loads(metadata) if metadata else {}
+        return result
+
+    def _match_filters(self, node_ids: Optional[List[str]], filters: MetadataFilters) -> List[str]:
+        """按 SQLite 中的元数据列筛选节点ID（node_ids 为 None 时扫描全部节点）"""
+        if node_ids is None:
+            metadata = dict(self.iter_metadata())
+            node_ids = list(metadata)
+        else:
+            metadata = self.get_metadata(list(node_ids))
+        matches = _build_metadata_filter_fn(lambda node_id: metadata[node_id], filters)
+        return [node_id for node_id in node_ids if node_id in metadata and matches(node_id)]
+
+    def get_vectors(self, node_ids: List[str]) -> Dict[str, np.ndarray]:
+        """按ID读取向量（从 mmap 段中取行，不存在的ID跳过）"""
+        with self._lock:
+            locations = [(node_id, self._locations.get(node_id)) for node_id in node_ids]
+            segments = dict(self._segments)
+        return {
+            node_id: np.asarray(segments[location[0]].vectors[location[1]])
+            for node_id, location in locations
+            if location is not None and location[0] in segments
+        }
+
+    def segment_of(self, node_id: str) -> Optional[int]:
+        """节点当前所在的段（不存在时返回 None）"""
+        location = self._locations.get(node_id)
+        return location[0] if location is not None else None
+
+    def generation(self) -> Tuple[int, int]:
+        """
+        存储版本：(实例编号, 下一个段ID)。每次新增或合并产生新段时变化；
+        删除不改变版本，由调用方按当前位置剔除
+        """
+        with self._lock:
+            return self._instance_id, self._next_segment_id
+
+    def iter_metadata(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """遍历全部 (node_id, metadata)，用于重建元数据索引"""
+        for node_id, metadata in self._fetchall("SELECT node_id, metadata FROM nodes"):
+            yield node_id, (json.loads(metadata) if metadata else {})
+
+    def iter_nodes(self) -> Iterator[Tuple[str, BaseNode]]:
+        """遍历全部 (node_id, node)"""
+        for node_id, node_json in self._fetchall("SELECT node_id, node FROM nodes"):
+            yield node_id, json_to_doc(json.loads(node_json))
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        """
+        计算余弦相似度并合并各段 top-k：
+        ANN 索引已就绪且无过滤条件时，已建索引的段走 ANN，构建后新增的段逐段暴力计算
+        """
+        if query.mode != VectorStoreQueryMode.DEFAULT:
+            raise ValueError(f"分段存储不支持的查询模式: {query.mode}")
+        top_k = query.similarity_top_k
+        # 只在锁内取段列表快照；段文件只读，合并后旧段的 mmap 仍然有效
+        with self._lock:
+            segments = list(self._segments.values())
+        if not segments or query.query_embedding is None:
+            return VectorStoreQueryResult(nodes=[], similarities=[], ids=[])
+
+        q = np.asarray(query.query_embedding, dtype=np.float32)
+        q_norm = float(np.linalg.norm(q)) or 1.0
+        # VectorStoreIndex.as_retriever 会传入 index_struct 中的空 node_ids 列表，视为不限制
+        allowed = self._allowed_rows(query.node_ids) if query.node_ids else None
+
+        all_scores: List[np.ndarray] = []
+        all_ids: List[str] = []
+        snapshot = self._ann.snapshot if self._ann is not None else None
+        if snapshot is not None and allowed is None and query.filters is None:
+            covered = snapshot.covered_segments
+            ann_ids: List[str] = []
+            ann_scores: List[float] = []
+            # 多取一些候选，抵消构建后被删除或移动到新段的节点
+            for node_id, score in snapshot.search(q / q_norm, top_k * self._ann.oversample):
+                location = self._locations.get(node_id)
+                if location is not None and location[0] in covered:
+                    ann_ids.append(node_id)
+                    ann_scores.append(score)
+            if ann_ids:
+                all_scores.append(np.asarray(ann_scores, dtype=np.float32))
+                all_ids.extend(ann_ids)
+            segments = [segment for segment in segments if segment.id not in covered]
+
+        for segment in segments:
+            if allowed is not None:
+                # 预过滤：只计算允许节点所在的行
+                rows = allowed.get(segment.id)
+                if rows is None:
+                    continue
+            else:
+                rows = np.nonzero(segment.alive)[0]
+            if rows.size == 0:
+                continue
+            scores = (segment.vectors[rows] @ q) / (segment.norms[rows] * q_norm)
+            if query.filters is None and rows.size > top_k:
+                # 无过滤时每段只需保留本段 top-k
+                keep = np.argpartition(-scores, top_k - 1)[:top_k]
+                rows, scores = rows[keep], scores[keep]
+            all_scores.append(scores)
+            all_ids.extend(segment.node_ids[r] for r in rows)
+
+        if not all_scores:
+            return VectorStoreQueryResult(nodes=[], similarities=[], ids=[])
+        scores = np.concatenate(all_scores)
+        order = np.argsort(-scores)
+
+        if query.filters is not None:
+            order = self._filter_ranked(order, all_ids, query.filters, top_k)
+        else:
+            order = order[:top_k]
+
+        ids = [all_ids[i] for i in order]
+        similarities = [float(scores[i]) for i in order]
+        nodes_by_id = {node.node_id: node for node in self.get_nodes(ids)}
+        kept = [i for i, node_id in enumerate(ids) if node_id in nodes_by_id]
+        return VectorStoreQueryResult(
+            nodes=[nodes_by_id[ids[i]] for i in kept],
+            similarities=[similarities[i] for i in kept],
+            ids=[ids[i] for i in kept]
+        )
+
+    def _allowed_rows(self, node_ids: List[str]) -> Dict[int, np.ndarray]:
+        """把允许的节点ID集合按位置表转换为各段的行号数组（开销与允许的节点数成正比）"""
+        rows_by_segment: Dict[int, List[int]] = {}
+        with self._lock:
+            for node_id in node_ids:
+                location = self._locations.get(node_id)
+                if location is not None:
+                    rows_by_segment.setdefault(location[0], []).append(location[1])
+        return {
+            seg_id: np.unique(np.asarray(rows, dtype=np.int64))
+            for seg_id, rows in rows_by_segment.items()
+        }
+
+    def _filter_ranked(self, order: np.ndarray, ids: List[str], filters: MetadataFilters, top_k: int) -> List[int]:
+        """按相似度从高到低分块读取元数据并过滤，凑够 top_k 即停止"""
+        selected: List[int] = []
+        for start in range(0, len(order), _FILTER_SCAN_CHUNK):
+            chunk = [int(i) for i in order[start:start + _FILTER_SCAN_CHUNK]]
+            metadata = self.get_metadata([ids[i] for i in chunk])
+            matches = _build_metadata_filter_fn(lambda node_id: metadata.get(node_id, {}), filters)
+            for i in chunk:
+                if matches(ids[i]):
+                    selected.append(i)
+                    if len(selected) >= top_k:
+                        return selected
+        return selected
+
+    # ---- ANN 索引 ----
+
+    def attach_ann_index(self, ann: Any, rebuild_ratio: float = 0.1):
+        """
+        挂载 ANN 索引（见 app.services.ann_index），并在后台构建首个快照
+
+        Args:
+            ann: FaissAnnIndex 实例
+            rebuild_ratio: 未建索引行与快照中已删除行合计超过已建索引节点数的此比例时后台重建
+        """
+        self._ann = ann
+        self._ann_rebuild_ratio = float(rebuild_ratio)
+        self._maybe_rebuild_ann()
+
+    def normalized_snapshot(self) -> Tuple[np.ndarray, List[str], frozenset]:
+        """收集全部存活向量（归一化），返回 (向量, 节点ID, 覆盖的段)，供 ANN 构建与跨工作区堆叠"""
+        with self._lock:
+            segments = list(self._segments.values())
+            parts = [(segment, np.nonzero(segment.alive)[0]) for segment in segments]
+            node_ids = [segment.node_ids[row] for segment, rows in parts for row in rows]
+        matrices = [normalize_rows(segment.vectors[rows]) for segment, rows in parts if rows.size]
+        vectors = np.concatenate(matrices) if matrices else np.zeros((0, self._dimension or 0), dtype=np.float32)
+        return vectors, node_ids, frozenset(segment.id for segment in segments)
+
+    def _maybe_rebuild_ann(self):
+        """
+        快照过期的行足够多时后台重建 ANN 索引：过期行包括未建索引的新增（或合并产生）行，
+        以及快照中已删除的行（它们占用固定的 oversample 候选名额，使 ANN 返回的存活结果少于 top_k）
+        """
+        if self._ann is None:
+            return
+        if not self._locations:
+            # 存储已清空：丢弃旧快照，避免其覆盖的段信息影响之后的写入
+            self._ann.reset()
+            return
+        snapshot = self._ann.snapshot
+        if snapshot is None:
+            self._ann.schedule_rebuild(self.normalized_snapshot)
+            return
+        covered = snapshot.covered_segments
+        with self._lock:
+            uncovered_rows = sum(segment.rows for segment in self._segments.values() if segment.id not in covered)
+            alive_covered = sum(
+                int(np.count_nonzero(segment.alive)) for segment in self._segments.values() if segment.id in covered
+            )
+        dead_rows = max(len(snapshot) - alive_covered, 0)
+        if uncovered_rows + dead_rows > self._ann_rebuild_ratio * max(len(snapshot), 1):
+            self._ann.schedule_rebuild(self.normalized_snapshot)
+
+    # ---- 维护 ----
+
+    def compact(self, max_segments: int = 16, max_dead_ratio: float = 0.3, force: bool = False) -> bool:
+        """
+        段数过多或已删除行占比过高时，把存活向量合并为一个新段
+
+        Returns:
+            是否执行了合并
+        """
+        with self._lock:
+            total_rows = sum(segment.rows for segment in self._segments.values())
+            alive_rows = len(self._locations)
+            dead_ratio = 1 - alive_rows / total_rows if total_rows else 0.0
+            if not force and len(self._segments) <= max_segments and dead_ratio <= max_dead_ratio:
+                return False
+
+            old_segments = list(self._segments.values())
+            live: List[Tuple[str, np.ndarray]] = []
+            for segment in old_segments:
+                for row in np.nonzero(segment.alive)[0]:
+                    live.append((segment.node_ids[row], segment.vectors[row]))
+
+            new_segment: Optional[_Segment] = None
+            seg_id = self._allocate_segment_id() if live else 0
+            if live:
+                path = self._segment_path(seg_id)
+                with open(path, 'wb') as f:
+                    f.write(np.ascontiguousarray(np.stack([v for _, v in live]), dtype=np.float32).tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+                new_segment = _Segment(seg_id, path, len(live), self._dimension or 0)
+
+            with self._conn:
+                if new_segment is not None:
+                    self._conn.execute("INSERT INTO segments VALUES (?, ?)", (seg_id, len(live)))
+                    self._conn.executemany(
+                        "UPDATE nodes SET segment=?, row=? WHERE node_id=?",
+                        [(seg_id, row, node_id) for row, (node_id, _) in enumerate(live)]
+                    )
+                self._conn.executemany("DELETE FROM segments WHERE id=?", [(s.id,) for s in old_segments])
+
+            self._segments = {}
+            self._locations = {}
+            if new_segment is not None:
+                for row, (node_id, _) in enumerate(live):
+                    new_segment.node_ids[row] = node_id
+                    new_segment.alive[row] = True
+                    self._locations[node_id] = (seg_id, row)
+                self._segments[seg_id] = new_segment
+            for segment in old_segments:
+                segment.path.unlink(missing_ok=True)
+            # 旧快照覆盖的段已全部删除，其结果都会被剔除；丢弃后由下面的重建生成新快照
+            if self._ann is not None:
+                self._ann.reset()
+
+        self._maybe_rebuild_ann()
+        logger.info(
+            f"向量段合并完成: {self.persist_dir}，{len(old_segments)} 段 -> {len(self._segments)} 段，"
+            f"存活节点={alive_rows}，清理已删除行占比 {dead_ratio:.0%}"
+        )
+        return True
+
+    def estimate_memory_bytes(self) -> int:
+        """估算常驻内存：位置表、行号映射、存活标记、范数缓存与 ANN 索引（mmap 向量页不计入）"""
+        with self._lock:
+            total_rows = sum(segment.rows for segment in self._segments.values())
+            norm_rows = sum(segment.rows for segment in self._segments.values() if segment._norms is not None)
+            total = len(self._locations) * _NODE_OVERHEAD_BYTES + total_rows * 9 + norm_rows * 4
+        snapshot = self._ann.snapshot if self._ann is not None else None
+        if snapshot is not None:
+            # 向量副本 + 图/倒排结构（按每节点 2*M 个邻接 ID 粗略估算）
+            total += len(snapshot) * ((self._dimension or 0) * 4 + _NODE_OVERHEAD_BYTES // 2)
+            if snapshot.kind.startswith("hnsw"):
+                total += len(snapshot) * getattr(self._ann, 'hnsw_m', 32) * 2 * 4
+        return total
+
+    def get_stats(self) -> Dict[str, Any]:
+        """存储统计"""
+        with self._lock:
+            total_rows = sum(segment.rows for segment in self._segments.values())
+            return {
+                "path": self.persist_dir,
+                "segments": len(self._segments),
+                "nodes": len(self._locations),
+                "dead_rows": total_rows - len(self._locations),
+                "dimension": self._dimension,
+                "vectors_mb": round(total_rows * (self._dimension or 0) * 4 / (1024 * 1024), 2),
+                "ann": self._ann.get_stats() if self._ann is not None else None
+            }
+
+
+def summarize_documents(persist_dir: Any) -> Optional[List[Dict[str, Any]]]:
+    """
+    直接查询 SQLite，按原始文件名聚合文档（供未加载检索器的列表接口使用）
+
+    Returns:
+        文档列表；存储不存在时返回 None
+    """
+    db_path = Path(persist_dir) / NODES_DB_NAME
+    if not db_path.exists():
+        return None
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        rows = conn.execute(
+            """
+            SELECT COALESCE(json_extract(metadata, '$.original_filename'), json_extract(metadata, '$.file_name')) AS fname,
+                   MIN(node_id), COUNT(*),
+                   MAX(json_extract(metadata, '$.file_size')),
+                   MAX(COALESCE(json_extract(metadata, '$.file_type'), json_extract(metadata, '$.mime_type'))),
+                   MAX(COALESCE(json_extract(metadata, '$.upload_time'), json_extract(metadata, '$.creation_date')))
+            FROM nodes
+            WHERE fname IS NOT NULL
+            GROUP BY fname
+            """
+        ).fetchall()
+    finally:
+        conn.close()
+    return [
+        {
+            "id": first_id,
+            "filename": fname,
+            "original_filename": fname,
+            "file_size": file_size or 0,
+            "file_type": file_type or '',
+            "status": "completed",
+            "created_at": created_at or '',
+            "chunk_count": count
+        }
+        for fname, first_id, count, file_size, file_type, created_at in rows
+    ]
@@ -0,0 +1,186 @@
+"""
+跨工作区堆叠向量索引
+把多个分段向量存储的归一化向量按行堆叠为一个矩阵，一次矩阵乘法完成多工作区检索并全局排序，
+检索多个工作区的开销与检索一个同规模工作区相同
+"""
+
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 每个堆叠行在节点ID列表中的常驻字节估算
+_ROW_OVERHEAD_BYTES = 80
+
+
+class _Stack:
+    """一次堆叠的结果：矩阵 + 行号到 (存储序号, 节点ID) 的映射 + 各存储堆叠时的版本与覆盖的段"""
+
+    def __init__(
+        self,
+        matrix: np.ndarray,
+        owners: np.ndarray,
+        node_ids: List[str],
+        generations: List[tuple],
+        covered: List[frozenset]
+    ):
+        self.matrix = matrix
+        self.owners = owners
+        self.node_ids = node_ids
+        self.generations = generations
+        self.covered = covered
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.matrix.nbytes + self.owners.nbytes + len(self.node_ids) * _ROW_OVERHEAD_BYTES)
+
+
+class StackedVectorIndex:
+    """
+    按工作区组合缓存堆叠矩阵
+
+    缓存键为工作区ID序列，命中条件为各存储的版本（SegmentVectorStore.generation）未变化：
+    新增写入或合并会推进版本，存储被重新打开或重建时实例编号不同，均触发重新堆叠；
+    堆叠后删除的节点在检索时按当前位置剔除，与 ANN 快照的处理方式一致。
+    每个堆叠矩阵的总行数不超过 max_nodes（见 partition），缓存占用由 memory_bytes() 计入检索器缓存预算
+    """
+
+    def __init__(self, max_entries: int = 4, oversample: int = 2, max_nodes: int = 200000):
+        self.max_entries = max(1, int(max_entries))
+        self.oversample = max(1, int(oversample))
+        self.max_nodes = max(1, int(max_nodes))
+        self._cache: "OrderedDict[Tuple[str, ...], _Stack]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        # 统计
+        self.total_stacks = 0
+        self.total_searches = 0
+
+    def partition(self, stores: Sequence[Tuple[str, Any]]) -> Tuple[List[Tuple[str, Any]], List[str]]:
+        """
+        按顺序挑选参与堆叠的存储，使合计节点数不超过 max_nodes
+
+        Returns:
+            (参与堆叠的 [(工作区ID, 存储)], 放不下、需单独检索的工作区ID)
+        """
+        stacked, overflow, total = [], [], 0
+        for workspace_id, store in stores:
+            size = len(store)
+            if total + size <= self.max_nodes:
+                stacked.append((workspace_id, store))
+                total += size
+            else:
+                overflow.append(workspace_id)
+        return stacked, overflow
+
+    def _get_stack(self, stores: Sequence[Tuple[str, Any]]) -> Optional[_Stack]:
+        key = tuple(workspace_id for workspace_id, _ in stores)
+        # 先于快照读取版本：堆叠期间发生写入时缓存的是旧版本，下次检索会重新堆叠
+        generations = [store.generation() for _, store in stores]
+        with self._lock:
+            stack = self._cache.get(key)
+            if stack is not None and stack.generations == generations:
+                self._cache.move_to_end(key)
+                return stack
+
+        matrices, owners, node_ids, covered = [], [], [], []
+        for position, (workspace_id, store) in enumerate(stores):
+            vectors, ids, segments = store.normalized_snapshot()
+            covered.append(segments)
+            if not ids:
+                continue
+            if matrices and vectors.shape[1] != matrices[0].shape[1]:
+                raise ValueError(f"工作区向量维度不一致，无法堆叠: {workspace_id}")
+            matrices.append(vectors)
+            owners.append(np.full(len(ids), position, dtype=np.int32))
+            node_ids.extend(ids)
+        if not matrices:
+            return None
+        if len(node_ids) > self.max_nodes:
+            raise ValueError(f"堆叠节点数 {len(node_ids)} 超过上限 {self.max_nodes}")
+
+        stack = _Stack(
+            np.concatenate(matrices) if len(matrices) > 1 else matrices[0],
+            np.concatenate(owners),
+            node_ids,
+            generations,
+            covered
+        )
+        with self._lock:
+            self._cache[key] = stack
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+            self.total_stacks += 1
+        logger.info(f"跨工作区向量堆叠完成: 工作区={list(key)}, 节点={len(node_ids)}")
+        return stack
+
+    def search(
+        self,
+        stores: Sequence[Tuple[str, Any]],
+        query_embedding: Sequence[float],
+        top_k: int
+    ) -> List[Tuple[str, str, float]]:
+        """
+        在多个存储上检索余弦相似度 top-k
+
+        Args:
+            stores: [(工作区ID, SegmentVectorStore)]
+            query_embedding: 查询向量
+            top_k: 返回数量
+
+        Returns:
+            按相似度降序的 [(工作区ID, 节点ID, 余弦相似度)]
+        """
+        if not stores or top_k <= 0:
+            return []
+        stack = self._get_stack(stores)
+        if stack is None:
+            return []
+        self.total_searches += 1
+
+        q = np.asarray(query_embedding, dtype=np.float32)
+        scores = stack.matrix @ (q / (float(np.linalg.norm(q)) or 1.0))
+        # 多取一些候选，抵消堆叠后被删除的节点
+        k = min(top_k * self.oversample, scores.size)
+        rows = np.argpartition(-scores, k - 1)[:k] if scores.size > k else np.arange(scores.size)
+        rows = rows[np.argsort(-scores[rows], kind='stable')]
+
+        hits: List[Tuple[str, str, float]] = []
+        for row in rows:
+            position = int(stack.owners[row])
+            workspace_id, store = stores[position]
+            node_id = stack.node_ids[row]
+            if store.segment_of(node_id) not in stack.covered[position]:
+                continue
+            hits.append((workspace_id, node_id, float(scores[row])))
+            if len(hits) >= top_k:
+                break
+        return hits
+
+    def evict_workspace(self, workspace_id: str):
+        """丢弃包含该工作区的堆叠矩阵（工作区检索器被淘汰时调用）"""
+        with self._lock:
+            for key in [key for key in self._cache if workspace_id in key]:
+                del self._cache[key]
+
+    def memory_bytes(self) -> int:
+        """缓存的堆叠矩阵占用的内存"""
+        with self._lock:
+            return sum(stack.nbytes for stack in self._cache.values())
+
+    def get_stats(self) -> Dict[str, Any]:
+        """缓存统计"""
+        with self._lock:
+            return {
+                "cached_stacks": len(self._cache),
+                "cached_nodes": sum(len(stack.node_ids) for stack in self._cache.values()),
+                "cached_bytes": sum(stack.nbytes for stack in self._cache.values()),
+                "max_nodes": self.max_nodes,
+                "total_stacks": self.total_stacks,
+                "total_searches": self.total_searches
+            }
@@ -11,9 +11,10 @@ from typing import List, Dict, Any, Optional, Tuple
 from pathlib import Path
 
 import chromadb
-from sentence_transformers import SentenceTransformer
 import faiss
 
+from .embedding_registry import get_embedding_registry
+
 logger = logging.getLogger(__name__)
 
 
@@ -61,6 +62,9 @@ class VectorService:
             'all-MiniLM-L12-v2'   # 384维，性能较好
         ]
         
+        # 通过进程级注册表加载，多个 VectorService 实例共享同一模型
+        registry = get_embedding_registry()
+        
         for model_name in models_to_try:
             try:
                 logger.info(f"正在尝试加载模型: {model_name}")
@@ -75,19 +79,19 @@ class VectorService:
                         if snapshot_dirs:
                             full_path = os.path.join(snapshot_path, snapshot_dirs[0])
                             logger.info(f"使用snapshot路径: {full_path}")
-                            self.embedding_model = SentenceTransformer(full_path)
+                            self.embedding_model = registry.get_sentence_transformer(full_path)
                         else:
                             raise Exception("No snapshot found")
                     else:
-                        # 使用cache_folder方式
-                        self.embedding_model = SentenceTransformer(model_name, cache_folder='./models')
+                        # 未找到本地snapshot，按模型名从默认缓存加载
+                        self.embedding_model = registry.get_sentence_transformer(model_name)
                     
                     logger.info(f"成功从本地缓存加载模型: {model_name}")
                 except Exception as local_error:
                     logger.warning(f"本地缓存加载失败: {str(local_error)}")
                     # 尝试在线下载
                     try:
-                        self.embedding_model = SentenceTransformer(model_name)
+                        self.embedding_model = registry.get_sentence_transformer(model_name)
                         logger.info(f"成功在线下载模型: {model_name}")
                     except Exception as online_error:
                         logger.warning(f"在线下载失败: {str(online_error)}")
@@ -0,0 +1,171 @@
+"""
+启动预热与就绪检查
+服务启动后在后台线程中依次加载嵌入模型、重排序模型与最近使用的工作区索引，
+并各做一次小规模推理，让首个用户请求不再承担模型加载与 torch 的延迟初始化；
+/api/ready 在必需阶段完成前返回未就绪，/api/health 只表示进程存活
+"""
+
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_WARMUP_QUERY = "预热查询"
+_WARMUP_TEXTS = ["预热文档：服务启动时的示例文本。", "Warm-up document for the first inference."]
+
+# 阶段 -> 失败时是否影响就绪（重排序为可选阶段，失败时对话路径保持向量顺序）
+_STAGES = {"embedding": True, "reranker": False, "workspaces": True}
+
+
+def _warmup_config() -> Dict[str, Any]:
+    """从 rag_config.yaml 读取 llamaindex.warmup"""
+    try:
+        from app.utils.config_loader import get_rag_config
+        return get_rag_config().get('llamaindex.warmup', {}) or {}
+    except Exception:
+        return {}
+
+
+def recent_workspaces(storage_root: Path, limit: int) -> List[str]:
+    """按索引文件最近修改时间排序的工作区（不含 _ 开头的内部目录）"""
+    if limit <= 0 or not storage_root.exists():
+        return []
+    candidates = []
+    for path in storage_root.iterdir():
+        if not path.is_dir() or path.name.startswith('_'):
+            continue
+        mtimes = [child.stat().st_mtime for child in path.iterdir() if child.is_file()]
+        if mtimes:
+            candidates.append((max(mtimes), path.name))
+    candidates.sort(reverse=True)
+    return [name for _, name in candidates[:limit]]
+
+
+class WarmupManager:
+    """后台预热任务与各阶段状态"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.stages: Dict[str, Dict[str, Any]] = {name: {"status": "pending"} for name in _STAGES}
+
+    def start(self) -> bool:
+        """启动后台预热（重复调用无效），返回是否新启动"""
+        with self._lock:
+            if self._thread is not None:
+                return False
+            config = _warmup_config()
+            if not config.get('enabled', True):
+                for stage in self.stages.values():
+                    stage["status"] = "skipped"
+                self.finished_at = time.time()
+                logger.info("启动预热已关闭（llamaindex.warmup.enabled=false）")
+                return False
+            self.started_at = time.time()
+            self._thread = threading.Thread(target=self._run, args=(config,), name="startup-warmup", daemon=True)
+            self._thread.start()
+        return True
+
+    def _run(self, config: Dict[str, Any]):
+        logger.info("🔥 开始启动预热（后台）")
+        self._stage("embedding", self._warm_embedding)
+        if config.get('reranker', True):
+            self._stage("reranker", self._warm_reranker)
+        else:
+            self.stages["reranker"] = {"status": "skipped"}
+        self._stage("workspaces", lambda: self._warm_workspaces(int(config.get('hot_workspaces', 5))))
+        self.finished_at = time.time()
+        logger.info(f"🔥 启动预热结束（耗时 {self.finished_at - self.started_at:.2f} 秒），就绪={self.is_ready()}")
+
+    def _stage(self, name: str, fn):
+        self.stages[name] = {"status": "running"}
+        start = time.time()
+        try:
+            detail = fn()
+            self.stages[name] = {"status": "skipped" if detail is None else "done", **(detail or {})}
+        except Exception as e:
+            logger.error(f"预热阶段失败: {name}, {e}", exc_info=True)
+            self.stages[name] = {"status": "failed", "error": str(e)}
+        self.stages[name]["time_s"] = round(time.time() - start, 2)
+
+    @staticmethod
+    def _warm_embedding() -> Dict[str, Any]:
+        """加载共享嵌入模型并做一次查询 + 文档编码（触发 torch 的首次内核初始化）"""
+        from app.services.embedding_registry import get_embedding_registry
+        engine = get_embedding_registry().get_engine(os.getenv("LOCAL_BGE_MODEL_DIR") or None)
+        engine.encode_query(_WARMUP_QUERY)
+        engine.encode(_WARMUP_TEXTS)
+        engine.get_batcher()
+        return {"model": engine.model_path, "dimension": engine.dimension}
+
+    @staticmethod
+    def _warm_reranker() -> Optional[Dict[str, Any]]:
+        """加载共享重排序模型并推理一次；首轮耗时不计入按预算重排序使用的单对耗时统计"""
+        from app.utils.config_loader import chat_reranking_enabled
+        # 只有对话路径按预算重排序时才需要常驻模型；其他路径在首次使用时加载
+        if not chat_reranking_enabled():
+            return None
+        from app.services.reranker_service import get_reranker_service
+        service = get_reranker_service()
+        if not service.is_available():
+            raise RuntimeError("重排序模型不可用")
+        items = [(None, text) for text in _WARMUP_TEXTS]
+        service.score(_WARMUP_QUERY, items)
+        service.ms_per_pair = None
+        service.score(_WARMUP_QUERY + "（二）", items)
+        return {"model": service.model_name, "ms_per_pair": service.ms_per_pair}
+
+    @staticmethod
+    def _warm_workspaces(limit: int) -> Dict[str, Any]:
+        """加载 global 与最近使用的工作区索引（含 BM25 / 元数据索引），并执行一次向量检索"""
+        from app.services.llamaindex_retriever import get_retriever
+        workspaces = list(dict.fromkeys(["global"] + recent_workspaces(Path("llamaindex_storage"), limit)))
+        loaded, failed = [], {}
+        for workspace_id in workspaces:
+            try:
+                retriever = get_retriever(workspace_id)
+                retriever.warm_up(_WARMUP_QUERY)
+                loaded.append(workspace_id)
+            except Exception as e:
+                logger.warning(f"工作区预热失败: {workspace_id}, {e}")
+                failed[workspace_id] = str(e)
+        if not loaded and failed:
+            raise RuntimeError(f"工作区预热全部失败: {failed}")
+        return {"loaded": loaded, "failed": failed}
+
+    def is_ready(self) -> bool:
+        """必需阶段均已完成（或被跳过）"""
+        for name, required in _STAGES.items():
+            status = self.stages[name]["status"]
+            if status in ("pending", "running") or (required and status == "failed"):
+                return False
+        return True
+
+    def get_status(self) -> Dict[str, Any]:
+        """就绪状态与各阶段详情"""
+        return {
+            "ready": self.is_ready(),
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "stages": {name: dict(stage) for name, stage in self.stages.items()}
+        }
+
+
+_manager_instance: Optional[WarmupManager] = None
+_manager_lock = threading.Lock()
+
+
+def get_warmup_manager() -> WarmupManager:
+    """获取全局预热管理器（单例）"""
+    global _manager_instance
+    if _manager_instance is None:
+        with _manager_lock:
+            if _manager_instance is None:
+                _manager_instance = WarmupManager()
+    return _manager_instance
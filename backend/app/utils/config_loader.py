@@ -13,7 +13,7 @@ class RAGConfig:
     def __init__(self, config_path: str = "rag_config.yaml"):
         self.config_path = Path(config_path)
         self.config: Dict[str, Any] = {}
-        self.load_config llama
+        self.load_config()
     
     def load_config(self):
         """加载配置文件"""
@@ -101,3 +101,19 @@ def get_rag_config() -> RAGConfig:
         _rag_config = RAGConfig()
     return _rag_config
 
+def get_reranking_config() -> Dict[str, Any]:
+    """获取重排序配置（llamaindex.reranking），读取失败时返回空字典"""
+    try:
+        return get_rag_config().get('llamaindex.reranking', {}) or {}
+    except Exception:
+        return {}
+
+def chat_reranking_enabled(config: Optional[Dict[str, Any]] = None) -> bool:
+    """对话路径是否按预算重排序（需同时开启 use_reranking 与 chat_enabled，且预算大于 0）"""
+    config = get_reranking_config() if config is None else config
+    return (
+        bool(config.get('use_reranking', False))
+        and bool(config.get('chat_enabled', False))
+        and float(config.get('budget_ms', 150)) > 0
+    )
+
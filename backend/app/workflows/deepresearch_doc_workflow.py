@@ -5,9 +5,9 @@ DeepResearch 风格长文档生成工作流
 
 from typing import TypedDict, List, Dict
 from langgraph.graph import StateGraph, END
-from langgraph.checkpoint.memory import MemorySaver
-from langchain_openai import ChatOpenAI
-import os
+from app.services.llm_registry import get_llm
+from app.services.query_sharing import SharedQueryRetrievalMixin
+from app.workflows.graph_runtime import get_compiled_graph, run_config, workflow_node
 import asyncio
 import logging
 import json
@@ -15,6 +15,23 @@ import re
 
 logger = logging.getLogger(__name__)
 
+
+def get_deepresearch_llm():
+    """
+    DeepResearch 使用的共享 LLM 客户端：长文档逐段生成单次耗时长，
+    超时与重试按 llm.deepresearch 配置（默认与 ChatOpenAI 默认值一致：600 秒、重试 2 次）
+    """
+    try:
+        from app.utils.config_loader import get_rag_config
+        config = get_rag_config().get('llm.deepresearch', {}) or {}
+    except Exception:
+        config = {}
+    return get_llm(
+        temperature=0.3,
+        request_timeout=float(config.get('request_timeout_s', 600)),
+        max_retries=int(config.get('max_retries', 2))
+    )
+
 # 状态定义
 class DocGenState(TypedDict):
     """长文档生成状态"""
@@ -53,41 +70,36 @@ class DocGenState(TypedDict):
     current_step: str
     error: str
 
-class DeepResearchDocWorkflow:
+class DeepResearchDocWorkflow(SharedQueryRetrievalMixin):
     """DeepResearch 风格长文档生成工作流"""
     
     def __init__(self, workspace_retriever, global_retriever, web_search_service, llm=None):
         self.workspace_retriever = workspace_retriever
         self.global_retriever = global_retriever
         self.web_search_service = web_search_service
-        if llm is None:
-            api_key = os.getenv('THIRD_PARTY_API_KEY') or os.getenv('OPENAI_API_KEY')
-            api_base = os.getenv('THIRD_PARTY_API_BASE') or os.getenv('OPENAI_BASE_URL', 'https://api.openai.com/v1')
-            # 从环境变量读取模型名称，默认使用 gpt-4o
-            model_name = os.getenv('LLM_MODEL', 'gpt-4o-2024-08-06')
-            self.llm = ChatOpenAI(
-                model=model_name,
-                temperature=0.3,
-                openai_api_key=api_key,
-                openai_api_base=api_base
-            )
-        else:
-            self.llm = llm
-        
-        self.graph = self._build_graph()
-        self.checkpointer = MemorySaver()
-        self.compiled_graph = self.graph.compile(checkpointer=self.checkpointer)
+        # 未显式传入时使用进程级共享客户端
+        self.llm = llm if llm is not None else get_deepresearch_llm()
+    
+    @property
+    def compiled_graph(self):
+        """进程级共享的编译图"""
+        return get_compiled_graph(type(self))
     
-    def _build_graph(self) -> StateGraph:
-        """构建文档生成状态图"""
+    @property
+    def graph(self):
+        return self.compiled_graph.builder
+    
+    @classmethod
+    def _build_graph(cls) -> StateGraph:
+        """构建文档生成状态图（每个进程只编译一次，节点运行时分派到本次请求的工作流实例）"""
         workflow = StateGraph(DocGenState)
         
         # 节点
-        workflow.add_node("outline_planning", self._outline_planning_node)
-        workflow.add_node("parallel_retrieval", self._parallel_retrieval_node)
-        workflow.add_node("parallel_generation", self._parallel_generation_node)
-        workflow.add_node("merge_sections", self._merge_sections_node)
-        workflow.add_node("final_polish", self._final_polish_node)
+        workflow.add_node("outline_planning", workflow_node(cls._outline_planning_node))
+        workflow.add_node("parallel_retrieval", workflow_node(cls._parallel_retrieval_node))
+        workflow.add_node("parallel_generation", workflow_node(cls._parallel_generation_node))
+        workflow.add_node("merge_sections", workflow_node(cls._merge_sections_node))
+        workflow.add_node("final_polish", workflow_node(cls._final_polish_node))
         
         # 流程
         workflow.set_entry_point("outline_planning")
@@ -201,21 +213,15 @@ class DeepResearchDocWorkflow:
             section_id = section["id"]
             query = section["title"]
             
-            # 并行：工作区 + 全局
-            workspace_task = self.workspace_retriever.retrieve(query, top_k=3, use_hybrid=True)
-            global_task = self.global_retriever.retrieve(query, top_k=3, use_hybrid=True)
-            
-            workspace_docs, global_docs = await asyncio.gather(
-                workspace_task, global_task, return_exceptions=True
-            )
+            # 段落标题只编码一次，工作区 + 全局一次堆叠检索并统一排序
+            query_embedding = await self._embed_query(query)
+            try:
+                all_docs = await self._retrieve_across(query, query_embedding, top_k=5, use_hybrid=True)
+            except Exception as e:
+                logger.error(f"段落检索失败: {section_id}, {e}")
+                all_docs = []
             
-            all_docs = []
-            if not isinstance(workspace_docs, Exception):
-                all_docs.extend(workspace_docs)
-            if not isinstance(global_docs, Exception):
-                all_docs.extend(global_docs)
-            
-            return {section_id: all_docs[:5]}
+            return {section_id: all_docs}
         
         results = await asyncio.gather(*[retrieve_for_section(s) for s in all_sections])
         
@@ -458,10 +464,9 @@ C. [选项C]
             error=""
         )
         
-        final_state = await self.compiled_graph.ainvoke(
-            initial_state,
-            config={"configurable": {"thread_id": "doc_gen"}}
-        )
+        # 生成耗时较长，期间租用检索器，避免被检索器缓存淘汰关闭
+        with self._leased_retrievers():
+            final_state = await self.compiled_graph.ainvoke(initial_state, config=run_config(self, "doc_gen"))
         
         # 提取大纲结构便于前端展示
         outline_data = final_state["outline"]
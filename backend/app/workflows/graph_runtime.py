@@ -0,0 +1,142 @@
+"""
+LangGraph 工作流运行时 - 进程级编译图缓存与有界检查点
+每个工作流类的状态图只编译一次，节点在运行时从 config["configurable"]["workflow"] 取到本次请求的
+工作流实例（检索器、LLM 等依赖随实例注入）；每次运行使用独立的 thread_id，
+检查点按线程数上限与 TTL 淘汰，长期运行的进程内存不再随请求数增长
+"""
+
+import inspect
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+from langgraph.checkpoint.memory import MemorySaver
+
+logger = logging.getLogger(__name__)
+
+
+def _checkpoint_config() -> Dict[str, Any]:
+    """从 rag_config.yaml 读取 langgraph.checkpoint"""
+    try:
+        from app.utils.config_loader import get_rag_config
+        return get_rag_config().get('langgraph.checkpoint', {}) or {}
+    except Exception:
+        return {}
+
+
+class BoundedMemorySaver(MemorySaver):
+    """内存检查点：超过 max_threads 时淘汰最久未写入的线程，超过 ttl_s 未写入的线程过期"""
+
+    def __init__(self, max_threads: int = 1000, ttl_s: float = 3600.0):
+        super().__init__()
+        self.max_threads = max(1, int(max_threads))
+        self.ttl_s = float(ttl_s)
+        self._touched: "OrderedDict[str, float]" = OrderedDict()
+        self._evict_lock = threading.Lock()
+        self.evictions = 0
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        result = super().put(config, checkpoint, metadata, new_versions)
+        thread_id = str(config["configurable"]["thread_id"])
+        now = time.time()
+        with self._evict_lock:
+            self._touched[thread_id] = now
+            self._touched.move_to_end(thread_id)
+            expired = []
+            for key, touched_at in self._touched.items():
+                if len(self._touched) - len(expired) <= self.max_threads and now - touched_at <= self.ttl_s:
+                    break
+                if key != thread_id:
+                    expired.append(key)
+            for key in expired:
+                del self._touched[key]
+        for key in expired:
+            self.delete_thread(key)
+            self.evictions += 1
+        return result
+
+    def delete_thread(self, thread_id: str) -> None:
+        super().delete_thread(thread_id)
+        with self._evict_lock:
+            self._touched.pop(str(thread_id), None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """驻留线程数与淘汰计数"""
+        return {
+            "threads": len(self._touched),
+            "max_threads": self.max_threads,
+            "ttl_s": self.ttl_s,
+            "evictions": self.evictions
+        }
+
+
+_checkpointer: Optional[BoundedMemorySaver] = None
+_compiled_graphs: Dict[type, Any] = {}
+_runtime_lock = threading.Lock()
+
+
+def get_checkpointer() -> BoundedMemorySaver:
+    """获取进程级共享检查点（单例，langgraph.checkpoint.max_threads / ttl_s）"""
+    global _checkpointer
+    if _checkpointer is None:
+        with _runtime_lock:
+            if _checkpointer is None:
+                config = _checkpoint_config()
+                _checkpointer = BoundedMemorySaver(
+                    max_threads=config.get('max_threads', 1000),
+                    ttl_s=config.get('ttl_s', 3600)
+                )
+    return _checkpointer
+
+
+def workflow_node(method: Callable) -> Callable:
+    """
+    把工作流类的方法包装为与实例无关的节点/路由函数
+
+    运行时从 config["configurable"]["workflow"] 取工作流实例并调用同名方法，
+    使编译后的图可被所有请求共享
+    """
+    name = method.__name__
+    if inspect.iscoroutinefunction(method):
+        async def _async_node(state, config):
+            return await getattr(config["configurable"]["workflow"], name)(state)
+        _async_node.__name__ = name
+        return _async_node
+
+    def _node(state, config):
+        return getattr(config["configurable"]["workflow"], name)(state)
+    _node.__name__ = name
+    return _node
+
+
+def get_compiled_graph(workflow_cls: type, **compile_kwargs) -> Any:
+    """获取工作流类的编译图（首次调用时由 workflow_cls._build_graph() 构建并编译）"""
+    graph = _compiled_graphs.get(workflow_cls)
+    if graph is not None:
+        return graph
+    checkpointer = get_checkpointer()
+    with _runtime_lock:
+        graph = _compiled_graphs.get(workflow_cls)
+        if graph is None:
+            graph = workflow_cls._build_graph().compile(checkpointer=checkpointer, **compile_kwargs)
+            _compiled_graphs[workflow_cls] = graph
+            logger.info(f"编译工作流图: {workflow_cls.__name__}")
+    return graph
+
+
+def run_config(workflow: Any, prefix: str = "run", **extra) -> Dict[str, Any]:
+    """单次运行的 config：独立 thread_id + 注入工作流实例"""
+    config = dict(extra)
+    config["configurable"] = {"thread_id": f"{prefix}-{uuid.uuid4().hex}", "workflow": workflow}
+    return config
+
+
+def get_runtime_stats() -> Dict[str, Any]:
+    """已编译的工作流与检查点统计"""
+    return {
+        "compiled_graphs": sorted(cls.__name__ for cls in _compiled_graphs),
+        "checkpoint": get_checkpointer().get_stats()
+    }
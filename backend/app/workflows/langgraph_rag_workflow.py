@@ -3,18 +3,31 @@ LangGraph 智能 RAG 工作流
 基于状态机和条件路由的智能编排层
 """
 
-from typing import TypedDict, Dict
+from typing import AsyncIterator, TypedDict, Dict, Optional
 from langgraph.graph import StateGraph, END
-from langgraph.checkpoint.memory import MemorySaver
-from langchain_openai import ChatOpenAI
-import os
+from app.services.executors import get_query_executor
+from app.services.llm_registry import get_llm
+from app.services.query_sharing import SharedQueryRetrievalMixin
+from app.utils.config_loader import chat_reranking_enabled, get_reranking_config
+from app.workflows.graph_runtime import get_compiled_graph, run_config, workflow_node
 import logging
 import asyncio
 import json
 import re
+import time
 
 logger = logging.getLogger(__name__)
 
+
+def _rag_workflow_config() -> Dict:
+    """从 rag_config.yaml 读取 langgraph.rag_workflow"""
+    try:
+        from app.utils.config_loader import get_rag_config
+        return get_rag_config().get('langgraph.rag_workflow', {}) or {}
+    except Exception:
+        return {}
+
+
 # 定义状态
 class RAGState(TypedDict):
     """RAG 工作流状态"""
@@ -22,6 +35,7 @@ class RAGState(TypedDict):
     question: str
     workspace_id: str
     conversation_history: list
+    filters: dict  # 检索元数据过滤条件（见 LlamaIndexRetriever.retrieve）
     
     # 意图识别
     intent: str  # "greeting" | "simple_qa" | "complex_reasoning" | "document_generation"
@@ -47,33 +61,44 @@ class RAGState(TypedDict):
     retrieval_strategy: str
     sources_used: list
     processing_steps: list
+    rerank_stats: dict
+    intent_source: str  # 意图判定来源：keyword / centroid / llm
+    speculative: str  # 推测检索结果：used / dropped（未启用或未触发时为空）
 
-class LangGraphRAGWorkflow:
+class LangGraphRAGWorkflow(SharedQueryRetrievalMixin):
     """基于 LangGraph 的智能 RAG 工作流"""
     
     def __init__(self, workspace_retriever, global_retriever, llm=None):
         self.workspace_retriever = workspace_retriever
         self.global_retriever = global_retriever
-        if llm is None:
-            api_key = os.getenv('THIRD_PARTY_API_KEY') or os.getenv('OPENAI_API_KEY')
-            api_base = os.getenv('THIRD_PARTY_API_BASE') or os.getenv('OPENAI_BASE_URL', 'https://api.openai.com/v1')
-            # 从环境变量读取模型名称，默认使用 gpt-4o
-            model_name = os.getenv('LLM_MODEL', 'gpt-4o-2024-08-06')
-            self.llm = ChatOpenAI(
-                model=model_name,
-                temperature=0.1,
-                openai_api_key=api_key,
-                openai_api_base=api_base
-            )
-        else:
-            self.llm = llm
+        # 未显式传入时使用进程级共享客户端
+        self.llm = llm if llm is not None else get_llm(temperature=0.1)
         
-        # 构建状态图
-        self.graph = self._build_graph()
+        # 重排序阶段：按时间预算重排序检索候选，超出预算的部分保持向量顺序
+        rerank_config = get_reranking_config()
+        self.rerank_budget_ms = float(rerank_config.get('budget_ms', 150))
+        self.rerank_enabled = chat_reranking_enabled(rerank_config)
+        self.rerank_candidates = int(rerank_config.get('chat_candidates', 10))
         
-        # 配置检查点（支持断点续传）
-        self.checkpointer = MemorySaver()
-        self.compiled_graph = self.graph.compile(checkpointer=self.checkpointer)
+        # 流式输出：astream 运行期间节点把检索来源与答案 token 写入该队列
+        self._event_queue: Optional[asyncio.Queue] = None
+        
+        # 本地意图分类（关键词 + 最近质心），不确定时才调用 LLM
+        workflow_config = _rag_workflow_config()
+        self.local_intent_enabled = bool((workflow_config.get('local_intent', {}) or {}).get('enabled', True))
+        
+        # 推测检索：意图 LLM 调用期间并行执行简单检索，走简单检索路由时直接复用结果
+        self.speculative_retrieval = bool(workflow_config.get('speculative_retrieval', False))
+        self._speculative: Optional[asyncio.Task] = None
+    
+    @property
+    def compiled_graph(self):
+        """进程级共享的编译图"""
+        return get_compiled_graph(type(self))
+    
+    @property
+    def graph(self):
+        return self.compiled_graph.builder
     
     def _sanitize_docs(self, docs: list) -> list:
         """清理文档列表，确保所有值都可以被 msgpack 序列化"""
@@ -112,20 +137,76 @@ class LangGraphRAGWorkflow:
         else:
             return value
     
-    def _build_graph(self) -> StateGraph:
-        """构建 LangGraph 状态图"""
+    def _candidate_count(self, top_k: int) -> int:
+        """启用重排序时多取候选，供重排序挑选"""
+        return max(top_k, self.rerank_candidates) if self.rerank_enabled else top_k
+    
+    async def _rerank_docs(self, query: str, docs: list, top_k: int) -> tuple:
+        """
+        在时间预算内重排序单组候选，返回 (top_k 文档, 统计)
+        模型尚未加载时不等待（后台开始加载），直接保持原顺序
+        """
+        if not self.rerank_enabled or not docs:
+            return docs[:top_k], None
+        try:
+            from app.services.reranker_service import get_reranker_service_if_ready
+            service = get_reranker_service_if_ready()
+        except Exception as e:
+            logger.warning(f"重排序服务不可用，保持向量顺序: {e}")
+            service = None
+        if service is None or not service.is_available():
+            return docs[:top_k], {"applied": False, "candidates": len(docs), "reranked": 0, "reason": "reranker_not_ready"}
+        # 与检索共用有界线程池，重排序计入同一并发上限
+        return await get_query_executor().run(service.rerank_with_budget, query, docs, top_k, self.rerank_budget_ms)
+    
+    def _record_rerank(self, state: RAGState, infos: list, elapsed_ms: float):
+        """汇总本次请求的重排序统计（写入响应 metadata）"""
+        infos = [info for info in infos if info]
+        if not infos:
+            return
+        stats = state.get("rerank_stats") or {"enabled": True, "budget_ms": self.rerank_budget_ms}
+        stats["applied"] = stats.get("applied", False) or any(info.get("applied") for info in infos)
+        stats["candidates"] = stats.get("candidates", 0) + sum(info.get("candidates", 0) for info in infos)
+        stats["reranked"] = stats.get("reranked", 0) + sum(info.get("reranked", 0) for info in infos)
+        stats["timed_out"] = stats.get("timed_out", False) or any(info.get("timed_out") for info in infos)
+        stats["time_ms"] = round(stats.get("time_ms", 0.0) + elapsed_ms, 2)
+        reasons = [info["reason"] for info in infos if info.get("reason")]
+        if reasons:
+            stats["reason"] = reasons[0]
+        state["rerank_stats"] = stats
+    
+    def _emit(self, event_type: str, **payload):
+        """流式运行时向客户端推送事件（非流式运行时忽略）"""
+        if self._event_queue is not None:
+            self._event_queue.put_nowait({"type": event_type, **payload})
+    
+    async def _generate(self, prompt: str) -> str:
+        """生成面向用户的答案；流式运行时逐 token 推送"""
+        if self._event_queue is None:
+            response = await self.llm.ainvoke(prompt)
+            return response.content
+        parts = []
+        async for chunk in self.llm.astream(prompt):
+            if chunk.content:
+                parts.append(chunk.content)
+                self._emit("token", content=chunk.content)
+        return "".join(parts)
+    
+    @classmethod
+    def _build_graph(cls) -> StateGraph:
+        """构建 LangGraph 状态图（每个进程只编译一次，节点运行时分派到本次请求的工作流实例）"""
         workflow = StateGraph(RAGState)
         
         # 添加节点
-        workflow.add_node("intent_analysis", self._intent_analysis_node)
-        workflow.add_node("simple_retrieval", self._simple_retrieval_node)
-        workflow.add_node("complex_retrieval", self._complex_retrieval_node)
-        workflow.add_node("multi_hop_reasoning", self._multi_hop_reasoning_node)
-        workflow.add_node("direct_answer", self._direct_answer_node)
-        workflow.add_node("answer_generation", self._answer_generation_node)
-        workflow.add_node("quality_check", self._quality_check_node)
-        workflow.add_node("answer_refinement", self._answer_refinement_node)
-        workflow.add_node("finalize", self._finalize_node)
+        workflow.add_node("intent_analysis", workflow_node(cls._intent_analysis_node))
+        workflow.add_node("simple_retrieval", workflow_node(cls._simple_retrieval_node))
+        workflow.add_node("complex_retrieval", workflow_node(cls._complex_retrieval_node))
+        workflow.add_node("multi_hop_reasoning", workflow_node(cls._multi_hop_reasoning_node))
+        workflow.add_node("direct_answer", workflow_node(cls._direct_answer_node))
+        workflow.add_node("answer_generation", workflow_node(cls._answer_generation_node))
+        workflow.add_node("quality_check", workflow_node(cls._quality_check_node))
+        workflow.add_node("answer_refinement", workflow_node(cls._answer_refinement_node))
+        workflow.add_node("finalize", workflow_node(cls._finalize_node))
         
         # 设置入口
         workflow.set_entry_point("intent_analysis")
@@ -133,7 +214,7 @@ class LangGraphRAGWorkflow:
         # 意图识别后路由
         workflow.add_conditional_edges(
             "intent_analysis",
-            self._route_by_intent,
+            workflow_node(cls._route_by_intent),
             {
                 "no_retrieval": "direct_answer",  # 不需要检索，直接回答（包括问候和文档生成提示）
                 "simple": "simple_retrieval",
@@ -150,7 +231,7 @@ class LangGraphRAGWorkflow:
         # 复杂检索需要判断是否多跳推理
         workflow.add_conditional_edges(
             "complex_retrieval",
-            self._needs_multi_hop,
+            workflow_node(cls._needs_multi_hop),
             {
                 "yes": "multi_hop_reasoning",
                 "no": "answer_generation"
@@ -166,7 +247,7 @@ class LangGraphRAGWorkflow:
         # 质量检查后条件路由
         workflow.add_conditional_edges(
             "quality_check",
-            self._needs_refinement,
+            workflow_node(cls._needs_refinement),
             {
                 "yes": "answer_refinement",
                 "no": "finalize"
@@ -182,9 +263,26 @@ class LangGraphRAGWorkflow:
         return workflow
     
     async def _intent_analysis_node(self, state: RAGState) -> RAGState:
-        """节点1: 意图识别"""
+        """节点1: 意图识别（本地分类器足够确定时跳过 LLM）"""
         question = state["question"]
         
+        if self.local_intent_enabled:
+            from app.services.local_intent_classifier import get_local_intent_classifier
+            local = await get_local_intent_classifier().classify(question, embed=self._embed_query)
+            if local is not None:
+                state["intent"] = local["intent"]
+                state["needs_retrieval"] = local["needs_retrieval"]
+                state["complexity"] = local["complexity"]
+                state["requires_multi_hop"] = local["requires_multi_hop"]
+                state["intent_source"] = local["source"]
+                state["processing_steps"].append("intent_analysis")
+                logger.info(f"本地意图识别: {local['intent']} ({local['source']}, 置信度 {local['confidence']})")
+                return state
+        
+        # 需要等待 LLM 判定意图时，同时开始简单检索（多数问题最终走该路由）
+        if self.speculative_retrieval and self._speculative is None:
+            self._speculative = asyncio.create_task(self._simple_candidates(question, state.get("filters")))
+        
         prompt = f"""分析以下问题的意图和复杂度：
 
 问题: {question}
@@ -241,6 +339,7 @@ class LangGraphRAGWorkflow:
             state["requires_multi_hop"] = False
             state["needs_retrieval"] = True
         
+        state["intent_source"] = "llm"
         state["processing_steps"].append("intent_analysis")
         logger.info(f"意图: {state['intent']}, 复杂度: {state['complexity']}, 需要检索: {state.get('needs_retrieval', True)}")
         
@@ -262,6 +361,8 @@ class LangGraphRAGWorkflow:
         """直接回答节点（不需要检索）"""
         question = state["question"]
         intent = state.get("intent", "")
+        if self._drop_speculative():
+            state["speculative"] = "dropped"
         
         # 如果是文档生成意图，给出特殊提示
         if intent == "document_generation":
@@ -293,33 +394,52 @@ class LangGraphRAGWorkflow:
 请给出简洁友好的回答。如果问题涉及文档查询、技术细节或需要检索的信息，请礼貌地说明需要具体查询相关文档。
 """
         
-        response = await self.llm.ainvoke(prompt)
-        state["draft_answer"] = response.content
         state["sources_used"] = []
+        self._emit("sources", sources=[])
+        state["draft_answer"] = await self._generate(prompt)
         state["processing_steps"].append("direct_answer")
         
         logger.info(f"直接回答，跳过检索 (意图: {intent})")
         return state
     
+    async def _simple_candidates(self, question: str, filters: Dict = None) -> tuple:
+        """简单检索的候选：问题只编码一次，工作区与全局一次堆叠检索（有过滤条件时并行分别检索），返回 (工作区候选, 全局候选)"""
+        query_embedding = await self._embed_query(question)
+        return await self._retrieve_split(
+            question, query_embedding, filters, top_k=self._candidate_count(5), use_hybrid=True
+        )
+    
+    def _drop_speculative(self) -> bool:
+        """丢弃未被使用的推测检索（问候、文档生成与复杂检索路由），返回是否有被丢弃的任务"""
+        speculative, self._speculative = self._speculative, None
+        if speculative is None:
+            return False
+        speculative.cancel()
+        return True
+    
     async def _simple_retrieval_node(self, state: RAGState) -> RAGState:
         """节点3: 简单检索（单次检索）"""
         question = state["question"]
         workspace_id = state["workspace_id"]
         
-        # 并行检索工作区和全局
-        workspace_task = self.workspace_retriever.retrieve(
-            question, top_k=5, use_hybrid=True, use_compression=True
-        )
-        global_task = self.global_retriever.retrieve(
-            question, top_k=5, use_hybrid=True, use_compression=True
-        )
+        # 复用意图识别期间已开始的推测检索
+        speculative, self._speculative = self._speculative, None
+        if speculative is not None:
+            workspace_docs, global_docs = await speculative
+            state["speculative"] = "used"
+        else:
+            workspace_docs, global_docs = await self._simple_candidates(question, state.get("filters"))
         
-        workspace_docs, global_docs = await asyncio.gather(
-            workspace_task, global_task, return_exceptions=True
+        # 两组候选并发重排序（同一批推理），共用一个时间预算
+        rerank_start = time.perf_counter()
+        (workspace_docs, workspace_info), (global_docs, global_info) = await asyncio.gather(
+            self._rerank_docs(question, workspace_docs, 5),
+            self._rerank_docs(question, global_docs, 5)
         )
+        self._record_rerank(state, [workspace_info, global_info], (time.perf_counter() - rerank_start) * 1000)
         
-        state["workspace_docs"] = self._sanitize_docs(workspace_docs) if not isinstance(workspace_docs, Exception) else []
-        state["global_docs"] = self._sanitize_docs(global_docs) if not isinstance(global_docs, Exception) else []
+        state["workspace_docs"] = self._sanitize_docs(workspace_docs)
+        state["global_docs"] = self._sanitize_docs(global_docs)
         state["processing_steps"].append("simple_retrieval")
         
         logger.info(f"简单检索: 工作区{len(state['workspace_docs'])}个，全局{len(state['global_docs'])}个")
@@ -329,6 +449,8 @@ class LangGraphRAGWorkflow:
     async def _complex_retrieval_node(self, state: RAGState) -> RAGState:
         """节点4: 复杂检索（多次检索+查询扩展）"""
         question = state["question"]
+        if self._drop_speculative():
+            state["speculative"] = "dropped"
         
         # 1. 查询扩展
         expansion_prompt = f"生成3个与'{question}'语义相关的查询变体，返回JSON数组: [...]"
@@ -340,13 +462,12 @@ class LangGraphRAGWorkflow:
         except:
             queries = [question]
         
-        # 2. 并行检索所有查询
-        tasks = []
-        for q in queries:
-            tasks.append(self.workspace_retriever.retrieve(q, top_k=3, use_hybrid=True))
-            tasks.append(self.global_retriever.retrieve(q, top_k=3, use_hybrid=True))
-        
-        results = await asyncio.gather(*tasks, return_exceptions=True)
+        # 2. 并发编码所有查询变体（每个变体只编码一次），再并行检索（每个变体在工作区与全局上一次堆叠检索）
+        embeddings = await asyncio.gather(*[self._embed_query(q) for q in queries])
+        results = await asyncio.gather(*[
+            self._retrieve_across(q, q_embedding, state.get("filters"), top_k=6, use_hybrid=True)
+            for q, q_embedding in zip(queries, embeddings)
+        ], return_exceptions=True)
         
         # 3. 合并去重
         all_docs = []
@@ -358,8 +479,11 @@ class LangGraphRAGWorkflow:
                         seen_ids.add(doc['node_id'])
                         all_docs.append(doc)
         
-        # 按分数排序
-        all_docs.sort(key=lambda x: x['score'], reverse=True)
+        # 按 RRF 融合分数排序（只命中 BM25 的结果向量分数很低，不能按 score 排），再以原问题在预算内重排序
+        all_docs.sort(key=lambda x: x.get('fused_score', x.get('score', 0)), reverse=True)
+        rerank_start = time.perf_counter()
+        all_docs, rerank_info = await self._rerank_docs(question, all_docs, 10)
+        self._record_rerank(state, [rerank_info], (time.perf_counter() - rerank_start) * 1000)
         
         state["workspace_docs"] = self._sanitize_docs(all_docs[:10])
         state["global_docs"] = []  # 已合并
@@ -396,7 +520,7 @@ class LangGraphRAGWorkflow:
         # 第二跳：检索子问题
         if sub_questions:
             tasks = [
-                self.workspace_retriever.retrieve(sq, top_k=3, use_hybrid=True)
+                self._retrieve(self.workspace_retriever, sq, filters=state.get("filters"), top_k=3, use_hybrid=True)
                 for sq in sub_questions
             ]
             sub_results = await asyncio.gather(*tasks, return_exceptions=True)
@@ -447,9 +571,6 @@ class LangGraphRAGWorkflow:
 回答:
 """
         
-        response = await self.llm.ainvoke(answer_prompt)
-        state["draft_answer"] = response.content
-        
         # 构建详细的引用来源信息
         state["sources_used"] = []
         for i, doc in enumerate(all_docs[:5]):
@@ -474,6 +595,10 @@ class LangGraphRAGWorkflow:
             }
             state["sources_used"].append(source)
         
+        # 来源在生成前即可推送，客户端无需等待答案生成
+        self._emit("sources", sources=state["sources_used"])
+        
+        state["draft_answer"] = await self._generate(answer_prompt)
         state["processing_steps"].append("answer_generation")
         
         return state
@@ -524,8 +649,9 @@ class LangGraphRAGWorkflow:
 改进后的答案:
 """
         
-        response = await self.llm.ainvoke(refinement_prompt)
-        state["draft_answer"] = response.content
+        # 流式运行时先通知客户端丢弃已推送的草稿，再推送改进后的答案
+        self._emit("refine", iteration=state["iteration_count"])
+        state["draft_answer"] = await self._generate(refinement_prompt)
         state["processing_steps"].append("answer_refinement")
         
         return state
@@ -571,12 +697,13 @@ class LangGraphRAGWorkflow:
         else:
             return "no"
     
-    async def run(self, question: str, workspace_id: str = "global") -> Dict:
-        """执行工作流"""
+    async def run(self, question: str, workspace_id: str = "global", filters: Dict = None) -> Dict:
+        """执行工作流（filters 限定检索范围，如只在某个文件或工作表中回答）"""
         initial_state = RAGState(
             question=question,
             workspace_id=workspace_id,
             conversation_history=[],
+            filters=filters or {},
             intent="",
             complexity="",
             requires_multi_hop=False,
@@ -591,24 +718,80 @@ class LangGraphRAGWorkflow:
             iteration_count=0,
             retrieval_strategy="",
             sources_used=[],
-            processing_steps=[]
+            processing_steps=[],
+            rerank_stats={},
+            intent_source="",
+            speculative=""
         )
         
-        final_state = await self.compiled_graph.ainvoke(
-            initial_state,
-            config={"configurable": {"thread_id": "1"}}
-        )
+        try:
+            with self._leased_retrievers():
+                final_state = await self.compiled_graph.ainvoke(initial_state, config=run_config(self, "rag"))
+        finally:
+            self._drop_speculative()
         
         return {
             "answer": final_state["final_answer"],
             "sources": final_state["sources_used"],
             "metadata": {
                 "intent": final_state["intent"],
+                "intent_source": final_state.get("intent_source", ""),
+                "speculative_retrieval": final_state.get("speculative", ""),
                 "complexity": final_state["complexity"],
                 "quality_score": final_state["quality_score"],
                 "iterations": final_state["iteration_count"],
                 "processing_steps": final_state["processing_steps"],
-                "retrieval_strategy": final_state["retrieval_strategy"]
+                "retrieval_strategy": final_state["retrieval_strategy"],
+                "rerank": final_state.get("rerank_stats") or {"enabled": self.rerank_enabled, "applied": False}
             }
         }
 
+    
+    async def astream(self, question: str, workspace_id: str = "global", filters: Dict = None) -> AsyncIterator[Dict]:
+        """
+        流式执行工作流
+        
+        依次产出事件:
+            {"type": "sources", "sources": [...]}     检索完成、生成开始前
+            {"type": "token", "content": "..."}       答案 token
+            {"type": "refine", "iteration": n}        质量检查要求改进，客户端应清空已显示的草稿
+            {"type": "done", "answer", "sources", "metadata"}  metadata.latency 含首 token 耗时
+            {"type": "error", "message": "..."}
+        """
+        if self._event_queue is not None:
+            raise RuntimeError("同一工作流实例不支持并发流式运行")
+        queue: asyncio.Queue = asyncio.Queue()
+        self._event_queue = queue
+        start = time.perf_counter()
+        latency = {"sources_ms": None, "ttft_ms": None}
+        
+        task = asyncio.create_task(self.run(question, workspace_id, filters=filters))
+        task.add_done_callback(lambda _: queue.put_nowait(None))
+        try:
+            while True:
+                event = await queue.get()
+                if event is None:
+                    break
+                elapsed = round((time.perf_counter() - start) * 1000, 1)
+                if event["type"] == "sources" and latency["sources_ms"] is None:
+                    latency["sources_ms"] = elapsed
+                elif event["type"] == "token" and latency["ttft_ms"] is None:
+                    latency["ttft_ms"] = elapsed
+                yield event
+            
+            try:
+                result = task.result()
+            except Exception as e:
+                logger.error(f"流式工作流执行失败: {e}", exc_info=True)
+                yield {"type": "error", "message": str(e)}
+                return
+            latency["total_ms"] = round((time.perf_counter() - start) * 1000, 1)
+            logger.info(
+                f"流式回答完成: 来源 {latency['sources_ms']}ms, 首 token {latency['ttft_ms']}ms, 总耗时 {latency['total_ms']}ms"
+            )
+            yield {"type": "done", **result, "metadata": {**result["metadata"], "latency": latency}}
+        finally:
+            # 客户端断开时取消仍在运行的工作流
+            if not task.done():
+                task.cancel()
+            self._event_queue = None
@@ -5,13 +5,13 @@
 
 import asyncio
 import logging
-import uuid
 from typing import Dict, Any, Optional, List
 from pathlib import Path
 
 from langchain_core.language_models import BaseChatModel
 from langgraph.graph import StateGraph, END
-from langgraph.checkpoint.memory import MemorySaver
+
+from app.workflows.graph_runtime import get_compiled_graph, run_config, workflow_node
 
 # 导入状态模型
 from app.models.agent_models import AgentState
@@ -54,16 +54,15 @@ class ProductionWorkflow:
         
         # 然后初始化所有 Agent
         self.agents = self._initialize_agents()
-        
-        # 构建工作流图
-        self.graph = self._build_workflow_graph()
-        
-        # 配置检查点（支持中断恢复）
-        self.checkpointer = MemorySaver()
-        self.compiled_graph = self.graph.compile(
-            checkpointer=self.checkpointer,
-            debug=True
-        )
+    
+    @property
+    def compiled_graph(self):
+        """进程级共享的编译图（检查点为有界共享检查点，支持中断恢复）"""
+        return get_compiled_graph(type(self), debug=True)
+    
+    @property
+    def graph(self):
+        return self.compiled_graph.builder
     
     def _initialize_agents(self) -> Dict[str, Any]:
         """初始化所有 Agent"""
@@ -86,20 +85,21 @@ class ProductionWorkflow:
             "formatting": FormattingAgent(self.llm)
         }
     
-    def _build_workflow_graph(self):
-        """构建 LangGraph 状态图"""
+    @classmethod
+    def _build_graph(cls):
+        """构建 LangGraph 状态图（每个进程只编译一次，节点运行时分派到本次请求的工作流实例）"""
         workflow = StateGraph(AgentState)
         
         # 添加所有节点
-        workflow.add_node("intent_analysis", self._intent_analysis_node)
-        workflow.add_node("search_strategy", self._search_strategy_node)
-        workflow.add_node("parallel_search", self._parallel_search_node)
-        workflow.add_node("information_synthesis", self._synthesis_node)
-        workflow.add_node("content_planning", self._planning_node)
-        workflow.add_node("content_generation", self._generation_node)
-        workflow.add_node("quality_assessment", self._quality_node)
-        workflow.add_node("content_refinement", self._refinement_node)
-        workflow.add_node("final_formatting", self._formatting_node)
+        workflow.add_node("intent_analysis", workflow_node(cls._intent_analysis_node))
+        workflow.add_node("search_strategy", workflow_node(cls._search_strategy_node))
+        workflow.add_node("parallel_search", workflow_node(cls._parallel_search_node))
+        workflow.add_node("information_synthesis", workflow_node(cls._synthesis_node))
+        workflow.add_node("content_planning", workflow_node(cls._planning_node))
+        workflow.add_node("content_generation", workflow_node(cls._generation_node))
+        workflow.add_node("quality_assessment", workflow_node(cls._quality_node))
+        workflow.add_node("content_refinement", workflow_node(cls._refinement_node))
+        workflow.add_node("final_formatting", workflow_node(cls._formatting_node))
         
         # 设置入口
         workflow.set_entry_point("intent_analysis")
@@ -115,7 +115,7 @@ class ProductionWorkflow:
         # 条件边
         workflow.add_conditional_edges(
             "quality_assessment",
-            self._quality_routing,
+            workflow_node(cls._quality_routing),
             {
                 "pass": "final_formatting",
                 "refine": "content_refinement",
@@ -416,10 +416,7 @@ class ProductionWorkflow:
         try:
             final_state = await self.compiled_graph.ainvoke(
                 initial_state,
-                config={
-                    "configurable": {"thread_id": str(uuid.uuid4())},
-                    "recursion_limit": 10  # 限制递归次数，避免无限循环
-                }
+                config=run_config(self, "production", recursion_limit=10)  # 限制递归次数，避免无限循环
             )
             
             return {
@@ -10,6 +10,7 @@ import uuid
 import json
 import logging
 import asyncio
+import contextlib
 from datetime import datetime
 from pathlib import Path
 from typing import List
@@ -122,6 +123,7 @@ async def llamaindex_health(workspace_id: str = "global"):
         docstore = base / "docstore"
         index_store = base / "index_store"
         vector_store = base / "vector_store"
+        segments = base / "segments"
 
         return {
             "workspace_id": workspace_id,
@@ -129,6 +131,7 @@ async def llamaindex_health(workspace_id: str = "global"):
             "docstore_exists": docstore.exists(),
             "index_store_exists": index_store.exists(),
             "vector_store_exists": vector_store.exists(),
+            "segments_exists": (segments / "nodes.sqlite").exists(),
             "base_path": str(base)
         }
     except Exception as e:
@@ -137,6 +140,23 @@ async def llamaindex_health(workspace_id: str = "global"):
             "error": str(e)
         }
 
+@app.on_event("startup")
+async def start_warmup():
+    """后台预热嵌入模型、重排序模型与最近使用的工作区（不阻塞启动）"""
+    from app.services.warmup import get_warmup_manager
+    get_warmup_manager().start()
+
+@app.on_event("shutdown")
+async def flush_llamaindex_on_shutdown():
+    """退出前落盘各检索器尚未合并提交的索引变更，并关闭共享 LLM 连接池"""
+    import sys
+    retriever_module = sys.modules.get("app.services.llamaindex_retriever")
+    if retriever_module is not None:
+        await asyncio.to_thread(retriever_module.flush_all_retrievers)
+    llm_module = sys.modules.get("app.services.llm_registry")
+    if llm_module is not None:
+        await llm_module.get_llm_registry().aclose()
+
 # 内存存储（临时替代数据库）
 workspaces_db = []
 documents_db = []
@@ -168,6 +188,17 @@ async def health_check():
         "timestamp": datetime.now().isoformat()
     }
 
+@app.get("/api/ready")
+async def readiness_check():
+    """就绪检查：模型与热点工作区预热完成前返回 503"""
+    from fastapi.responses import JSONResponse
+    from app.services.warmup import get_warmup_manager
+    warmup_status = get_warmup_manager().get_status()
+    return JSONResponse(
+        status_code=200 if warmup_status["ready"] else 503,
+        content={**warmup_status, "timestamp": datetime.now().isoformat()}
+    )
+
 # 旧的工作区API已删除，使用新的RAG集成版本
 
 # 旧的文档API已删除，使用新的RAG集成版本
@@ -393,42 +424,46 @@ async def get_chat_history(workspace_id: str):
         "actions": actions
     }
 
+def _parse_langgraph_request(data: dict):
+    """解析 LangGraph 对话请求，返回 (问题, 工作区, 过滤条件)；过滤条件非法时抛出 ValueError"""
+    question = data.get("question") or data.get("message", "")
+    workspace_id = data.get("workspace_id") or data.get("workspaceId", "global")
+    filters = data.get("filters") or {}
+    
+    # 检索过滤条件（document_id / original_filename / file_type / sheet / upload_time）
+    from app.services.metadata_index import validate_filters
+    validate_filters(filters)
+    return question, workspace_id, filters
+
+def _create_langgraph_workflow(workspace_id: str):
+    """创建本次请求的 LangGraph 工作流（检索器与 LLM 均为进程级缓存，编译图进程内共享）"""
+    from app.services.llamaindex_retriever import get_retriever
+    from app.services.llm_registry import get_llm
+    from app.workflows.langgraph_rag_workflow import LangGraphRAGWorkflow
+    
+    logger.info(f"获取检索器: workspace_id={workspace_id}")
+    return LangGraphRAGWorkflow(
+        workspace_retriever=get_retriever(workspace_id),
+        global_retriever=get_retriever("global"),
+        llm=get_llm(temperature=0.1)
+    )
+
 @app.post("/api/chat/langgraph")
 async def chat_with_langgraph(data: dict):
     """LangGraph 智能 RAG API"""
     logger.info(f"收到 LangGraph 请求: {data}")
     try:
-        question = data.get("question") or data.get("message", "")
-        workspace_id = data.get("workspace_id") or data.get("workspaceId", "global")
-        
-        logger.info(f"处理问题: {question}, 工作区: {workspace_id}")
-        
-        # 导入新组件
-        logger.info("导入 LlamaIndexRetriever 和 LangGraphRAGWorkflow...")
-        from app.services.llamaindex_retriever import get_retriever
-        from app.workflows.langgraph_rag_workflow import LangGraphRAGWorkflow
-        
-        # 获取或创建检索器（使用缓存避免重复加载）
-        logger.info(f"获取检索器: workspace_id={workspace_id}")
-        workspace_retriever = get_retriever(workspace_id)
-        global_retriever = get_retriever("global")
+        try:
+            question, workspace_id, filters = _parse_langgraph_request(data)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
         
-        # 获取 LLM
-        logger.info("初始化 LangChainRAGService...")
-        from app.services.langchain_rag_service import LangChainRAGService
-        rag_service = LangChainRAGService(vector_db_path="langchain_vector_db")
-        
-        logger.info("LLM 初始化完成，创建 LangGraphRAGWorkflow...")
-        # 创建工作流
-        workflow = LangGraphRAGWorkflow(
-            workspace_retriever=workspace_retriever,
-            global_retriever=global_retriever,
-            llm=rag_service.llm
-        )
+        logger.info(f"处理问题: {question}, 工作区: {workspace_id}, 过滤条件: {filters}")
+        workflow = _create_langgraph_workflow(workspace_id)
         
         # 执行工作流
         logger.info("开始执行工作流...")
-        result = await workflow.run(question, workspace_id)
+        result = await workflow.run(question, workspace_id, filters=filters)
         
         logger.info("工作流执行完成，返回结果")
         return {
@@ -436,6 +471,8 @@ async def chat_with_langgraph(data: dict):
             "sources": result["sources"],
             "metadata": result["metadata"]
         }
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"LangGraph 查询失败: {e}", exc_info=True)
         import traceback
@@ -446,6 +483,63 @@ async def chat_with_langgraph(data: dict):
             "metadata": {"error": str(e)}
         }
 
+@app.post("/api/chat/langgraph/stream")
+async def chat_with_langgraph_stream(data: dict):
+    """LangGraph 智能 RAG 流式 API（SSE）：检索完成即推送来源，随后逐 token 推送答案"""
+    from fastapi.responses import StreamingResponse
+    try:
+        question, workspace_id, filters = _parse_langgraph_request(data)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    logger.info(f"收到 LangGraph 流式请求: {question}, 工作区: {workspace_id}, 过滤条件: {filters}")
+    
+    async def event_source():
+        try:
+            workflow = _create_langgraph_workflow(workspace_id)
+            async with contextlib.aclosing(workflow.astream(question, workspace_id, filters=filters)) as events:
+                async for event in events:
+                    yield f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False, default=str)}\n\n"
+        except Exception as e:
+            logger.error(f"LangGraph 流式查询失败: {e}", exc_info=True)
+            yield f"event: error\ndata: {json.dumps({'type': 'error', 'message': str(e)}, ensure_ascii=False)}\n\n"
+    
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def _ws_send_json(websocket: WebSocket, payload: dict):
+    """发送一条事件；连接已关闭时的发送失败统一视为断开（抛出 WebSocketDisconnect）"""
+    try:
+        await websocket.send_text(json.dumps(payload, ensure_ascii=False, default=str))
+    except WebSocketDisconnect:
+        raise
+    except Exception as e:
+        raise WebSocketDisconnect(code=1006, reason=str(e)) from e
+
+@app.websocket("/ws/chat/langgraph")
+async def chat_with_langgraph_ws(websocket: WebSocket):
+    """LangGraph 智能 RAG 流式 API（WebSocket）：每条请求消息对应一组与 SSE 相同的事件"""
+    await websocket.accept()
+    try:
+        while True:
+            data = await websocket.receive_json()
+            try:
+                question, workspace_id, filters = _parse_langgraph_request(data)
+                workflow = _create_langgraph_workflow(workspace_id)
+                # 断开时立即关闭生成器，停止后续检索与 LLM 调用
+                async with contextlib.aclosing(workflow.astream(question, workspace_id, filters=filters)) as events:
+                    async for event in events:
+                        await _ws_send_json(websocket, event)
+            except WebSocketDisconnect:
+                raise
+            except Exception as e:
+                logger.error(f"LangGraph WebSocket 查询失败: {e}", exc_info=True)
+                await _ws_send_json(websocket, {"type": "error", "message": str(e)})
+    except WebSocketDisconnect:
+        logger.info("LangGraph 流式 WebSocket 已断开")
+
 @app.post("/api/document/generate-deepresearch")
 async def generate_deepresearch_document(data: dict):
     """DeepResearch 风格长文档生成 API"""
@@ -459,16 +553,14 @@ async def generate_deepresearch_document(data: dict):
         
         # 导入新组件
         from app.services.llamaindex_retriever import get_retriever
-        from app.workflows.deepresearch_doc_workflow import DeepResearchDocWorkflow
+        from app.workflows.deepresearch_doc_workflow import DeepResearchDocWorkflow, get_deepresearch_llm
         from app.services.web_search_service import get_web_search_service
         
         # 获取或创建检索器（使用缓存单例，避免重复加载模型和索引）
         workspace_retriever = get_retriever(workspace_id)
         global_retriever = get_retriever("global")
         
-        # 获取 LLM 和网络搜索服务
-        from app.services.langchain_rag_service import LangChainRAGService
-        rag_service = LangChainRAGService(vector_db_path="langchain_vector_db")
+        # 获取共享 LLM 客户端（长超时）和网络搜索服务
         web_search_service = get_web_search_service()
         
         # 创建文档生成工作流
@@ -476,7 +568,7 @@ async def generate_deepresearch_document(data: dict):
             workspace_retriever=workspace_retriever,
             global_retriever=global_retriever,
             web_search_service=web_search_service,
-            llm=rag_service.llm
+            llm=get_deepresearch_llm()
         )
         
         # 执行工作流
@@ -1139,8 +1231,6 @@ async def upload_document_for_rag(
                 "extract_images": extract_images
             }
         )
-        # 持久化到 llamaindex_storage/<workspace_id>
-        retriever.index.storage_context.persist(persist_dir=str(retriever.storage_dir))
         
         if added:
             return {
@@ -1235,7 +1325,6 @@ async def process_document_async(task_id: str, file_path: str, workspace_id: str
                 "source": "async_processing"
             }
         )
-        retriever_async.index.storage_context.persist(persist_dir=str(retriever_async.storage_dir))
         success = bool(added_cnt)
         
         if success:
@@ -1341,7 +1430,6 @@ async def process_global_document_async(task_id: str, file_path: str):
                 "source": "global_async_processing"
             }
         )
-        retriever_global.index.storage_context.persist(persist_dir=str(retriever_global.storage_dir))
         success = bool(added_cnt)
         
         if success:
@@ -1432,7 +1520,6 @@ async def process_zip_async(task_id: str, zip_path: str, workspace_id: str = "gl
                         "file_type": file_info['file_type']
                     }
                 )
-                zip_retriever.index.storage_context.persist(persist_dir=str(zip_retriever.storage_dir))
                 success = bool(added_cnt)
                 
                 # 为每个内部文件生成唯一ID（用于后续保存到JSON）
@@ -1465,8 +1552,10 @@ async def process_zip_async(task_id: str, zip_path: str, workspace_id: str = "gl
         # 创建所有任务
         tasks = [process_with_semaphore(file_info, idx) for idx, file_info in enumerate(extracted_files)]
         
-        # 等待所有任务完成
-        results = await asyncio.gather(*tasks)
+        # 等待所有任务完成（批处理期间只累积变更，结束后统一持久化一次索引）
+        from app.services.llamaindex_retriever import get_retriever as _get_batch_retriever
+        with _get_batch_retriever(workspace_id).persist_batch():
+            results = await asyncio.gather(*tasks)
         
         # 统计结果
         successful = sum(1 for r in results if r['success'])
@@ -1721,11 +1810,22 @@ async def get_cache_stats_api():
     try:
         from app.services.smart_cache_manager import get_cache_manager
         
+        from app.services.llamaindex_retriever import get_retriever_cache_stats
+        from app.services.executors import get_executor_stats
+        from app.services.llm_registry import get_llm_registry
+        from app.workflows.graph_runtime import get_runtime_stats
+        from app.services.local_intent_classifier import get_local_intent_classifier
+        
         cache_manager = get_cache_manager()
         stats = cache_manager.get_all_stats()
         
         return {
             "cache_stats": stats,
+            "retriever_cache": get_retriever_cache_stats(),
+            "executors": get_executor_stats(),
+            "llm_clients": get_llm_registry().get_stats(),
+            "workflows": get_runtime_stats(),
+            "intent_classifier": get_local_intent_classifier().get_stats(),
             "timestamp": datetime.now().isoformat()
         }
         
@@ -1751,6 +1851,22 @@ async def clear_cache_api():
         logger.error(f"清空缓存失败: {str(e)}")
         raise HTTPException(status_code=500, detail=f"清空缓存失败: {str(e)}")
 
+# 嵌入模型API
+@app.get("/api/embedding/models")
+async def get_embedding_models_api():
+    """获取常驻嵌入模型及内存占用API"""
+    try:
+        from app.services.embedding_registry import get_embedding_registry
+        
+        return {
+            "embedding_models": get_embedding_registry().get_stats(),
+            "timestamp": datetime.now().isoformat()
+        }
+        
+    except Exception as e:
+        logger.error(f"获取嵌入模型统计失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"获取嵌入模型统计失败: {str(e)}")
+
 # WebSocket端点
 @app.websocket("/ws/status/{workspace_id}")
 async def websocket_status_endpoint(websocket: WebSocket, workspace_id: str):
@@ -0,0 +1,99 @@
+"""
+FAISS ANN 索引测试
+"""
+
+import time
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("faiss")
+pytest.importorskip("llama_index.core")
+
+from llama_index.core.schema import TextNode
+from llama_index.core.vector_stores.types import VectorStoreQuery
+
+from app.services.ann_index import FaissAnnIndex, normalize_rows
+from app.services.segment_vector_store import SegmentVectorStore
+
+
+def _wait_built(ann, builds, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if ann.total_builds >= builds and not ann.get_stats()["building"]:
+            return
+        time.sleep(0.01)
+    raise AssertionError("ANN 索引未在超时前构建完成")
+
+
+@pytest.mark.parametrize("index_type", ["hnsw", "ivf"])
+def test_index_type_follows_size_and_reports_recall(index_type):
+    vectors = normalize_rows(np.random.default_rng(0).normal(size=(2000, 32)))
+    ids = [f"n{i}" for i in range(len(vectors))]
+
+    small = FaissAnnIndex(flat_max_nodes=5000, index_type=index_type)
+    small.rebuild(lambda: (vectors, ids, frozenset({1})))
+    assert small.snapshot.kind == "flat"
+    assert small.last_recall == 1.0
+
+    large = FaissAnnIndex(flat_max_nodes=500, index_type=index_type, ivf_nprobe=32)
+    large.rebuild(lambda: (vectors, ids, frozenset({1})))
+    assert large.snapshot.kind.startswith(index_type)
+    assert large.last_recall >= 0.8
+    assert large.snapshot.search(vectors[7], 1)[0][0] == "n7"
+
+
+def test_segment_store_merges_ann_and_unindexed_segments(tmp_path):
+    store = SegmentVectorStore(str(tmp_path))
+    store.add([
+        TextNode(id_=f"a{i}", text=f"a{i}", embedding=[1.0, i / 10.0])
+        for i in range(5)
+    ])
+    ann = FaissAnnIndex(flat_max_nodes=100)
+    store.attach_ann_index(ann, rebuild_ratio=10)
+    _wait_built(ann, 1)
+
+    # 构建后新增的段不在 ANN 中，需逐段计算；已删除节点需从 ANN 结果中剔除
+    store.add([TextNode(id_="b0", text="b0", embedding=[1.0, 0.05])])
+    store.remove_nodes(["a0"])
+    result = store.query(VectorStoreQuery(query_embedding=[1.0, 0.0], similarity_top_k=2))
+
+    assert ann.total_builds == 1
+    assert result.ids == ["b0", "a1"]
+    assert store.get_stats()["ann"]["kind"] == "flat"
+
+
+def test_nodes_added_after_clearing_and_compacting_are_searchable(tmp_path):
+    store = SegmentVectorStore(str(tmp_path))
+    ann = FaissAnnIndex(flat_max_nodes=100)
+    store.add([TextNode(id_=f"a{i}", text=f"a{i}", embedding=[1.0, i / 10.0]) for i in range(5)])
+    store.attach_ann_index(ann, rebuild_ratio=10)
+    _wait_built(ann, 1)
+    assert ann.snapshot.covered_segments == frozenset({1})
+
+    store.remove_nodes([f"a{i}" for i in range(5)])
+    store.compact(force=True)
+    assert ann.snapshot is None
+
+    store.add([TextNode(id_=f"b{i}", text=f"b{i}", embedding=[1.0, i / 10.0]) for i in range(5)])
+    result = store.query(VectorStoreQuery(query_embedding=[1.0, 0.0], similarity_top_k=2))
+    assert result.ids == ["b0", "b1"]
+
+
+def test_deletes_count_toward_the_rebuild_threshold(tmp_path):
+    store = SegmentVectorStore(str(tmp_path))
+    ann = FaissAnnIndex(flat_max_nodes=100, oversample=1)
+    store.add([TextNode(id_=f"a{i}", text=f"a{i}", embedding=[1.0, i / 10.0]) for i in range(10)])
+    store.attach_ann_index(ann, rebuild_ratio=0.3)
+    _wait_built(ann, 1)
+
+    # 删除 2 行未超过阈值，不重建
+    store.remove_nodes(["a0", "a1"])
+    assert ann.total_builds == 1
+
+    # 已删除行超过快照的 30%：重建后 ANN 不再被失效候选占满
+    store.remove_nodes(["a2", "a3"])
+    _wait_built(ann, 2)
+    assert len(ann.snapshot) == 6
+    result = store.query(VectorStoreQuery(query_embedding=[1.0, 0.0], similarity_top_k=3))
+    assert result.ids == ["a4", "a5", "a6"]
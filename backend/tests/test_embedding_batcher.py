@@ -0,0 +1,78 @@
+"""
+嵌入微批处理器测试
+"""
+
+import asyncio
+
+import pytest
+
+from app.services.embedding_batcher import EmbeddingBatcher
+
+
+def _fake_encode(calls):
+    """返回记录每次批量调用的伪编码函数"""
+    def encode(texts):
+        calls.append(list(texts))
+        return [[float(len(t)), 1.0] for t in texts]
+    return encode
+
+
+def test_concurrent_requests_are_merged_into_one_batch():
+    """等待窗口内的并发请求合并为一次编码"""
+    calls = []
+    batcher = EmbeddingBatcher(_fake_encode(calls), max_batch_size=16, max_wait_ms=50)
+    try:
+        futures = batcher.submit_many(["a", "bb", "ccc", "dddd"])
+        results = [f.result(timeout=5) for f in futures]
+    finally:
+        batcher.shutdown()
+
+    assert results == [[1.0, 1.0], [2.0, 1.0], [3.0, 1.0], [4.0, 1.0]]
+    assert len(calls) == 1
+    assert batcher.get_stats()["max_observed_batch"] == 4
+
+
+def test_batch_size_is_bounded_and_duplicates_encoded_once():
+    """超过最大批量时拆批，同批内重复文本只编码一次"""
+    calls = []
+    batcher = EmbeddingBatcher(_fake_encode(calls), max_batch_size=2, max_wait_ms=50)
+    try:
+        futures = batcher.submit_many(["x", "x", "y", "z"])
+        results = [f.result(timeout=5) for f in futures]
+    finally:
+        batcher.shutdown()
+
+    assert results[0] == results[1]
+    assert all(len(batch) <= 2 for batch in calls)
+    assert calls[0] == ["x"]
+
+
+def test_encode_error_is_propagated_to_callers():
+    """编码失败时所有调用方都收到异常"""
+    def failing_encode(texts):
+        raise RuntimeError("boom")
+
+    batcher = EmbeddingBatcher(failing_encode, max_batch_size=8, max_wait_ms=1)
+    try:
+        future = batcher.submit("q")
+        with pytest.raises(RuntimeError):
+            future.result(timeout=5)
+    finally:
+        batcher.shutdown()
+
+
+def test_aencode_from_multiple_coroutines():
+    """异步接口可被多个协程并发等待"""
+    calls = []
+    batcher = EmbeddingBatcher(_fake_encode(calls), max_batch_size=32, max_wait_ms=20)
+
+    async def run():
+        return await asyncio.gather(*[batcher.aencode(q) for q in ["q1", "q22", "q333"]])
+
+    try:
+        results = asyncio.run(run())
+    finally:
+        batcher.shutdown()
+
+    assert [r[0] for r in results] == [2.0, 3.0, 4.0]
+    assert sum(len(batch) for batch in calls) == 3
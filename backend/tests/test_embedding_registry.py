@@ -0,0 +1,80 @@
+"""
+嵌入模型注册表测试（按模型路径 / 设备共享同一份模型，归一化按调用区分）
+"""
+
+import threading
+
+import pytest
+
+from app.services import embedding_registry
+from app.services.embedding_registry import EmbeddingEngine, EmbeddingModelRegistry
+
+
+class _FakeEngine:
+    loads = 0
+
+    def __init__(self, model_path, device='cpu', batch_size=32):
+        type(self).loads += 1
+        self.model_path = model_path
+        self.device = device
+        self.calls = []
+        self._langchain_adapters = {}
+
+    as_langchain = EmbeddingEngine.as_langchain
+
+    def encode_query(self, text, normalize=True):
+        self.calls.append(normalize)
+        return [0.0]
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    _FakeEngine.loads = 0
+    monkeypatch.setattr(embedding_registry, "EmbeddingEngine", _FakeEngine)
+    monkeypatch.delenv("LOCAL_BGE_MODEL_DIR", raising=False)
+    monkeypatch.delenv("CUDA_VISIBLE_DEVICES", raising=False)
+    return EmbeddingModelRegistry()
+
+
+def test_default_and_explicit_arguments_share_one_engine(registry):
+    engine = registry.get_engine()
+    assert registry.get_engine(embedding_registry.DEFAULT_BGE_MODEL_NAME) is engine
+    assert registry.get_engine(device=embedding_registry.resolve_device()) is engine
+    assert _FakeEngine.loads == 1
+    assert registry.is_loaded()
+
+
+def test_gpu_hosts_resolve_the_same_device_for_every_caller(registry, monkeypatch):
+    monkeypatch.setenv("CUDA_VISIBLE_DEVICES", "0")
+    # 不显式传 device 的调用方都按同一规则落到 cuda，只加载一次
+    assert registry.get_engine().device == "cuda"
+    assert registry.get_engine(device="cuda") is registry.get_engine()
+    assert _FakeEngine.loads == 1
+
+    # 显式指定不同设备才会另加载
+    registry.get_engine(device="cpu")
+    assert _FakeEngine.loads == 2
+
+
+def test_normalize_settings_share_one_engine(registry):
+    normalized = registry.get_langchain_embeddings(normalize=True)
+    raw = registry.get_langchain_embeddings(normalize=False)
+    assert _FakeEngine.loads == 1
+    assert normalized.engine is raw.engine
+    assert registry.get_langchain_embeddings() is normalized
+
+    # 归一化方式随每次编码传给模型
+    normalized.embed_query("问题")
+    raw.embed_query("问题")
+    assert normalized.engine.calls == [True, False]
+
+
+def test_concurrent_first_use_loads_once(registry):
+    engines = []
+    threads = [threading.Thread(target=lambda: engines.append(registry.get_engine())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert _FakeEngine.loads == 1
+    assert all(engine is engines[0] for engine in engines)
@@ -0,0 +1,124 @@
+"""
+持久化内容寻址嵌入存储测试
+"""
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from app.services.embedding_store import EmbeddingStore, make_model_id
+
+
+def _counting_encoder(calls):
+    def encode(texts):
+        calls.append(list(texts))
+        return np.array([[float(len(t)), 1.0, 0.0] for t in texts], dtype=np.float32)
+    return encode
+
+
+def test_only_unseen_texts_are_encoded(tmp_path):
+    """已存储的文本不再调用模型"""
+    calls = []
+    store = EmbeddingStore(str(tmp_path), "m", dimension=3)
+
+    first = store.encode_with_store(["a", "bb", "a"], _counting_encoder(calls))
+    second = store.encode_with_store(["bb", "ccc"], _counting_encoder(calls))
+
+    assert calls == [["a", "bb"], ["ccc"]]
+    assert first.shape == (3, 3)
+    assert np.allclose(first[0], first[2])
+    assert np.allclose(second[0], [2.0, 1.0, 0.0])
+    assert store.get_stats()["hits"] == 1
+
+
+def test_store_survives_reopen(tmp_path):
+    """重新打开后仍可命中，向量通过 mmap 读取"""
+    store = EmbeddingStore(str(tmp_path), "m", dimension=3)
+    store.put_many(["x", "yy"], [[1, 2, 3], [4, 5, 6]])
+
+    reopened = EmbeddingStore(str(tmp_path), "m", dimension=3)
+    vectors = reopened.get_many(["yy", "missing"])
+
+    assert len(reopened) == 2
+    assert np.allclose(vectors[0], [4, 5, 6])
+    assert vectors[1] is None
+
+
+def test_torn_write_is_truncated_on_load(tmp_path):
+    """向量文件残缺行在加载时被截断，键不会指向不完整的向量"""
+    store = EmbeddingStore(str(tmp_path), "m", dimension=3)
+    store.put_many(["x"], [[1, 2, 3]])
+    with open(store.vectors_path, "ab") as f:
+        f.write(b"\x00" * 5)
+
+    reopened = EmbeddingStore(str(tmp_path), "m", dimension=3)
+
+    assert len(reopened) == 1
+    assert reopened.vectors_path.stat().st_size == 12
+
+
+def test_dimension_mismatch_is_rejected(tmp_path):
+    EmbeddingStore(str(tmp_path), "m", dimension=3)
+    with pytest.raises(ValueError):
+        EmbeddingStore(str(tmp_path), "m", dimension=4)
+
+
+def test_model_id_is_stable_and_path_safe():
+    model_id = make_model_id("/models/bge-large-zh-v1.5/")
+    assert model_id == make_model_id("/models/bge-large-zh-v1.5/")
+    assert model_id.startswith("bge-large-zh-v1.5-")
+    assert model_id != make_model_id("/models/bge-large-zh-v1.5/", normalize=False)
+
+
+def test_failed_append_does_not_shift_later_rows(tmp_path, monkeypatch):
+    """向量已落盘但键写入失败时，下一次追加的行号仍与键对齐"""
+    import app.services.embedding_store as embedding_store
+
+    store = EmbeddingStore(str(tmp_path), "m", dimension=3)
+    store.put_many(["x"], [[1, 2, 3]])
+
+    real_fsync, calls = embedding_store.os.fsync, []
+
+    def failing_fsync(fd):
+        calls.append(fd)
+        if len(calls) == 2:
+            raise OSError("disk full")
+        real_fsync(fd)
+
+    monkeypatch.setattr(embedding_store.os, "fsync", failing_fsync)
+    with pytest.raises(OSError):
+        store.put_many(["lost"], [[9, 9, 9]])
+    monkeypatch.setattr(embedding_store.os, "fsync", real_fsync)
+
+    store.put_many(["yy"], [[4, 5, 6]])
+    for current in (store, EmbeddingStore(str(tmp_path), "m", dimension=3)):
+        x, lost, yy = current.get_many(["x", "lost", "yy"])
+        assert np.allclose(x, [1, 2, 3])
+        assert lost is None
+        assert np.allclose(yy, [4, 5, 6])
+    assert store.vectors_path.stat().st_size == 2 * store.row_bytes
+
+
+def test_torn_key_line_does_not_shift_later_rows(tmp_path):
+    """崩溃留下残缺键行时，重新打开后新写入的键仍对应自己的向量"""
+    from app.services.embedding_store import text_digest
+
+    store = EmbeddingStore(str(tmp_path), "m", dimension=3)
+    store.put_many(["a", "b"], [[1, 0, 0], [2, 0, 0]])
+    with open(store.vectors_path, "ab") as f:
+        f.write(np.array([3, 0, 0], dtype=np.float32).tobytes())
+    with open(store.keys_path, "a", encoding="utf-8") as f:
+        f.write(text_digest("c")[:10])
+
+    reopened = EmbeddingStore(str(tmp_path), "m", dimension=3)
+    assert len(reopened) == 2
+    assert reopened.keys_path.stat().st_size == 2 * reopened.key_bytes
+    reopened.put_many(["d", "e"], [[4, 0, 0], [5, 0, 0]])
+
+    final = EmbeddingStore(str(tmp_path), "m", dimension=3)
+    a, b, c, d, e = final.get_many(["a", "b", "c", "d", "e"])
+    assert np.allclose(a, [1, 0, 0])
+    assert np.allclose(b, [2, 0, 0])
+    assert c is None
+    assert np.allclose(d, [4, 0, 0])
+    assert np.allclose(e, [5, 0, 0])
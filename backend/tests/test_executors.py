@@ -0,0 +1,88 @@
+"""
+检索 / 入库线程池测试（并发上限、排队深度统计、异常计数）
+"""
+
+import asyncio
+import sys
+import threading
+import types
+
+import pytest
+
+from app.services.executors import BoundedExecutor
+
+
+def test_queue_depth_is_tracked_when_workers_are_saturated():
+    executor = BoundedExecutor("test", max_workers=1)
+    release = threading.Event()
+
+    async def main():
+        tasks = [asyncio.ensure_future(executor.run(release.wait, 5)) for _ in range(3)]
+        while executor.get_stats()["running"] < 1:
+            await asyncio.sleep(0.01)
+        stats = executor.get_stats()
+        release.set()
+        await asyncio.gather(*tasks)
+        return stats
+
+    saturated = asyncio.run(main())
+    assert saturated["running"] == 1
+    assert saturated["queued"] == 2
+
+    stats = executor.get_stats()
+    assert stats["max_queue_depth"] >= 2
+    assert stats["queued"] == 0 and stats["running"] == 0
+    assert stats["completed"] == 3
+    executor.shutdown()
+
+
+def test_exceptions_propagate_and_are_counted():
+    executor = BoundedExecutor("test", max_workers=2)
+
+    def boom():
+        raise ValueError("boom")
+
+    async def main():
+        assert await executor.run(sum, [1, 2, 3]) == 6
+        with pytest.raises(ValueError):
+            await executor.run(boom)
+
+    asyncio.run(main())
+    stats = executor.get_stats()
+    assert stats["completed"] == 2
+    assert stats["failed"] == 1
+    executor.shutdown()
+
+
+def test_chat_reranking_runs_on_the_query_executor(monkeypatch):
+    pytest.importorskip("langgraph")
+    from app.services import executors
+    from app.workflows.langgraph_rag_workflow import LangGraphRAGWorkflow
+
+    class _Service:
+        thread = None
+
+        def is_available(self):
+            return True
+
+        def rerank_with_budget(self, query, docs, top_k, budget_ms):
+            self.thread = threading.current_thread().name
+            return docs[:top_k], {"applied": True}
+
+    service = _Service()
+    executor = BoundedExecutor("retrieval", max_workers=1)
+    monkeypatch.setattr(executors, "_query_executor", executor)
+    # 替换整个 reranker_service 模块（真实模块需要 torch）
+    monkeypatch.setitem(
+        sys.modules, "app.services.reranker_service",
+        types.SimpleNamespace(get_reranker_service_if_ready=lambda: service)
+    )
+    workflow = LangGraphRAGWorkflow(object(), object(), llm=object())
+    workflow.rerank_enabled = True
+
+    docs, info = asyncio.run(workflow._rerank_docs("q", [{"content": "a"}, {"content": "b"}], 1))
+
+    assert docs == [{"content": "a"}] and info == {"applied": True}
+    assert service.thread.startswith("retrieval-worker")
+    assert executor.get_stats()["completed"] == 1
+    executor.shutdown()
@@ -0,0 +1,78 @@
+"""
+工作流运行时测试（编译图进程内共享、按实例分派节点、独立 thread_id、有界检查点）
+"""
+
+import asyncio
+from typing import TypedDict
+
+import pytest
+
+pytest.importorskip("langgraph")
+
+from langgraph.graph import StateGraph, END
+
+from app.workflows.graph_runtime import BoundedMemorySaver, get_compiled_graph, run_config, workflow_node
+
+
+class _State(TypedDict):
+    value: int
+
+
+class _AddWorkflow:
+    builds = 0
+
+    def __init__(self, step):
+        self.step = step
+
+    @classmethod
+    def _build_graph(cls):
+        cls.builds += 1
+        workflow = StateGraph(_State)
+        workflow.add_node("add", workflow_node(cls._add_node))
+        workflow.set_entry_point("add")
+        workflow.add_conditional_edges("add", workflow_node(cls._route), {"again": "add", "done": END})
+        return workflow
+
+    async def _add_node(self, state):
+        await asyncio.sleep(0)
+        return {"value": state["value"] + self.step}
+
+    def _route(self, state):
+        return "again" if state["value"] < 10 * self.step else "done"
+
+    async def run(self, value):
+        graph = get_compiled_graph(type(self))
+        return await graph.ainvoke({"value": value}, config=run_config(self, "test"))
+
+
+def test_graph_is_compiled_once_and_runs_dispatch_to_their_own_instance():
+    async def main():
+        return await asyncio.gather(*[_AddWorkflow(step).run(0) for step in (1, 2, 3)])
+
+    results = asyncio.run(main())
+    assert [result["value"] for result in results] == [10, 20, 30]
+    assert _AddWorkflow.builds == 1
+
+
+def test_run_config_uses_unique_thread_ids():
+    first, second = run_config(object(), "rag"), run_config(object(), "rag")
+    assert first["configurable"]["thread_id"] != second["configurable"]["thread_id"]
+    assert run_config(object(), "p", recursion_limit=10)["recursion_limit"] == 10
+
+
+def test_bounded_saver_evicts_oldest_threads():
+    saver = BoundedMemorySaver(max_threads=2, ttl_s=3600)
+    graph = _AddWorkflow._build_graph().compile(checkpointer=saver)
+
+    async def main():
+        thread_ids = []
+        for _ in range(4):
+            config = run_config(_AddWorkflow(5), "bounded")
+            await graph.ainvoke({"value": 0}, config=config)
+            thread_ids.append(config["configurable"]["thread_id"])
+        return thread_ids
+
+    thread_ids = asyncio.run(main())
+    assert set(saver.storage.keys()) == set(thread_ids[-2:])
+    assert saver.get_stats()["threads"] == 2
+    assert saver.get_stats()["evictions"] == 2
@@ -0,0 +1,129 @@
+"""
+混合检索器测试（FAISS 向量检索 ID 映射、RRF 融合排序、docstore 缺失的 ID、BM25 增量维护）
+"""
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("faiss")
+pytest.importorskip("torch")
+pytest.importorskip("langchain_community.vectorstores")
+
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import Embeddings
+
+from app.services import hybrid_retriever
+from app.services.hybrid_retriever import HybridRetriever
+
+_VECTORS = {
+    "苹果 价格": [1.0, 0.0, 0.0],
+    "香蕉 价格": [0.8, 0.6, 0.0],
+    "会议 纪要": [0.0, 0.0, 1.0],
+    "价格": [1.0, 0.0, 0.0],
+    "梨子 价格": [0.6, 0.8, 0.0],
+}
+
+
+class _TableEmbeddings(Embeddings):
+    """按文本查表的确定性嵌入"""
+
+    def embed_documents(self, texts):
+        return [_VECTORS[text] for text in texts]
+
+    def embed_query(self, text):
+        return _VECTORS[text]
+
+
+class _StubRegistry:
+    def get_langchain_embeddings(self, model_name=None, normalize=True):
+        return _TableEmbeddings()
+
+
+class _UnavailableReranker:
+    def is_available(self):
+        return False
+
+
+@pytest.fixture
+def retriever(tmp_path, monkeypatch):
+    """在 tmp_path 下保存一个 3 条文档的 FAISS 库，再通过构造函数加载"""
+    monkeypatch.setattr(hybrid_retriever, "get_embedding_registry", _StubRegistry)
+    monkeypatch.setattr(hybrid_retriever, "get_reranker_service", _UnavailableReranker)
+    monkeypatch.delenv("LOCAL_BGE_MODEL_DIR", raising=False)
+
+    texts = ["苹果 价格", "香蕉 价格", "会议 纪要"]
+    store = FAISS.from_texts(texts, _TableEmbeddings(), ids=["apple", "banana", "minutes"])
+    store.save_local(str(tmp_path / "workspace_ws"))
+    return HybridRetriever("ws", vector_db_path=str(tmp_path))
+
+
+def test_vector_search_maps_faiss_rows_to_docstore_ids(retriever):
+    ids, scores = retriever._vector_search_ids("价格", top_k=10)
+
+    # top_k 大于库内条数时 FAISS 返回的 -1 行被丢弃
+    assert list(ids) == ["apple", "banana", "minutes"]
+    assert scores.dtype == np.float32
+    assert list(scores) == sorted(scores, reverse=True)
+    assert scores[0] == pytest.approx(1.0)
+
+
+def test_ids_missing_from_docstore_are_skipped_when_materialized(retriever):
+    del retriever.vector_store.docstore._dict["apple"]
+
+    ids, _ = retriever._vector_search_ids("价格", top_k=2)
+    results = retriever._vector_search("价格", top_k=2)
+
+    assert list(ids) == ["apple", "banana"]
+    assert [r["doc_id"] for r in results] == ["banana"]
+    assert results[0]["rank"] == 1
+    assert "vector_score" in results[0]
+
+
+def test_rrf_fusion_ranks_by_weighted_reciprocal_rank(retriever):
+    bm25_ids = np.array(["banana", "apple"], dtype=object)
+    vector_ids = np.array(["apple", "minutes", "banana"], dtype=object)
+
+    ids, scores = retriever._rrf_fusion_ids(bm25_ids, vector_ids)
+
+    k = retriever.rrf_k
+    expected = {
+        "apple": retriever.bm25_weight / (k + 2) + retriever.vector_weight / (k + 1),
+        "banana": retriever.bm25_weight / (k + 1) + retriever.vector_weight / (k + 3),
+        "minutes": retriever.vector_weight / (k + 2),
+    }
+    assert list(ids) == ["apple", "banana", "minutes"]
+    assert scores == pytest.approx([expected[i] for i in ids])
+
+
+def test_rrf_fusion_ties_and_empty_inputs(retriever):
+    retriever.bm25_weight = retriever.vector_weight = 0.5
+
+    ids, scores = retriever._rrf_fusion_ids(
+        np.array(["minutes"], dtype=object), np.array(["apple"], dtype=object)
+    )
+    # 同分时按 ID 排序，结果稳定
+    assert list(ids) == ["apple", "minutes"]
+    assert scores[0] == scores[1]
+
+    ids, scores = retriever._rrf_fusion_ids(np.empty(0, dtype=object), np.empty(0, dtype=object))
+    assert ids.size == 0 and scores.size == 0
+
+
+class _NoScanDict(dict):
+    """禁止按条目遍历的 docstore，确认增量维护不扫描整个语料"""
+
+    def items(self):
+        raise AssertionError("docstore scanned")
+
+
+def test_bm25_is_maintained_from_changed_ids_only(retriever):
+    docstore = retriever.vector_store.docstore
+    docstore._dict = _NoScanDict(docstore._dict)
+
+    retriever.add_documents([{"content": "梨子 价格", "metadata": {}}])
+    new_ids = [doc_id for doc_id, _ in retriever.bm25_index.search("梨子")]
+    retriever._remove_bm25_documents(["apple"])
+
+    assert len(new_ids) == 1 and new_ids[0] in docstore._dict
+    assert len(retriever.bm25_index) == 3
+    assert "apple" not in retriever.bm25_index
@@ -0,0 +1,86 @@
+"""
+二级索引增量持久化测试（快照 + 追加日志、未变更不写、日志过长重写快照、残缺日志行）
+"""
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from app.services import index_journal
+from app.services.index_journal import journal_path
+from app.services.lexical_index import LexicalIndex
+from app.services.metadata_index import MetadataIndex
+
+
+def test_saves_append_only_changes_and_reload_replays_them(tmp_path):
+    path = tmp_path / "lexical.json"
+    index = LexicalIndex.build([(f"n{i}", f"文档 编号{i}") for i in range(3)])
+    assert index.save(path)
+    snapshot = path.read_bytes()
+
+    assert not index.save(path)
+    index.add("n3", "新增 内容")
+    index.remove(["n0"])
+    assert index.save(path)
+
+    # 快照不变，变更只追加到日志
+    assert path.read_bytes() == snapshot
+    assert len(journal_path(path).read_text(encoding="utf-8").splitlines()) == 3
+    reloaded = LexicalIndex.load(path)
+    assert sorted(reloaded.node_ids()) == ["n1", "n2", "n3"]
+    assert reloaded.search("内容") == index.search("内容")
+
+
+def test_long_log_is_compacted_into_a_new_snapshot(tmp_path, monkeypatch):
+    monkeypatch.setattr(index_journal, "_COMPACT_MIN_RECORDS", 2)
+    path = tmp_path / "metadata.json"
+    index = MetadataIndex.build([("a", {"document_id": "d1"})])
+    index.save(path)
+
+    index.add("b", {"document_id": "d1", "upload_time": "2024-01-05"})
+    index.save(path)
+    assert journal_path(path).exists()
+    index.add("c", {"document_id": "d2"})
+    index.remove(["a"])
+    index.save(path)
+
+    assert not journal_path(path).exists()
+    reloaded = MetadataIndex.load(path)
+    assert sorted(reloaded.lookup("document_id", "d1")) == ["b"]
+    assert reloaded.lookup("document_id", "d2") == ["c"]
+    assert reloaded.lookup_time_range(start=0) == {"b"}
+
+
+def test_torn_log_line_is_dropped_and_forces_a_snapshot(tmp_path):
+    path = tmp_path / "metadata.json"
+    index = MetadataIndex.build([("a", {"document_id": "d1"})])
+    index.save(path)
+    index.add("b", {"document_id": "d1"})
+    index.save(path)
+    with open(journal_path(path), "a", encoding="utf-8") as f:
+        f.write('{"op": "add", "id": "c"')
+
+    reloaded = MetadataIndex.load(path)
+    assert sorted(reloaded.node_ids()) == ["a", "b"]
+    reloaded.add("d", {"document_id": "d2"})
+    assert reloaded.save(path)
+
+    assert not journal_path(path).exists()
+    assert sorted(MetadataIndex.load(path).node_ids()) == ["a", "b", "d"]
+
+
+def test_stale_log_from_an_older_snapshot_is_ignored(tmp_path):
+    path = tmp_path / "lexical.json"
+    index = LexicalIndex.build([("a", "甲 文档")])
+    index.save(path)
+    index.add("b", "乙 文档")
+    index.save(path)
+    stale_log = journal_path(path).read_bytes()
+
+    # 重写快照后、删除旧日志前崩溃
+    index.remove(["b"])
+    index._journal.snapshot_needed = True
+    index.save(path)
+    journal_path(path).write_bytes(stale_log)
+
+    assert LexicalIndex.load(path).node_ids() == ["a"]
@@ -81,6 +81,114 @@ async def test_deepresearch_workflow_creation():
         pytest.skip(f"DeepResearch 工作流创建失败（可能缺少依赖）: {e}")
 
 
+@pytest.mark.asyncio
+async def test_langgraph_workflow_streams_sources_before_tokens():
+    """测试流式工作流：先推送来源，再逐 token 推送答案，最后返回含首 token 耗时的结果"""
+    from langchain_core.language_models import GenericFakeChatModel
+    from langchain_core.messages import AIMessage
+    from app.workflows.langgraph_rag_workflow import LangGraphRAGWorkflow
+
+    class MockRetriever:
+        async def retrieve(self, query, top_k=5, use_hybrid=True, use_compression=True):
+            return [{"content": "前海十二条的入驻条件", "score": 0.9, "metadata": {"filename": "policy.pdf"}}]
+
+    llm = GenericFakeChatModel(messages=iter([
+        AIMessage(content='{"intent": "simple_qa", "needs_retrieval": true, "complexity": "low", "requires_multi_hop": false}'),
+        AIMessage(content="入驻 条件 如下"),
+        AIMessage(content='{"score": 0.9, "needs_improvement": false}')
+    ]))
+    workflow = LangGraphRAGWorkflow(MockRetriever(), MockRetriever(), llm=llm)
+    workflow.rerank_enabled = False
+
+    events = [event async for event in workflow.astream("入驻条件是什么", "test")]
+    types = [event["type"] for event in events]
+
+    assert types[0] == "sources"
+    assert events[0]["sources"][0]["filename"] == "policy.pdf"
+    assert types.count("token") > 1
+    assert types[-1] == "done"
+    assert "".join(event["content"] for event in events if event["type"] == "token") == "入驻 条件 如下"
+    assert events[-1]["answer"] == "入驻 条件 如下"
+    latency = events[-1]["metadata"]["latency"]
+    assert latency["sources_ms"] <= latency["ttft_ms"] <= latency["total_ms"]
+
+
+@pytest.mark.asyncio
+async def test_speculative_retrieval_overlaps_intent_analysis():
+    """测试推测检索：意图 LLM 调用期间已开始检索，简单检索路由复用结果，问候路由丢弃结果"""
+    from types import SimpleNamespace
+    from app.workflows.langgraph_rag_workflow import LangGraphRAGWorkflow
+
+    class SlowIntentLLM:
+        def __init__(self, intent):
+            self.intent = intent
+            self.intent_done = None
+
+        async def ainvoke(self, prompt):
+            if "分析以下问题的意图" in prompt:
+                await asyncio.sleep(0.05)
+                self.intent_done = asyncio.get_running_loop().time()
+                return SimpleNamespace(content='{"intent": "%s", "needs_retrieval": %s}' % (
+                    self.intent, "false" if self.intent == "greeting" else "true"))
+            if "评估以下答案的质量" in prompt:
+                return SimpleNamespace(content='{"score": 0.9, "needs_improvement": false}')
+            return SimpleNamespace(content="答案")
+
+    class RecordingRetriever:
+        def __init__(self):
+            self.calls = []
+
+        async def retrieve(self, query, top_k=5, use_hybrid=True, use_compression=True):
+            self.calls.append(asyncio.get_running_loop().time())
+            return [{"content": "内容", "score": 0.8, "metadata": {}}]
+
+    for intent, expected in (("simple_qa", "used"), ("greeting", "dropped")):
+        llm, workspace, global_ = SlowIntentLLM(intent), RecordingRetriever(), RecordingRetriever()
+        workflow = LangGraphRAGWorkflow(workspace, global_, llm=llm)
+        workflow.local_intent_enabled = False
+        workflow.rerank_enabled = False
+        workflow.speculative_retrieval = True
+
+        result = await workflow.run("入驻条件是什么", "test")
+
+        assert result["metadata"]["speculative_retrieval"] == expected
+        assert len(workspace.calls) == 1 and len(global_.calls) == 1
+        assert workspace.calls[0] < llm.intent_done
+        if expected == "used":
+            assert result["sources"]
+
+
+@pytest.mark.asyncio
+async def test_complex_retrieval_keeps_the_fused_order():
+    """测试复杂检索：合并后按 RRF 融合分数排序，只命中 BM25 的结果不会被向量分数压到后面"""
+    from types import SimpleNamespace
+    from app.workflows.langgraph_rag_workflow import LangGraphRAGWorkflow
+
+    class ExpansionLLM:
+        async def ainvoke(self, prompt):
+            return SimpleNamespace(content='["入驻条件"]')
+
+    class HybridRetriever:
+        def __init__(self, docs):
+            self.docs = docs
+
+        async def retrieve(self, query, top_k=5, use_hybrid=True, use_compression=True):
+            return list(self.docs)
+
+    workspace = HybridRetriever([
+        {"node_id": "lexical", "content": "BM25 命中", "score": 0.05, "fused_score": 0.033, "metadata": {}}
+    ])
+    global_ = HybridRetriever([
+        {"node_id": "vector", "content": "向量命中", "score": 0.7, "fused_score": 0.016, "metadata": {}}
+    ])
+    workflow = LangGraphRAGWorkflow(workspace, global_, llm=ExpansionLLM())
+    workflow.rerank_enabled = False
+
+    state = await workflow._complex_retrieval_node({"question": "入驻条件", "processing_steps": []})
+
+    assert [doc["content"] for doc in state["workspace_docs"]] == ["BM25 命中", "向量命中"]
+
+
 def test_config_loader():
     """测试配置加载器"""
     from app.utils.config_loader import get_rag_config
@@ -0,0 +1,48 @@
+"""
+BM25 词法索引测试
+"""
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from app.services import lexical_index
+from app.services.lexical_index import LexicalIndex, tokenize
+
+
+def test_tokenize_keeps_codes_and_splits_chinese_into_bigrams():
+    tokens = tokenize("型号XJ-2000的参数")
+
+    assert "xj-2000" in tokens
+    assert {"型号", "的参", "参数"} <= set(tokens)
+
+
+def test_search_scores_only_matching_documents_and_ranks_by_bm25():
+    index = LexicalIndex.build([
+        ("a", "服务器 采购 清单"),
+        ("b", "服务器 服务器 参数 说明"),
+        ("c", "员工 手册"),
+    ])
+
+    hits = index.search("服务器参数", top_k=5)
+
+    assert [node_id for node_id, _ in hits] == ["b", "a"]
+    assert hits[0][1] > hits[1][1] > 0
+
+
+def test_incremental_updates_and_compaction(tmp_path, monkeypatch):
+    monkeypatch.setattr(lexical_index, "_COMPACT_MIN_DEAD", 2)
+    index = LexicalIndex.build([(f"n{i}", f"文档 编号{i}") for i in range(4)])
+    index.add("n1", "完全 不同 的 内容")
+
+    assert index.search("1") == []
+    assert index.remove(["n0", "n2", "missing"]) == 2
+    # 墓碑数超过存活数后整理倒排表
+    assert index.get_stats()["dead_slots"] == 0
+    assert [node_id for node_id, _ in index.search("编号3")] == ["n3"]
+    assert index.search("2") == []
+
+    index.save(tmp_path / "lexical.json")
+    reloaded = LexicalIndex.load(tmp_path / "lexical.json")
+    assert sorted(reloaded.node_ids()) == ["n1", "n3"]
+    assert reloaded.search("内容") == index.search("内容")
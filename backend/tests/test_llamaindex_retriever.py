@@ -0,0 +1,310 @@
+"""
+LlamaIndexRetriever 索引维护测试（批量插入、增量删除、元数据索引）
+"""
+
+import asyncio
+import threading
+
+import pytest
+
+pytest.importorskip("llama_index.core")
+
+from llama_index.core import Document
+from llama_index.core.embeddings import MockEmbedding
+
+from app.services import llamaindex_retriever as li
+
+
+class _CountingEmbedding(MockEmbedding):
+    """记录每次批量编码的文本数"""
+
+    calls: list = []
+
+    def _get_text_embeddings(self, texts):
+        self.calls.append(len(texts))
+        return super()._get_text_embeddings(texts)
+
+
+class _KeywordEmbedding(MockEmbedding):
+    """按关键词编码：第 i 维为第 i 个关键词是否出现，其余维度为常数"""
+
+    def _vector(self, text):
+        head = [1.0 if keyword in text else 0.0 for keyword in ("苹果", "香蕉", "会议")]
+        return head + [0.1] * (self.embed_dim - len(head))
+
+    def _get_query_embedding(self, query):
+        return self._vector(query)
+
+    async def _aget_query_embedding(self, query):
+        return self._vector(query)
+
+    def _get_text_embedding(self, text):
+        return self._vector(text)
+
+    def _get_text_embeddings(self, texts):
+        return [self._vector(text) for text in texts]
+
+
+class _StubEmbeddingRegistry:
+    """替代进程级嵌入模型注册表，返回 MockEmbedding"""
+
+    def __init__(self):
+        self.embedding = MockEmbedding(embed_dim=8)
+
+    def is_loaded(self, model_path=None):
+        return True
+
+    def get_llamaindex_embedding(self, model_path=None):
+        return self.embedding
+
+
+@pytest.fixture
+def make_retriever(tmp_path, monkeypatch):
+    """通过构造函数创建检索器：存储目录位于 tmp_path，嵌入模型为 MockEmbedding，默认 JSON 存储"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("LOCAL_BGE_MODEL_DIR", str(tmp_path))
+    monkeypatch.setattr(li, "get_embedding_registry", _StubEmbeddingRegistry)
+
+    def make(count=12, storage_format="json", workspace_id="test"):
+        monkeypatch.setattr(li, "_storage_config", lambda: {
+            "format": storage_format, "persist_scheduler": {"max_delay_s": 3600}
+        })
+        retriever = li.LlamaIndexRetriever(workspace_id)
+        retriever._insert_documents([
+            Document(text=f"块 {i}", metadata={"document_id": f"doc{i % 3}", "original_filename": f"f{i % 3}.txt"})
+            for i in range(count)
+        ])
+        return retriever
+
+    return make
+
+
+def test_delete_removes_only_matching_nodes(make_retriever):
+    retriever = make_retriever()
+
+    result = retriever.delete_by_document_id("doc1")
+
+    assert result["deleted"] == 4
+    assert result["kept"] == 8
+    assert len(retriever.index.vector_store.data.embedding_dict) == 8
+    assert retriever.get_node_ids_by_document_id("doc1") == []
+    assert len(retriever.get_node_ids_by_document_id("doc0")) == 4
+
+
+def test_write_ahead_log_is_replayed_on_load(make_retriever):
+    retriever = make_retriever()
+    retriever.persist()
+
+    retriever.delete_by_original_filename("f2.txt")
+    retriever._insert_documents([Document(text="新块", metadata={"document_id": "doc9"})])
+    assert retriever.wal_path.exists()
+    assert retriever.get_persist_stats()["dirty"]
+
+    # 不做全量持久化，重新加载后应通过写前日志恢复插入与删除
+    reloaded = retriever._load_or_create_json_index()
+    assert len(reloaded.index_struct.nodes_dict) == 9
+    assert len(reloaded.vector_store.data.embedding_dict) == 9
+
+    assert retriever.flush()
+    assert not retriever.wal_path.exists()
+    assert not retriever.flush()
+
+
+def test_metadata_index_tracks_deletes_and_reloads(make_retriever):
+    retriever = make_retriever()
+    node_id = retriever.get_node_ids_by_document_id("doc2")[0]
+
+    assert retriever.resolve_document_id("doc2") == "doc2"
+    assert retriever.resolve_document_id(node_id) == "doc2"
+    assert retriever.metadata_index_path.exists()
+
+    retriever.persist()
+    retriever.delete_by_document_id("doc2")
+    assert retriever.get_node_ids_by_field("original_filename", "f2.txt") == []
+
+    # 持久化的倒排索引仍含已删除节点，重新加载时应按当前索引剔除
+    retriever._metadata_index = None
+    assert retriever.get_node_ids_by_document_id("doc2") == []
+    assert sorted(d["chunk_count"] for d in retriever.list_documents()) == [4, 4]
+
+
+def test_hybrid_retrieve_fuses_bm25_hits(make_retriever):
+    retriever = make_retriever()
+    retriever._insert_documents([Document(text="型号 XJ-2000 参数表", metadata={"document_id": "spec"})])
+
+    results = asyncio.run(retriever.retrieve("XJ-2000 的参数", top_k=3))
+    spec = [r for r in results if r["metadata"].get("document_id") == "spec"]
+
+    assert spec and "bm25" in spec[0]["retrieval_sources"]
+    assert spec[0]["score"] == pytest.approx(1.0)
+    assert all("fused_score" in r for r in results)
+
+    retriever.persist()
+    retriever.delete_by_document_id("spec")
+    assert retriever.get_lexical_index().search("XJ-2000") == []
+    retriever._lexical_index = None
+    assert retriever.get_lexical_index().search("XJ-2000") == []
+
+
+def test_retrieve_prefilters_by_metadata(make_retriever):
+    retriever = make_retriever()
+    retriever._insert_documents([
+        Document(text="价格表 一月", metadata={"document_id": "xls", "sheet_name": "一月", "upload_time": "2024-01-05T10:00:00"}),
+        Document(text="价格表 二月", metadata={"document_id": "xls", "sheet_name": "二月", "upload_time": "2024-02-05T10:00:00"}),
+    ])
+
+    results = asyncio.run(retriever.retrieve("价格表", top_k=5, filters={"sheet": "二月"}))
+    assert [r["metadata"]["sheet_name"] for r in results] == ["二月"]
+
+    results = asyncio.run(retriever.retrieve(
+        "价格表", top_k=5, filters={"document_id": ["xls", "doc0"], "upload_time": {"to": "2024-01-31"}}
+    ))
+    assert [r["metadata"]["sheet_name"] for r in results] == ["一月"]
+
+    assert asyncio.run(retriever.retrieve("价格表", filters={"file_type": "pdf"})) == []
+    with pytest.raises(ValueError):
+        asyncio.run(retriever.retrieve("价格表", filters={"owner": "me"}))
+
+
+def test_bulk_insert_embeds_in_configured_batches(make_retriever):
+    retriever = make_retriever()
+    retriever.get_metadata_index()
+    retriever.embed_model = _CountingEmbedding(embed_dim=8, embed_batch_size=32, calls=[])
+    docs = [Document(text=f"行 {i}", metadata={"document_id": "sheet", "task_id": "t1"}) for i in range(70)]
+
+    inserted = retriever._insert_documents(docs)
+
+    assert inserted == 70
+    assert retriever.embed_model.calls == [32, 32, 6]
+    assert retriever.node_count() == 82
+    assert len(retriever.get_node_ids_by_field("task_id", "t1")) == 70
+
+
+def test_json_index_is_migrated_to_segment_store(make_retriever):
+    retriever = make_retriever()
+    retriever.persist()
+    retriever.delete_by_document_id("doc0")
+
+    retriever.index = retriever._load_or_create_segment_index()
+
+    assert retriever.segment_store() is not None
+    assert retriever.node_count() == 8
+    assert (retriever.storage_dir / "legacy_json" / "docstore.json").exists()
+    assert not retriever.wal_path.exists()
+
+    # 分段存储下的查找、删除与检索
+    retriever._metadata_index = None
+    assert retriever.delete_by_original_filename("f1.txt")["deleted"] == 4
+    assert retriever._load_or_create_segment_index().vector_store.get_stats()["nodes"] == 4
+    results = asyncio.run(retriever.retrieve("块", top_k=3))
+    assert {r["metadata"]["document_id"] for r in results} == {"doc2"}
+
+
+def test_get_loaded_retriever_does_not_load(monkeypatch):
+    from app.services.retriever_cache import RetrieverLRUCache
+
+    loads = []
+    cache = RetrieverLRUCache(lambda workspace_id: loads.append(workspace_id) or object(), pinned=[])
+    monkeypatch.setattr(li, "_retriever_cache", cache)
+
+    assert li.get_loaded_retriever("ws") is None
+    assert loads == []
+    retriever = li.get_retriever("ws")
+    assert li.get_loaded_retriever("ws") is retriever
+
+
+def test_load_results_uses_known_scores_and_computes_the_rest(make_retriever):
+    retriever = make_retriever(count=3)
+    known, other = retriever.get_node_ids_by_document_id("doc0")[0], retriever.get_node_ids_by_document_id("doc1")[0]
+    query_embedding = retriever.embed_model.get_query_embedding("块")
+
+    results = retriever.load_results([known, other, "missing"], query_embedding, {known: 0.42})
+
+    assert set(results) == {known, other}
+    assert results[known]["score"] == pytest.approx(0.42)
+    assert results[other]["score"] == pytest.approx(1.0)
+    assert results[other]["metadata"]["document_id"] == "doc1"
+
+
+def test_workspace_is_not_idle_while_batching_ingesting_or_dirty(make_retriever):
+    import sqlite3
+
+    retriever = make_retriever(count=3, storage_format="segment")
+    assert not retriever.is_idle(0)  # 插入后尚未落盘
+    retriever.flush()
+    assert retriever.is_idle(0)
+
+    with retriever.persist_batch():
+        assert not retriever.is_idle(0)
+
+    release = threading.Event()
+    retriever._add_document_sync = lambda file_path, metadata=None: release.wait(5) and 0
+
+    async def ingest():
+        task = asyncio.create_task(retriever.add_document("a.txt"))
+        await asyncio.sleep(0.05)
+        busy = not retriever.is_idle(0)
+        release.set()
+        await task
+        return busy
+
+    assert asyncio.run(ingest())
+    assert retriever.is_idle(0)
+
+    store = retriever.segment_store()
+    retriever.shutdown()
+    with pytest.raises(sqlite3.ProgrammingError):
+        store.client.execute("SELECT 1")
+
+
+def test_new_workspace_uses_the_segment_store(make_retriever):
+    retriever = make_retriever(count=0, storage_format="segment")
+
+    assert retriever.segment_store() is not None
+    retriever._insert_documents([Document(text="块", metadata={"document_id": "d"})])
+    assert len(retriever.segment_store()) == 1
+
+
+def test_search_workspaces_ranks_workspaces_in_one_stacked_pass(make_retriever, monkeypatch):
+    from app.services.query_sharing import SharedQueryRetrievalMixin
+    from app.services.stacked_vector_index import StackedVectorIndex
+
+    retrievers = {}
+    for workspace_id, texts in (("ws", ["苹果 价格", "会议 纪要"]), ("global", ["苹果 产地", "香蕉 价格"])):
+        retriever = make_retriever(count=0, storage_format="segment", workspace_id=workspace_id)
+        retriever.embed_model = _KeywordEmbedding(embed_dim=8)
+        retriever._insert_documents([
+            Document(text=text, metadata={"document_id": f"{workspace_id}{i}"}) for i, text in enumerate(texts)
+        ])
+        retrievers[workspace_id] = retriever
+    stacked = StackedVectorIndex()
+    monkeypatch.setattr(li, "get_retriever", retrievers.__getitem__)
+    monkeypatch.setattr(li, "get_loaded_retriever", retrievers.get)
+    monkeypatch.setattr(li, "_stacked_index", stacked)
+
+    def top(query, **kwargs):
+        results = asyncio.run(li.search_workspaces(query, ["ws", "global", "ws"], top_k=1, **kwargs))
+        return [(r["workspace_id"], r["metadata"]["document_id"]) for r in results]
+
+    assert top("香蕉", use_hybrid=False) == [("global", "global1")]
+    assert top("会议", use_hybrid=False) == [("ws", "ws1")]
+    hybrid = asyncio.run(li.search_workspaces("香蕉", ["ws", "global"], top_k=2))
+    assert hybrid[0]["workspace_id"] == "global" and "vector" in hybrid[0]["retrieval_sources"]
+    assert all("fused_score" in r for r in hybrid)
+    # 三次检索复用同一个堆叠矩阵
+    assert stacked.total_stacks == 1 and stacked.total_searches == 3
+
+    # 工作流的合并检索走同一条堆叠路径
+    class _Workflow(SharedQueryRetrievalMixin):
+        workspace_retriever = retrievers["ws"]
+        global_retriever = retrievers["global"]
+
+    merged = asyncio.run(_Workflow()._retrieve_across("会议", top_k=1, use_hybrid=False))
+    assert [r["workspace_id"] for r in merged] == ["ws"]
+    assert stacked.total_searches == 4
+
+    # 简单检索的候选同样一次堆叠检索，再按 workspace_id 拆成工作区与全局两组
+    workspace_docs, global_docs = asyncio.run(_Workflow()._retrieve_split("价格", top_k=1))
+    assert [r["metadata"]["document_id"] for r in workspace_docs] == ["ws0"]
+    assert [r["metadata"]["document_id"] for r in global_docs] == ["global1"]
+    assert stacked.total_searches == 5
@@ -0,0 +1,69 @@
+"""
+LLM 客户端注册表测试（按模型/地址/温度/超时/重试缓存、共享连接池、未配置 Key 时不可用）
+"""
+
+import pytest
+
+pytest.importorskip("langchain_openai")
+pytest.importorskip("httpx")
+
+from app.services.llm_registry import LLMClientRegistry
+
+
+@pytest.fixture
+def api_env(monkeypatch):
+    monkeypatch.setenv("THIRD_PARTY_API_KEY", "sk-test")
+    monkeypatch.setenv("THIRD_PARTY_API_BASE", "http://llm.local/v1")
+    monkeypatch.setenv("LLM_MODEL", "test-model")
+
+
+def test_clients_are_cached_per_key_and_share_one_pool(api_env):
+    registry = LLMClientRegistry()
+
+    first = registry.get_llm(temperature=0.1)
+    assert registry.get_llm(temperature=0.1) is first
+    assert first.model_name == "test-model"
+
+    warmer = registry.get_llm(temperature=0.3)
+    other_base = registry.get_llm(temperature=0.1, base_url="http://other.local/v1")
+    assert warmer is not first and other_base is not first
+
+    # 所有客户端共用同一对 httpx 客户端
+    assert first.http_client is warmer.http_client is other_base.http_client
+    assert first.http_async_client is warmer.http_async_client
+
+    stats = registry.get_stats()
+    assert stats["created"] == 3
+    assert stats["hits"] == 1
+    assert stats["http_pool"]["active"]
+    registry.close()
+
+
+def test_timeout_and_retries_are_part_of_the_key(api_env):
+    registry = LLMClientRegistry()
+
+    default = registry.get_llm(temperature=0.3)
+    assert default.request_timeout == registry.request_timeout
+    assert default.max_retries == registry.max_retries
+
+    # 长耗时调用方（DeepResearch）拿到独立客户端，不继承默认的短超时
+    long_running = registry.get_llm(temperature=0.3, request_timeout=600, max_retries=2)
+    assert long_running is not default
+    assert long_running.request_timeout == 600
+    assert long_running.max_retries == 2
+    assert registry.get_llm(temperature=0.3, request_timeout=600.0, max_retries=2) is long_running
+    assert long_running.http_client is default.http_client
+
+    clients = registry.get_stats()["clients"]
+    assert {(c["request_timeout_s"], c["max_retries"]) for c in clients} == {
+        (float(registry.request_timeout), registry.max_retries), (600.0, 2)
+    }
+    registry.close()
+
+
+def test_missing_api_key_returns_none(monkeypatch):
+    monkeypatch.delenv("THIRD_PARTY_API_KEY", raising=False)
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    registry = LLMClientRegistry()
+    assert registry.get_llm() is None
+    assert registry.get_stats()["created"] == 0
@@ -0,0 +1,109 @@
+"""
+本地意图分类器测试（关键词规则、最近质心、不确定时回退 LLM、命中率统计）
+"""
+
+import asyncio
+
+from app.services.local_intent_classifier import LocalIntentClassifier
+
+_PROTOTYPES = {
+    "simple_qa": ["qa one", "qa two"],
+    "complex_reasoning": ["why one", "why two"],
+}
+
+
+async def _embed(text):
+    # 玩具编码：按前缀区分方向，"mixed" 落在两个质心中间
+    if text.startswith("qa"):
+        return [1.0, 0.1]
+    if text.startswith("why"):
+        return [0.1, 1.0]
+    return [1.0, 1.0]
+
+
+def test_keyword_rules_cover_greetings_and_generation_requests():
+    classifier = LocalIntentClassifier(prototypes=_PROTOTYPES)
+
+    greeting = LocalIntentClassifier.classify_keywords("你好！")
+    assert greeting["intent"] == "greeting" and not greeting["needs_retrieval"]
+
+    generation = LocalIntentClassifier.classify_keywords("根据上传的文件帮我写一份总结报告")
+    assert generation["intent"] == "document_generation"
+
+    assert LocalIntentClassifier.classify_keywords("入驻条件有哪些") is None
+    assert classifier.get_stats()["total"] == 0
+
+
+def test_generation_rule_accepts_imperatives_only():
+    for question in ("生成一个 Excel 表格", "把刚才的讨论整理成会议纪要", "请根据上周的会议记录，整理一份纪要"):
+        assert LocalIntentClassifier.classify_keywords(question)["intent"] == "document_generation"
+
+    # 提到生成/导出的提问、陈述不是生成请求
+    for question in (
+        "上次生成的报告里提到了哪些风险",
+        "如何生成报告",
+        "系统怎么导出excel表格",
+        "能帮我生成报告吗",
+        "生成的报告有问题",
+        "这份报告是谁写的",
+    ):
+        assert LocalIntentClassifier.classify_keywords(question) is None, question
+
+
+def test_nearest_centroid_decides_or_falls_back():
+    classifier = LocalIntentClassifier(prototypes=_PROTOTYPES, min_similarity=0.5, min_margin=0.1)
+
+    async def main():
+        return [
+            await classifier.classify("qa question", embed=_embed),
+            await classifier.classify("why question", embed=_embed),
+            await classifier.classify("mixed question", embed=_embed),
+            await classifier.classify("谢谢", embed=_embed),
+        ]
+
+    simple, complex_, uncertain, thanks = asyncio.run(main())
+    assert simple["intent"] == "simple_qa" and simple["source"] == "centroid" and simple["needs_retrieval"]
+    assert complex_["intent"] == "complex_reasoning" and complex_["complexity"] == "high"
+    assert uncertain is None
+    assert thanks["source"] == "keyword"
+
+    stats = classifier.get_stats()
+    assert stats == {
+        "total": 4,
+        "keyword_hits": 1,
+        "centroid_hits": 2,
+        "llm_fallbacks": 1,
+        "hit_rate": 0.75,
+        "centroids_ready": True
+    }
+
+
+def test_centroid_never_skips_retrieval_under_compressed_similarities():
+    """BGE 类模型的中文余弦普遍偏高：最近质心即使是问候 / 文档生成也回退 LLM，不跳过检索"""
+    prototypes = {
+        "greeting": ["greeting a", "greeting b"],
+        "simple_qa": ["simple_qa a", "simple_qa b"],
+        "complex_reasoning": ["complex_reasoning a", "complex_reasoning b"],
+        "document_generation": ["document_generation a", "document_generation b"],
+    }
+    axes = {intent: i + 1 for i, intent in enumerate(prototypes)}
+
+    async def embed(text):
+        # 所有文本共享一个大的公共分量，不同意图之间余弦约 0.9，接近真实模型的分布
+        intent, variant = text.rsplit(" ", 1)
+        vector = [3.0, 0.0, 0.0, 0.0, 0.0, 0.0]
+        vector[axes[intent]] = 1.0
+        vector[5] = 0.1 if variant == "a" else -0.1
+        return vector
+
+    classifier = LocalIntentClassifier(prototypes=prototypes)
+
+    async def main():
+        return [await classifier.classify(f"{intent} q", embed=embed) for intent in prototypes]
+
+    greeting, simple, complex_, generation = asyncio.run(main())
+    assert greeting is None
+    assert generation is None
+    assert simple["intent"] == "simple_qa" and simple["needs_retrieval"]
+    assert complex_["intent"] == "complex_reasoning" and complex_["needs_retrieval"]
+    assert simple["confidence"] > 0.9
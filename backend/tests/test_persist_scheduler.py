@@ -0,0 +1,74 @@
+"""
+索引持久化调度器测试
+"""
+
+import threading
+import time
+
+from app.services.persist_scheduler import PersistScheduler
+
+
+class _Recorder:
+    def __init__(self, fail_times=0):
+        self.calls = 0
+        self.fail_times = fail_times
+        self.event = threading.Event()
+
+    def __call__(self):
+        self.calls += 1
+        if self.calls <= self.fail_times:
+            raise IOError("磁盘已满")
+        self.event.set()
+
+
+def test_changes_are_merged_until_delay_expires():
+    recorder = _Recorder()
+    scheduler = PersistScheduler(recorder, max_delay_s=0.2)
+    for _ in range(10):
+        scheduler.mark_dirty(3)
+
+    assert recorder.event.wait(2)
+    time.sleep(0.05)
+    assert recorder.calls == 1
+    assert not scheduler.dirty
+    scheduler.shutdown()
+
+
+def test_pending_change_threshold_triggers_flush():
+    recorder = _Recorder()
+    scheduler = PersistScheduler(recorder, max_delay_s=3600, max_pending_changes=100)
+    scheduler.mark_dirty(60)
+    assert not recorder.event.wait(0.1)
+
+    scheduler.mark_dirty(60)
+    assert recorder.event.wait(2)
+    scheduler.shutdown()
+
+
+def test_batch_defers_flush_until_exit():
+    recorder = _Recorder()
+    scheduler = PersistScheduler(recorder, max_delay_s=0)
+    with scheduler.batch():
+        with scheduler.batch():
+            scheduler.mark_dirty(5)
+        assert not recorder.event.wait(0.1)
+        scheduler.mark_dirty(5)
+
+    assert recorder.event.wait(2)
+    assert recorder.calls == 1
+    scheduler.shutdown()
+
+
+def test_failed_flush_keeps_changes_pending():
+    recorder = _Recorder(fail_times=1)
+    scheduler = PersistScheduler(recorder, max_delay_s=3600)
+    scheduler.mark_dirty(7)
+
+    assert not scheduler.flush()
+    assert scheduler.get_stats()["pending_changes"] == 7
+    assert scheduler.get_stats()["last_error"] == "磁盘已满"
+
+    assert scheduler.flush()
+    assert not scheduler.flush()
+    assert scheduler.get_stats()["total_flushes"] == 1
+    scheduler.shutdown()
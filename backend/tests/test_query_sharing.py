@@ -0,0 +1,115 @@
+"""
+查询向量共享测试（同模型复用、不同模型各自编码、不支持的参数不传入、每个查询只编码一次）
+"""
+
+import asyncio
+
+import pytest
+
+from app.services.query_sharing import SharedQueryRetrievalMixin, retrieve_with
+
+
+class _Model:
+    pass
+
+
+class _Retriever:
+    def __init__(self, model, dimension=2):
+        self.embed_model = model
+        self.dimension = dimension
+        self.encoded = []
+        self.calls = []
+        self.results = []
+
+    async def embed_query(self, query):
+        self.encoded.append(query)
+        return [1.0] * self.dimension
+
+    async def retrieve(self, query, top_k=5, use_hybrid=True, query_embedding=None, filters=None):
+        self.calls.append({"query": query, "query_embedding": query_embedding, "filters": filters})
+        return list(self.results)
+
+
+class _LegacyRetriever:
+    """不支持预编码向量与过滤条件的旧检索器"""
+
+    def __init__(self):
+        self.calls = []
+
+    async def retrieve(self, query, top_k=5, use_hybrid=True):
+        self.calls.append(query)
+        return []
+
+
+class _Workflow(SharedQueryRetrievalMixin):
+    def __init__(self, workspace_retriever, global_retriever):
+        self.workspace_retriever = workspace_retriever
+        self.global_retriever = global_retriever
+
+    async def search(self, query, filters=None):
+        embedding = await self._embed_query(query)
+        await asyncio.gather(
+            self._retrieve(self.workspace_retriever, query, embedding, filters, top_k=3),
+            self._retrieve(self.global_retriever, query, embedding, filters, top_k=3)
+        )
+
+
+def test_shared_model_encodes_each_query_once():
+    model = _Model()
+    workspace, global_ = _Retriever(model), _Retriever(model)
+    workflow = _Workflow(workspace, global_)
+
+    async def main():
+        await workflow.search("入驻条件")
+        await workflow.search("入驻条件")
+
+    asyncio.run(main())
+    assert workspace.encoded == ["入驻条件"]
+    assert global_.encoded == []
+    assert all(call["query_embedding"] == [1.0, 1.0] for call in workspace.calls + global_.calls)
+
+
+def test_embedding_is_not_passed_to_a_retriever_with_another_model():
+    workspace, global_ = _Retriever(_Model()), _Retriever(_Model(), dimension=3)
+    asyncio.run(_Workflow(workspace, global_).search("q", filters={"file_type": "pdf"}))
+
+    assert workspace.calls[0]["query_embedding"] == [1.0, 1.0]
+    assert global_.calls[0]["query_embedding"] is None
+    assert global_.calls[0]["filters"] == {"file_type": "pdf"}
+
+
+def test_legacy_retrievers_get_only_supported_arguments():
+    legacy = _LegacyRetriever()
+    workflow = _Workflow(legacy, legacy)
+    asyncio.run(workflow.search("q"))
+    assert legacy.calls == ["q", "q"]
+
+    with pytest.raises(ValueError):
+        retrieve_with(legacy, "q", filters={"file_type": "pdf"})
+
+
+def test_retrieve_across_merges_other_retrievers_by_score():
+    model = _Model()
+    workspace, global_ = _Retriever(model), _Retriever(model)
+    workspace.results = [{"node_id": "w", "score": 0.5}, {"node_id": "shared", "score": 0.7}]
+    global_.results = [{"node_id": "g", "score": 0.9}, {"node_id": "shared", "score": 0.7}]
+
+    # 测试替身不是缓存中的 LlamaIndex 检索器，分别检索后合并
+    merged = asyncio.run(_Workflow(workspace, global_)._retrieve_across("q", [1.0, 1.0], top_k=2))
+
+    assert [doc["node_id"] for doc in merged] == ["g", "shared"]
+    assert workspace.calls[0]["query_embedding"] == [1.0, 1.0]
+
+
+def test_retrieve_across_keeps_the_fused_ranking_of_hybrid_results():
+    model = _Model()
+    workspace, global_ = _Retriever(model), _Retriever(model)
+    # 只命中 BM25 的结果余弦很低，但融合排名靠前
+    workspace.results = [{"node_id": "lexical", "score": 0.1, "fused_score": 0.032}]
+    global_.results = [{"node_id": "weak_vector", "score": 0.6, "fused_score": 0.016}]
+
+    # 带过滤条件时分别检索后合并
+    workflow = _Workflow(workspace, global_)
+    merged = asyncio.run(workflow._retrieve_across("q", [1.0, 1.0], filters={"file_type": "pdf"}, top_k=2))
+
+    assert [doc["node_id"] for doc in merged] == ["lexical", "weak_vector"]
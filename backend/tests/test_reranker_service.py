@@ -0,0 +1,83 @@
+"""
+共享重排序服务测试（用假模型验证合并推理、分桶与缓存）
+"""
+
+import threading
+
+import pytest
+
+pytest.importorskip("torch")
+
+from app.services import reranker_service
+from app.services.reranker_service import RerankerService
+
+
+class _FakeReranker:
+    """分数 = 文档长度，记录每次推理的批量"""
+
+    def __init__(self):
+        self.calls = []
+
+    def compute_score(self, pairs, batch_size=None, max_length=None):
+        self.calls.append([len(text) for _, text in pairs])
+        return [float(len(text)) for _, text in pairs]
+
+
+@pytest.fixture
+def service(monkeypatch):
+    monkeypatch.setattr(RerankerService, "_initialize_reranker", lambda self: setattr(self, "reranker", _FakeReranker()))
+    monkeypatch.setattr(reranker_service, "get_reranking_config", lambda: {})
+    return RerankerService(batch_size=2, max_wait_ms=50)
+
+
+def test_concurrent_queries_share_one_inference_and_scores_are_cached(service):
+    docs = [{"node_id": f"n{i}", "content": "x" * (i + 1)} for i in range(3)]
+    results = {}
+    barrier = threading.Barrier(2)
+
+    def run(query):
+        barrier.wait()
+        results[query] = service.rerank(query, [dict(d) for d in docs], top_k=2)
+
+    threads = [threading.Thread(target=run, args=(q,)) for q in ("问题一", "问题二")]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    # 6 个文档对合并为一次推理，按长度分桶（batch_size=2）
+    assert service.reranker.calls == [[1, 1], [2, 2], [3, 3]]
+    assert [d["node_id"] for d in results["问题一"]] == ["n2", "n1"]
+
+    service.rerank("问题一", [dict(d) for d in docs], top_k=1)
+    assert len(service.reranker.calls) == 3
+    assert service.get_model_info()["cache_hit_rate"] == pytest.approx(0.33, abs=0.01)
+
+
+def test_batch_rerank_scores_all_queries_together(service):
+    batches = service.batch_rerank(
+        ["a", "b"],
+        [[{"doc_id": "d1", "content": "xx"}], [{"doc_id": "d1", "content": "xx"}, {"doc_id": "d2", "content": "x"}]],
+        top_k=1
+    )
+
+    assert [[d["doc_id"] for d in docs] for docs in batches] == [["d1"], ["d1"]]
+    assert sum(len(call) for call in service.reranker.calls) == 3
+
+
+def test_rerank_with_budget_keeps_vector_order_beyond_budget(service):
+    docs = [{"node_id": f"n{i}", "content": "x" * (i + 1)} for i in range(4)]
+
+    # 按历史耗时，预算内只够推理 2 个文档对：前 2 个重排序，其余保持原顺序
+    service.ms_per_pair = 40.0
+    ranked, info = service.rerank_with_budget("问题", [dict(d) for d in docs], top_k=4, budget_ms=100)
+    assert [d["node_id"] for d in ranked] == ["n1", "n0", "n2", "n3"]
+    assert info["applied"] and info["reranked"] == 2 and info["candidates"] == 4
+    assert info["time_ms"] >= 0
+
+    # 推理超出预算时整体回退为原顺序，结果仍写入缓存
+    service.reranker.compute_score = lambda pairs, **kwargs: (threading.Event().wait(0.2), [1.0] * len(pairs))[1]
+    service.ms_per_pair = 1.0
+    ranked, info = service.rerank_with_budget("另一个问题", [dict(d) for d in docs], top_k=3, budget_ms=20)
+    assert info["timed_out"] and not info["applied"]
+    assert [d["node_id"] for d in ranked] == ["n0", "n1", "n2"]
@@ -0,0 +1,129 @@
+"""
+检索器 LRU 缓存测试（内存预算淘汰、固定工作区、忙碌或租用中的工作区不淘汰、后台淘汰）
+"""
+
+import threading
+import time
+
+from app.services.retriever_cache import RetrieverLRUCache
+
+
+class _FakeRetriever:
+    def __init__(self, workspace_id, size=100):
+        self.workspace_id = workspace_id
+        self.size = size
+        self.busy = False
+        self.closed = False
+
+    def estimate_memory_bytes(self):
+        return self.size
+
+    def is_idle(self, min_idle_s):
+        return not self.busy
+
+    def shutdown(self):
+        self.closed = True
+
+
+def _cache(**kwargs):
+    loaded = {}
+
+    def factory(workspace_id):
+        loaded[workspace_id] = _FakeRetriever(workspace_id)
+        return loaded[workspace_id]
+
+    kwargs.setdefault("min_idle_s", 0)
+    kwargs.setdefault("background", False)
+    return RetrieverLRUCache(factory, **kwargs), loaded
+
+
+def test_least_recently_used_idle_workspace_is_evicted_and_reloaded():
+    evicted = []
+    cache, loaded = _cache(max_memory_bytes=250, pinned=["global"], on_evict=evicted.append)
+    cache.get_or_load("global")
+    first_a = cache.get_or_load("a")
+    cache.get_or_load("global")
+    cache.get_or_load("b")
+
+    # global 固定不淘汰，a 最久未使用
+    assert "a" not in cache and first_a.closed
+    assert evicted == ["a"]
+    assert cache.get_or_load("a") is not first_a
+
+    stats = cache.get_stats()
+    assert (stats["hits"], stats["misses"], stats["evictions"]) == (1, 4, 2)
+    assert stats["resident_bytes"] <= 250
+    assert stats["workspaces"]["global"]["resident_bytes"] == 100
+
+
+def test_busy_workspace_is_kept_over_budget():
+    cache, loaded = _cache(max_memory_bytes=150, pinned=[])
+    cache.get_or_load("a")
+    loaded["a"].busy = True
+    cache.get_or_load("b")
+
+    assert "a" in cache and "b" in cache
+    loaded["a"].busy = False
+    assert cache.enforce_budget() == ["a"]
+
+
+def test_shared_structures_count_towards_the_budget():
+    shared = {"bytes": 0}
+    cache, loaded = _cache(max_memory_bytes=250, pinned=[], shared_memory=lambda: shared["bytes"])
+    cache.get_or_load("a")
+    cache.get_or_load("b")
+    assert "a" in cache
+
+    # 堆叠矩阵等共享结构占用 100 字节后，两个工作区合计超出预算，淘汰最久未使用的 a
+    shared["bytes"] = 100
+    assert cache.enforce_budget() == ["a"]
+    assert cache.get_stats()["shared_bytes"] == 100
+
+
+def test_eviction_runs_off_the_calling_thread_and_stats_have_no_side_effects():
+    release = threading.Event()
+    closed_on = []
+
+    class _SlowRetriever(_FakeRetriever):
+        def shutdown(self):
+            closed_on.append(threading.current_thread().name)
+            release.wait(5)
+            self.closed = True
+
+    cache = RetrieverLRUCache(_SlowRetriever, max_memory_bytes=150, min_idle_s=0, pinned=[])
+    cache.get_or_load("a")
+    start = time.monotonic()
+    cache.get_or_load("b")
+    # 淘汰 a 的落盘被阻塞，调用方仍立即返回
+    assert time.monotonic() - start < 1
+
+    deadline = time.monotonic() + 5
+    while not closed_on and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert closed_on == ["retriever-cache-evictor"]
+    assert "a" not in cache
+    release.set()
+
+    # get_stats 只读，不触发预算检查
+    cache.max_memory_bytes = 0
+    assert cache.get_stats()["entries"] == 1
+    assert "b" in cache
+    cache.close()
+
+
+def test_leased_workspace_is_not_shut_down_until_released():
+    cache, loaded = _cache(max_memory_bytes=150, pinned=[])
+
+    with cache.lease("a") as retriever:
+        cache.get_or_load("b")
+        # 超出预算时跳过租用中的 a，淘汰较新但未租用的 b
+        assert cache.enforce_budget() == ["b"]
+        assert not retriever.closed and cache.get_stats()["workspaces"]["a"]["leases"] == 1
+
+    # 租约释放后，下一次预算检查即可淘汰 a
+    cache.get_or_load("b")
+    assert "a" not in cache and retriever.closed
+
+    # 已被淘汰的实例不再租用，原样返回
+    with cache.lease("a", retriever) as same:
+        assert same is retriever and "a" not in cache
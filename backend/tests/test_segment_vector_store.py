@@ -0,0 +1,160 @@
+"""
+分段向量存储测试
+"""
+
+import threading
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("llama_index.core")
+
+from llama_index.core.schema import TextNode
+from llama_index.core.vector_stores.types import (
+    FilterOperator,
+    MetadataFilter,
+    MetadataFilters,
+    VectorStoreQuery,
+)
+
+from app.services.segment_vector_store import SegmentVectorStore, fcntl, summarize_documents
+
+
+def _nodes(prefix, vectors, filename="a.pdf"):
+    return [
+        TextNode(
+            id_=f"{prefix}{i}",
+            text=f"{prefix} 文本 {i}",
+            embedding=list(vector),
+            metadata={"original_filename": filename, "idx": i}
+        )
+        for i, vector in enumerate(vectors)
+    ]
+
+
+def _query(store, vector, top_k=2, **kwargs):
+    return store.query(VectorStoreQuery(query_embedding=list(vector), similarity_top_k=top_k, **kwargs))
+
+
+def test_each_add_appends_a_segment_and_survives_reopen(tmp_path):
+    store = SegmentVectorStore(str(tmp_path))
+    store.add(_nodes("a", [[1, 0, 0], [0, 1, 0]]))
+    store.add(_nodes("b", [[0, 0, 1]], filename="b.xlsx"))
+
+    assert sorted(p.name for p in tmp_path.glob("seg-*.f32")) == ["seg-000001.f32", "seg-000002.f32"]
+
+    reopened = SegmentVectorStore(str(tmp_path))
+    result = _query(reopened, [0, 0.1, 1])
+
+    assert len(reopened) == 3
+    assert result.ids == ["b0", "a1"]
+    assert result.nodes[0].get_content() == "b 文本 0"
+    assert result.nodes[0].embedding is None
+    assert result.similarities[0] == pytest.approx(1 / np.linalg.norm([0, 0.1, 1]))
+
+
+def test_delete_is_committed_and_compaction_drops_dead_rows(tmp_path):
+    store = SegmentVectorStore(str(tmp_path))
+    store.add(_nodes("a", [[1, 0], [0, 1], [1, 1]]))
+
+    assert store.remove_nodes(["a0", "missing"]) == ["a0"]
+    assert "a0" not in SegmentVectorStore(str(tmp_path))
+
+    assert store.compact(max_dead_ratio=0.2)
+    assert store.get_stats()["dead_rows"] == 0
+    assert [p.name for p in tmp_path.glob("seg-*.f32")] == ["seg-000002.f32"]
+    assert _query(store, [1, 0], top_k=1).ids == ["a2"]
+    assert len(SegmentVectorStore(str(tmp_path))) == 2
+
+
+def test_segment_ids_are_not_reused_after_clearing(tmp_path):
+    store = SegmentVectorStore(str(tmp_path))
+    store.add(_nodes("a", [[1, 0], [0, 1]]))
+    store.remove_nodes(["a0", "a1"])
+    assert store.compact(force=True)
+    assert list(tmp_path.glob("seg-*.f32")) == []
+
+    store.add(_nodes("b", [[1, 0]]))
+    assert store.segment_of("b0") == 2
+    # 重新打开后继续递增
+    reopened = SegmentVectorStore(str(tmp_path))
+    reopened.add(_nodes("c", [[0, 1]]))
+    assert reopened.segment_of("c0") == 3
+
+
+@pytest.mark.skipif(fcntl is None, reason="需要 fcntl.flock")
+def test_uncommitted_segment_file_is_removed_only_without_other_openers(tmp_path):
+    store = SegmentVectorStore(str(tmp_path))
+    store.add(_nodes("a", [[1, 0]]))
+    (tmp_path / "seg-000002.f32").write_bytes(b"\x00" * 8)
+
+    # 另一个实例仍打开时，段文件可能是它正在写入的新段，不能删除
+    SegmentVectorStore(str(tmp_path)).close()
+    assert (tmp_path / "seg-000002.f32").exists()
+
+    store.close()
+    reopened = SegmentVectorStore(str(tmp_path))
+
+    assert len(reopened) == 1
+    assert not (tmp_path / "seg-000002.f32").exists()
+
+
+def test_get_and_delete_nodes_by_metadata_filters(tmp_path):
+    store = SegmentVectorStore(str(tmp_path))
+    store.add(_nodes("a", [[1, 0], [0, 1]]))
+    store.add(_nodes("b", [[1, 1]], filename="b.xlsx"))
+    pdf = MetadataFilters(filters=[
+        MetadataFilter(key="original_filename", value="a.pdf", operator=FilterOperator.EQ)
+    ])
+
+    assert [node.node_id for node in store.get_nodes(filters=pdf)] == ["a0", "a1"]
+    assert [node.node_id for node in store.get_nodes(["b0", "a1"], filters=pdf)] == ["a1"]
+
+    store.delete_nodes(["a0", "b0"], filters=pdf)
+    assert sorted(store._locations) == ["a1", "b0"]
+    store.delete_nodes(filters=pdf)
+    assert sorted(store._locations) == ["b0"]
+
+
+def test_concurrent_reads_and_writes_share_one_connection(tmp_path):
+    store = SegmentVectorStore(str(tmp_path))
+    store.add(_nodes("seed", [[1, 0]]))
+    errors = []
+
+    def writer(prefix):
+        try:
+            for i in range(20):
+                store.add(_nodes(f"{prefix}{i}-", [[1, i]]))
+        except Exception as e:
+            errors.append(e)
+
+    def reader():
+        try:
+            for _ in range(50):
+                _query(store, [1, 0], top_k=3)
+                list(store.iter_metadata())
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=writer, args=(p,)) for p in "xy"] + [threading.Thread(target=reader) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert len(store) == 41
+
+
+def test_metadata_filters_and_document_summary(tmp_path):
+    store = SegmentVectorStore(str(tmp_path))
+    store.add(_nodes("a", [[1, 0], [0.9, 0.1]]))
+    store.add(_nodes("b", [[0.8, 0.2]], filename="b.xlsx"))
+
+    filters = MetadataFilters(filters=[
+        MetadataFilter(key="original_filename", value="b.xlsx", operator=FilterOperator.EQ)
+    ])
+    assert _query(store, [1, 0], top_k=2, filters=filters).ids == ["b0"]
+
+    summary = {doc["original_filename"]: doc["chunk_count"] for doc in summarize_documents(tmp_path)}
+    assert summary == {"a.pdf": 2, "b.xlsx": 1}
@@ -0,0 +1,85 @@
+"""
+跨工作区堆叠向量索引测试
+"""
+
+import pytest
+
+pytest.importorskip("llama_index.core")
+
+from llama_index.core.schema import TextNode
+
+from app.services.segment_vector_store import SegmentVectorStore
+from app.services.stacked_vector_index import StackedVectorIndex
+
+
+def _store(path, prefix, angles):
+    store = SegmentVectorStore(str(path))
+    store.add([
+        TextNode(id_=f"{prefix}{i}", text=f"{prefix}{i}", embedding=[1.0, angle])
+        for i, angle in enumerate(angles)
+    ])
+    return store
+
+
+def test_results_are_ranked_across_workspaces(tmp_path):
+    stores = [
+        ("ws", _store(tmp_path / "ws", "w", [0.3, 0.05])),
+        ("global", _store(tmp_path / "global", "g", [0.0, 0.5]))
+    ]
+    index = StackedVectorIndex()
+
+    hits = index.search(stores, [1.0, 0.0], top_k=3)
+    assert [(ws, node_id) for ws, node_id, _ in hits] == [("global", "g0"), ("ws", "w1"), ("ws", "w0")]
+    assert hits[0][2] == pytest.approx(1.0)
+
+    # 删除的节点按当前位置剔除，不重新堆叠；新增段触发重新堆叠
+    stores[1][1].remove_nodes(["g0"])
+    assert [node_id for _, node_id, _ in index.search(stores, [1.0, 0.0], top_k=1)] == ["w1"]
+    assert index.total_stacks == 1
+
+    stores[0][1].add([TextNode(id_="w9", text="w9", embedding=[2.0, 0.0])])
+    assert [node_id for _, node_id, _ in index.search(stores, [1.0, 0.0], top_k=1)] == ["w9"]
+    assert index.total_stacks == 2
+
+
+def test_refilled_workspace_is_restacked(tmp_path):
+    stores = [("ws", _store(tmp_path / "ws", "w", [0.0, 0.5]))]
+    index = StackedVectorIndex()
+    assert [node_id for _, node_id, _ in index.search(stores, [1.0, 0.0], top_k=1)] == ["w0"]
+
+    # 清空、合并后重新写入：不能命中旧的堆叠矩阵
+    store = stores[0][1]
+    store.remove_nodes(["w0", "w1"])
+    store.compact(force=True)
+    store.add([TextNode(id_="n0", text="n0", embedding=[1.0, 0.0])])
+    assert [node_id for _, node_id, _ in index.search(stores, [1.0, 0.0], top_k=1)] == ["n0"]
+
+    # 目录重建后的新实例段ID从头开始，同样重新堆叠
+    store.close()
+    for path in (tmp_path / "ws").iterdir():
+        path.unlink()
+    rebuilt = [("ws", _store(tmp_path / "ws", "r", [0.0]))]
+    assert [node_id for _, node_id, _ in index.search(rebuilt, [1.0, 0.0], top_k=1)] == ["r0"]
+    assert index.total_stacks == 3
+
+
+def test_stack_rows_are_capped_and_memory_is_reported(tmp_path):
+    stores = [
+        ("a", _store(tmp_path / "a", "a", [0.1, 0.2])),
+        ("b", _store(tmp_path / "b", "b", [0.3, 0.4, 0.5])),
+        ("c", _store(tmp_path / "c", "c", [0.6]))
+    ]
+    index = StackedVectorIndex(max_nodes=3)
+
+    stacked, overflow = index.partition(stores)
+    assert [ws for ws, _ in stacked] == ["a", "c"]
+    assert overflow == ["b"]
+    with pytest.raises(ValueError):
+        index.search(stores[:2], [1.0, 0.0], top_k=1)
+
+    assert index.memory_bytes() == 0
+    index.search(stacked, [1.0, 0.0], top_k=1)
+    assert index.memory_bytes() >= 3 * 2 * 4
+    assert index.get_stats()["cached_bytes"] == index.memory_bytes()
+    index.evict_workspace("c")
+    assert index.memory_bytes() == 0
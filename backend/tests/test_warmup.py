@@ -0,0 +1,54 @@
+"""
+启动预热测试（阶段状态与就绪判断、最近使用工作区排序）
+"""
+
+import os
+
+from app.services import warmup
+from app.services.warmup import WarmupManager, recent_workspaces
+
+
+def test_recent_workspaces_orders_by_latest_index_write(tmp_path):
+    for i, name in enumerate(["old", "new", "_embedding_store", "empty"]):
+        (tmp_path / name).mkdir()
+        if name != "empty":
+            path = tmp_path / name / "nodes.sqlite"
+            path.write_text("x")
+            os.utime(path, (1000 + i, 1000 + i))
+
+    assert recent_workspaces(tmp_path, 5) == ["new", "old"]
+    assert recent_workspaces(tmp_path, 1) == ["new"]
+
+
+def test_optional_reranker_failure_does_not_block_readiness(monkeypatch):
+    monkeypatch.setattr(warmup, "_warmup_config", lambda: {"hot_workspaces": 0})
+    monkeypatch.setattr(WarmupManager, "_warm_embedding", staticmethod(lambda: {"model": "bge"}))
+    monkeypatch.setattr(WarmupManager, "_warm_workspaces", staticmethod(lambda limit: {"loaded": ["global"]}))
+
+    def broken_reranker():
+        raise RuntimeError("重排序模型不可用")
+
+    monkeypatch.setattr(WarmupManager, "_warm_reranker", staticmethod(broken_reranker))
+
+    manager = WarmupManager()
+    assert not manager.is_ready()
+    assert manager.start()
+    manager._thread.join(5)
+
+    status = manager.get_status()
+    assert status["ready"]
+    assert status["stages"]["reranker"]["status"] == "failed"
+    assert status["stages"]["workspaces"]["loaded"] == ["global"]
+    assert not manager.start()
+
+
+def test_reranker_is_not_warmed_unless_chat_reranking_is_enabled():
+    from app.utils.config_loader import chat_reranking_enabled
+
+    # 默认配置：use_reranking 开启但对话路径关闭，预热不加载重排序模型
+    assert not chat_reranking_enabled()
+    assert WarmupManager._warm_reranker() is None
+
+    assert chat_reranking_enabled({"use_reranking": True, "chat_enabled": True})
+    assert not chat_reranking_enabled({"use_reranking": True, "chat_enabled": True, "budget_ms": 0})
+    assert not chat_reranking_enabled({"use_reranking": False, "chat_enabled": True})